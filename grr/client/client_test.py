@@ -2,6 +2,7 @@
 """Tests for the client."""
 
 
+import threading
 
 # Need to import client to add the flags.
 from grr.client import actions
@@ -181,6 +182,57 @@ class BasicContextTests(test_lib.GRRBaseTest):
       result.append(item)
     self.assertEqual(result, ["C"] * 10 + ["A", "B"] * 10)
 
+  def testSizeQueueGetMaxSize(self):
+    queue = comms.SizeQueue(maxsize=10000000)
+    for i in range(10):
+      queue.Put("%02d" % i)
+
+    # Items are returned until the limit is exceeded.
+    self.assertEqual(list(queue.Get(max_size=5)), ["00", "01", "02"])
+    self.assertEqual(queue.Size(), 14)
+    self.assertEqual(len(list(queue.Get())), 7)
+    self.assertEqual(queue.Size(), 0)
+
+  def testSizeQueueStress(self):
+    """Many blocking producers against a single draining consumer."""
+    queue = comms.SizeQueue(maxsize=1000, nanny=self.context.nanny_controller)
+    producers = 5
+    items_per_producer = 2000
+
+    def Produce(producer_id):
+      for i in range(items_per_producer):
+        # HIGH_PRIORITY items would bypass the size limit.
+        queue.Put("%d:%06d" % (producer_id, i), priority=i % 2, timeout=60)
+
+    threads = [
+        threading.Thread(target=Produce, args=(i,)) for i in range(producers)
+    ]
+    for thread in threads:
+      thread.start()
+
+    results = []
+    while len(results) < producers * items_per_producer:
+      # Producers block once the queue is full, so it never holds more than
+      # one item over the limit.
+      self.assertLess(queue.Size(), 1000 + 8)
+      results.extend(queue.Get(max_size=500))
+
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(queue.Size(), 0)
+    self.assertEqual(len(set(results)), producers * items_per_producer)
+
+    # Items of each producer with the same priority keep their order.
+    for producer_id in range(producers):
+      for priority in range(2):
+        items = [
+            r for r in results
+            if r.startswith("%d:" % producer_id) and
+            int(r.split(":")[1]) % 2 == priority
+        ]
+        self.assertEqual(items, sorted(items))
+
 
 def main(argv):
   test_lib.main(argv)
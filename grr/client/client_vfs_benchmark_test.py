@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmarks for reading disk images with the sleuthkit."""
+
+
+import os
+import time
+
+import pytsk3
+
+from grr.client import vfs
+from grr.client.vfs_handlers import sleuthkit
+from grr.lib import flags
+from grr.lib import stats
+from grr.lib import utils
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class LegacyImgInfo(pytsk3.Img_Info):
+  """The previous implementation: every read goes to the device."""
+
+  def __init__(self, fd=None, progress_callback=None):
+    pytsk3.Img_Info.__init__(self)
+    self.progress_callback = progress_callback
+    self.fd = fd
+
+  def read(self, offset, length):  # pylint: disable=g-bad-name
+    if self.progress_callback:
+      self.progress_callback()
+    self.fd.seek(offset)
+    return self.fd.read(length)
+
+  def get_size(self):  # pylint: disable=g-bad-name
+    return long(1e12)
+
+  def SetBlockSize(self, block_size):
+    _ = block_size
+
+
+class TSKBlockCacheBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Lists whole disk images with and without the block cache."""
+
+  units = "s"
+
+  IMAGES = ["test_img.dd", "ntfs_img.dd"]
+  REPEATS = 10
+
+  def setUp(self):
+    super(TSKBlockCacheBenchmark, self).setUp(["Image", "Hit rate"],
+                                              ["<15", "<10"])
+
+  def _ListImage(self, name, image):
+    ps = rdf_paths.PathSpec(
+        path=os.path.join(self.base_path, image),
+        pathtype=rdf_paths.PathSpec.PathType.OS)
+    ps.Append(pathtype=rdf_paths.PathSpec.PathType.TSK)
+
+    hits = stats.STATS.GetMetricValue("grr_client_tsk_cache_hits")
+    misses = stats.STATS.GetMetricValue("grr_client_tsk_cache_misses")
+    start = time.time()
+    for _ in xrange(self.REPEATS):
+      # Every iteration parses the filesystem from scratch.
+      vfs.DEVICE_CACHE.Flush()
+      for _ in vfs.VFSOpen(ps).RecursiveListNames(depth=float("inf")):
+        pass
+    time_taken = time.time() - start
+
+    hits = stats.STATS.GetMetricValue("grr_client_tsk_cache_hits") - hits
+    misses = stats.STATS.GetMetricValue("grr_client_tsk_cache_misses") - misses
+    hit_rate = "-"
+    if hits + misses:
+      hit_rate = "%.1f%%" % (100.0 * hits / (hits + misses))
+
+    self.AddResult(name, time_taken / self.REPEATS, self.REPEATS, image,
+                   hit_rate)
+
+  def testRecursiveListNames(self):
+    """Recursively lists the disk images in the test data."""
+    for image in self.IMAGES:
+      with utils.Stubber(sleuthkit, "MyImgInfo", LegacyImgInfo):
+        self._ListImage("Uncached", image)
+
+      self._ListImage("Block cache", image)
+
+
+def main(argv):
+  vfs.VFSInit()
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -17,6 +17,7 @@ from grr.client import client_plugins
 import logging
 from grr.client import vfs
 from grr.client.vfs_handlers import files
+from grr.client.vfs_handlers import sleuthkit
 from grr.lib import flags
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
@@ -663,6 +664,32 @@ class VFSTest(test_lib.GRRBaseTest):
                                                       [u"入乡随俗.txt"])
     ])
 
+  def testTSKBlockCache(self):
+    """Cached reads return the same data as reads from the device."""
+    path = os.path.join(self.base_path, "ntfs_img.dd")
+    size = os.path.getsize(path)
+    with open(path, "rb") as device, open(path, "rb") as fd:
+      img = sleuthkit.MyImgInfo(
+          fd=fd, block_size=1000, cache_size=64 * 1024, max_read_ahead=4)
+      # The blocks are aligned to whole sectors.
+      self.assertEqual(img.block_size, 1024)
+
+      # Sequential reads, random reads and reads past the end of the device.
+      offsets = range(0, 20000, 100) + [
+          (i * 7919) % size for i in xrange(200)
+      ] + [size - 50, size + 100]
+      for offset in offsets:
+        device.seek(offset)
+        self.assertEqual(img.read(offset, 300), device.read(300))
+
+      self.assertGreater(img.hits, img.misses)
+
+      # Resizing the blocks to the cluster size drops the cache.
+      img.SetBlockSize(4096)
+      self.assertEqual(len(img.blocks), 0)
+      device.seek(4000)
+      self.assertEqual(img.read(4000, 10000), device.read(10000))
+
 
 def main(argv):
   vfs.VFSInit()
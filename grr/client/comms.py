@@ -70,6 +70,8 @@ Examples:
 
 
 import base64
+import heapq
+import itertools
 import os
 
 import pdb
@@ -539,8 +541,11 @@ class GRRClientWorker(object):
     # Queue of messages from the server to be processed.
     self._in_queue = []
 
-    # Queue of messages to be sent to the server.
+    # Queue of messages to be sent to the server. This is a heap of
+    # (-priority, sequence number, message) tuples so messages of equal
+    # priority are sent in the order they were queued.
     self._out_queue = []
+    self._out_queue_sequence = itertools.count()
 
     # A tally of the total byte count of messages
     self._out_queue_size = 0
@@ -605,13 +610,9 @@ class GRRClientWorker(object):
     queue = rdf_flows.MessageList()
 
     length = 0
-    self._out_queue.sort(key=lambda msg: msg[0])
-
-    # Front pops are quadratic so we reverse the queue.
-    self._out_queue.reverse()
 
     while self._out_queue and length < max_size:
-      message = self._out_queue.pop()[1]
+      message = heapq.heappop(self._out_queue)[2]
       queue.job.Append(message)
       stats.STATS.IncrementCounter("grr_client_sent_messages")
 
@@ -622,9 +623,6 @@ class GRRClientWorker(object):
       length += message_length
       self._out_queue_size -= message_length
 
-    # Restore the old order.
-    self._out_queue.reverse()
-
     return queue
 
   def SendReply(self,
@@ -781,7 +779,8 @@ class GRRClientWorker(object):
     # The simple queue has no size restrictions so we never block and ignore
     # this parameter.
     _ = blocking
-    self._out_queue.append((-1 * priority, message))
+    heapq.heappush(self._out_queue,
+                   (-1 * priority, next(self._out_queue_sequence), message))
 
     # Maintain the tally of the output queue size.  We estimate the size of the
     # message by only considering the args member. This is usually close enough
@@ -933,20 +932,23 @@ class GRRClientWorker(object):
 
 
 class SizeQueue(object):
-  """A Queue which limits the total size of its elements.
+  """A priority queue which limits the total size of its elements.
 
   The standard Queue implementations uses the total number of elements to block
   on. In the client we want to limit the total memory footprint, hence we need
   to use the total size as a measure of how full the queue is.
 
-  TODO(user): this class needs some attention to ensure it is thread safe.
+  Items are kept in a heap ordered by priority and then by insertion order, so
+  both adding and removing an item is O(log n) regardless of how many items are
+  queued.
   """
   total_size = 0
 
   def __init__(self, maxsize=1024, nanny=None):
     self.lock = threading.RLock()
+    self._not_full = threading.Condition(self.lock)
     self.queue = []
-    self._reversed = []
+    self._sequence = itertools.count()
     self.total_size = 0
     self.maxsize = maxsize
     self.nanny = nanny
@@ -975,45 +977,54 @@ class SizeQueue(object):
     if isinstance(item, rdfvalue.RDFValue):
       item = item.SerializeToString()
 
-    if priority >= rdf_flows.GrrMessage.Priority.HIGH_PRIORITY:
-      pass  # If high priority is set we dont care about the size of the queue.
-
-    elif not block:
-      if self.total_size >= self.maxsize:
-        raise Queue.Full
+    with self._not_full:
+      if priority >= rdf_flows.GrrMessage.Priority.HIGH_PRIORITY:
+        pass  # If high priority is set we dont care about the size of the queue.
 
-    else:
-      count = 0
-      # Wait until the queue has more space. We do not hold the lock here to
-      # ensure that the posting thread can drain this queue while we block here.
-      while self.total_size >= self.maxsize:
-        time.sleep(1)
-        self.nanny.Heartbeat()
-        count += 1
-
-        if timeout and count > timeout:
+      elif not block:
+        if self.total_size >= self.maxsize:
           raise Queue.Full
 
-    with self.lock:
-      self.queue.append((-1 * priority, item))
+      else:
+        deadline = timeout and time.time() + timeout
+        # Wait until the queue has more space. Waiting releases the lock so the
+        # posting thread can drain this queue while we block here.
+        while self.total_size >= self.maxsize:
+          self._not_full.wait(1)
+          if self.nanny:
+            self.nanny.Heartbeat()
+
+          if deadline and time.time() > deadline:
+            raise Queue.Full
+
+      heapq.heappush(self.queue, (-1 * priority, next(self._sequence), item))
       self.total_size += len(item)
 
-  def Get(self):
-    """Retrieves the items from the queue."""
-    with self.lock:
-      if self._reversed:
-        # We have leftovers from a partial Get().
-        self._reversed.reverse()
-        self.queue = self._reversed + self.queue
+  def Get(self, max_size=None):
+    """Retrieves the items from the queue in priority order.
+
+    Items are removed from the queue as they are yielded, so items that the
+    caller does not consume remain queued.
 
-      self.queue.sort(key=lambda msg: msg[0])  # by priority only.
-      self.queue.reverse()
-      self._reversed, self.queue = self.queue, []
+    Args:
+      max_size: If set, stop once the yielded items add up to more than this
+        many bytes.
 
-      while self._reversed:
-        item = self._reversed.pop()[1]
+    Yields:
+      The queued items.
+    """
+    length = 0
+    while max_size is None or length <= max_size:
+      with self.lock:
+        if not self.queue:
+          return
+
+        item = heapq.heappop(self.queue)[2]
         self.total_size -= len(item)
-        yield item
+        self._not_full.notify_all()
+
+      length += len(item)
+      yield item
 
   def Size(self):
     return self.total_size
@@ -1086,15 +1097,10 @@ class GRRThreadedWorker(GRRClientWorker, threading.Thread):
        A MessageList protobuf
     """
     queue = rdf_flows.MessageList()
-    length = 0
 
-    for message in self._out_queue.Get():
+    for message in self._out_queue.Get(max_size=max_size):
       queue.job.Append(rdf_flows.GrrMessage.FromSerializedString(message))
       stats.STATS.IncrementCounter("grr_client_sent_messages")
-      length += len(message)
-
-      if length > max_size:
-        break
 
     return queue
 
@@ -1592,6 +1598,8 @@ class ClientCommunicator(communicator.Communicator):
   def __init__(self, certificate=None, private_key=None):
     super(ClientCommunicator, self).__init__(
         certificate=certificate, private_key=private_key)
+    # The compression types the server told us it can decode.
+    self.server_compression = None
     self.InitPrivateKey()
 
   def InitPrivateKey(self):
@@ -1674,9 +1682,17 @@ class ClientCommunicator(communicator.Communicator):
   def EncodeMessages(self, message_list, result, **kwargs):
     # Force the right API to be used
     kwargs["api_version"] = config.CONFIG["Network.api"]
+    kwargs.setdefault("remote_compression", self.server_compression)
     return super(ClientCommunicator, self).EncodeMessages(
         message_list, result, **kwargs)
 
+  def DecodeMessages(self, response_comms):
+    result = super(ClientCommunicator, self).DecodeMessages(response_comms)
+    # Only trust the advertised compression types once the response has been
+    # decoded successfully.
+    self.server_compression = list(response_comms.supported_compression)
+    return result
+
   def _GetRemotePublicKey(self, common_name):
 
     if common_name == self.server_name:
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Benchmarks for the client message queues."""
+
+
+import time
+
+from grr.client import comms
+from grr.lib import flags
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class SizeQueueBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Shows that the per message cost does not depend on the queue length."""
+
+  units = "us"
+
+  QUEUE_LENGTHS = [1000, 10000, 100000]
+  MESSAGES = 10000
+
+  def setUp(self):
+    super(SizeQueueBenchmark, self).setUp(["Queue length"], ["<20"])
+
+  def _Fill(self, queue, count):
+    for i in xrange(count):
+      queue.Put("x" * 100, priority=i % 2, block=False)
+
+  def testPutAndDrain(self):
+    """Put and drain messages on a queue of varying length."""
+    for queue_length in self.QUEUE_LENGTHS:
+      queue = comms.SizeQueue(maxsize=1 << 40)
+      self._Fill(queue, queue_length)
+
+      start = time.time()
+      self._Fill(queue, self.MESSAGES)
+      self.AddResult("SizeQueue.Put per message",
+                     (time.time() - start) / self.MESSAGES, self.MESSAGES,
+                     queue_length)
+
+      start = time.time()
+      for _ in queue.Get(max_size=100 * self.MESSAGES):
+        pass
+      self.AddResult("SizeQueue.Get per message",
+                     (time.time() - start) / self.MESSAGES, self.MESSAGES,
+                     queue_length)
+
+  def testWorkerDrain(self):
+    """Queue replies on a worker and drain them in small bundles."""
+    worker = comms.GRRClientWorker()
+    message = rdf_flows.GrrMessage(args="x" * 100)
+
+    for queue_length in self.QUEUE_LENGTHS:
+      for i in xrange(queue_length):
+        worker.QueueResponse(message, priority=i % 3)
+
+      start = time.time()
+      for i in xrange(self.MESSAGES):
+        worker.QueueResponse(message, priority=i % 3)
+        worker.Drain(max_size=1)
+
+      self.AddResult("Worker QueueResponse and Drain",
+                     (time.time() - start) / self.MESSAGES, self.MESSAGES,
+                     queue_length)
+      worker.Drain(max_size=1 << 40)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -71,41 +71,78 @@ class PoolGRRClient(threading.Thread):
     self.Run()
 
 
-def CreateClientPool(n):
-  """Create n clients to run in a pool."""
-  clients = []
+def LoadClients(n, cert_file, fast_poll=False):
+  """Loads n pool clients from the private keys stored in cert_file.
 
-  # Load previously stored clients.
+  Args:
+    n: The number of clients to load.
+    cert_file: Path to a file written by SaveClients().
+    fast_poll: If True, the clients work in the fast poll mode.
+
+  Returns:
+    A list of PoolGRRClient objects or None if the file could not be read.
+
+  Raises:
+    RuntimeError: If the file stores less than n clients.
+  """
+  certificates = []
   try:
-    certificates = []
-    with open(flags.FLAGS.cert_file, "rb") as fd:
+    with open(cert_file, "rb") as fd:
       # Certificates are base64-encoded, so that we can use new-lines as
       # separators.
       for l in fd:
         cert = rdf_crypto.RSAPrivateKey(initializer=base64.b64decode(l))
         certificates.append(cert)
+  except (IOError, EOFError):
+    return None
 
-    for certificate in certificates[:n]:
-      clients.append(
-          PoolGRRClient(
-              private_key=certificate,
-              ca_cert=config.CONFIG["CA.certificate"],
-              fast_poll=flags.FLAGS.fast_poll),)
+  if len(certificates) < n:
+    raise RuntimeError("Loaded %d clients, but expected %d." %
+                       (len(certificates), n))
 
-    clients_loaded = True
-  except (IOError, EOFError):
-    clients_loaded = False
+  return [
+      PoolGRRClient(
+          private_key=certificate,
+          ca_cert=config.CONFIG["CA.certificate"],
+          fast_poll=fast_poll) for certificate in certificates[:n]
+  ]
 
-  if clients_loaded and len(clients) < n:
-    raise RuntimeError("Loaded %d clients, but expected %d." % (len(clients),
-                                                                n))
 
-  while len(clients) < n:
-    # Generate a new RSA key pair for each client.
+def GenerateClients(n, fast_poll=False):
+  """Generates n pool clients with new RSA keys."""
+  clients = []
+  for _ in xrange(n):
     bits = config.CONFIG["Client.rsa_key_length"]
     key = rdf_crypto.RSAPrivateKey.GenerateKey(bits=bits)
     clients.append(
-        PoolGRRClient(private_key=key, ca_cert=config.CONFIG["CA.certificate"]))
+        PoolGRRClient(
+            private_key=key,
+            ca_cert=config.CONFIG["CA.certificate"],
+            fast_poll=fast_poll))
+
+  return clients
+
+
+def SaveClients(clients, cert_file):
+  """Stores the private keys of the clients so LoadClients() can reuse them."""
+  with open(cert_file, "wb") as fd:
+    # We're base64-encoding ceritificates so that we can use new-lines
+    # as separators.
+    b64_certs = [
+        base64.b64encode(x.private_key.SerializeToString()) for x in clients
+    ]
+    fd.write("\n".join(b64_certs))
+
+
+def CreateClientPool(n):
+  """Create n clients to run in a pool."""
+  # Load previously stored clients.
+  clients = LoadClients(
+      n, flags.FLAGS.cert_file, fast_poll=flags.FLAGS.fast_poll)
+  clients_loaded = clients is not None
+  if not clients_loaded:
+    # Generate a new RSA key pair for each client.
+    clients = GenerateClients(n)
 
   # Start all the clients now.
   for c in clients:
@@ -149,13 +186,7 @@ def CreateClientPool(n):
   # same data.
   if not clients_loaded:
     logging.info("Saving certificates.")
-    with open(flags.FLAGS.cert_file, "wb") as fd:
-      # We're base64-encoding ceritificates so that we can use new-lines
-      # as separators.
-      b64_certs = [
-          base64.b64encode(x.private_key.SerializeToString()) for x in clients
-      ]
-      fd.write("\n".join(b64_certs))
+    SaveClients(clients, flags.FLAGS.cert_file)
 
 
 def CheckLocation():
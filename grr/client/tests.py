@@ -9,7 +9,9 @@ This module loads and registers all the GRR library tests.
 from grr.client import client_build_test
 from grr.client import client_test
 from grr.client import client_utils_test
+from grr.client import client_vfs_benchmark_test
 from grr.client import client_vfs_test
+from grr.client import comms_benchmark_test
 from grr.client import comms_test
 from grr.client.client_actions import tests
 from grr.client.osx import objc_test
@@ -6,8 +6,11 @@ import stat
 
 import pytsk3
 
+from grr import config
 from grr.client import client_utils
 from grr.client import vfs
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -22,20 +25,110 @@ class CachedFilesystem(object):
 
 
 class MyImgInfo(pytsk3.Img_Info):
-  """An Img_Info class using the regular python file handling."""
+  """An Img_Info class using the regular python file handling.
 
-  def __init__(self, fd=None, progress_callback=None):
+  The sleuthkit issues many small reads for the filesystem metadata, so reads
+  are served from a size bounded LRU cache of aligned blocks. Sequential reads
+  make the cache read ahead an increasing number of blocks.
+  """
+
+  # Raw devices can only be read in multiples of the sector size.
+  SECTOR_SIZE = 512
+
+  def __init__(self,
+               fd=None,
+               progress_callback=None,
+               block_size=4096,
+               cache_size=None,
+               max_read_ahead=None):
     pytsk3.Img_Info.__init__(self)
     self.progress_callback = progress_callback
     self.fd = fd
+    if cache_size is None:
+      cache_size = config.CONFIG["Client.tsk_block_cache_size"]
+    if max_read_ahead is None:
+      max_read_ahead = config.CONFIG["Client.tsk_max_read_ahead"]
+    self.cache_size = cache_size
+    self.max_read_ahead = max_read_ahead
+    self.hits = 0
+    self.misses = 0
+    self.SetBlockSize(block_size)
+
+  def SetBlockSize(self, block_size):
+    """Sets the size of the cached blocks, e.g. to the cluster size.
+
+    Args:
+      block_size: The new block size. It is rounded up to whole sectors.
+    """
+    sectors = max(1, (block_size + self.SECTOR_SIZE - 1) // self.SECTOR_SIZE)
+    self.block_size = sectors * self.SECTOR_SIZE
+    self.blocks = utils.FastStore(
+        max_size=max(1, self.cache_size // self.block_size))
+    self.last_block = None
+    self.read_ahead = 0
+
+  def _ReadBlocks(self, block, count):
+    """Reads count blocks from the device and caches them."""
+    self.fd.seek(block * self.block_size)
+    data = self.fd.read(count * self.block_size)
+
+    blocks = []
+    for i in xrange(count):
+      chunk = data[i * self.block_size:(i + 1) * self.block_size]
+      if not chunk:
+        break
+      self.blocks.Put(block + i, chunk)
+      blocks.append(chunk)
+
+    return blocks
 
   def read(self, offset, length):  # pylint: disable=g-bad-name
     # Sleuthkit operations might take a long time so we periodically call the
     # progress indicator callback as long as there are still data reads.
     if self.progress_callback:
       self.progress_callback()
-    self.fd.seek(offset)
-    return self.fd.read(length)
+    if length <= 0:
+      return ""
+
+    first = offset // self.block_size
+    last = (offset + length - 1) // self.block_size
+
+    # Grow the read ahead window while the reads continue where the previous
+    # one stopped.
+    if self.last_block is not None and first == self.last_block + 1:
+      self.read_ahead = min(max(1, self.read_ahead * 2), self.max_read_ahead)
+    elif first != self.last_block:
+      self.read_ahead = 0
+    self.last_block = last
+
+    hits = misses = 0
+    data = []
+    block = first
+    while block <= last:
+      try:
+        data.append(self.blocks.Get(block))
+        hits += 1
+        block += 1
+        continue
+      except KeyError:
+        pass
+
+      misses += 1
+      needed = last - block + 1
+      blocks = self._ReadBlocks(block, needed + self.read_ahead)
+      data.extend(blocks[:needed])
+      if len(blocks) < needed or len(blocks[needed - 1]) < self.block_size:
+        # We hit the end of the device.
+        break
+      block += needed
+
+    self.hits += hits
+    self.misses += misses
+    stats.STATS.IncrementCounter("grr_client_tsk_cache_hits", delta=hits)
+    stats.STATS.IncrementCounter("grr_client_tsk_cache_misses", delta=misses)
+
+    start = offset - first * self.block_size
+    return "".join(data)[start:start + length]
 
   def get_size(self):  # pylint: disable=g-bad-name
     # Windows is unable to report the true size of the raw device and allows
@@ -148,6 +241,8 @@ class TSKFile(vfs.VFSHandler):
           fd=self.tsk_raw_device, progress_callback=progress_callback)
 
       self.fs = pytsk3.FS_Info(self.img, 0)
+      # Align the cached blocks with the clusters of the filesystem.
+      self.img.SetBlockSize(self.fs.info.block_size)
       self.filesystem = CachedFilesystem(self.fs, self.img)
 
       vfs.DEVICE_CACHE.Put(fd_hash, self.filesystem)
@@ -434,3 +529,10 @@ class TSKFile(vfs.VFSHandler):
           pathspec=pathspec,
           progress_callback=progress_callback,
           full_pathspec=full_pathspec)
+
+
+class TSKInit(registry.InitHook):
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric("grr_client_tsk_cache_hits")
+    stats.STATS.RegisterCounterMetric("grr_client_tsk_cache_misses")
@@ -26,3 +26,19 @@ config_lib.DEFINE_string("API.DefaultRouter", "DisabledApiCallRouter",
                          "The default router used by the API if there are no "
                          "rules defined in API.RouterACLConfigFile or if none "
                          "of these rules matches.")
+
+config_lib.DEFINE_integer("API.archive_prefetch_threads", 4,
+                          "Number of threads reading files ahead when "
+                          "generating file archives of flow and hunt results. "
+                          "Set to 0 to read files one batch at a time.")
+
+config_lib.DEFINE_integer("API.archive_prefetch_bytes", 256 * 1024 * 1024,
+                          "Maximum number of bytes of file contents read "
+                          "ahead and held in memory while generating a file "
+                          "archive.")
+
+config_lib.DEFINE_integer("API.archive_deflate_threads", 4,
+                          "Number of threads compressing files in ZIP "
+                          "archives of flow results, hunt results and VFS "
+                          "folders. Set to 0 to compress on the thread "
+                          "serving the request.")
@@ -135,6 +135,16 @@ config_lib.DEFINE_list(
           " relative to the given root. Format is os:/mount/disk."),
     default=[])
 
+config_lib.DEFINE_integer(
+    "Client.tsk_block_cache_size", 16 * 1024 * 1024,
+    "Maximum number of bytes of a raw device cached for each filesystem "
+    "opened with the sleuthkit.")
+
+config_lib.DEFINE_integer(
+    "Client.tsk_max_read_ahead", 64,
+    "Maximum number of blocks read ahead of sequential reads from a raw "
+    "device opened with the sleuthkit.")
+
 # Windows client specific options.
 config_lib.DEFINE_string(
     "Client.config_hive",
@@ -16,6 +16,15 @@ config_lib.DEFINE_integer("Dataserver.max_connections", 5,
                           ("Maximum number of connections to the data server "
                            "per process."))
 
+config_lib.DEFINE_integer("Dataserver.migration_bandwidth", 10 * 1024 * 1024,
+                          ("Maximum number of bytes per second a data server "
+                           "sends while migrating ranges online. 0 means no "
+                           "limit."))
+
+config_lib.DEFINE_integer("Dataserver.migration_replay_frequency", 10,
+                          ("Time interval in seconds between replays of the "
+                           "writes logged during an online range migration."))
+
 config_lib.DEFINE_integer("Dataserver.port", 7000,
                           "Port for a specific data server.")
 
@@ -67,6 +67,19 @@ config_lib.DEFINE_integer(
     help=("Number of file handles kept in the SQLite "
           "data_store cache."))
 
+config_lib.DEFINE_integer(
+    "SqliteDatastore.scan_threads",
+    default=8,
+    help=("Number of threads scanning database files in parallel for "
+          "a single prefix scan."))
+
+config_lib.DEFINE_integer(
+    "SqliteDatastore.prefix_index_max_age",
+    default=60,
+    help=("Maximum time (in seconds) the database files found for a "
+          "subject prefix are cached. Files copied into the data store "
+          "directory by other processes are scanned after this time."))
+
 # MySQLAdvanced data store.
 config_lib.DEFINE_string("Mysql.host", "localhost",
                          "The MySQL server hostname.")
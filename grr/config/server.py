@@ -33,6 +33,18 @@ config_lib.DEFINE_integer("Source.version_numeric",
 config_lib.DEFINE_integer("Threadpool.size", 50,
                           "Number of threads in the shared thread pool.")
 
+config_lib.DEFINE_integer("Server.rdfurn_intern_table_size", 0,
+                          "If non zero, short RDFURN paths (hot prefixes like "
+                          "aff4:/C.xxxx/flows) are normalized once and shared "
+                          "through a table of at most this many entries.")
+
+config_lib.DEFINE_string(
+    "Server.plugin_manifest_path",
+    "%(Config.prefix)/var/grr-server/plugin_manifest.json",
+    "Where the manifest of server plugins is kept. Components only import the "
+    "plugins they need at startup and use this manifest to import the others "
+    "when they are used. If empty, all plugins are imported at startup.")
+
 config_lib.DEFINE_integer("Worker.queue_shards", 5,
                           "Queue notifications will be sharded across "
                           "this number of datastore subjects.")
@@ -117,6 +129,15 @@ config_lib.DEFINE_integer("Frontend.message_expiry_time", 600,
                           "Maximum time messages remain valid within the "
                           "system.")
 
+config_lib.DEFINE_integer("Frontend.response_cache_size", 256 * 1024 * 1024,
+                          "Maximum number of bytes of rendered static content "
+                          "and Rekall profiles the frontend keeps in memory.")
+
+config_lib.DEFINE_integer("Frontend.response_cache_max_age", 600,
+                          "Number of seconds a rendered static file or Rekall "
+                          "profile is served from the frontend cache before it "
+                          "is read again.")
+
 config_lib.DEFINE_string("Frontend.upload_store", "FileUploadFileStore",
                          "The implementation of the upload file store.")
 
@@ -127,6 +148,12 @@ config_lib.DEFINE_bool("Server.initialized", False,
                        "True once config_updater initialize has been "
                        "run at least once.")
 
+config_lib.DEFINE_bool("Server.legacy_client_stats", True,
+                       "Also store client load stats as versioned AFF4 "
+                       "attributes. The load stats API reads them for the "
+                       "times before the columnar client stats store holds "
+                       "any samples of a client.")
+
 config_lib.DEFINE_string("Server.master_watcher_class", "DefaultMasterWatcher",
                          "The master watcher class to use.")
 
@@ -264,6 +291,33 @@ config_lib.DEFINE_string(
     help="Inactive clients marked with "
     "this label will be retained forever.")
 
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "DataRetention.shown_notifications_ttl",
+    default="90d",
+    description="Time to keep user notifications for after they were shown, "
+    "specified as the duration string. Examples: 30d, 90d, 1y. If not set, "
+    "shown notifications will be retained forever.")
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "DataRetention.pending_notifications_ttl",
+    default="90d",
+    description="Time to keep user notifications for which were never shown, "
+    "specified as the duration string. Notifications older than this and "
+    "DataRetention.shown_notifications_ttl together are deleted, whether they "
+    "were shown or not. If not set, pending notifications will be retained "
+    "forever.")
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "FileStore.stats_full_scan_interval",
+    default=None,
+    description="How often the filestore stats cron recounts all the files "
+    "in the hash file store instead of only adding the files added since its "
+    "last run, specified as the duration string. Examples: 30d, 90d. If not "
+    "set, the files are only recounted on the first run.")
+
 config_lib.DEFINE_integer(
     "Hunt.default_crash_limit",
     default=100,
@@ -16,13 +16,16 @@ from grr.config import contexts
 
 # pylint: disable=unused-import,g-bad-import-order
 from grr.gui import local
-from grr.lib import server_plugins
 # pylint: enable=unused-import,g-bad-import-order
 
 from grr.gui import wsgiapp
 from grr.lib import flags
+from grr.server import plugin_manifest
 from grr.server import server_startup
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS + ["gui"]
+
 
 class ThreadedServer(SocketServer.ThreadingMixIn, simple_server.WSGIServer):
   address_family = socket.AF_INET6
@@ -33,7 +36,7 @@ def main(_):
   config.CONFIG.AddContext(
       contexts.ADMIN_UI_CONTEXT,
       "Context applied when running the admin user interface GUI.")
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   if (not os.path.exists(
       os.path.join(config.CONFIG["AdminUI.document_root"],
@@ -6,8 +6,10 @@
 import cStringIO
 import itertools
 import os
+import Queue
 import re
 import sys
+import threading
 import zipfile
 
 
@@ -15,6 +17,7 @@ import yaml
 
 import logging
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import crypto as rdf_crypto
@@ -42,7 +45,9 @@ class CollectionArchiveGenerator(object):
                prefix=None,
                description=None,
                predicate=None,
-               client_id=None):
+               client_id=None,
+               prefetch_threads=None,
+               prefetch_bytes=None):
     """CollectionArchiveGenerator constructor.
 
     Args:
@@ -56,6 +61,11 @@ class CollectionArchiveGenerator(object):
       predicate: If not None, only the files matching the predicate will be
           archived, all others will be skipped.
       client_id: The client_id to use when exporting a flow results collection.
+      prefetch_threads: Number of threads reading the contents of the next
+          batches while the current one is written. 0 disables prefetching.
+          Defaults to API.archive_prefetch_threads.
+      prefetch_bytes: Maximum number of prefetched content bytes held in
+          memory. Defaults to API.archive_prefetch_bytes.
     Raises:
       ValueError: if prefix is None.
     """
@@ -63,7 +73,8 @@ class CollectionArchiveGenerator(object):
 
     if archive_format == self.ZIP:
       self.archive_generator = utils.StreamingZipGenerator(
-          compression=zipfile.ZIP_DEFLATED)
+          compression=zipfile.ZIP_DEFLATED,
+          deflate_threads=config.CONFIG["API.archive_deflate_threads"])
     elif archive_format == self.TAR_GZ:
       self.archive_generator = utils.StreamingTarGenerator()
     else:
@@ -83,6 +94,13 @@ class CollectionArchiveGenerator(object):
     self.predicate = predicate or (lambda _: True)
     self.client_id = client_id
 
+    if prefetch_threads is None:
+      prefetch_threads = config.CONFIG["API.archive_prefetch_threads"]
+    self.prefetch_threads = prefetch_threads
+    if prefetch_bytes is None:
+      prefetch_bytes = config.CONFIG["API.archive_prefetch_bytes"]
+    self.prefetch_bytes = prefetch_bytes
+
   @property
   def output_size(self):
     return self.archive_generator.output_size
@@ -123,24 +141,28 @@ class CollectionArchiveGenerator(object):
         manifest_fd, os.path.join(self.prefix, "MANIFEST"), st=st):
       yield chunk
 
-  def Generate(self, collection, token=None):
-    """Generates archive from a given collection.
+  def _PlanBatches(self, collection, token=None):
+    """Opens the collection's files in batches and decides what to archive.
 
-    Iterates the collection and generates an archive by yielding contents
-    of every referenced AFF4Stream.
+    Hash based deduplication is done here, in collection order, so the
+    generated archive does not depend on how batch contents are prefetched.
 
     Args:
       collection: Iterable with items that point to aff4 paths.
       token: User's ACLToken.
 
     Yields:
-      Binary chunks comprising the generated archive.
+      Tuples (symlinks, fds_to_write) where symlinks is a list of
+      (target, archive_path) pairs and fds_to_write a list of
+      (fd, content_path, st) tuples of files whose contents have to be
+      archived.
     """
     hashes = set()
     for fd_urn_batch in utils.Grouper(
         self._ItemsToUrns(collection), self.BATCH_SIZE):
 
-      fds_to_write = {}
+      symlinks = []
+      fds_to_write = []
       for fd in aff4.FACTORY.MultiOpen(fd_urn_batch, token=token):
         self.total_files += 1
 
@@ -162,35 +184,96 @@ class CollectionArchiveGenerator(object):
             # Make sure size of the original file is passed. It's required
             # when output_writer is StreamingTarWriter.
             st = os.stat_result((0644, 0, 0, 0, 0, 0, fd.size, 0, 0, 0))
-            fds_to_write[fd] = (content_path, st)
+            fds_to_write.append((fd, content_path, st))
             hashes.add(sha256_hash)
 
           up_prefix = "../" * len(fd.urn.Split())
-          yield self.archive_generator.WriteSymlink(up_prefix + content_path,
-                                                    archive_path)
+          symlinks.append((up_prefix + content_path, archive_path))
 
-      if fds_to_write:
-        prev_fd = None
-        for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds_to_write):
-          if exception:
-            logging.exception(exception)
+      yield symlinks, fds_to_write
 
-            self.archived_files -= 1
-            self.failed_files.append(utils.SmartUnicode(fd.urn))
-            continue
+  def _WriteBatch(self, symlinks, fds_to_write, streamed_chunks):
+    """Writes a single planned batch into the archive.
+
+    Args:
+      symlinks: A list of (target, archive_path) pairs.
+      fds_to_write: A list of (fd, content_path, st) tuples.
+      streamed_chunks: An iterable of (fd, chunk, exception) tuples as
+          returned by aff4.AFF4Stream.MultiStream for the fds in fds_to_write.
+
+    Yields:
+      Binary chunks comprising the generated archive.
+    """
+    for target, archive_path in symlinks:
+      yield self.archive_generator.WriteSymlink(target, archive_path)
 
-          if prev_fd != fd:
-            if prev_fd:
-              yield self.archive_generator.WriteFileFooter()
-            prev_fd = fd
+    if not fds_to_write:
+      return
 
-            content_path, st = fds_to_write[fd]
-            yield self.archive_generator.WriteFileHeader(content_path, st=st)
+    paths = dict((fd, (content_path, st))
+                 for fd, content_path, st in fds_to_write)
+    prev_fd = None
+    for fd, chunk, exception in streamed_chunks:
+      if exception:
+        logging.exception(exception)
 
-          yield self.archive_generator.WriteFileChunk(chunk)
+        self.failed_files.append(utils.SmartUnicode(fd.urn))
+        continue
 
-        if self.archive_generator.is_file_write_in_progress:
+      if prev_fd != fd:
+        if prev_fd:
           yield self.archive_generator.WriteFileFooter()
+        prev_fd = fd
+
+        content_path, st = paths[fd]
+        yield self.archive_generator.WriteFileHeader(content_path, st=st)
+
+      yield self.archive_generator.WriteFileChunk(chunk)
+
+    if self.archive_generator.is_file_write_in_progress:
+      yield self.archive_generator.WriteFileFooter()
+
+  def Generate(self, collection, token=None):
+    """Generates archive from a given collection.
+
+    Iterates the collection and generates an archive by yielding contents
+    of every referenced AFF4Stream. Unless prefetch_threads is 0, the
+    following batches are opened and read by background threads while the
+    current one is written.
+
+    Args:
+      collection: Iterable with items that point to aff4 paths.
+      token: User's ACLToken.
+
+    Yields:
+      Binary chunks comprising the generated archive.
+    """
+    plans = self._PlanBatches(collection, token=token)
+
+    if self.prefetch_threads:
+      prefetcher = _BatchPrefetcher(
+          plans,
+          num_threads=self.prefetch_threads,
+          max_bytes=self.prefetch_bytes)
+      batches = prefetcher.Batches()
+    else:
+      batches = ((symlinks, fds_to_write,
+                  aff4.AFF4Stream.MultiStream(
+                      [fd for fd, _, _ in fds_to_write]))
+                 for symlinks, fds_to_write in plans)
+
+    try:
+      for symlinks, fds_to_write, streamed_chunks in batches:
+        for chunk in self._WriteBatch(symlinks, fds_to_write,
+                                      streamed_chunks):
+          yield chunk
+    finally:
+      if self.prefetch_threads:
+        prefetcher.Stop()
+
+    # Files are counted as archived while batches are planned, possibly in a
+    # different thread, so failures are only accounted for here.
+    self.archived_files -= len(self.failed_files)
 
     for chunk in self._WriteDescription():
       yield chunk
@@ -198,6 +281,170 @@ class CollectionArchiveGenerator(object):
     yield self.archive_generator.Close()
 
 
+class _ByteBudget(object):
+  """Limits the number of prefetched bytes held in memory.
+
+  The batch currently being written (the head) may always buffer data if it
+  has nothing buffered, so that prefetching of later batches can never
+  starve it.
+  """
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.used = 0
+    self.used_by_batch = {}
+    self.head = 0
+    self.stopped = False
+    self._cond = threading.Condition()
+
+  def Acquire(self, size, batch_index):
+    with self._cond:
+      while not self.stopped:
+        if not self.used or self.used + size <= self.max_bytes:
+          break
+        if batch_index == self.head and not self.used_by_batch.get(batch_index):
+          break
+        self._cond.wait()
+
+      self.used += size
+      self.used_by_batch[batch_index] = (
+          self.used_by_batch.get(batch_index, 0) + size)
+
+  def Release(self, size, batch_index):
+    with self._cond:
+      self.used -= size
+      self.used_by_batch[batch_index] -= size
+      if not self.used_by_batch[batch_index]:
+        del self.used_by_batch[batch_index]
+      self._cond.notify_all()
+
+  def SetHead(self, batch_index):
+    with self._cond:
+      self.head = batch_index
+      self._cond.notify_all()
+
+  def Stop(self):
+    with self._cond:
+      self.stopped = True
+      self._cond.notify_all()
+
+
+class _BatchPrefetcher(object):
+  """Opens and reads archive batches ahead of the archive writer.
+
+  A planner thread runs the (sequential) batch planning, reader threads stream
+  the contents of planned batches into per-batch queues. Batches are handed to
+  the consumer in their original order.
+  """
+
+  # Marks the end of a queue.
+  _END = object()
+
+  def __init__(self, plans, num_threads=4, max_bytes=256 * 1024 * 1024):
+    self.plans = plans
+    self.budget = _ByteBudget(max_bytes)
+    self.stopped = threading.Event()
+
+    # Planned batches, in order. Bounds how far ahead batches are opened.
+    self._batches = Queue.Queue(maxsize=num_threads * 2)
+    # Batches waiting for a reader.
+    self._to_read = Queue.Queue()
+
+    self._threads = [
+        threading.Thread(name="ArchivePlanner", target=self._Plan)
+    ]
+    for i in range(num_threads):
+      self._threads.append(
+          threading.Thread(name="ArchiveReader%d" % i, target=self._Read))
+
+    for thread in self._threads:
+      thread.daemon = True
+      thread.start()
+
+  def _Put(self, queue, item):
+    while not self.stopped.is_set():
+      try:
+        queue.put(item, timeout=1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def _Plan(self):
+    try:
+      for batch_index, (symlinks, fds_to_write) in enumerate(self.plans):
+        batch = _PrefetchedBatch(batch_index, symlinks, fds_to_write)
+        if not self._Put(self._batches, batch):
+          return
+        self._to_read.put(batch)
+    except Exception as e:  # pylint: disable=broad-except
+      self._Put(self._batches, e)
+    else:
+      self._Put(self._batches, self._END)
+    finally:
+      for _ in self._threads:
+        self._to_read.put(self._END)
+
+  def _Read(self):
+    while not self.stopped.is_set():
+      batch = self._to_read.get()
+      if batch is self._END:
+        return
+
+      try:
+        fds = [fd for fd, _, _ in batch.fds_to_write]
+        for fd, chunk, exception in aff4.AFF4Stream.MultiStream(fds):
+          size = len(chunk or "")
+          self.budget.Acquire(size, batch.index)
+          if self.stopped.is_set():
+            return
+          batch.chunks.put((fd, chunk, exception, size))
+      except Exception as e:  # pylint: disable=broad-except
+        batch.chunks.put(e)
+      finally:
+        batch.chunks.put(self._END)
+
+  def _Stream(self, batch):
+    while True:
+      item = batch.chunks.get()
+      if item is self._END:
+        return
+      if isinstance(item, Exception):
+        raise item
+
+      fd, chunk, exception, size = item
+      try:
+        yield fd, chunk, exception
+      finally:
+        self.budget.Release(size, batch.index)
+
+  def Batches(self):
+    """Yields (symlinks, fds_to_write, streamed_chunks) tuples in order."""
+    while True:
+      batch = self._batches.get()
+      if batch is self._END:
+        return
+      if isinstance(batch, Exception):
+        raise batch
+
+      self.budget.SetHead(batch.index)
+      yield batch.symlinks, batch.fds_to_write, self._Stream(batch)
+
+  def Stop(self):
+    self.stopped.set()
+    self.budget.Stop()
+
+
+class _PrefetchedBatch(object):
+  """A planned archive batch and the queue its contents are read into."""
+
+  def __init__(self, index, symlinks, fds_to_write):
+    self.index = index
+    self.symlinks = symlinks
+    self.fds_to_write = fds_to_write
+    self.chunks = Queue.Queue()
+
+
 class ApiDataObjectKeyValuePair(rdf_structs.RDFProtoStruct):
   """Defines a proto for returning key value pairs of data objects."""
 
@@ -7,6 +7,8 @@
 import hashlib
 import os
 import tarfile
+import threading
+import time
 import zipfile
 
 
@@ -16,6 +18,7 @@ from grr.gui import api_call_handler_utils
 
 from grr.lib import flags
 from grr.lib import rdfvalue
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -61,7 +64,9 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
       self,
       collection,
       archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP,
-      predicate=None):
+      predicate=None,
+      prefetch_threads=None,
+      prefetch_bytes=None):
 
     self.fd_path = os.path.join(self.temp_dir, "archive")
     archive_generator = api_call_handler_utils.CollectionArchiveGenerator(
@@ -69,7 +74,9 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
         predicate=predicate,
         prefix="test_prefix",
         description="Test description",
-        client_id=self.client_id)
+        client_id=self.client_id,
+        prefetch_threads=prefetch_threads,
+        prefetch_bytes=prefetch_bytes)
     with open(self.fd_path, "wb") as out_fd:
       for chunk in archive_generator.Generate(collection, token=self.token):
         out_fd.write(chunk)
@@ -284,6 +291,156 @@ class CollectionArchiveGeneratorTest(test_lib.GRRBaseTest):
         ]
     })
 
+  def _CreateManyFiles(self, count):
+    stat_entries = []
+    for i in range(count):
+      path = self.client_id.Add("fs/os/foo/many/file%d.txt" % i)
+      # Every third file has the same content to exercise deduplication
+      # across batches.
+      content = "content%d" % (i % (count // 3 or 1)) * 100
+      with aff4.FACTORY.Create(
+          path, aff4.AFF4MemoryStream, token=self.token) as fd:
+        fd.Write(content)
+        fd.Set(
+            fd.Schema.HASH,
+            rdf_crypto.Hash(sha256=hashlib.sha256(content).digest()))
+
+      stat_entries.append(
+          rdf_client.StatEntry(pathspec=rdf_paths.PathSpec(
+              path="foo/many/file%d.txt" % i,
+              pathtype=rdf_paths.PathSpec.PathType.OS)))
+    return stat_entries
+
+  def _ReadTar(self, fd_path):
+    with tarfile.open(fd_path) as tar_fd:
+      result = []
+      for member in tar_fd.getmembers():
+        if member.issym():
+          result.append((member.name, member.linkname))
+        else:
+          result.append((member.name, tar_fd.extractfile(member).read()))
+      return result
+
+  def testPrefetchingDoesNotChangeArchive(self):
+    stat_entries = self._CreateManyFiles(30)
+
+    tar_gz = api_call_handler_utils.CollectionArchiveGenerator.TAR_GZ
+    with utils.Stubber(api_call_handler_utils.CollectionArchiveGenerator,
+                       "BATCH_SIZE", 4):
+      _, fd_path = self._GenerateArchive(
+          stat_entries, archive_format=tar_gz, prefetch_threads=0)
+      expected = self._ReadTar(fd_path)
+      self.fd.close()
+
+      for prefetch_bytes in [1, 1024, 1024 * 1024]:
+        _, fd_path = self._GenerateArchive(
+            stat_entries,
+            archive_format=tar_gz,
+            prefetch_threads=3,
+            prefetch_bytes=prefetch_bytes)
+        self.assertEqual(self._ReadTar(fd_path), expected)
+        self.fd.close()
+
+    # 10 distinct contents, 30 symlinks and the MANIFEST.
+    self.assertEqual(len(expected), 41)
+
+  def testCorrectlyAccountsForFailedFilesWithoutPrefetching(self):
+    with test_lib.ConfigOverrider({"API.archive_prefetch_threads": 0}):
+      self.testCorrectlyAccountsForFailedFiles()
+
+  def testPrefetchThreadsAreStoppedWhenGenerationIsAborted(self):
+    stat_entries = self._CreateManyFiles(30)
+    threads_before = threading.active_count()
+
+    with utils.Stubber(api_call_handler_utils.CollectionArchiveGenerator,
+                       "BATCH_SIZE", 2):
+      archive_generator = api_call_handler_utils.CollectionArchiveGenerator(
+          archive_format=api_call_handler_utils.CollectionArchiveGenerator.ZIP,
+          prefix="test_prefix",
+          client_id=self.client_id,
+          prefetch_threads=3,
+          prefetch_bytes=1)
+      chunks = archive_generator.Generate(stat_entries, token=self.token)
+      next(chunks)
+      chunks.close()
+
+    for _ in range(100):
+      if threading.active_count() <= threads_before:
+        break
+      time.sleep(0.1)
+    self.assertLessEqual(threading.active_count(), threads_before)
+
+
+class ByteBudgetTest(test_lib.GRRBaseTest):
+  """Test for the prefetching byte budget."""
+
+  def _AcquireInThread(self, budget, size, batch_index):
+    thread = threading.Thread(
+        target=budget.Acquire, args=(size, batch_index))
+    thread.daemon = True
+    thread.start()
+    thread.join(0.1)
+    return thread
+
+  def testAcquireWithinBudgetDoesNotBlock(self):
+    budget = api_call_handler_utils._ByteBudget(100)
+    budget.Acquire(60, 1)
+    budget.Acquire(40, 2)
+    self.assertEqual(budget.used, 100)
+
+  def testAcquireOverBudgetBlocksUntilReleased(self):
+    budget = api_call_handler_utils._ByteBudget(100)
+    budget.Acquire(60, 0)
+
+    thread = self._AcquireInThread(budget, 60, 1)
+    self.assertTrue(thread.is_alive())
+
+    budget.Release(60, 0)
+    thread.join(5)
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(budget.used, 60)
+
+  def testHeadBatchIsNeverStarved(self):
+    budget = api_call_handler_utils._ByteBudget(100)
+    budget.Acquire(100, 1)
+    budget.Acquire(100, 2)
+
+    # Batch 0 is the head and has nothing buffered yet.
+    budget.Acquire(1000, 0)
+    self.assertEqual(budget.used, 1200)
+
+    # But once it has, it has to wait like everyone else.
+    thread = self._AcquireInThread(budget, 10, 0)
+    self.assertTrue(thread.is_alive())
+
+    budget.Release(1000, 0)
+    budget.Release(100, 1)
+    budget.Release(100, 2)
+    thread.join(5)
+    self.assertFalse(thread.is_alive())
+
+  def testSetHeadUnblocksNewHead(self):
+    budget = api_call_handler_utils._ByteBudget(100)
+    budget.Acquire(100, 0)
+
+    thread = self._AcquireInThread(budget, 10, 1)
+    self.assertTrue(thread.is_alive())
+
+    budget.SetHead(1)
+    thread.join(5)
+    self.assertFalse(thread.is_alive())
+
+  def testStopUnblocksWaiters(self):
+    budget = api_call_handler_utils._ByteBudget(100)
+    budget.Acquire(100, 0)
+
+    thread = self._AcquireInThread(budget, 10, 1)
+    self.assertTrue(thread.is_alive())
+
+    budget.Stop()
+    thread.join(5)
+    self.assertFalse(thread.is_alive())
+
 
 class FilterCollectionTest(test_lib.GRRBaseTest):
   """Test for FilterCollection."""
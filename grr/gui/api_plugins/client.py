@@ -21,6 +21,7 @@ from grr.proto.api import client_pb2
 from grr.server import aff4
 
 from grr.server import client_index
+from grr.server import client_stats_store
 from grr.server import data_store
 from grr.server import events
 
@@ -157,13 +158,11 @@ class ApiSearchClientsHandler(api_call_handler_base.ApiCallHandler):
   result_type = ApiSearchClientsResult
 
   def Handle(self, args, token=None):
-    end = args.count or sys.maxint
-
     keywords = shlex.split(args.query)
 
     index = client_index.CreateClientIndex(token=token)
-    result_urns = sorted(
-        index.LookupClients(keywords), key=str)[args.offset:args.offset + end]
+    result_urns = index.LookupClients(
+        keywords, offset=args.offset, limit=args.count or None)
 
     result_set = aff4.FACTORY.MultiOpen(result_urns, token=token)
 
@@ -675,16 +674,8 @@ class ApiGetClientLoadStatsHandler(api_call_handler_base.ApiCallHandler):
   # pyformat: enable
   MAX_SAMPLES = 100
 
-  def Handle(self, args, token=None):
-    start_time = args.start
-    end_time = args.end
-
-    if not end_time:
-      end_time = rdfvalue.RDFDatetime.Now()
-
-    if not start_time:
-      start_time = end_time - rdfvalue.Duration("30m")
-
+  def _ReadLegacyPoints(self, args, start_time, end_time, token=None):
+    """Reads points from the versioned AFF4 stats attribute."""
     fd = aff4.FACTORY.Create(
         args.client_id.ToClientURN().Add("stats"),
         aff4_type=aff4_stats.ClientStats,
@@ -729,6 +720,40 @@ class ApiGetClientLoadStatsHandler(api_call_handler_base.ApiCallHandler):
       else:
         raise ValueError("Unknown metric.")
 
+    return points, len(stat_values)
+
+  def Handle(self, args, token=None):
+    start_time = args.start
+    end_time = args.end
+
+    if not end_time:
+      end_time = rdfvalue.RDFDatetime.Now()
+
+    if not start_time:
+      start_time = end_time - rdfvalue.Duration("30m")
+
+    store = client_stats_store.ClientStatsStore(
+        args.client_id.ToClientURN(), token=token)
+    since = store.Since()
+
+    points = []
+    num_samples = 0
+    # Stats from before the columnar store was used by the client are only
+    # kept in the AFF4 object.
+    if since is None or start_time < since:
+      legacy_end = end_time if since is None else min(end_time, since)
+      legacy_points, num_samples = self._ReadLegacyPoints(
+          args, start_time, legacy_end, token=token)
+      if since is not None:
+        legacy_points = [p for p in legacy_points if p[1] < since]
+      points.extend(legacy_points)
+
+    if since is not None and end_time >= since:
+      store_points = store.ReadMetric(
+          str(args.metric), max(start_time, since), end_time, self.MAX_SAMPLES)
+      num_samples += len(store_points)
+      points.extend(store_points)
+
     # Points collected from "cpu_samples" and "io_samples" may not be correctly
     # sorted in some cases (as overlaps between different stat_values are
     # possible).
@@ -740,7 +765,7 @@ class ApiGetClientLoadStatsHandler(api_call_handler_base.ApiCallHandler):
     if args.metric not in self.GAUGE_METRICS:
       ts.MakeIncreasing()
 
-    if len(stat_values) > self.MAX_SAMPLES:
+    if num_samples > self.MAX_SAMPLES:
       sampling_interval = rdfvalue.Duration.FromSeconds(
           ((end_time - start_time).seconds / self.MAX_SAMPLES) or 1)
       if args.metric in self.GAUGE_METRICS:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Benchmarks for reading client load stats."""
+
+
+import time
+
+from grr.gui.api_plugins import client as client_plugin
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import aff4
+from grr.server import client_stats_store
+from grr.server.aff4_objects import stats as aff4_stats
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class ClientLoadStatsBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Reads a month of load stats from the AFF4 object and the store."""
+
+  units = "s"
+
+  DAYS = 31
+  # Seconds between two ClientStats messages and two samples within them.
+  MESSAGE_INTERVAL = 600
+  SAMPLE_INTERVAL = 10
+
+  WINDOWS = [("1h", 3600), ("1d", 24 * 3600), ("1w", 7 * 24 * 3600),
+             ("31d", 31 * 24 * 3600)]
+  METRICS = ["CPU_PERCENT", "IO_READ_BYTES"]
+  REPEATS = 5
+
+  def setUp(self):
+    super(ClientLoadStatsBenchmark, self).setUp(["Window", "Points"],
+                                                ["<10", "<10"])
+    self.legacy_client_id, self.store_client_id = self.SetupClients(2)
+    self.start = rdfvalue.RDFDatetime.FromSecondsFromEpoch(1000000000)
+    self.end = self.start + rdfvalue.Duration.FromSeconds(self.DAYS * 24 *
+                                                          3600)
+    self._FillStats()
+
+  def _ClientStats(self, start):
+    stats = rdf_client.ClientStats(
+        bytes_received=start, bytes_sent=start, RSS_size=start % 1000000)
+    for seconds in xrange(start, start + self.MESSAGE_INTERVAL,
+                          self.SAMPLE_INTERVAL):
+      timestamp = rdfvalue.RDFDatetime.FromSecondsFromEpoch(seconds)
+      stats.cpu_samples.Append(
+          rdf_client.CpuSample(
+              timestamp=timestamp,
+              cpu_percent=seconds % 100,
+              user_cpu_time=seconds / 10.0,
+              system_cpu_time=seconds / 20.0))
+      stats.io_samples.Append(
+          rdf_client.IOSample(
+              timestamp=timestamp, read_bytes=seconds, write_bytes=seconds))
+    return stats
+
+  def _FillStats(self):
+    """Writes every message to the AFF4 object of one client, store of other."""
+    store = client_stats_store.ClientStatsStore(
+        self.store_client_id, token=self.token)
+    start_seconds = self.start.AsSecondsFromEpoch()
+    for start in xrange(start_seconds, self.end.AsSecondsFromEpoch(),
+                        self.MESSAGE_INTERVAL):
+      stats = self._ClientStats(start)
+      sent = start + self.MESSAGE_INTERVAL
+      with test_lib.FakeTime(sent):
+        with aff4.FACTORY.Create(
+            self.legacy_client_id.Add("stats"),
+            aff4_type=aff4_stats.ClientStats,
+            token=self.token,
+            mode="w") as stats_fd:
+          stats_fd.AddAttribute(stats_fd.Schema.STATS, stats.DownSample())
+
+      store.AddClientStats(stats,
+                           rdfvalue.RDFDatetime.FromSecondsFromEpoch(sent))
+
+  def _Time(self, name, client_id, window_name, window, metric):
+    handler = client_plugin.ApiGetClientLoadStatsHandler()
+    args = client_plugin.ApiGetClientLoadStatsArgs(
+        client_id=client_id.Basename(),
+        metric=metric,
+        start=self.end - rdfvalue.Duration.FromSeconds(window),
+        end=self.end)
+
+    start = time.time()
+    for _ in xrange(self.REPEATS):
+      result = handler.Handle(args, token=self.token)
+    self.AddResult("%s %s" % (name, metric),
+                   (time.time() - start) / self.REPEATS, self.REPEATS,
+                   window_name, len(result.data_points))
+
+  def testGetClientLoadStats(self):
+    """Reads windows of up to a month of 10 second samples."""
+    for metric in self.METRICS:
+      for window_name, window in self.WINDOWS:
+        self._Time("AFF4", self.legacy_client_id, window_name, window, metric)
+        self._Time("Store", self.store_client_id, window_name, window, metric)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -8,11 +8,14 @@ from grr.gui import api_test_lib
 from grr.gui.api_plugins import client as client_plugin
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import test_base as rdf_test_base
 from grr.server import aff4
 from grr.server import client_index
+from grr.server import client_stats_store
 from grr.server import events
+from grr.server.aff4_objects import stats as aff4_stats
 from grr.server.flows.general import audit
 
 from grr.test_lib import test_lib
@@ -284,6 +287,73 @@ class ApiInterrogateClientHandlerTest(api_test_lib.ApiCallHandlerTest):
     self.assertEqual(str(flows_urns[0]), result.operation_id)
 
 
+class ApiGetClientLoadStatsHandlerTest(api_test_lib.ApiCallHandlerTest):
+  """Test for ApiGetClientLoadStatsHandler."""
+
+  def setUp(self):
+    super(ApiGetClientLoadStatsHandlerTest, self).setUp()
+    self.client_id = self.SetupClients(1)[0]
+    self.handler = client_plugin.ApiGetClientLoadStatsHandler()
+
+  def _ClientStats(self, seconds):
+    stats = rdf_client.ClientStats()
+    stats.cpu_samples.Append(
+        rdf_client.CpuSample(
+            timestamp=rdfvalue.RDFDatetime.FromSecondsFromEpoch(seconds),
+            cpu_percent=seconds))
+    return stats
+
+  def _WriteLegacyStats(self, seconds):
+    with test_lib.FakeTime(seconds):
+      with aff4.FACTORY.Create(
+          self.client_id.Add("stats"),
+          aff4_type=aff4_stats.ClientStats,
+          token=self.token,
+          mode="w") as stats_fd:
+        stats_fd.AddAttribute(
+            stats_fd.Schema.STATS(self._ClientStats(seconds)))
+
+  def _WriteStoreStats(self, seconds):
+    client_stats_store.ClientStatsStore(
+        self.client_id, token=self.token).AddClientStats(
+            self._ClientStats(seconds),
+            rdfvalue.RDFDatetime.FromSecondsFromEpoch(seconds))
+
+  def _Handle(self, start, end):
+    args = client_plugin.ApiGetClientLoadStatsArgs(
+        client_id=self.client_id,
+        metric="CPU_PERCENT",
+        start=rdfvalue.RDFDatetime.FromSecondsFromEpoch(start),
+        end=rdfvalue.RDFDatetime.FromSecondsFromEpoch(end))
+    result = self.handler.Handle(args, token=self.token)
+    return [(dp.value, dp.timestamp.AsSecondsFromEpoch())
+            for dp in result.data_points]
+
+  def testLegacyStatsAreRead(self):
+    for seconds in [10, 20, 30]:
+      self._WriteLegacyStats(seconds)
+
+    self.assertEqual(self._Handle(1, 100), [(10, 10), (20, 20), (30, 30)])
+
+  def testStoreStatsAreRead(self):
+    for seconds in [10, 20, 30]:
+      self._WriteStoreStats(seconds)
+
+    self.assertEqual(self._Handle(1, 100), [(10, 10), (20, 20), (30, 30)])
+
+  def testLegacyStatsAreReadBeforeTheStoreWasUsed(self):
+    for seconds in [10, 20]:
+      self._WriteLegacyStats(seconds)
+    # Stats are written to both while migrating.
+    for seconds in [30, 40]:
+      self._WriteLegacyStats(seconds)
+      self._WriteStoreStats(seconds)
+
+    self.assertEqual(
+        self._Handle(1, 100), [(10, 10), (20, 20), (30, 30), (40, 40)])
+    self.assertEqual(self._Handle(35, 100), [(40, 40)])
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -6,6 +6,7 @@
 # These need to register plugins so, pylint: disable=unused-import
 from grr.gui.api_plugins import artifact_regression_test
 from grr.gui.api_plugins import artifact_test
+from grr.gui.api_plugins import client_benchmark_test
 from grr.gui.api_plugins import client_regression_test
 from grr.gui.api_plugins import client_test
 from grr.gui.api_plugins import config_regression_test
@@ -878,7 +878,8 @@ class ApiGetPendingUserNotificationsCountHandler(
         mode="r",
         token=token)
 
-    notifications = user_record.Get(user_record.Schema.PENDING_NOTIFICATIONS)
+    notifications = user_record.GetPendingNotifications(
+        max_records=aff4_users.GRRUser.MAX_PENDING_NOTIFICATIONS)
 
     return ApiGetPendingUserNotificationsCountResult(count=len(notifications))
 
@@ -913,11 +914,13 @@ class ApiListPendingUserNotificationsHandler(
         mode="r",
         token=token)
 
-    notifications = user_record.Get(user_record.Schema.PENDING_NOTIFICATIONS)
+    notifications = user_record.GetPendingNotifications(
+        after_timestamp=args.timestamp,
+        max_records=aff4_users.GRRUser.MAX_PENDING_NOTIFICATIONS)
 
     result = [
         ApiNotification().InitFromNotification(n, is_pending=True)
-        for n in notifications if n.timestamp > args.timestamp
+        for n in notifications
     ]
 
     return ApiListPendingUserNotificationsResult(items=result)
@@ -973,15 +976,22 @@ class ApiListAndResetUserNotificationsHandler(
         mode="rw",
         token=token)
 
-    result = []
+    if not args.count:
+      args.count = 50
 
-    pending_notifications = user_record.Get(
-        user_record.Schema.PENDING_NOTIFICATIONS)
+    # Without a filter, only the requested page and the notification after it
+    # are read. The latter tells the UI that there is a next page.
+    max_records = None
+    if not args.filter:
+      max_records = args.offset + args.count + 1
 
-    # Hack for sorting. Requires retrieval of all notifications.
-    notifications = list(user_record.ShowNotifications(reset=True))
-    notifications = sorted(
-        notifications, key=lambda x: x.timestamp, reverse=True)
+    notifications = list(
+        user_record.ShowNotifications(reset=False, max_records=max_records))
+    pending_notifications = [
+        n for n in notifications if user_record.IsPendingNotification(n)
+    ]
+    if pending_notifications:
+      user_record.MarkNotificationsShown(notifications[0].timestamp)
 
     total_count = len(notifications)
 
@@ -990,9 +1000,7 @@ class ApiListAndResetUserNotificationsHandler(
           n for n in notifications if args.filter.lower() in n.message.lower()
       ]
 
-    if not args.count:
-      args.count = 50
-
+    result = []
     start = args.offset
     end = args.offset + args.count
     for notification in notifications[start:end]:
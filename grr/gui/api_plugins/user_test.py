@@ -42,11 +42,10 @@ class ApiNotificationTest(api_test_lib.ApiCallHandlerTest):
 
     user_record = aff4.FACTORY.Open(
         aff4.ROOT_URN.Add("users").Add(self.token.username), token=self.token)
-    pending_notifications = user_record.Get(
-        user_record.Schema.PENDING_NOTIFICATIONS)
+    pending_notifications = user_record.GetPendingNotifications()
 
     result = user_plugin.ApiNotification().InitFromNotification(
-        pending_notifications.Pop())
+        pending_notifications[-1])
     aff4.FACTORY.Delete(
         aff4.ROOT_URN.Add("users").Add(self.token.username), token=self.token)
     return result
@@ -649,8 +648,8 @@ class ApiDeletePendingUserNotificationHandlerTest(
         mode="r",
         token=self.token)
 
-    pending = user_record.Get(user_record.Schema.PENDING_NOTIFICATIONS)
-    shown = user_record.Get(user_record.Schema.SHOWN_NOTIFICATIONS)
+    pending = user_record.GetPendingNotifications()
+    shown = user_record.GetShownNotifications()
     return (pending, shown)
 
   def testDeletesFromPendingAndAddsToShown(self):
@@ -706,6 +705,45 @@ class ApiDeletePendingUserNotificationHandlerTest(
     self.assertEqual(len(shown), 0)
 
 
+class ApiListAndResetUserNotificationsHandlerTest(
+    api_test_lib.ApiCallHandlerTest):
+  """Test for ApiListAndResetUserNotificationsHandler."""
+
+  def setUp(self):
+    super(ApiListAndResetUserNotificationsHandlerTest, self).setUp()
+    self.handler = user_plugin.ApiListAndResetUserNotificationsHandler()
+    self.client_id = self.SetupClients(1)[0]
+
+    for i in range(5):
+      with test_lib.FakeTime(42 + i):
+        self._SendNotification(
+            notification_type="ViewObject",
+            subject=str(self.client_id),
+            message="<message %d>" % i,
+            client_id=self.client_id)
+
+  def testOnlyReadsUpToTheRequestedPage(self):
+    result = self.handler.Handle(
+        user_plugin.ApiListAndResetUserNotificationsArgs(offset=1, count=2),
+        token=self.token)
+
+    self.assertEqual(len(result.items), 2)
+    self.assertIn("<message 3>", result.items[0].message)
+    self.assertIn("<message 2>", result.items[1].message)
+    self.assertTrue(all(item.is_pending for item in result.items))
+    # The notification after the page is counted to show there are more.
+    self.assertEqual(result.total_count, 4)
+
+  def testAllNotificationsAreMarkedShown(self):
+    self.handler.Handle(
+        user_plugin.ApiListAndResetUserNotificationsArgs(count=1),
+        token=self.token)
+
+    result = user_plugin.ApiGetPendingUserNotificationsCountHandler().Handle(
+        None, token=self.token)
+    self.assertEqual(result.count, 0)
+
+
 class ApiDeletePendingGlobalNotificationHandlerTest(
     api_test_lib.ApiCallHandlerTest):
   """Test for ApiDeletePendingGlobalNotificationHandler."""
@@ -2,6 +2,7 @@
 """API handlers for dealing with files in a client's virtual file system."""
 
 import csv
+import itertools
 import os
 import re
 import StringIO
@@ -23,6 +24,7 @@ from grr.proto.api import vfs_pb2
 from grr.server import aff4
 from grr.server import data_store
 from grr.server import flow
+from grr.server import timeline_index
 from grr.server.aff4_objects import aff4_grr
 from grr.server.aff4_objects import standard as aff4_standard
 from grr.server.flows.general import filesystem
@@ -677,6 +679,7 @@ class ApiGetVfsTimelineArgs(rdf_structs.RDFProtoStruct):
   protobuf = vfs_pb2.ApiGetVfsTimelineArgs
   rdf_deps = [
       client.ApiClientId,
+      rdfvalue.RDFDatetime,
   ]
 
 
@@ -697,62 +700,86 @@ class ApiGetVfsTimelineHandler(api_call_handler_base.ApiCallHandler):
     ValidateVfsPath(args.file_path)
 
     folder_urn = args.client_id.ToClientURN().Add(args.file_path)
-    items = self.GetTimelineItems(folder_urn, token=token)
-    return ApiGetVfsTimelineResult(items=items)
+    items = list(
+        self.GetTimelineItems(
+            folder_urn,
+            start_time=args.start_time or None,
+            end_time=args.end_time or None,
+            offset=args.offset,
+            count=args.count or None,
+            cursor=args.cursor or None,
+            token=token))
+
+    result = ApiGetVfsTimelineResult(items=items)
+    if items and len(items) == args.count:
+      result.next_cursor = timeline_index.NextCursor(
+          [item.timestamp.AsMicroSecondsFromEpoch() for item in items],
+          cursor=args.cursor or None)
+    return result
+
+  ACTIONS = {
+      timeline_index.MODIFICATION:
+          ApiVfsTimelineItem.FileActionType.MODIFICATION,
+      timeline_index.ACCESS:
+          ApiVfsTimelineItem.FileActionType.ACCESS,
+      timeline_index.METADATA_CHANGED:
+          ApiVfsTimelineItem.FileActionType.METADATA_CHANGED,
+  }
 
   @staticmethod
-  def GetTimelineItems(folder_urn, token=None):
+  def GetTimelineItems(folder_urn,
+                       start_time=None,
+                       end_time=None,
+                       offset=0,
+                       count=None,
+                       cursor=None,
+                       token=None):
     """Retrieves the timeline items for a given folder.
 
     The timeline consists of items indicating a state change of a file. To
     construct the timeline, MAC times are used. Whenever a timestamp on a
     file changes, a corresponding timeline item is created.
 
+    Items are read from the client's timeline index. Files written before the
+    index was maintained are indexed the first time a folder's timeline is
+    requested.
+
     Args:
       folder_urn: The urn of the target folder.
+      start_time: If set, only items at or after this time are returned.
+      end_time: If set, only items at or before this time are returned.
+      offset: Number of items to skip.
+      count: Maximum number of items to return. All if None.
+      cursor: If set, only items following a previous page are returned, see
+        timeline_index.NextCursor.
       token: The user token.
 
-    Returns:
-      A list of timeline items, each consisting of a file path, a timestamp
-      and an action describing the nature of the file change.
+    Yields:
+      Timeline items, each consisting of a file path, a timestamp and an
+      action describing the nature of the file change, newest first.
     """
-    child_urns = []
-    for _, children in aff4.FACTORY.RecursiveMultiListChildren(
-        folder_urn, token=token):
-      child_urns.extend(children)
-
-    # Get the stats attributes for all clients.
-    attribute = aff4.Attribute.GetAttributeByName("stat")
-
-    items = []
-    for subject, values in data_store.DB.MultiResolvePrefix(
-        child_urns,
-        attribute.predicate,
-        timestamp=data_store.DB.ALL_TIMESTAMPS,
-        token=token):
-      for _, serialized, _ in values:
-        stat = rdf_client.StatEntry.FromSerializedString(serialized)
-
-        # Add a new event for each MAC time if it exists.
-        for c in "mac":
-          timestamp = getattr(stat, "st_%stime" % c)
-          if timestamp is not None:
-            item = ApiVfsTimelineItem()
-            item.timestamp = timestamp * 1000000
-
-            # Remove aff4:/<client_id> to have a more concise path to the
-            # subject.
-            item.file_path = "/".join(str(subject).split("/")[2:])
-            if c == "m":
-              item.action = ApiVfsTimelineItem.FileActionType.MODIFICATION
-            elif c == "a":
-              item.action = ApiVfsTimelineItem.FileActionType.ACCESS
-            elif c == "c":
-              item.action = ApiVfsTimelineItem.FileActionType.METADATA_CHANGED
-
-            items.append(item)
-
-    return sorted(items, key=lambda x: x.timestamp, reverse=True)
+    client_id, folder_path = folder_urn.Split(2)
+    index = timeline_index.VfsTimelineIndex(client_id, token=token)
+
+    if not index.IsIndexed(folder_path):
+      index.IndexStatHistory(
+          itertools.chain.from_iterable(
+              children
+              for _, children in aff4.FACTORY.RecursiveMultiListChildren(
+                  folder_urn, token=token)))
+      index.MarkIndexed(folder_path)
+
+    for timestamp, file_path, action in index.Read(
+        folder_path,
+        start_time=start_time and start_time.AsMicroSecondsFromEpoch(),
+        end_time=end_time and end_time.AsMicroSecondsFromEpoch(),
+        offset=offset,
+        count=count,
+        cursor=cursor):
+      yield ApiVfsTimelineItem(
+          timestamp=rdfvalue.RDFDatetime(timestamp),
+          file_path=file_path,
+          action=ApiGetVfsTimelineHandler.ACTIONS[action])
 
 
 class ApiGetVfsTimelineAsCsvArgs(rdf_structs.RDFProtoStruct):
@@ -776,8 +803,8 @@ class ApiGetVfsTimelineAsCsvHandler(api_call_handler_base.ApiCallHandler):
     # can export a format suited for TimeSketch import.
     writer.writerow(["Timestamp", "Datetime", "Message", "Timestamp_desc"])
 
-    for start in range(0, len(items), self.CHUNK_SIZE):
-      for item in items[start:start + self.CHUNK_SIZE]:
+    for batch in utils.Grouper(items, self.CHUNK_SIZE):
+      for item in batch:
         writer.writerow([
             item.timestamp.AsMicroSecondsFromEpoch(), item.timestamp,
             utils.SmartStr(item.file_path), item.action
@@ -909,7 +936,8 @@ class ApiGetVfsFilesArchiveHandler(api_call_handler_base.ApiCallHandler):
 
   def _GenerateContent(self, start_urns, prefix, token=None):
     archive_generator = utils.StreamingZipGenerator(
-        compression=zipfile.ZIP_DEFLATED)
+        compression=zipfile.ZIP_DEFLATED,
+        deflate_threads=config.CONFIG["API.archive_deflate_threads"])
     folders_urns = set(start_urns)
 
     while folders_urns:
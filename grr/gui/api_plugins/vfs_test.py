@@ -477,12 +477,11 @@ class ApiCreateVfsRefreshOperationHandlerTest(api_test_lib.ApiCallHandlerTest):
         mode="r",
         token=self.token)
 
-    pending_notifications = user_record.Get(
-        user_record.Schema.PENDING_NOTIFICATIONS)
+    pending_notifications = user_record.GetPendingNotifications()
 
     self.assertIn("Recursive Directory Listing complete",
-                  pending_notifications[0].message)
-    self.assertEqual(pending_notifications[0].source, str(flow_urn))
+                  pending_notifications[-1].message)
+    self.assertEqual(pending_notifications[-1].source, str(flow_urn))
 
 
 class ApiGetVfsRefreshOperationStateHandlerTest(api_test_lib.ApiCallHandlerTest,
@@ -743,6 +742,62 @@ class ApiGetVfsTimelineHandlerTest(api_test_lib.ApiCallHandlerTest,
     with self.assertRaises(ValueError):
       self.handler.Handle(args, token=self.token)
 
+  def testTimelineIsPaginated(self):
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=self.client_id,
+        file_path=self.folder_path,
+        offset=1,
+        count=2)
+    result = self.handler.Handle(args, token=self.token)
+
+    self.assertEqual(
+        [item.timestamp.AsSecondsFromEpoch() for item in result.items], [3, 2])
+
+  def testTimelineIsPagedWithCursor(self):
+    pages = []
+    cursor = None
+    while True:
+      args = vfs_plugin.ApiGetVfsTimelineArgs(
+          client_id=self.client_id, file_path=self.folder_path, count=2)
+      if cursor:
+        args.cursor = cursor
+      result = self.handler.Handle(args, token=self.token)
+      pages.append(
+          [item.timestamp.AsSecondsFromEpoch() for item in result.items])
+      if not result.next_cursor:
+        break
+      cursor = result.next_cursor
+
+    self.assertEqual(pages, [[4, 3], [2, 1], [0]])
+
+  def testTimelineIsFilteredByTime(self):
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=self.client_id,
+        file_path=self.folder_path,
+        start_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(1),
+        end_time=rdfvalue.RDFDatetime().FromSecondsFromEpoch(3))
+    result = self.handler.Handle(args, token=self.token)
+
+    self.assertEqual(
+        [item.timestamp.AsSecondsFromEpoch() for item in result.items],
+        [3, 2, 1])
+
+  def testTimelineIncludesFilesWrittenAfterIndexing(self):
+    args = vfs_plugin.ApiGetVfsTimelineArgs(
+        client_id=self.client_id, file_path=self.folder_path)
+    self.assertEqual(len(self.handler.Handle(args, token=self.token).items), 5)
+
+    with aff4.FACTORY.Create(
+        self.client_id.Add(self.folder_path + "/b.txt"),
+        aff4_grr.VFSAnalysisFile,
+        mode="w",
+        token=self.token) as fd:
+      fd.Set(fd.Schema.STAT, rdf_client.StatEntry(st_mtime=10, st_atime=10))
+
+    items = self.handler.Handle(args, token=self.token).items
+    self.assertEqual(len(items), 7)
+    self.assertEqual(items[0].file_path, self.folder_path + "/b.txt")
+
 
 class ApiGetVfsFilesArchiveHandlerTest(api_test_lib.ApiCallHandlerTest,
                                        VfsTestMixin):
@@ -535,7 +535,7 @@ $('body').injector().get('$browser').notifyWhenNoOutstandingRequests(function()
     for _ in xrange(iterations):
       try:
         fd = aff4.FACTORY.Open(user, users.GRRUser, mode="r", token=self.token)
-        pending_notifications = fd.Get(fd.Schema.PENDING_NOTIFICATIONS)
+        pending_notifications = fd.GetPendingNotifications()
         if pending_notifications:
           return
       except IOError:
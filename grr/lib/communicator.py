@@ -17,6 +17,25 @@ from grr.lib import utils
 from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import flows as rdf_flows
 
+try:
+  # pylint: disable=g-import-not-at-top
+  from lz4 import block as lz4_block
+  # pylint: enable=g-import-not-at-top
+except ImportError:
+  lz4_block = None
+
+
+def SupportedCompression():
+  """Returns the compression types this endpoint is able to decode."""
+  compression_type = rdf_flows.SignedMessageList.CompressionType
+  supported = [
+      compression_type.UNCOMPRESSED, compression_type.ZCOMPRESSION
+  ]
+  if lz4_block is not None:
+    supported.append(compression_type.LZ4COMPRESSION)
+
+  return supported
+
 
 class CommunicatorInit(registry.InitHook):
 
@@ -275,18 +294,95 @@ class Communicator(object):
     # A cache for encrypted ciphers
     self.encrypted_cipher_cache = utils.FastStore(max_size=50000)
 
-  def EncodeMessageList(self, message_list, signed_message_list):
-    """Encode the MessageList into the signed_message_list rdfvalue."""
+  # Message lists smaller than this are not worth compressing.
+  MIN_COMPRESSION_SIZE = 256
+
+  # Message lists larger than this are compressed with the fastest zlib level.
+  LARGE_MESSAGE_LIST_SIZE = 1024 * 1024
+
+  # Message payloads larger than this are sampled to find out if they are
+  # already compressed (e.g. file chunks sent by TransferBuffer).
+  SAMPLED_PAYLOAD_SIZE = 4096
+  PAYLOAD_SAMPLE_SIZE = 1024
+
+  def _IsCompressed(self, payload):
+    """Guesses from a sample whether payload is already compressed."""
+    middle = len(payload) // 2
+    sample = payload[middle:middle + self.PAYLOAD_SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) > len(sample) * 0.9
+
+  def _CompressedPayloadSize(self, message_list):
+    """Returns the number of bytes in already compressed message payloads."""
+    result = 0
+    for message in message_list.job:
+      payload = message.Get("args") or ""
+      if (len(payload) >= self.SAMPLED_PAYLOAD_SIZE and
+          self._IsCompressed(payload)):
+        result += len(payload)
+
+    return result
+
+  def ChooseCompression(self, message_list, size, remote_compression=None):
+    """Chooses how to compress a message list.
+
+    Args:
+      message_list: The MessageList to be sent.
+      size: The size of the serialized message_list.
+      remote_compression: The compression types the receiver can decode. If
+        None, only zlib compression is assumed to be supported.
+
+    Returns:
+      A tuple (compression type, zlib level). The level is None for
+      compression types other than ZCOMPRESSION.
+    """
+    compression_type = rdf_flows.SignedMessageList.CompressionType
+    if size < self.MIN_COMPRESSION_SIZE:
+      return compression_type.UNCOMPRESSED, None
+
+    compressed_size = self._CompressedPayloadSize(message_list)
+    # Compressing compressed data only costs CPU on both ends.
+    if compressed_size > size * 0.9:
+      return compression_type.UNCOMPRESSED, None
+
+    if (lz4_block is not None and remote_compression and
+        compression_type.LZ4COMPRESSION in remote_compression):
+      return compression_type.LZ4COMPRESSION, None
+
+    if size >= self.LARGE_MESSAGE_LIST_SIZE or compressed_size > size * 0.5:
+      return compression_type.ZCOMPRESSION, 1
+
+    return compression_type.ZCOMPRESSION, zlib.Z_DEFAULT_COMPRESSION
+
+  def EncodeMessageList(self,
+                        message_list,
+                        signed_message_list,
+                        remote_compression=None):
+    """Encode the MessageList into the signed_message_list rdfvalue.
+
+    Args:
+      message_list: The MessageList to encode.
+      signed_message_list: The SignedMessageList to fill in.
+      remote_compression: The compression types the receiver can decode.
+    """
     # By default uncompress
     uncompressed_data = message_list.SerializeToString()
     signed_message_list.message_list = uncompressed_data
 
-    compressed_data = zlib.compress(uncompressed_data)
+    compression, level = self.ChooseCompression(
+        message_list, len(uncompressed_data),
+        remote_compression=remote_compression)
+
+    compression_type = rdf_flows.SignedMessageList.CompressionType
+    if compression == compression_type.ZCOMPRESSION:
+      compressed_data = zlib.compress(uncompressed_data, level)
+    elif compression == compression_type.LZ4COMPRESSION:
+      compressed_data = lz4_block.compress(uncompressed_data)
+    else:
+      return
 
     # Only compress if it buys us something.
     if len(compressed_data) < len(uncompressed_data):
-      signed_message_list.compression = (
-          rdf_flows.SignedMessageList.CompressionType.ZCOMPRESSION)
+      signed_message_list.compression = compression
       signed_message_list.message_list = compressed_data
 
   def _GetServerCipher(self):
@@ -308,7 +404,8 @@ class Communicator(object):
                      result,
                      destination=None,
                      timestamp=None,
-                     api_version=3):
+                     api_version=3,
+                     remote_compression=None):
     """Accepts a list of messages and encodes for transmission.
 
     This function signs and then encrypts the payload.
@@ -326,6 +423,9 @@ class Communicator(object):
 
        api_version: The api version which this should be encoded in.
 
+       remote_compression: The compression types the receiver advertised it
+              can decode. If None, zlib compression is used.
+
     Returns:
        A nonce (based on time) which is inserted to the encrypted payload. The
        client can verify that the server is able to decrypt the message and
@@ -355,7 +455,10 @@ class Communicator(object):
       self.timestamp = timestamp = long(time.time() * 1000000)
 
     signed_message_list = rdf_flows.SignedMessageList(timestamp=timestamp)
-    self.EncodeMessageList(message_list, signed_message_list)
+    self.EncodeMessageList(
+        message_list,
+        signed_message_list,
+        remote_compression=remote_compression)
 
     result.encrypted_cipher_metadata = cipher.encrypted_cipher_metadata
 
@@ -380,6 +483,7 @@ class Communicator(object):
                                    struct.pack("<I", api_version))
 
     result.api_version = api_version
+    result.supported_compression = SupportedCompression()
 
     if isinstance(result, rdfvalue.RDFValue):
       # Store the number of messages contained.
@@ -426,6 +530,14 @@ class Communicator(object):
         data = zlib.decompress(signed_message_list.message_list)
       except zlib.error as e:
         raise DecodingError("Failed to decompress: %s" % e)
+
+    elif (compression ==
+          rdf_flows.SignedMessageList.CompressionType.LZ4COMPRESSION and
+          lz4_block is not None):
+      try:
+        data = lz4_block.decompress(signed_message_list.message_list)
+      except Exception as e:  # pylint: disable=broad-except
+        raise DecodingError("Failed to decompress: %s" % e)
     else:
       raise DecodingError("Compression scheme not supported")
 
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Benchmarks for message list compression."""
+
+
+import os
+import time
+import zlib
+
+from grr.lib import communicator
+from grr.lib import flags
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import protodict as rdf_protodict
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class CompressionBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares CPU time and bandwidth of message list compression."""
+
+  units = "ms"
+
+  REPEATS = 20
+
+  def setUp(self):
+    super(CompressionBenchmark, self).setUp(
+        ["Payload", "Compression", "Bytes sent", "Ratio"],
+        ["<12", "<16", "<12", "<8"])
+    self.communicator = communicator.Communicator()
+
+  def _MessageList(self, payloads):
+    message_list = rdf_flows.MessageList()
+    for payload in payloads:
+      message_list.job.Append(
+          rdf_flows.GrrMessage(payload=rdf_protodict.DataBlob(data=payload)))
+    return message_list
+
+  def _Payloads(self):
+    text = "".join("Line %d of some log file with text.\n" % i
+                   for i in xrange(200000))
+    return {
+        # Typical responses, e.g. StatEntry or process listings.
+        "text": [text[i:i + 64 * 1024] for i in xrange(0, len(text), 65536)],
+        # File chunks sent by TransferBuffer are already compressed.
+        "file chunks":
+            [zlib.compress(os.urandom(512 * 1024)) for _ in xrange(4)],
+        "small": ["x" * 100],
+    }
+
+  def _Benchmark(self, name, message_list, remote_compression):
+    uncompressed_size = len(message_list.SerializeToString())
+
+    start = time.time()
+    for _ in xrange(self.REPEATS):
+      signed_message_list = rdf_flows.SignedMessageList()
+      self.communicator.EncodeMessageList(
+          message_list,
+          signed_message_list,
+          remote_compression=remote_compression)
+    encode_time = (time.time() - start) / self.REPEATS
+
+    start = time.time()
+    for _ in xrange(self.REPEATS):
+      self.communicator.DecompressMessageList(signed_message_list)
+    decode_time = (time.time() - start) / self.REPEATS
+
+    compressed_size = len(signed_message_list.message_list)
+    compression = str(signed_message_list.compression)
+    ratio = "%.3f" % (float(compressed_size) / uncompressed_size)
+    self.AddResult("Encode", encode_time, self.REPEATS, name, compression,
+                   compressed_size, ratio)
+    self.AddResult("Decode", decode_time, self.REPEATS, name, compression,
+                   compressed_size, ratio)
+
+  def testAdaptiveCompression(self):
+    """Adaptive compression with the default (zlib only) negotiation."""
+    for name, payloads in sorted(self._Payloads().iteritems()):
+      self._Benchmark(name, self._MessageList(payloads), None)
+
+  def testNegotiatedCompression(self):
+    """Adaptive compression with all codecs available locally."""
+    for name, payloads in sorted(self._Payloads().iteritems()):
+      self._Benchmark(name,
+                      self._MessageList(payloads),
+                      communicator.SupportedCompression())
+
+  def testZlibDefaultLevel(self):
+    """The previous behaviour: zlib at the default level for everything."""
+    for name, payloads in sorted(self._Payloads().iteritems()):
+      message_list = self._MessageList(payloads)
+      data = message_list.SerializeToString()
+
+      start = time.time()
+      for _ in xrange(self.REPEATS):
+        compressed = zlib.compress(data)
+      encode_time = (time.time() - start) / self.REPEATS
+
+      self.AddResult("Encode", encode_time, self.REPEATS, name, "ZLIB (6)",
+                     len(compressed),
+                     "%.3f" % (float(len(compressed)) / len(data)))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -3,8 +3,10 @@
 
 
 import array
+import os
 import pdb
 import time
+import zlib
 
 
 import requests
@@ -24,6 +26,7 @@ from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.server import aff4
 from grr.server import front_end
 from grr.server.aff4_objects import aff4_grr
@@ -290,6 +293,86 @@ class ClientCommsTest(test_lib.GRRBaseTest):
     cn = rdf_client.ClientURN.FromPublicKey(csr.GetPublicKey())
     self.assertEqual(cn, csr.GetCN())
 
+  def _MessageList(self, payload, count=10):
+    message_list = rdf_flows.MessageList()
+    for _ in range(count):
+      message_list.job.Append(
+          rdf_flows.GrrMessage(payload=rdf_protodict.DataBlob(data=payload)))
+    return message_list
+
+  def _Encode(self, message_list, remote_compression=None):
+    signed_message_list = rdf_flows.SignedMessageList()
+    self.client_communicator.EncodeMessageList(
+        message_list,
+        signed_message_list,
+        remote_compression=remote_compression)
+    return signed_message_list
+
+  def testCompressiblePayloadsAreCompressed(self):
+    message_list = self._MessageList("x" * 10000)
+    signed_message_list = self._Encode(message_list)
+    self.assertEqual(signed_message_list.compression,
+                     rdf_flows.SignedMessageList.CompressionType.ZCOMPRESSION)
+    self.assertLess(
+        len(signed_message_list.message_list),
+        len(message_list.SerializeToString()))
+
+    decoded = self.server_communicator.DecompressMessageList(
+        signed_message_list)
+    self.assertEqual(decoded, message_list)
+
+  def testCompressedPayloadsAreNotCompressedAgain(self):
+    message_list = self._MessageList(zlib.compress(os.urandom(10000)))
+
+    compress_calls = []
+
+    def CountingCompress(*args):
+      compress_calls.append(args)
+      return zlib.compress(*args)
+
+    # The samples taken to detect compressed payloads are small.
+    with utils.Stubber(zlib, "compress", CountingCompress):
+      signed_message_list = self._Encode(message_list)
+
+    self.assertEqual(signed_message_list.compression,
+                     rdf_flows.SignedMessageList.CompressionType.UNCOMPRESSED)
+    for args in compress_calls:
+      self.assertLessEqual(len(args[0]), 1024)
+
+  def testSmallMessageListsAreNotCompressed(self):
+    signed_message_list = self._Encode(self._MessageList("x" * 10, count=1))
+    self.assertEqual(signed_message_list.compression,
+                     rdf_flows.SignedMessageList.CompressionType.UNCOMPRESSED)
+
+  def testCompressionIsNegotiated(self):
+    compression_type = rdf_flows.SignedMessageList.CompressionType
+    message_list = self._MessageList("x" * 10000)
+
+    # Nothing is known about the server yet.
+    self.assertIsNone(self.client_communicator.server_compression)
+
+    result = rdf_flows.ClientCommunication()
+    self.client_communicator.EncodeMessages(message_list, result)
+    self.assertItemsEqual(result.supported_compression,
+                          communicator.SupportedCompression())
+
+    # Only use the fast codec if the other side supports it.
+    compression = self._Encode(
+        message_list,
+        remote_compression=[compression_type.ZCOMPRESSION]).compression
+    self.assertEqual(compression, compression_type.ZCOMPRESSION)
+
+    if communicator.lz4_block is None:
+      return
+
+    signed_message_list = self._Encode(
+        message_list, remote_compression=communicator.SupportedCompression())
+    self.assertEqual(signed_message_list.compression,
+                     compression_type.LZ4COMPRESSION)
+    self.assertEqual(
+        self.server_communicator.DecompressMessageList(signed_message_list),
+        message_list)
+
 
 class HTTPClientTests(test_lib.GRRBaseTest):
   """Test the http communicator."""
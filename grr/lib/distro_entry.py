@@ -95,6 +95,12 @@ def EndToEndTests():
   flags.StartMain(end_to_end_tests.main)
 
 
+def LoadTest():
+  from grr.tools import load_test
+  SetConfigOptions()
+  flags.StartMain(load_test.main)
+
+
 def Worker():
   from grr.worker import worker
   SetConfigOptions()
@@ -788,6 +788,20 @@ class ByteSize(RDFInteger):
     self._value = int(value * multiplier)
 
 
+# Matches the path forms utils.NormalizePath() would rewrite in an absolute
+# path: empty, "." and ".." components and trailing separators.
+_NON_NORMAL_PATH_RE = re.compile(r"//|/\.\.?(?:/|$)|[^/]/$")
+
+
+def _NormalizeURNPath(path):
+  """Normalizes a URN path, skipping the work for already normal paths."""
+  path = utils.SmartUnicode(path)
+  if path[:1] == u"/" and not _NON_NORMAL_PATH_RE.search(path):
+    return path
+
+  return utils.NormalizePath(path)
+
+
 @functools.total_ordering
 class RDFURN(RDFValue):
   """An object to abstract URL manipulation."""
@@ -800,6 +814,17 @@ class RDFURN(RDFValue):
 
   _string_urn = ""
 
+  # Cached hash of the string urn. See __hash__.
+  _hash = None
+  _hashed_urn = None
+
+  # An optional bounded table mapping raw paths to their normalized (and
+  # shared) form. Only short paths, i.e. hot prefixes like aff4:/C.xxxx/flows or
+  # aff4:/hunts/H:123456, are interned. See EnableInterning().
+  _intern_table = None
+  _intern_table_size = 0
+  _intern_max_depth = 3
+
   def __init__(self, initializer=None, age=None):
     """Constructor.
 
@@ -815,13 +840,42 @@ class RDFURN(RDFValue):
     if isinstance(initializer, RDFURN):
       # Make a direct copy of the other object
       self._string_urn = initializer.Path()
-      super(RDFURN, self).__init__(None, age=age)
+      self._age = 0 if age is None else age
       return
 
-    super(RDFURN, self).__init__(initializer=initializer, age=age)
+    # The age is kept as a plain integer, it is converted to an RDFDatetime by
+    # the age property when needed.
+    super(RDFURN, self).__init__(
+        initializer=initializer, age=0 if age is None else age)
     if self._value is None and initializer is not None:
       self.ParseFromString(initializer)
 
+  @classmethod
+  def EnableInterning(cls, max_size=10000, max_depth=3):
+    """Enables the process wide intern table for short URN paths.
+
+    Args:
+      max_size: The maximum number of paths held in the table. When the table
+        is full it is cleared. A value of 0 disables interning.
+      max_depth: Only paths with at most this many components are interned.
+    """
+    RDFURN._intern_table_size = max_size
+    RDFURN._intern_max_depth = max_depth
+    RDFURN._intern_table = {} if max_size else None
+
+  @property
+  def age(self):
+    # Copy() and Add() leave the age unset and it gets stamped here, on first
+    # access, since most URNs never have their age looked at.
+    if self._age is None:
+      self._age = RDFDatetime.Now()
+
+    return super(RDFURN, self).age
+
+  @age.setter
+  def age(self, value):
+    self._age = RDFDatetime(value, age=0)
+
   def ParseFromString(self, initializer):
     """Create RDFRUN from string.
 
@@ -832,7 +886,22 @@ class RDFURN(RDFValue):
     if initializer.startswith("aff4:/"):
       initializer = initializer[5:]
 
-    self._string_urn = utils.NormalizePath(initializer)
+    table = RDFURN._intern_table
+    if table is None:
+      self._string_urn = _NormalizeURNPath(initializer)
+      return
+
+    try:
+      self._string_urn = table[initializer]
+      return
+    except (KeyError, TypeError):
+      pass
+
+    self._string_urn = path = _NormalizeURNPath(initializer)
+    if path.count(u"/") <= RDFURN._intern_max_depth:
+      if len(table) >= RDFURN._intern_table_size:
+        table.clear()
+      table[initializer] = path
 
   def SerializeToString(self):
     return str(self)
@@ -865,10 +934,21 @@ class RDFURN(RDFValue):
       raise ValueError("Only strings should be added to a URN.")
 
     result = self.Copy(age)
-    result.Update(path=utils.JoinPath(self._string_urn, path))
+    result.Update(path=self._JoinPath(path))
 
     return result
 
+  def _JoinPath(self, path):
+    """Equivalent to utils.JoinPath(self._string_urn, path) but faster."""
+    path = _NormalizeURNPath(u"/" + utils.SmartUnicode(path))
+    if path == u"/":
+      return self._string_urn or u"/"
+
+    if self._string_urn == u"/":
+      return path
+
+    return self._string_urn + path
+
   def Update(self, url=None, path=None):
     """Update one of the fields.
 
@@ -883,10 +963,19 @@ class RDFURN(RDFValue):
     self.dirty = True
 
   def Copy(self, age=None):
-    """Make a copy of ourselves."""
+    """Make a copy of ourselves.
+
+    Args:
+      age: The age of the copy. If None, the current time is used. It is only
+        taken when the age is first accessed.
+
+    Returns:
+      A new RDFURN of the same class.
+    """
+    result = self.__class__(self, age=age)
     if age is None:
-      age = int(time.time() * MICROSECONDS)
-    return self.__class__(self, age=age)
+      result._age = None  # pylint: disable=protected-access
+    return result
 
   def __str__(self):
     return utils.SmartStr("aff4:%s" % self._string_urn)
@@ -915,6 +1004,15 @@ class RDFURN(RDFValue):
   def __lt__(self, other):
     return self._string_urn < other
 
+  def __hash__(self):
+    # _string_urn is only ever replaced, never modified in place, so an
+    # identity check tells us whether the cached hash is still valid.
+    if self._hashed_urn is not self._string_urn:
+      self._hash = hash(self.SerializeToString())
+      self._hashed_urn = self._string_urn
+
+    return self._hash
+
   def Path(self):
     """Return the path of the urn."""
     return self._string_urn
@@ -953,8 +1051,15 @@ class RDFURN(RDFValue):
       A string of the url relative from the volume or None if our URN does not
       start with the volume prefix.
     """
-    string_url = utils.SmartUnicode(self)
-    volume_url = utils.SmartUnicode(volume)
+    if isinstance(volume, RDFURN):
+      # Both paths carry the same "aff4:" prefix so there is no need to build
+      # the full urls.
+      string_url = utils.SmartUnicode(self._string_urn)
+      volume_url = utils.SmartUnicode(volume.Path())
+    else:
+      string_url = utils.SmartUnicode(self)
+      volume_url = utils.SmartUnicode(volume)
+
     if string_url.startswith(volume_url):
       result = string_url[len(volume_url):]
       # This must always return a relative path so we strip leading "/"s. The
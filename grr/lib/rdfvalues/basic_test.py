@@ -251,6 +251,61 @@ class RDFURNTest(test_base.RDFValueTestCase):
     self.assertIn(urn1, m)
     self.assertNotIn(urn2, m)
 
+  def testNormalization(self):
+    for path, expected in [("aff4:/a/b", "/a/b"), ("aff4:/a//b/", "/a/b"),
+                           ("aff4:/a/./b/../c", "/a/c"), ("a/b", "/a/b"),
+                           ("aff4:/", "/"), ("aff4:/a/.b/..c", "/a/.b/..c")]:
+      self.assertEqual(rdfvalue.RDFURN(path).Path(), expected)
+
+    urn = rdfvalue.RDFURN("aff4:/a")
+    for path, expected in [("b", "/a/b"), ("/b/", "/a/b"),
+                           ("b/../../c", "/a/c"), ("", "/a"), ("./", "/a")]:
+      self.assertEqual(urn.Add(path).Path(), expected)
+      self.assertEqual(urn.Add(path).Path(), utils.JoinPath("/a", path))
+
+    self.assertEqual(rdfvalue.RDFURN("aff4:/").Add("b").Path(), "/b")
+
+  def testLazyAge(self):
+    urn = rdfvalue.RDFURN("aff4:/a")
+    self.assertEqual(urn.age, 0)
+
+    with test_lib.FakeTime(1000):
+      child = urn.Add("b")
+    with test_lib.FakeTime(2000):
+      self.assertEqual(child.age,
+                       rdfvalue.RDFDatetime().FromSecondsFromEpoch(2000))
+
+    self.assertEqual(urn.Add("b", age=5).age, 5)
+
+  def testInterning(self):
+    try:
+      rdfvalue.RDFURN.EnableInterning(max_size=2, max_depth=2)
+
+      urn1 = rdfvalue.RDFURN("aff4:/C.0000000000000001/flows")
+      urn2 = rdfvalue.RDFURN("aff4:/C.0000000000000001/flows")
+      self.assertIs(urn1.Path(), urn2.Path())
+      self.assertEqual(urn1, urn2)
+
+      # Deep paths are not interned.
+      urn1 = rdfvalue.RDFURN("aff4:/C.0000000000000001/fs/os/a")
+      urn2 = rdfvalue.RDFURN("aff4:/C.0000000000000001/fs/os/a")
+      self.assertIsNot(urn1.Path(), urn2.Path())
+      self.assertEqual(urn1, urn2)
+
+      # The table is bounded.
+      for i in range(10):
+        self.assertEqual(
+            rdfvalue.RDFURN("aff4:/hunts/H:%d" % i).Path(), "/hunts/H:%d" % i)
+      self.assertLessEqual(len(rdfvalue.RDFURN._intern_table), 2)
+    finally:
+      rdfvalue.RDFURN.EnableInterning(max_size=0)
+
+  def testHashIsUpdated(self):
+    urn = rdfvalue.RDFURN("aff4:/a")
+    self.assertEqual(hash(urn), hash("aff4:/a"))
+    urn.Update(path="/b")
+    self.assertEqual(hash(urn), hash("aff4:/b"))
+
   def testInitialization(self):
     """Check that we can initialize from common initializers."""
 
@@ -4,7 +4,9 @@
 
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.lib import type_info
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import jobs_pb2
@@ -341,6 +343,115 @@ class RDFValueBenchmark(benchmark_test_lib.AverageMicroBenchmarks):
     self.TimeIt(ProtoDecodeEncode)
 
 
+class RDFURNBenchmark(benchmark_test_lib.AverageMicroBenchmarks):
+  """Microbenchmark tests for RDFURN construction and manipulation."""
+
+  REPEATS = 10000
+  units = "us"
+
+  def setUp(self):
+    super(RDFURNBenchmark, self).setUp()
+    self.urn = rdfvalue.RDFURN("aff4:/C.0000000000000001/fs/os/usr/lib")
+
+  def testConstruction(self):
+    """Compare URN construction with and without path normalization."""
+
+    def NormalizePath():
+      return utils.NormalizePath("/C.0000000000000001/fs/os/usr/lib")
+
+    def FromNormalString():
+      return rdfvalue.RDFURN("aff4:/C.0000000000000001/fs/os/usr/lib")
+
+    def FromDenormalString():
+      return rdfvalue.RDFURN("aff4:/C.0000000000000001//fs/./os/usr/lib/")
+
+    def FromURN():
+      return rdfvalue.RDFURN(self.urn)
+
+    self.TimeIt(NormalizePath, "utils.NormalizePath")
+    self.TimeIt(FromNormalString, "RDFURN from a normal string")
+    self.TimeIt(FromDenormalString, "RDFURN from a non-normal string")
+    self.TimeIt(FromURN, "RDFURN from another RDFURN")
+
+  def testInterning(self):
+    """Measure construction of hot prefixes through the intern table."""
+
+    def HotPrefix():
+      return rdfvalue.RDFURN("aff4:/C.0000000000000001/flows")
+
+    self.TimeIt(HotPrefix, "Hot prefix, no intern table")
+    try:
+      rdfvalue.RDFURN.EnableInterning(max_size=1000)
+      self.TimeIt(HotPrefix, "Hot prefix, intern table")
+    finally:
+      rdfvalue.RDFURN.EnableInterning(max_size=0)
+
+  def testAdd(self):
+    """Compare RDFURN.Add to the generic utils.JoinPath."""
+
+    def JoinPath():
+      return utils.JoinPath(self.urn.Path(), "python2.7")
+
+    def Add():
+      return self.urn.Add("python2.7")
+
+    def AddMultipleComponents():
+      return self.urn.Add("python2.7/site-packages")
+
+    def ChainedAdd():
+      return self.urn.Add("python2.7").Add("site-packages").Add("grr")
+
+    self.TimeIt(JoinPath, "utils.JoinPath")
+    self.TimeIt(Add, "RDFURN.Add")
+    self.TimeIt(AddMultipleComponents, "RDFURN.Add, multiple components")
+    self.TimeIt(ChainedAdd, "RDFURN.Add, chained three times")
+
+  def testSplit(self):
+    """Measure splitting of a URN into components."""
+
+    def Split():
+      return len(self.urn.Split())
+
+    def SplitCount():
+      return len(self.urn.Split(2))
+
+    self.TimeIt(Split, "RDFURN.Split")
+    self.TimeIt(SplitCount, "RDFURN.Split with count")
+
+  def testRelativeName(self):
+    """Compare RelativeName with a string and a URN volume."""
+    volume = rdfvalue.RDFURN("aff4:/C.0000000000000001/fs")
+
+    def RelativeNameFromString():
+      return self.urn.RelativeName("aff4:/C.0000000000000001/fs")
+
+    def RelativeNameFromURN():
+      return self.urn.RelativeName(volume)
+
+    self.TimeIt(RelativeNameFromString, "RDFURN.RelativeName from string")
+    self.TimeIt(RelativeNameFromURN, "RDFURN.RelativeName from RDFURN")
+
+  def testHashing(self):
+    """Measure hashing and dict lookups keyed by URNs."""
+    urns = [self.urn.Add("file%d" % i) for i in range(100)]
+    lookup = dict((urn, i) for i, urn in enumerate(urns))
+
+    def Hash():
+      return hash(self.urn)
+
+    def NewURNHash():
+      return hash(rdfvalue.RDFURN(self.urn))
+
+    def DictLookup():
+      for urn in urns:
+        lookup[urn]  # pylint: disable=pointless-statement
+
+    self.TimeIt(Hash, "Hash of an existing RDFURN")
+    self.TimeIt(NewURNHash, "Hash of a new RDFURN")
+    self.TimeIt(
+        DictLookup, "100 dict lookups", repetitions=self.REPEATS / 100)
+
+
 def main(argv):
   # Run the full test suite
   test_lib.main(argv)
@@ -119,8 +119,8 @@ class ClientURN(rdfvalue.RDFURN):
     if not isinstance(path, basestring):
       raise ValueError("Only strings should be added to a URN.")
 
-    result = rdfvalue.RDFURN(self.Copy(age))
-    result.Update(path=utils.JoinPath(self._string_urn, path))
+    result = rdfvalue.RDFURN(self, age=age)
+    result.Update(path=self._JoinPath(path))
 
     return result
 
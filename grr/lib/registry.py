@@ -10,10 +10,230 @@ and class as value.
 
 # The following are abstract base classes
 import abc
+import contextlib
+import imp
+import importlib
+import sys
 import threading
 
 import logging
 
+# Plugins that are known from a manifest but have not been imported yet. Maps
+# the name of a registry to a dict of class name -> name of the module which
+# defines the class. See SetPluginManifest().
+_PENDING_PLUGINS = {}
+
+# Event listeners that are known from a manifest but have not been imported
+# yet. Maps the event name to a set of module names.
+_PENDING_EVENT_LISTENERS = {}
+
+# All class registries by name.
+_REGISTRIES = {}
+
+# Registries whose classes are never looked up by name, so there is no point in
+# listing them in a manifest.
+_UNINDEXED_REGISTRIES = frozenset(["grr.lib.registry.InitHook"])
+
+
+@contextlib.contextmanager
+def _ImportLock():
+  """Holds the interpreter's import lock.
+
+  Plugin modules are imported under this lock anyway. Guarding the pending
+  plugins with a lock of our own would deadlock against a thread which looks
+  up a plugin while it imports a module.
+
+  Yields:
+    None.
+  """
+  imp.acquire_lock()
+  try:
+    yield
+  finally:
+    imp.release_lock()
+
+
+def _ImportPluginModule(module_name):
+  """Imports a plugin module listed in the manifest.
+
+  Args:
+    module_name: The name of the module to import.
+
+  Returns:
+    True if the module is imported, False if it could not be imported.
+  """
+  with _ImportLock():
+    if module_name in sys.modules:
+      return True
+
+    logging.debug("Importing plugin module %s.", module_name)
+    try:
+      importlib.import_module(module_name)
+    except ImportError as e:
+      logging.error("Unable to import plugin module %s: %s", module_name, e)
+      return False
+
+    # Init hooks defined by modules we import after Init() was called still
+    # have to run.
+    if InitHook.already_run_once:
+      InitHook().RunNewHooks()
+
+    return True
+
+
+class PluginClassDict(dict):
+  """The dict of registered classes kept by each registry.
+
+  Lookups of classes that are not registered yet import the module defining
+  them if it is listed in the plugin manifest. Listing the dict imports all
+  pending modules of this registry.
+  """
+
+  def __init__(self, registry_name, *args):
+    super(PluginClassDict, self).__init__(*args)
+    self.registry_name = registry_name
+    _REGISTRIES[registry_name] = self
+
+  def _LoadPlugin(self, name):
+    """Imports the module defining a pending plugin, returns True on success."""
+    with _ImportLock():
+      pending = _PENDING_PLUGINS.get(self.registry_name)
+      if not pending or name not in pending:
+        return False
+
+      _ImportPluginModule(pending.pop(name))
+
+    return dict.__contains__(self, name)
+
+  def _LoadAll(self):
+    with _ImportLock():
+      pending = _PENDING_PLUGINS.pop(self.registry_name, None)
+      if pending:
+        for module_name in sorted(set(pending.itervalues())):
+          _ImportPluginModule(module_name)
+
+  def __missing__(self, name):
+    if self._LoadPlugin(name):
+      return dict.__getitem__(self, name)
+
+    raise KeyError(name)
+
+  def __contains__(self, name):
+    return dict.__contains__(self, name) or self._LoadPlugin(name)
+
+  def has_key(self, name):
+    return name in self
+
+  def get(self, name, default=None):
+    try:
+      return self[name]
+    except KeyError:
+      return default
+
+  def __iter__(self):
+    self._LoadAll()
+    return dict.__iter__(self)
+
+  def __len__(self):
+    self._LoadAll()
+    return dict.__len__(self)
+
+  def keys(self):
+    self._LoadAll()
+    return dict.keys(self)
+
+  def values(self):
+    self._LoadAll()
+    return dict.values(self)
+
+  def items(self):
+    self._LoadAll()
+    return dict.items(self)
+
+  def iterkeys(self):
+    self._LoadAll()
+    return dict.iterkeys(self)
+
+  def itervalues(self):
+    self._LoadAll()
+    return dict.itervalues(self)
+
+  def iteritems(self):
+    self._LoadAll()
+    return dict.iteritems(self)
+
+  def copy(self):
+    self._LoadAll()
+    return dict(dict.iteritems(self))
+
+
+class EventNameMap(dict):
+  """Maps event names to listeners, importing pending listeners on lookup."""
+
+  def _LoadListeners(self, event_name):
+    with _ImportLock():
+      for module_name in sorted(_PENDING_EVENT_LISTENERS.pop(event_name, ())):
+        _ImportPluginModule(module_name)
+
+  def get(self, event_name, default=None):
+    self._LoadListeners(event_name)
+    return dict.get(self, event_name, default)
+
+  def __getitem__(self, event_name):
+    self._LoadListeners(event_name)
+    return dict.__getitem__(self, event_name)
+
+
+def _IsManifestModule(module_name):
+  return (module_name.startswith("grr.") and
+          not module_name.startswith("grr.test_lib") and
+          not module_name.endswith("_test"))
+
+
+def GetPluginManifest():
+  """Returns a manifest of the plugins registered so far.
+
+  A manifest taken after importing all plugins can be passed to
+  SetPluginManifest() in a new process, which then only imports plugins as they
+  are used.
+
+  Returns:
+    A dict with the "plugins" by registry and the "events" listener modules.
+  """
+  plugins = {}
+  for registry_name, classes in _REGISTRIES.iteritems():
+    if registry_name in _UNINDEXED_REGISTRIES:
+      continue
+
+    modules = dict((name, cls.__module__)
+                   for name, cls in dict.iteritems(classes)
+                   if _IsManifestModule(cls.__module__))
+    if modules:
+      plugins[registry_name] = modules
+
+  events = {}
+  for event_name, listeners in dict.iteritems(EventRegistry.EVENT_NAME_MAP):
+    modules = set(cls.__module__ for cls in listeners
+                  if _IsManifestModule(cls.__module__))
+    if modules:
+      events[event_name] = sorted(modules)
+
+  return dict(plugins=plugins, events=events)
+
+
+def SetPluginManifest(manifest):
+  """Makes the plugins listed in the manifest available for lazy import."""
+  with _ImportLock():
+    for registry_name, modules in manifest["plugins"].iteritems():
+      pending = _PENDING_PLUGINS.setdefault(registry_name, {})
+      for name, module_name in modules.iteritems():
+        if module_name not in sys.modules:
+          pending[name] = module_name
+
+    for event_name, modules in manifest["events"].iteritems():
+      _PENDING_EVENT_LISTENERS.setdefault(event_name, set()).update(
+          m for m in modules if m not in sys.modules)
+
 
 class MetaclassRegistry(abc.ABCMeta):
   """Automatic Plugin Registration through metaclasses."""
@@ -41,7 +261,8 @@ class MetaclassRegistry(abc.ABCMeta):
           pass
 
       try:
-        if cls.classes and cls.__name__ in cls.classes:
+        # Do not trigger imports of pending plugins here.
+        if dict.__contains__(cls.classes, cls.__name__):
           raise RuntimeError("Duplicate names for registered classes: %s, %s" %
                              (cls, cls.classes[cls.__name__]))
 
@@ -51,7 +272,8 @@ class MetaclassRegistry(abc.ABCMeta):
           cls.__doc__ = "%s\n\n%s" % (getattr(cls, "__doc__", ""),
                                       cls._ClsHelpEpilog())
       except AttributeError:
-        cls.classes = {cls.__name__: cls}
+        cls.classes = PluginClassDict(_RegistryName(cls),
+                                      {cls.__name__: cls})
         cls.classes_by_name = {getattr(cls, "name", None): cls}
         cls.plugin_feature = cls.__name__
         # Keep a reference to the top level class
@@ -69,7 +291,7 @@ class MetaclassRegistry(abc.ABCMeta):
           pass
 
       if not hasattr(cls, "classes"):
-        cls.classes = {}
+        cls.classes = PluginClassDict(_RegistryName(cls))
 
       if not hasattr(cls, "classes_by_name"):
         cls.classes_by_name = {}
@@ -89,9 +311,13 @@ class MetaclassRegistry(abc.ABCMeta):
     return cls.classes[name]
 
 
+def _RegistryName(cls):
+  return "%s.%s" % (cls.__module__, cls.__name__)
+
+
 class EventRegistry(MetaclassRegistry):
 
-  EVENT_NAME_MAP = {}
+  EVENT_NAME_MAP = EventNameMap()
 
   def __init__(cls, name, bases, env_dict):
     MetaclassRegistry.__init__(cls, name, bases, env_dict)
@@ -146,7 +372,9 @@ class HookRegistry(object):
       self.already_run_once.add(hook_cls)
 
   def _RunAllHooks(self, executed_hooks, skip_set):
-    for hook_cls in self.__class__.classes.values():
+    # Only hooks that are already imported are run, listing the registry would
+    # import all pending plugins.
+    for hook_cls in dict.values(self.__class__.classes):
       if skip_set and hook_cls.__name__ in skip_set:
         continue
       self._RunSingleHook(hook_cls, executed_hooks)
@@ -166,6 +394,12 @@ class HookRegistry(object):
         except StopIteration:
           logging.debug("Recalculating Hook dependency.")
 
+  def RunNewHooks(self):
+    """Runs hooks that were imported after Init() was called."""
+    with InitHook.lock:
+      executed_hooks = set(self.already_run_once)
+      self._RunAllHooks(executed_hooks, None)
+
   def RunOnce(self):
     """Hooks which only want to be run once."""
 
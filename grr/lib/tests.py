@@ -9,6 +9,7 @@ This module loads and registers all the GRR library tests.
 # pylint: disable=unused-import,g-import-not-at-top
 
 from grr.lib import build_test
+from grr.lib import communicator_benchmark_test
 from grr.lib import communicator_test
 from grr.lib import config_lib_test
 from grr.lib import config_validation_test
@@ -22,6 +23,7 @@ from grr.lib import threadpool_test
 from grr.lib import throttle_test
 from grr.lib import type_info_test
 from grr.lib import uploads_test
+from grr.lib import utils_benchmark_test
 from grr.lib import utils_test
 
 from grr.lib.builders import tests
@@ -29,4 +31,5 @@ from grr.lib.local import tests
 from grr.lib.rdfvalues import tests
 
 from grr.tools import frontend_test
+from grr.tools import load_test_test
 # pylint: enable=unused-import,g-import-not-at-top
@@ -2,6 +2,7 @@
 """This file contains various utility classes used by GRR."""
 
 import base64
+import collections
 import copy
 import cStringIO
 import errno
@@ -902,16 +903,245 @@ class ArchiveAlreadyClosedError(Error):
   pass
 
 
+def _GF2MatrixTimes(matrix, vector):
+  result = 0
+  i = 0
+  while vector:
+    if vector & 1:
+      result ^= matrix[i]
+    vector >>= 1
+    i += 1
+  return result
+
+
+def _GF2MatrixMultiply(a, b):
+  return [_GF2MatrixTimes(a, column) for column in b]
+
+
+def Crc32ZerosOperator(length):
+  """Returns the operator appending length zero bytes to a CRC32.
+
+  This is the operator used by zlib's crc32_combine(): a 32x32 GF(2) matrix
+  (stored as a list of columns) that maps the CRC32 of some data to the CRC32
+  of the same data followed by length zero bytes.
+
+  Args:
+    length: Number of zero bytes.
+
+  Returns:
+    The operator, to be passed to Crc32Combine.
+  """
+  # Operator for a single zero bit.
+  operator = [0xedb88320] + [1 << n for n in range(31)]
+  # Operator for a single zero byte.
+  for _ in range(3):
+    operator = _GF2MatrixMultiply(operator, operator)
+
+  # Identity.
+  result = [1 << n for n in range(32)]
+  while length:
+    if length & 1:
+      result = _GF2MatrixMultiply(operator, result)
+    length >>= 1
+    if length:
+      operator = _GF2MatrixMultiply(operator, operator)
+
+  return result
+
+
+def Crc32Combine(crc1, crc2, length2, operator=None):
+  """Combines CRC32 checksums of two consecutive pieces of data.
+
+  Args:
+    crc1: CRC32 of the first piece of data.
+    crc2: CRC32 of the second piece of data.
+    length2: Length of the second piece of data.
+    operator: Optional Crc32ZerosOperator(length2). Computing the operator is
+        much more expensive than applying it, so callers combining many pieces
+        of the same length should compute it once.
+
+  Returns:
+    The CRC32 of both pieces of data concatenated.
+  """
+  if operator is None:
+    operator = Crc32ZerosOperator(length2)
+  return _GF2MatrixTimes(operator, crc1 & 0xffffffff) ^ (crc2 & 0xffffffff)
+
+
+class _DeflateBlock(object):
+  """A block of data compressed by one of the deflate threads."""
+
+  def __init__(self, data, level):
+    self.data = data
+    self.level = level
+    self.size = len(data)
+    self.compressed = None
+    self.crc = None
+    self.error = None
+    self.done = threading.Event()
+
+  def Run(self):
+    try:
+      compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+      # The sync flush ends the block on a byte boundary without marking it
+      # final, so that blocks can be concatenated.
+      self.compressed = (compressor.compress(self.data) +
+                         compressor.flush(zlib.Z_SYNC_FLUSH))
+      self.crc = zlib.crc32(self.data) & 0xffffffff
+    except Exception as e:  # pylint: disable=broad-except
+      self.error = e
+    finally:
+      self.data = None
+      self.done.set()
+
+
+_DEFLATE_QUEUE = Queue.Queue()
+_DEFLATE_THREADS = []
+_DEFLATE_THREADS_LOCK = threading.Lock()
+
+
+def _DeflateWorker():
+  while True:
+    _DEFLATE_QUEUE.get().Run()
+
+
+def _StartDeflateThreads(count):
+  """Makes sure at least count shared deflate threads are running."""
+  with _DEFLATE_THREADS_LOCK:
+    while len(_DEFLATE_THREADS) < count:
+      thread = threading.Thread(
+          name="Deflate%d" % len(_DEFLATE_THREADS), target=_DeflateWorker)
+      thread.daemon = True
+      thread.start()
+      _DEFLATE_THREADS.append(thread)
+
+
+class ParallelDeflater(object):
+  """Compresses data into a raw deflate stream using multiple threads.
+
+  This works like pigz: the input is split into blocks that are compressed
+  independently by a pool of threads. Every compressed block ends with a sync
+  flush, so the blocks can simply be concatenated and the stream is
+  terminated with an empty final block. The CRC32 of every block is computed
+  by the threads as well and the results are combined in order.
+
+  Blocks don't share a compression dictionary, so the output is slightly
+  larger than the one of a single zlib compressor.
+
+  The interface mimics zlib compression objects.
+  """
+
+  BLOCK_SIZE = 128 * 1024
+
+  def __init__(self,
+               threads,
+               level=zlib.Z_DEFAULT_COMPRESSION,
+               block_size=None):
+    """ParallelDeflater constructor.
+
+    Args:
+      threads: Number of threads used for compression. Threads are shared by
+          all ParallelDeflater instances.
+      level: zlib compression level.
+      block_size: Size of the independently compressed blocks.
+    """
+    _StartDeflateThreads(threads)
+
+    self.level = level
+    self.block_size = block_size or self.BLOCK_SIZE
+    # Bounds memory used by blocks compressed ahead of the consumer.
+    self.max_pending = threads * 2
+
+    self.crc = 0
+    self.size = 0
+
+    self._buffer = []
+    self._buffered = 0
+    self._pending = collections.deque()
+    self._block_operator = Crc32ZerosOperator(self.block_size)
+
+  def _Submit(self, data):
+    block = _DeflateBlock(data, self.level)
+    self._pending.append(block)
+    _DEFLATE_QUEUE.put(block)
+
+  def _Collect(self, wait=False):
+    """Returns compressed data of blocks at the head of the queue.
+
+    Args:
+      wait: If True, waits for all pending blocks. Otherwise only waits when
+          there are more than max_pending blocks pending.
+
+    Returns:
+      Compressed data.
+
+    Raises:
+      Exception: Any exception raised while compressing a block.
+    """
+    result = []
+    while self._pending and (wait or self._pending[0].done.is_set() or
+                             len(self._pending) > self.max_pending):
+      block = self._pending.popleft()
+      block.done.wait()
+      if block.error:
+        raise block.error
+
+      if block.size == self.block_size:
+        operator = self._block_operator
+      else:
+        operator = Crc32ZerosOperator(block.size)
+      self.crc = Crc32Combine(self.crc, block.crc, block.size, operator)
+      self.size += block.size
+      result.append(block.compressed)
+
+    return "".join(result)
+
+  def compress(self, data):  # pylint: disable=invalid-name
+    """Compresses data, returns the compressed data available so far."""
+    self._buffer.append(data)
+    self._buffered += len(data)
+
+    if self._buffered >= self.block_size:
+      data = "".join(self._buffer)
+      offset = 0
+      while len(data) - offset >= self.block_size:
+        self._Submit(data[offset:offset + self.block_size])
+        offset += self.block_size
+
+      self._buffer = [data[offset:]]
+      self._buffered = len(data) - offset
+
+    return self._Collect()
+
+  def flush(self):  # pylint: disable=invalid-name
+    """Finishes the stream, returns the remaining compressed data."""
+    if self._buffered:
+      self._Submit("".join(self._buffer))
+      self._buffer = []
+      self._buffered = 0
+
+    terminator = zlib.compressobj(self.level, zlib.DEFLATED, -15).flush()
+    return self._Collect(wait=True) + terminator
+
+
 class StreamingZipGenerator(object):
   """A streaming zip generator that can archive file-like objects."""
 
   FILE_CHUNK_SIZE = 1024 * 1024 * 4
 
-  def __init__(self, compression=zipfile.ZIP_STORED):
+  def __init__(self, compression=zipfile.ZIP_STORED, deflate_threads=0):
+    """StreamingZipGenerator constructor.
+
+    Args:
+      compression: ZIP_STORED (no compression) or ZIP_DEFLATED (requires zlib).
+      deflate_threads: If non zero, deflated members are compressed by this
+          many threads using a ParallelDeflater.
+    """
     self._stream = RollingMemoryStream()
     self._zip_fd = zipfile.ZipFile(
         self._stream, mode="w", compression=compression, allowZip64=True)
     self._compression = compression
+    self._deflate_threads = deflate_threads
 
     self._ResetState()
 
@@ -1023,7 +1253,10 @@ class StreamingZipGenerator(object):
     self.cur_file_size = 0
     self.cur_compress_size = 0
 
-    if self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED:
+    if (self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED and
+        self._deflate_threads):
+      self.cur_cmpr = ParallelDeflater(self._deflate_threads)
+    elif self.cur_zinfo.compress_type == zipfile.ZIP_DEFLATED:
       self.cur_cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
                                        zlib.DEFLATED, -15)
     else:
@@ -1057,7 +1290,9 @@ class StreamingZipGenerator(object):
           "Attempting to write to a ZIP archive that was already closed.")
 
     self.cur_file_size += len(chunk)
-    self.cur_crc = zipfile.crc32(chunk, self.cur_crc) & 0xffffffff
+    # ParallelDeflater computes the CRC32 on its threads.
+    if not isinstance(self.cur_cmpr, ParallelDeflater):
+      self.cur_crc = zipfile.crc32(chunk, self.cur_crc) & 0xffffffff
 
     if self.cur_cmpr:
       chunk = self.cur_cmpr.compress(chunk)
@@ -1079,6 +1314,9 @@ class StreamingZipGenerator(object):
       self.cur_zinfo.compress_size = self.cur_compress_size
 
       self._stream.write(buf)
+
+      if isinstance(self.cur_cmpr, ParallelDeflater):
+        self.cur_crc = self.cur_cmpr.crc
     else:
       self.cur_zinfo.compress_size = self.cur_file_size
 
@@ -1163,7 +1401,11 @@ class StreamingZipWriter(object):
   all the necessary API to do streaming writes.
   """
 
-  def __init__(self, fd_or_path, mode="wb", compression=zipfile.ZIP_STORED):
+  def __init__(self,
+               fd_or_path,
+               mode="wb",
+               compression=zipfile.ZIP_STORED,
+               deflate_threads=0):
     """Open streaming ZIP file with mode read "r", write "w" or append "a".
 
     Args:
@@ -1172,6 +1414,8 @@ class StreamingZipWriter(object):
                   ZipFile.
       mode: The mode can be either read "r", write "w" or append "a".
       compression: ZIP_STORED (no compression) or ZIP_DEFLATED (requires zlib).
+      deflate_threads: Number of threads compressing deflated members, see
+                  StreamingZipGenerator.
     """
 
     if hasattr(fd_or_path, "write"):
@@ -1179,7 +1423,8 @@ class StreamingZipWriter(object):
     else:
       self._fd = open(fd_or_path, mode)
 
-    self._generator = StreamingZipGenerator(compression=compression)
+    self._generator = StreamingZipGenerator(
+        compression=compression, deflate_threads=deflate_threads)
 
   def __enter__(self):
     return self
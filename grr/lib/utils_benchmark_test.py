@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmarks for archive generation utilities."""
+
+
+import os
+import time
+import zipfile
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class StreamingZipGeneratorBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares single and multi-threaded deflate of large archive members."""
+
+  units = "s"
+
+  INPUT_SIZE = 2 * 1024 * 1024 * 1024
+
+  def setUp(self):
+    super(StreamingZipGeneratorBenchmark, self).setUp(
+        ["Threads", "MB/s", "Ratio"], ["<8", "<8", "<8"])
+
+    # Compressible but not trivially so: random data mixed with text, similar
+    # to memory images and logs collected from clients.
+    text = "".join("%d some log line\n" % i for i in xrange(100000))
+    chunk = os.urandom(256 * 1024) + text
+    chunk_size = utils.StreamingZipGenerator.FILE_CHUNK_SIZE
+    self.chunk = (chunk * (chunk_size // len(chunk) + 1))[:chunk_size]
+
+  def _Benchmark(self, deflate_threads):
+    generator = utils.StreamingZipGenerator(
+        compression=zipfile.ZIP_DEFLATED, deflate_threads=deflate_threads)
+
+    output_size = 0
+    start = time.time()
+    output_size += len(generator.WriteFileHeader("member"))
+    for _ in xrange(self.INPUT_SIZE // len(self.chunk)):
+      output_size += len(generator.WriteFileChunk(self.chunk))
+    output_size += len(generator.WriteFileFooter())
+    output_size += len(generator.Close())
+    time_taken = time.time() - start
+
+    self.AddResult("Deflate", time_taken, 1, deflate_threads,
+                   "%.1f" % (self.INPUT_SIZE / time_taken / 1024 / 1024),
+                   "%.3f" % (float(output_size) / self.INPUT_SIZE))
+
+  def testDeflate(self):
+    """Deflates a multi-GB member with different numbers of threads."""
+    for deflate_threads in [0, 1, 2, 4, 8]:
+      self._Benchmark(deflate_threads)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
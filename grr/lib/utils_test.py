@@ -7,6 +7,7 @@ import StringIO
 import tarfile
 import threading
 import zipfile
+import zlib
 
 
 from grr.lib import flags
@@ -428,6 +429,64 @@ class StreamingZipWriterTest(test_lib.GRRBaseTest):
         link_contents = zip_fd.read("test2.txt.link")
         self.assertEqual(link_contents, "subdir/test2.txt")
 
+  def testZipFileWithParallelDeflate(self):
+    """Members compressed on multiple threads are readable by zipfile."""
+    content = "".join("line %d\n" % i for i in range(100000))
+
+    outfd = StringIO.StringIO()
+    with utils.Stubber(utils.ParallelDeflater, "BLOCK_SIZE", 1024):
+      with utils.StreamingZipWriter(
+          outfd, compression=zipfile.ZIP_DEFLATED,
+          deflate_threads=4) as writer:
+        writer.WriteFromFD(StringIO.StringIO(content), "test1.txt")
+        writer.WriteFromFD(StringIO.StringIO(""), "empty.txt")
+        writer.WriteFromFD(StringIO.StringIO("x"), "test2.txt")
+
+    test_zip = zipfile.ZipFile(outfd, "r")
+    self.assertIsNone(test_zip.testzip())
+
+    self.assertEqual(test_zip.read("test1.txt"), content)
+    self.assertEqual(test_zip.read("empty.txt"), "")
+    self.assertEqual(test_zip.read("test2.txt"), "x")
+    self.assertLess(test_zip.getinfo("test1.txt").compress_size, len(content))
+
+
+class ParallelDeflaterTest(test_lib.GRRBaseTest):
+  """Tests for ParallelDeflater."""
+
+  def _Compress(self, deflater, data, chunk_size):
+    result = []
+    for i in range(0, len(data), chunk_size):
+      result.append(deflater.compress(data[i:i + chunk_size]))
+    result.append(deflater.flush())
+    return "".join(result)
+
+  def testOutputIsRawDeflateStream(self):
+    data = os.urandom(10000) + "a" * 100000 + os.urandom(1234)
+    for chunk_size in [1, 1000, 4096, 1000000]:
+      deflater = utils.ParallelDeflater(3, block_size=4096)
+      compressed = self._Compress(deflater, data, chunk_size)
+
+      self.assertEqual(zlib.decompress(compressed, -15), data)
+      self.assertEqual(deflater.size, len(data))
+      self.assertEqual(deflater.crc, zlib.crc32(data) & 0xffffffff)
+
+  def testEmptyInput(self):
+    deflater = utils.ParallelDeflater(2)
+
+    self.assertEqual(zlib.decompress(deflater.flush(), -15), "")
+    self.assertEqual(deflater.size, 0)
+    self.assertEqual(deflater.crc, 0)
+
+  def testCrc32Combine(self):
+    data = os.urandom(5000)
+    for split in [0, 1, 100, 4999, 5000]:
+      first, second = data[:split], data[split:]
+      self.assertEqual(
+          utils.Crc32Combine(
+              zlib.crc32(first), zlib.crc32(second), len(second)),
+          zlib.crc32(data) & 0xffffffff)
+
 
 class StreamingTarWriterTest(test_lib.GRRBaseTest):
   """Tests for StreamingTarWriter."""
@@ -28,6 +28,8 @@ from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.server import access_control
 from grr.server import data_store
+from grr.server import retention_index
+from grr.server import timeline_index
 
 # Factor to convert from seconds to microseconds
 MICROSECONDS = 1000000
@@ -226,32 +228,40 @@ class DeletionPool(object):
     urns += list(itertools.chain.from_iterable(all_children_urns.values()))
     self._urns_for_deletion.update(urns)
 
-    for obj in self.MultiOpen(urns):
+    for obj in self.MultiOpen(self.UrnsWithOnDelete(urns)):
       obj.OnDelete(deletion_pool=self)
 
-  @property
-  def root_urns_for_deletion(self):
-    """Roots of the graph of urns marked for deletion."""
-    roots = set()
-    for urn in self._urns_for_deletion:
-      new_root = True
+  def UrnsWithOnDelete(self, urns):
+    """Returns the urns of objects which have their own OnDelete handler.
 
-      str_urn = utils.SmartUnicode(urn)
-      fake_roots = []
-      for root in roots:
-        str_root = utils.SmartUnicode(root)
+    Only the type attribute of the objects is read, so objects which don't
+    need to do anything when they are deleted are never opened.
 
-        if str_urn.startswith(str_root):
-          new_root = False
-          break
-        elif str_root.startswith(str_urn):
-          fake_roots.append(root)
+    Args:
+      urns: Urns of the objects to check.
 
-      if new_root:
-        roots -= set(fake_roots)
-        roots.add(urn)
+    Returns:
+      A list of urns.
+    """
+    result = []
+    for subject, values in data_store.DB.MultiResolvePrefix(
+        urns,
+        AFF4Object.SchemaCls.TYPE.predicate,
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self._token):
+      for _, aff4_type, _ in values:
+        aff4_cls = AFF4Object.classes.get(utils.SmartStr(aff4_type))
+        if (aff4_cls is not None and
+            aff4_cls.OnDelete.im_func is not AFF4Object.OnDelete.im_func):
+          result.append(rdfvalue.RDFURN(subject))
+        break
 
-    return roots
+    return result
+
+  @property
+  def root_urns_for_deletion(self):
+    """Roots of the graph of urns marked for deletion."""
+    return _RootUrns(self._urns_for_deletion)
 
   @property
   def urns_for_deletion(self):
@@ -259,6 +269,20 @@ class DeletionPool(object):
     return self._urns_for_deletion
 
 
+def _RootUrns(urns):
+  """Returns the urns which are not below any other of the given urns."""
+  roots = set()
+  root = None
+  # All the urns starting with a given one directly follow it in sorted order.
+  for str_urn, urn in sorted((utils.SmartUnicode(urn), urn) for urn in urns):
+    if root is not None and str_urn.startswith(root):
+      continue
+    roots.add(urn)
+    root = str_urn
+
+  return roots
+
+
 def _ValidateAFF4Type(aff4_type):
   """Validates and normalizes aff4_type to class object."""
   if aff4_type is None:
@@ -279,6 +303,9 @@ class Factory(object):
   intermediate_cache_max_size = 2000
   intermediate_cache_age = 600
 
+  # Maximum number of objects deleted at once by MultiDelete.
+  deletion_batch_size = 1000
+
   def __init__(self):
     self.intermediate_cache = utils.AgeBasedCache(
         max_size=self.intermediate_cache_max_size,
@@ -348,6 +375,9 @@ class Factory(object):
       pool = data_store.DB.GetMutationPool(token=token)
 
     pool.MultiSet(urn, attributes, replace=False, to_delete=to_delete)
+    # The data retention crons find clients and temporary objects which were
+    # not written to for a while through this index.
+    retention_index.RecordWrite(urn, pool)
 
     if add_child_index:
       self._UpdateChildIndex(urn, pool)
@@ -1038,6 +1068,11 @@ class Factory(object):
     DANGEROUS! This recursively deletes all objects contained within the
     specified URN.
 
+    The objects are deleted in batches of deletion_batch_size, children
+    before their parents. An interrupted deletion therefore leaves every
+    remaining object reachable from the given urns and can simply be run
+    again.
+
     Args:
       urns: Urns of objects to remove.
       token: The Security Token to use for opening this item.
@@ -1054,40 +1089,96 @@ class Factory(object):
       if urn.Path() == "/":
         raise RuntimeError("Can't delete root URN. Please enter a valid URN")
 
-    deletion_pool = DeletionPool(token=token)
-    deletion_pool.MultiMarkForDeletion(urns)
-
-    marked_root_urns = deletion_pool.root_urns_for_deletion
-    marked_urns = deletion_pool.urns_for_deletion
-
-    logging.debug(u"Found %d objects to remove when removing %s",
-                  len(marked_urns), utils.SmartUnicode(urns))
+    deleted = 0
+    roots = _RootUrns(urns)
+    while roots:
+      logging.debug(u"Removing %d root objects when removing %s: %s",
+                    len(roots),
+                    utils.SmartUnicode(urns), utils.SmartUnicode(roots))
 
-    logging.debug(u"Removing %d root objects when removing %s: %s",
-                  len(marked_root_urns),
-                  utils.SmartUnicode(urns),
-                  utils.SmartUnicode(marked_root_urns))
+      count, marked_urns = self._DeleteSubtrees(roots, token)
+      deleted += count
 
-    pool = data_store.DB.GetMutationPool(token=token)
-    for root in marked_root_urns:
-      # Only the index of the parent object should be updated. Everything
-      # below the target object (along with indexes) is going to be
-      # deleted.
-      self._DeleteChildFromIndex(root, token, mutation_pool=pool)
+      pool = data_store.DB.GetMutationPool(token=token)
+      for root in roots:
+        # Only the index of the parent object should be updated. Everything
+        # below the target object (along with indexes) is deleted already.
+        self._DeleteChildFromIndex(root, token, mutation_pool=pool)
 
-    for urn_to_delete in marked_urns:
-      try:
-        self.intermediate_cache.ExpireObject(urn_to_delete.Path())
-      except KeyError:
-        pass
+      timeline_index.DeleteSubtrees(roots, pool, token=token)
+      pool.Flush()
 
-    pool.DeleteSubjects(marked_urns)
-    pool.Flush()
+      # OnDelete handlers may have marked objects outside of the deleted
+      # subtrees, e.g. symlinks pointing into them.
+      roots = _RootUrns(marked_urns | roots) - roots
 
     # Ensure this is removed from the cache as well.
     self.Flush()
 
-    logging.debug("Removed %d objects", len(marked_urns))
+    logging.debug("Removed %d objects", deleted)
+
+  def _DeleteSubtrees(self, roots, token):
+    """Deletes the objects below the given roots, children first.
+
+    Args:
+      roots: Urns of the subtrees to remove.
+      token: The Security Token to use for opening this item.
+
+    Returns:
+      A tuple of the number of deleted objects and the set of urns marked for
+      deletion by the OnDelete handlers of the deleted objects.
+    """
+    marked_urns = set()
+    deleted = 0
+    pool = data_store.DB.GetMutationPool(token=token)
+
+    # A stack of pages of urns, each with a flag telling if the children of
+    # the page are on the stack already. Urns are processed in sorted order.
+    stack = []
+    for page in reversed(
+        list(
+            utils.Grouper(
+                sorted(roots, key=utils.SmartUnicode),
+                self.deletion_batch_size))):
+      stack.append([page, False])
+
+    while stack:
+      page, expanded = stack[-1]
+      if not expanded:
+        stack[-1][1] = True
+
+        # OnDelete handlers may need the children, so they run first.
+        deletion_pool = DeletionPool(token=token)
+        for obj in deletion_pool.MultiOpen(
+            deletion_pool.UrnsWithOnDelete(page)):
+          obj.OnDelete(deletion_pool=deletion_pool)
+        marked_urns.update(deletion_pool.urns_for_deletion)
+
+        children = []
+        for _, subject_children in self.MultiListChildren(page, token=token):
+          children.extend(subject_children)
+
+        for child_page in reversed(
+            list(
+                utils.Grouper(
+                    sorted(children, key=utils.SmartUnicode),
+                    self.deletion_batch_size))):
+          stack.append([child_page, False])
+        continue
+
+      stack.pop()
+      for urn in page:
+        try:
+          self.intermediate_cache.ExpireObject(urn.Path())
+        except KeyError:
+          pass
+
+      pool.DeleteSubjects(page)
+      pool.Flush()
+      deleted += len(page)
+      logging.debug("Removed %d objects so far", deleted)
+
+    return deleted, marked_urns
 
   def Delete(self, urn, token=None):
     """Drop all the information about this object.
@@ -1946,6 +2037,15 @@ class AFF4Object(object):
           mutation_pool=self.mutation_pool,
           token=self.token)
 
+      # Stat entries of client files are indexed to build VFS timelines.
+      for attribute, value_array in self.new_attributes.iteritems():
+        if attribute.predicate == timeline_index.STAT_ATTRIBUTE:
+          timeline_index.AddStatEntries(
+              self.urn,
+              value_array,
+              mutation_pool=self.mutation_pool,
+              token=self.token)
+
   @utils.Synchronized
   def _SyncAttributes(self):
     """Sync the new attributes to the synced attribute cache.
@@ -5,9 +5,11 @@ Filestore allows for multiple different filestore modules to register URNs
 under aff4:/files to handle new file hash and new file creations.
 """
 
+import bisect
 import hashlib
 
 import logging
+import zlib
 
 from grr.lib import fingerprint
 from grr.lib import rdfvalue
@@ -177,6 +179,175 @@ class FileStoreHash(rdfvalue.RDFURN):
     self.fingerprint_type, self.hash_type, self.hash_value = relative_path
 
 
+class FileStoreStatsTotals(object):
+  """Number and size of the files in the hash file store."""
+
+  # Lower bounds of the file size histogram bins, in bytes.
+  SIZE_BINS = [
+      0, 2, 50, 100, 1e3, 10e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6, 100e6,
+      500e6, 1e9, 5e9, 10e9
+  ]
+
+  def __init__(self):
+    # Class name of the file to number of files and to total size.
+    self.counts = {}
+    self.sizes = {}
+    # Lower bound of the size bin to number of files.
+    self.histogram = {}
+
+  def Record(self, classname, size):
+    size = int(size or 0)
+    self.counts[classname] = self.counts.get(classname, 0) + 1
+    self.sizes[classname] = self.sizes.get(classname, 0) + size
+
+    size_bin = self.SIZE_BINS[max(bisect.bisect(self.SIZE_BINS, size) - 1, 0)]
+    self.histogram[size_bin] = self.histogram.get(size_bin, 0) + 1
+
+  def Add(self, other):
+    for mine, theirs in ((self.counts, other.counts),
+                         (self.sizes, other.sizes),
+                         (self.histogram, other.histogram)):
+      for key, value in theirs.iteritems():
+        mine[key] = mine.get(key, 0) + value
+
+
+class FileStoreStatsCounters(object):
+  """Sharded counters of the files in the hash file store.
+
+  HashFileStore.AddFile records every file it adds to the store as a pending
+  record in one of SHARDS rows, keyed by the file's hash. Concurrent writers
+  therefore neither contend on a single row nor need a read-modify-write, and
+  adding the same file twice is only counted once. Merge() folds the pending
+  records into the totals kept in the same rows.
+  """
+
+  ROOT = rdfvalue.RDFURN("aff4:/stats/FileStoreStats/counters")
+  SHARDS = 16
+
+  PENDING_PREFIX = "filestore_stats:pending:"
+  COUNT_PREFIX = "filestore_stats:count:"
+  SIZE_PREFIX = "filestore_stats:size:"
+  HISTOGRAM_PREFIX = "filestore_stats:histogram:"
+  LAST_FULL_SCAN_ATTRIBUTE = "filestore_stats:last_full_scan"
+
+  def __init__(self, token=None):
+    self.token = token
+
+  def _ShardUrn(self, shard):
+    return self.ROOT.Add("%02d" % shard)
+
+  def RecordFile(self, digest, classname, size):
+    """Records a file added to the store under the given hash."""
+    digest = str(digest)
+    shard = (zlib.crc32(digest) & 0xffffffff) % self.SHARDS
+    data_store.DB.Set(
+        self._ShardUrn(shard),
+        self.PENDING_PREFIX + digest,
+        "%s:%d" % (classname, int(size or 0)),
+        token=self.token,
+        sync=False)
+
+  def _ReadShard(self, shard):
+    """Reads a shard.
+
+    Args:
+      shard: Index of the shard.
+
+    Returns:
+      A tuple of the totals of the shard, the attributes they are stored in
+      and a list of (attribute, classname, size, timestamp) tuples of the
+      pending records.
+    """
+    totals = FileStoreStatsTotals()
+    total_attributes = []
+    pending = []
+    for attribute, value, ts in data_store.DB.ResolvePrefix(
+        self._ShardUrn(shard), "filestore_stats:", token=self.token):
+      if attribute.startswith(self.PENDING_PREFIX):
+        classname, size = value.rsplit(":", 1)
+        pending.append((attribute, classname, int(size), ts))
+        continue
+
+      total_attributes.append(attribute)
+      if attribute.startswith(self.COUNT_PREFIX):
+        totals.counts[attribute[len(self.COUNT_PREFIX):]] = int(value)
+      elif attribute.startswith(self.SIZE_PREFIX):
+        totals.sizes[attribute[len(self.SIZE_PREFIX):]] = int(value)
+      elif attribute.startswith(self.HISTOGRAM_PREFIX):
+        totals.histogram[float(attribute[len(self.HISTOGRAM_PREFIX):])] = int(
+            value)
+
+    return totals, total_attributes, pending
+
+  def _WriteShard(self, shard, totals, to_delete):
+    values = {}
+    for classname, count in totals.counts.iteritems():
+      values[self.COUNT_PREFIX + classname] = [count]
+    for classname, size in totals.sizes.iteritems():
+      values[self.SIZE_PREFIX + classname] = [size]
+    for size_bin, count in totals.histogram.iteritems():
+      values[self.HISTOGRAM_PREFIX + "%d" % size_bin] = [count]
+
+    # The totals and the records they include change in a single row
+    # mutation, so a record is never counted twice.
+    data_store.DB.MultiSet(
+        self._ShardUrn(shard),
+        values,
+        to_delete=[x for x in to_delete if x not in values],
+        token=self.token)
+
+  def Merge(self):
+    """Folds the pending records into the totals.
+
+    Returns:
+      The FileStoreStatsTotals of all the shards.
+    """
+    result = FileStoreStatsTotals()
+    for shard in xrange(self.SHARDS):
+      totals, _, pending = self._ReadShard(shard)
+      if pending:
+        for _, classname, size, _ in pending:
+          totals.Record(classname, size)
+        self._WriteShard(shard, totals, [x[0] for x in pending])
+
+      result.Add(totals)
+
+    return result
+
+  def Reset(self, totals, scan_start):
+    """Replaces the totals with the result of a full scan of the store.
+
+    Args:
+      totals: The FileStoreStatsTotals counted by the scan.
+      scan_start: The RDFDatetime the scan started at. Pending records written
+        before it are included in the scan and are dropped.
+    """
+    for shard in xrange(self.SHARDS):
+      _, total_attributes, pending = self._ReadShard(shard)
+      to_delete = total_attributes + [
+          x[0] for x in pending if x[3] < scan_start.AsMicroSecondsFromEpoch()
+      ]
+      if shard == 0:
+        self._WriteShard(shard, totals, to_delete)
+      else:
+        self._WriteShard(shard, FileStoreStatsTotals(), to_delete)
+
+    data_store.DB.Set(
+        self.ROOT,
+        self.LAST_FULL_SCAN_ATTRIBUTE,
+        scan_start.AsMicroSecondsFromEpoch(),
+        token=self.token)
+
+  def LastFullScan(self):
+    """Returns the RDFDatetime of the last full scan or None."""
+    value, _ = data_store.DB.Resolve(
+        self.ROOT, self.LAST_FULL_SCAN_ATTRIBUTE, token=self.token)
+    if value is None:
+      return None
+
+    return rdfvalue.RDFDatetime(value)
+
+
 class HashFileStore(FileStore):
   """FileStore that stores files referenced by hash."""
 
@@ -404,6 +575,9 @@ class HashFileStore(FileStore):
           canonical_urn, mode="rw", token=self.token) as new_fd:
         new_fd.Set(new_fd.Schema.STAT(None))
 
+      FileStoreStatsCounters(token=self.token).RecordFile(
+          hashes.sha256, fd.__class__.__name__, fd.Get(fd.Schema.SIZE))
+
     self._AddToIndex(canonical_urn, fd.urn)
 
     for hash_type, hash_digest in hashes.ListSetFields():
@@ -4,15 +4,18 @@
 
 import hashlib
 import itertools
-import time
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import flows_pb2
 from grr.proto import jobs_pb2
 from grr.server import aff4
+from grr.server import data_store
+from grr.server import sequential_collection
 
 
 class Error(Exception):
@@ -153,6 +156,16 @@ class GUISettings(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.GUISettings
 
 
+class UserNotificationCollection(sequential_collection.SequentialCollection):
+  """The notifications sent to a user, indexed by their timestamp."""
+  RDF_TYPE = rdf_flows.Notification
+
+
+class NotificationTimestampList(rdf_protodict.RDFValueArray):
+  """A list of notification timestamps."""
+  rdf_type = rdfvalue.RDFDatetime
+
+
 class GRRUser(aff4.AFF4Object):
   """An AFF4 object modeling a GRR User."""
 
@@ -163,20 +176,42 @@ class GRRUser(aff4.AFF4Object):
 
   _SYSTEM_USERS_LOWERCASE = set(username.lower() for username in SYSTEM_USERS)
 
+  # The most pending notifications the UI reads at once.
+  MAX_PENDING_NOTIFICATIONS = 50
+
+  # Each notification deletes up to this many expired ones.
+  EXPIRED_NOTIFICATIONS_PER_CALL = 10
+
+  # ShowNotifications() reads back from now in windows growing by a factor.
+  NOTIFICATIONS_READ_WINDOW = rdfvalue.Duration("1d")
+  NOTIFICATIONS_READ_WINDOW_GROWTH = 4
+
   class SchemaCls(aff4.AFF4Object.SchemaCls):
     """Schema for GRRUser."""
-    PENDING_NOTIFICATIONS = aff4.Attribute(
-        "aff4:notification/pending",
-        rdf_flows.NotificationList,
-        "The notifications pending for the user.",
-        default=rdf_flows.NotificationList(),
+    NOTIFICATIONS_SHOWN_UNTIL = aff4.Attribute(
+        "aff4:notification/shown_until",
+        rdfvalue.RDFDatetime,
+        "All notifications up to this time were shown to the user.",
+        versioned=False)
+
+    NOTIFICATIONS_SHOWN_INDIVIDUALLY = aff4.Attribute(
+        "aff4:notification/shown_individually",
+        NotificationTimestampList,
+        "Timestamps of notifications after NOTIFICATIONS_SHOWN_UNTIL which "
+        "were shown to the user.",
         versioned=False)
 
-    SHOWN_NOTIFICATIONS = aff4.Attribute(
-        "aff4:notifications/shown",
-        rdf_flows.NotificationList,
-        "Notifications already shown to the user.",
-        default=rdf_flows.NotificationList(),
+    NOTIFICATIONS_EXPIRE_UNTIL = aff4.Attribute(
+        "aff4:notification/expire_until",
+        rdfvalue.RDFDatetime,
+        "Shown notifications up to this time are deleted once "
+        "NOTIFICATIONS_EXPIRE_AT has passed.",
+        versioned=False)
+
+    NOTIFICATIONS_EXPIRE_AT = aff4.Attribute(
+        "aff4:notification/expire_at",
+        rdfvalue.RDFDatetime,
+        "The time to delete shown notifications at.",
         versioned=False)
 
     SHOWN_GLOBAL_NOTIFICATIONS = aff4.Attribute(
@@ -196,9 +231,16 @@ class GRRUser(aff4.AFF4Object):
   def IsValidUsername(username):
     return username.lower() not in GRRUser._SYSTEM_USERS_LOWERCASE
 
+  def _GetNotificationCollection(self):
+    return UserNotificationCollection(
+        self.urn.Add("Notifications"), token=self.token)
+
   def Notify(self, message_type, subject, msg, source):
     """Send a notification to the user in the UI.
 
+    Notifications are appended to a collection, so this does not require the
+    user object to be written.
+
     Args:
       message_type: One of aff4_grr.Notification.notification_types e.g.
         "ViewObject", "HostInformation", "GrantAccess".
@@ -209,28 +251,116 @@ class GRRUser(aff4.AFF4Object):
     Raises:
       TypeError: On invalid message_type.
     """
-    pending = self.Get(self.Schema.PENDING_NOTIFICATIONS)
-    if pending is None:
-      pending = self.Schema.PENDING_NOTIFICATIONS()
-
     if message_type not in rdf_flows.Notification.notification_types:
       raise TypeError("Invalid notification type %s" % message_type)
 
-    pending.Append(
+    timestamp = rdfvalue.RDFDatetime.Now()
+    notification = rdf_flows.Notification(
         type=message_type,
         subject=subject,
         message=msg,
         source=source,
-        timestamp=long(time.time() * 1e6))
+        timestamp=timestamp)
+
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      self._GetNotificationCollection().Add(
+          notification, timestamp=timestamp, mutation_pool=mutation_pool)
+      self._DeleteExpiredNotifications(timestamp, mutation_pool)
+
+  def _DeleteExpiredNotifications(self, now, mutation_pool):
+    """Deletes the oldest notifications, whether they were shown or not.
+
+    Notifications older than both TTLs together are expired even if they are
+    still pending. Only a few are deleted per call, which keeps up with the
+    notifications added and bounds the collection of users never looking at
+    their notifications.
 
-    # Limit the notification to 50, expiring older notifications.
-    while len(pending) > 50:
-      pending.Pop(0)
+    Args:
+      now: The current time.
+      mutation_pool: The pool to delete the notifications with.
+    """
+    pending_ttl = config.CONFIG["DataRetention.pending_notifications_ttl"]
+    shown_ttl = config.CONFIG["DataRetention.shown_notifications_ttl"]
+    if pending_ttl is None or shown_ttl is None:
+      return
+
+    expire_until = (now - pending_ttl - shown_ttl).AsMicroSecondsFromEpoch()
+    collection = self._GetNotificationCollection()
+    for (timestamp, suffix), _ in collection.Scan(
+        include_suffix=True, max_records=self.EXPIRED_NOTIFICATIONS_PER_CALL):
+      if timestamp > expire_until:
+        break
+
+      mutation_pool.DeleteSubject(
+          data_store.DB.CollectionMakeURN(collection.collection_id, timestamp,
+                                          suffix)[0])
+
+  def _GetShownState(self):
+    """Returns the cursor and the individually shown notification times."""
+    shown_until = self.Get(self.Schema.NOTIFICATIONS_SHOWN_UNTIL)
+    shown_individually = set(
+        timestamp.AsMicroSecondsFromEpoch()
+        for timestamp in self.Get(self.Schema.NOTIFICATIONS_SHOWN_INDIVIDUALLY,
+                                  []))
+    return shown_until, shown_individually
+
+  def _IsShown(self, notification, shown_until, shown_individually):
+    timestamp = notification.timestamp
+    if shown_until is not None and timestamp <= shown_until:
+      return True
+    return timestamp.AsMicroSecondsFromEpoch() in shown_individually
+
+  def _ScanNotifications(self, after_timestamp=None):
+    """Yields stored notifications after the given time, oldest first."""
+    if after_timestamp is not None:
+      after_timestamp = after_timestamp.AsMicroSecondsFromEpoch()
+
+    for _, notification in self._GetNotificationCollection().Scan(
+        after_timestamp=after_timestamp):
+      yield notification
+
+  def GetPendingNotifications(self, after_timestamp=None, max_records=None):
+    """Returns the notifications which were not shown to the user yet.
+
+    Only the notifications after the last ShowNotifications() call are read,
+    so this does not get slower as the notification history grows.
+
+    Args:
+      after_timestamp: If set, only notifications after this time are
+          returned. Together with max_records, this allows paging through the
+          pending notifications.
+      max_records: The maximum number of notifications to return.
+
+    Returns:
+      A list of notifications, oldest first.
+    """
+    shown_until, shown_individually = self._GetShownState()
+    if after_timestamp is None or (shown_until is not None and
+                                   shown_until > after_timestamp):
+      after_timestamp = shown_until
+
+    result = []
+    for notification in self._ScanNotifications(after_timestamp):
+      if max_records is not None and len(result) >= max_records:
+        break
+
+      timestamp = notification.timestamp.AsMicroSecondsFromEpoch()
+      if timestamp not in shown_individually:
+        result.append(notification)
+
+    return result
 
-    self.Set(self.Schema.PENDING_NOTIFICATIONS, pending)
+  def GetShownNotifications(self):
+    """Returns the retained notifications already shown to the user."""
+    shown_until, shown_individually = self._GetShownState()
+
+    return [
+        n for n in self._ScanNotifications()
+        if self._IsShown(n, shown_until, shown_individually)
+    ]
 
   def DeletePendingNotification(self, timestamp):
-    """Deletes the pending notification with the given timestamp.
+    """Marks the pending notification with the given timestamp as shown.
 
     Args:
       timestamp: The timestamp of the notification. Assumed to be unique.
@@ -238,49 +368,150 @@ class GRRUser(aff4.AFF4Object):
     Raises:
       UniqueKeyError: Raised if multiple notifications have the timestamp.
     """
-    shown_notifications = self.Get(self.Schema.SHOWN_NOTIFICATIONS)
-    if not shown_notifications:
-      shown_notifications = self.Schema.SHOWN_NOTIFICATIONS()
-
-    pending = self.Get(self.Schema.PENDING_NOTIFICATIONS)
-    if not pending:
+    shown_until, shown_individually = self._GetShownState()
+    # All notifications after the cursor, including individually shown ones.
+    unshown = list(self._ScanNotifications(shown_until))
+
+    delete_count = len([
+        n for n in unshown
+        if n.timestamp == timestamp and
+        not self._IsShown(n, shown_until, shown_individually)
+    ])
+    if not delete_count:
       return
 
-    # Remove all notifications with the given timestamp from pending
-    # and add them to the shown notifications.
-    delete_count = 0
-    for idx in reversed(range(0, len(pending))):
-      if pending[idx].timestamp == timestamp:
-        shown_notifications.Append(pending[idx])
-        pending.Pop(idx)
-        delete_count += 1
-
     if delete_count > 1:
       raise UniqueKeyError("Multiple notifications at %s" % timestamp)
 
-    self.Set(self.Schema.PENDING_NOTIFICATIONS, pending)
-    self.Set(self.Schema.SHOWN_NOTIFICATIONS, shown_notifications)
+    shown_individually.add(timestamp.AsMicroSecondsFromEpoch())
+
+    # Notifications shown in order only move the cursor.
+    for notification in unshown:
+      notification_timestamp = notification.timestamp.AsMicroSecondsFromEpoch()
+      if notification_timestamp not in shown_individually:
+        break
 
-  def ShowNotifications(self, reset=True):
-    """A generator of current notifications."""
-    shown_notifications = self.Schema.SHOWN_NOTIFICATIONS()
+      shown_until = notification.timestamp
+      shown_individually.discard(notification_timestamp)
 
-    # Pending notifications first
-    pending = self.Get(self.Schema.PENDING_NOTIFICATIONS, [])
-    for notification in pending:
-      shown_notifications.Append(notification)
+    if shown_until is not None:
+      self.Set(self.Schema.NOTIFICATIONS_SHOWN_UNTIL(shown_until))
+    self.Set(
+        self.Schema.NOTIFICATIONS_SHOWN_INDIVIDUALLY(
+            [rdfvalue.RDFDatetime(t) for t in sorted(shown_individually)]))
 
-    notifications = self.Get(self.Schema.SHOWN_NOTIFICATIONS, [])
-    for notification in notifications:
-      shown_notifications.Append(notification)
+  def IsPendingNotification(self, notification):
+    """Returns True if the notification was not shown to the user yet."""
+    shown_until, shown_individually = self._GetShownState()
+    return not self._IsShown(notification, shown_until, shown_individually)
+
+  def _ReadNewestNotifications(self, max_records=None):
+    """Returns the newest notifications, newest first.
+
+    The notifications are read back from now in growing windows, so reading a
+    page does not read the whole history.
+
+    Args:
+      max_records: The maximum number of notifications to return. If not set,
+          all retained notifications are returned.
+
+    Returns:
+      A list of notifications.
+    """
+    collection = self._GetNotificationCollection()
+    oldest = list(collection.Scan(max_records=1))
+    if not oldest:
+      return []
+
+    oldest_timestamp = oldest[0][0]
+    now = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+    window = self.NOTIFICATIONS_READ_WINDOW.microseconds
+    while True:
+      after_timestamp = now - window
+      if max_records is None or after_timestamp < oldest_timestamp:
+        after_timestamp = None
+
+      notifications = [
+          n for _, n in collection.Scan(after_timestamp=after_timestamp)
+      ]
+      if after_timestamp is None or len(notifications) >= max_records:
+        break
+
+      window *= self.NOTIFICATIONS_READ_WINDOW_GROWTH
+
+    notifications.reverse()
+    return notifications[:max_records]
+
+  def ShowNotifications(self, reset=True, max_records=None):
+    """Returns the newest retained notifications, newest first.
+
+    Args:
+      reset: If True, all notifications are marked as shown.
+      max_records: The maximum number of notifications to return. If not set,
+          all retained notifications are returned.
+
+    Returns:
+      A NotificationList.
+    """
+    notifications = self._ReadNewestNotifications(max_records)
 
     # Shall we reset the pending notification state?
-    if reset:
-      self.Set(shown_notifications)
-      self.Set(self.Schema.PENDING_NOTIFICATIONS())
-      self.Flush()
+    if reset and any(self.IsPendingNotification(n) for n in notifications):
+      self.MarkNotificationsShown(notifications[0].timestamp)
+
+    return rdf_flows.NotificationList(notifications)
+
+  def MarkNotificationsShown(self, shown_until):
+    """Marks all notifications up to the given time as shown.
+
+    Args:
+      shown_until: The time of the newest notification shown.
+    """
+    _, shown_individually = self._GetShownState()
+    shown_individually = [
+        rdfvalue.RDFDatetime(t)
+        for t in sorted(shown_individually)
+        if t > shown_until.AsMicroSecondsFromEpoch()
+    ]
+
+    self.Set(self.Schema.NOTIFICATIONS_SHOWN_UNTIL(shown_until))
+    self.Set(self.Schema.NOTIFICATIONS_SHOWN_INDIVIDUALLY(shown_individually))
+    self._ExpireShownNotifications(shown_until)
+    self.Flush()
+
+  def _ExpireShownNotifications(self, shown_until):
+    """Deletes notifications which were shown longer than the TTL ago.
+
+    Notifications up to shown_until are deleted no sooner than the TTL from
+    now, so shown notifications are retained for at least the TTL and at most
+    the TTL plus the time until the next ShowNotifications() call.
+
+    Args:
+      shown_until: The time up to which notifications were shown.
+    """
+    ttl = config.CONFIG["DataRetention.shown_notifications_ttl"]
+    if ttl is None:
+      return
 
-    return shown_notifications
+    now = rdfvalue.RDFDatetime.Now()
+    expire_until = self.Get(self.Schema.NOTIFICATIONS_EXPIRE_UNTIL)
+    expire_at = self.Get(self.Schema.NOTIFICATIONS_EXPIRE_AT)
+    if expire_until is not None and expire_at is not None:
+      if expire_at > now:
+        return
+
+      collection = self._GetNotificationCollection()
+      with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+        for (timestamp, suffix), _ in collection.Scan(include_suffix=True):
+          if timestamp > expire_until.AsMicroSecondsFromEpoch():
+            break
+
+          mutation_pool.DeleteSubject(
+              data_store.DB.CollectionMakeURN(collection.collection_id,
+                                              timestamp, suffix)[0])
+
+    self.Set(self.Schema.NOTIFICATIONS_EXPIRE_UNTIL(shown_until))
+    self.Set(self.Schema.NOTIFICATIONS_EXPIRE_AT(now + ttl))
 
   def Describe(self):
     """Return a description of this user."""
@@ -62,6 +62,120 @@ class UsersTest(aff4_test_lib.AFF4ObjectTest, acl_test_lib.AclTestMixin):
       notifications = self.user.GetPendingGlobalNotifications()
       self.assertFalse(notifications)
 
+  def _Notify(self, timestamp, message):
+    with test_lib.FakeTime(timestamp):
+      self.user.Notify("ViewObject", "aff4:/foo", message, "aff4:/source")
+
+  def _Messages(self, notifications):
+    return [n.message for n in notifications]
+
+  def testNotificationsArePendingUntilShown(self):
+    for i in range(3):
+      self._Notify(100 + i, "message %d" % i)
+
+    self.assertEqual(
+        self._Messages(self.user.GetPendingNotifications()),
+        ["message 0", "message 1", "message 2"])
+    after_timestamp = rdfvalue.RDFDatetime().FromSecondsFromEpoch(100)
+    self.assertEqual(
+        self._Messages(
+            self.user.GetPendingNotifications(
+                after_timestamp=after_timestamp, max_records=1)),
+        ["message 1"])
+
+    self.assertEqual(len(self.user.ShowNotifications(reset=True)), 3)
+    self.assertEqual(self.user.GetPendingNotifications(), [])
+
+    self._Notify(200, "new message")
+    self.assertEqual(
+        self._Messages(self.user.ShowNotifications(reset=False)),
+        ["new message", "message 2", "message 1", "message 0"])
+    self.assertEqual(
+        self._Messages(self.user.GetPendingNotifications()), ["new message"])
+
+  def testDeletingPendingNotificationsMovesTheCursor(self):
+    for i in range(3):
+      self._Notify(100 + i, "message %d" % i)
+
+    self.user.DeletePendingNotification(
+        rdfvalue.RDFDatetime().FromSecondsFromEpoch(101))
+    self.assertEqual(
+        self._Messages(self.user.GetPendingNotifications()),
+        ["message 0", "message 2"])
+    self.assertIsNone(self.user.Get(self.user.Schema.NOTIFICATIONS_SHOWN_UNTIL))
+
+    self.user.DeletePendingNotification(
+        rdfvalue.RDFDatetime().FromSecondsFromEpoch(100))
+    self.assertEqual(
+        self._Messages(self.user.GetPendingNotifications()), ["message 2"])
+    self.assertEqual(
+        self._Messages(self.user.GetShownNotifications()),
+        ["message 0", "message 1"])
+
+    # Both notifications are covered by the cursor now.
+    self.assertEqual(
+        self.user.Get(self.user.Schema.NOTIFICATIONS_SHOWN_UNTIL),
+        rdfvalue.RDFDatetime().FromSecondsFromEpoch(101))
+    self.assertFalse(
+        self.user.Get(self.user.Schema.NOTIFICATIONS_SHOWN_INDIVIDUALLY))
+
+  def testShownNotificationsExpire(self):
+    self._Notify(100, "old message")
+
+    with test_lib.ConfigOverrider({
+        "DataRetention.shown_notifications_ttl": rdfvalue.Duration("1d")
+    }):
+      with test_lib.FakeTime(200):
+        self.user.ShowNotifications(reset=True)
+
+      self._Notify(300, "new message")
+      with test_lib.FakeTime(400):
+        self.user.ShowNotifications(reset=True)
+      self.assertEqual(
+          self._Messages(self.user.GetShownNotifications()),
+          ["old message", "new message"])
+
+      # Only notifications which were shown a day ago are deleted.
+      self._Notify(24 * 3600 + 300, "newest message")
+      with test_lib.FakeTime(24 * 3600 + 400):
+        self.user.ShowNotifications(reset=True)
+      self.assertEqual(
+          self._Messages(self.user.GetShownNotifications()),
+          ["new message", "newest message"])
+
+  def testShowNotificationsReadsTheNewestOnes(self):
+    day = 24 * 3600
+    for i in range(10):
+      self._Notify((i + 1) * day, "message %d" % i)
+
+    with test_lib.FakeTime(11 * day):
+      self.assertEqual(
+          self._Messages(
+              self.user.ShowNotifications(reset=False, max_records=3)),
+          ["message 9", "message 8", "message 7"])
+
+      # Notifications before the ones read are shown as well.
+      self.user.ShowNotifications(reset=True, max_records=1)
+    self.assertEqual(self.user.GetPendingNotifications(), [])
+    self.assertEqual(len(self.user.GetShownNotifications()), 10)
+
+  def testPendingNotificationsExpire(self):
+    self._Notify(100, "old message")
+
+    with test_lib.ConfigOverrider({
+        "DataRetention.pending_notifications_ttl": rdfvalue.Duration("1d"),
+        "DataRetention.shown_notifications_ttl": rdfvalue.Duration("1d")
+    }):
+      self._Notify(2 * 24 * 3600, "new message")
+      self.assertEqual(
+          self._Messages(self.user.GetPendingNotifications()),
+          ["old message", "new message"])
+
+      self._Notify(2 * 24 * 3600 + 101, "newest message")
+      self.assertEqual(
+          self._Messages(self.user.GetPendingNotifications()),
+          ["new message", "newest message"])
+
   def testDescribe(self):
     self.user.AddLabels(["test1", "test2"])
     describe_str = self.user.Describe()
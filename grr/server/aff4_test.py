@@ -47,6 +47,17 @@ class ObjectWithLockProtectedAttribute(aff4.AFF4Volume):
         lock_protected=False)
 
 
+class ObjectWithOnDelete(aff4.AFF4Volume):
+  """Test object recording the children it had when it was deleted."""
+
+  deleted = {}
+
+  def OnDelete(self, deletion_pool=None):
+    super(ObjectWithOnDelete, self).OnDelete(deletion_pool=deletion_pool)
+    ObjectWithOnDelete.deleted[self.urn] = sorted(
+        deletion_pool.ListChildren(self.urn))
+
+
 class DeletionPoolTest(aff4_test_lib.AFF4ObjectTest):
   """Tests for DeletionPool class."""
 
@@ -1027,6 +1038,93 @@ class AFF4Test(aff4_test_lib.AFF4ObjectTest):
       for subject in subjects:
         self.assertFalse(data_store.DB.ResolveRow(subject, token=self.token))
 
+  def _CreateTree(self, root, aff4_type=aff4.AFF4Volume):
+    subjects = [root]
+    for i in range(4):
+      subjects.append("%s/%d" % (root, i))
+      for j in range(3):
+        subjects.append("%s/%d/%d" % (root, i, j))
+
+    for subject in subjects:
+      with aff4.FACTORY.Create(subject, aff4_type, token=self.token):
+        pass
+
+    return subjects
+
+  def testMultiDeleteDeletesInBatches(self):
+    subjects = self._CreateTree("aff4:/tmp/batches")
+
+    with utils.Stubber(aff4.FACTORY, "deletion_batch_size", 3):
+      with test_lib.Instrument(data_store.DB, "DeleteSubjects") as instrument:
+        aff4.FACTORY.Delete("aff4:/tmp/batches", token=self.token)
+
+    deleted = []
+    for args in instrument.args:
+      self.assertLessEqual(len(args[0]), 3)
+      deleted.extend(args[0])
+    self.assertEqual(sorted(deleted), sorted(subjects))
+
+    for subject in subjects:
+      self.assertFalse(data_store.DB.ResolveRow(subject, token=self.token))
+    fd = aff4.FACTORY.Open("aff4:/tmp", token=self.token)
+    self.assertFalse(list(fd.ListChildren()))
+
+  def testInterruptedMultiDeleteCanBeResumed(self):
+    subjects = self._CreateTree("aff4:/tmp/resumed")
+    original_delete_subjects = data_store.DB.DeleteSubjects
+    calls = [0]
+
+    def DeleteSubjects(*args, **kwargs):
+      calls[0] += 1
+      if calls[0] > 2:
+        raise RuntimeError("Interrupted")
+      return original_delete_subjects(*args, **kwargs)
+
+    with utils.Stubber(aff4.FACTORY, "deletion_batch_size", 3):
+      with utils.Stubber(data_store.DB, "DeleteSubjects", DeleteSubjects):
+        self.assertRaises(
+            RuntimeError,
+            aff4.FACTORY.Delete,
+            "aff4:/tmp/resumed",
+            token=self.token)
+
+    # Children are deleted before their parents, so all the objects which
+    # are left can still be reached from the root.
+    remaining = set(["aff4:/tmp/resumed"])
+    for _, children in aff4.FACTORY.RecursiveMultiListChildren(
+        ["aff4:/tmp/resumed"], token=self.token):
+      remaining.update(utils.SmartStr(child) for child in children)
+    for subject in subjects:
+      if data_store.DB.ResolveRow(subject, token=self.token):
+        self.assertIn(subject, remaining)
+
+    aff4.FACTORY.Delete("aff4:/tmp/resumed", token=self.token)
+    for subject in subjects:
+      self.assertFalse(data_store.DB.ResolveRow(subject, token=self.token))
+
+  def testMultiDeleteOnlyOpensObjectsWithOnDelete(self):
+    self._CreateTree("aff4:/tmp/ondelete")
+    with aff4.FACTORY.Create(
+        "aff4:/tmp/ondelete/1", ObjectWithOnDelete, token=self.token):
+      pass
+
+    ObjectWithOnDelete.deleted = {}
+    with test_lib.Instrument(aff4.FACTORY, "MultiOpen") as instrument:
+      aff4.FACTORY.Delete("aff4:/tmp/ondelete", token=self.token)
+
+    opened = []
+    for args in instrument.args:
+      opened.extend(args[0])
+    self.assertEqual(opened, [rdfvalue.RDFURN("aff4:/tmp/ondelete/1")])
+
+    # OnDelete runs while the children still exist.
+    self.assertEqual(ObjectWithOnDelete.deleted, {
+        rdfvalue.RDFURN("aff4:/tmp/ondelete/1"): [
+            "aff4:/tmp/ondelete/1/0", "aff4:/tmp/ondelete/1/1",
+            "aff4:/tmp/ondelete/1/2"
+        ]
+    })
+
   def testClientObject(self):
     fd = aff4.FACTORY.Create(
         self.client_id, aff4_grr.VFSGRRClient, token=self.token)
@@ -5,11 +5,14 @@ An index of client machines, associating likely identifiers to client IDs.
 """
 
 
+import itertools
+
 from grr.lib import rdfvalue
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.server import aff4
 from grr.server import keyword_index
+from grr.server import posting_list
 from grr.server.aff4_objects import aff4_grr
 
 # The system's primary client index.
@@ -74,14 +77,16 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
 
     return start_time, end_time, filtered_keywords, unversioned_keywords
 
-  def LookupClients(self, keywords):
+  def LookupClients(self, keywords, offset=0, limit=None):
     """Returns a list of client URNs associated with keywords.
 
     Args:
       keywords: The list of keywords to search by.
+      offset: The number of matching clients to skip.
+      limit: The maximum number of clients to return. All if None.
 
     Returns:
-      A list of client URNs.
+      A list of client URNs, sorted by client id.
 
     Raises:
       ValueError: A string (single keyword) was passed instead of an iterable.
@@ -93,41 +98,53 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
     start_time, end_time, filtered_keywords, unversioned_keywords = (
         self._AnalyzeKeywords(keywords))
 
-    last_seen_map = None
-    if unversioned_keywords:
-      last_seen_map = {}
-
     # TODO(user): Make keyword index datetime aware so that
     # AsMicroSecondsFromEpoch is unnecessary.
 
-    raw_results = self.Lookup(
-        map(self._NormalizeKeyword, filtered_keywords),
+    filtered_keywords = map(self._NormalizeKeyword, filtered_keywords)
+    unversioned_keywords = map(self._NormalizeKeyword, unversioned_keywords)
+    if not unversioned_keywords:
+      return [
+          rdf_client.ClientURN(result)
+          for result in self.LookupSorted(
+              filtered_keywords,
+              start_time=start_time.AsMicroSecondsFromEpoch(),
+              end_time=end_time.AsMicroSecondsFromEpoch(),
+              offset=offset,
+              limit=limit)
+      ]
+
+    posting_lists = self.ReadSortedPostingLists(
+        filtered_keywords + ["."],
         start_time=start_time.AsMicroSecondsFromEpoch(),
-        end_time=end_time.AsMicroSecondsFromEpoch(),
-        last_seen_map=last_seen_map)
-    if not raw_results:
-      return []
-
-    if unversioned_keywords:
-      universal_last_seen_raw = {}
-      self.ReadPostingLists(
-          map(self._NormalizeKeyword, raw_results),
-          start_time=start_time.AsMicroSecondsFromEpoch(),
-          end_time=end_time.AsMicroSecondsFromEpoch(),
-          last_seen_map=universal_last_seen_raw)
-
-      universal_last_seen = {}
-      for (_, client_id), ts in universal_last_seen_raw.iteritems():
-        universal_last_seen[client_id] = ts
-
-      old_results = set()
-      for keyword in unversioned_keywords:
-        for result in raw_results:
-          if last_seen_map[(keyword, result)] < universal_last_seen[result]:
-            old_results.add(result)
-      raw_results -= old_results
-
-    return [rdf_client.ClientURN(result) for result in raw_results]
+        end_time=end_time.AsMicroSecondsFromEpoch())
+
+    # The universal keyword is added every time a client is indexed, so its
+    # posting list holds the time each client was last indexed. Results are
+    # sorted, so they can all be looked up with a single cursor.
+    universal_last_seen = posting_lists["."].Filter().Cursor()
+    unversioned_indices = [
+        i for i, keyword in enumerate(filtered_keywords)
+        if keyword in unversioned_keywords
+    ]
+
+    def IsCurrent(match):
+      """Checks that unversioned keywords were added at the latest indexing."""
+      client_id, timestamps = match
+      posting = universal_last_seen.Seek(client_id)
+      if posting is None or posting[0] != client_id:
+        return True
+      return all(timestamps[i] >= posting[1] for i in unversioned_indices)
+
+    matches = posting_list.IntersectPostingLists(
+        [posting_lists[kw] for kw in filtered_keywords])
+    matches = itertools.ifilter(IsCurrent, matches)
+    if limit is None:
+      matches = itertools.islice(matches, offset, None)
+    else:
+      matches = itertools.islice(matches, offset, offset + limit)
+
+    return [rdf_client.ClientURN(client_id) for client_id, _ in matches]
 
   def ReadClientPostingLists(self, keywords):
     """Looks up all clients associated with any of the given keywords.
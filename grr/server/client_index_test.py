@@ -195,6 +195,43 @@ class ClientIndexTest(aff4_test_lib.AFF4ObjectTest):
           index.LookupClients(["+10.1.1", "Host-2"]),
           [rdf_client.ClientURN("aff4:/C.1000000000000002")])
 
+  def testLookupClientsPagination(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/client-index5/",
+        aff4_type=client_index.ClientIndex,
+        mode="rw",
+        token=self.token)
+
+    client_urns = self.SetupClients(10)
+    with test_lib.FakeTime(1000000):
+      for urn in client_urns:
+        client = aff4.FACTORY.Create(
+            urn, aff4_type=aff4_grr.VFSGRRClient, mode="rw", token=self.token)
+        client.Set(client.Schema.HOST_IPS("10.1.0.1"))
+        client.Flush()
+        index.AddClient(client)
+
+    # Clients 0-4 are reindexed with a different ip.
+    with test_lib.FakeTime(2000000):
+      for urn in client_urns[:5]:
+        client = aff4.FACTORY.Create(
+            urn, aff4_type=aff4_grr.VFSGRRClient, mode="rw", token=self.token)
+        client.Set(client.Schema.HOST_IPS("10.1.1.1"))
+        client.Flush()
+        index.AddClient(client)
+
+    with test_lib.FakeTime(3000000):
+      self.assertEqual(index.LookupClients(["."]), client_urns)
+      self.assertEqual(
+          index.LookupClients(["."], offset=3, limit=4), client_urns[3:7])
+      self.assertEqual(
+          index.LookupClients(["10.1.0.1"], offset=8), client_urns[8:])
+      self.assertEqual(
+          index.LookupClients(["+10.1.0.1"], offset=1, limit=2),
+          client_urns[6:8])
+      self.assertEqual(
+          index.LookupClients(["+10.1.0.1"], offset=5), [])
+
   def testRemoveLabels(self):
     client = aff4.FACTORY.Create(
         CLIENT_ID, aff4_type=aff4_grr.VFSGRRClient, mode="rw", token=self.token)
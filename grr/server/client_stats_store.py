@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+"""A columnar store for the load stats of clients.
+
+Every metric of a client is kept as a time series of its own: once at the
+resolution of the samples sent by the client and once rolled up into points
+of 1 minute, 10 minutes and 1 hour each. Rollups are computed when the stats
+are written, so reading a long time range only decodes the points of the
+coarsest resolution which still has the number of points the reader asked
+for.
+
+Points are stored in segments of fixed-width records, each holding the
+difference to the previous timestamp in milliseconds and the difference to the
+previous fixed point value. Rollup records also hold the number of samples
+rolled up into the point. Segments are versions of the series attribute,
+timestamped with the newest sample they cover, so a time range is read by
+resolving the versions of just the blocks overlapping it.
+
+Every write adds its raw samples as new segments. The rollups of the newest
+block are merged with the samples written and the block's segment replaced,
+so every block of a rollup is a single version.
+
+Raw samples are purged sooner than the rollups. The time up to which each
+resolution was purged is stored, so older ranges are read from the rollups.
+"""
+
+
+import itertools
+import struct
+
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import data_store
+
+# Gauges are averaged when rolled up, of counters the newest value is kept.
+GAUGE = "gauge"
+COUNTER = "counter"
+
+# The metrics stored, named like ApiGetClientLoadStatsArgs.Metric, mapped to
+# their kind and the scale of their fixed point values.
+METRICS = {
+    "CPU_PERCENT": (GAUGE, 1000),
+    "CPU_SYSTEM": (COUNTER, 1000),
+    "CPU_USER": (COUNTER, 1000),
+    "IO_READ_BYTES": (COUNTER, 1),
+    "IO_WRITE_BYTES": (COUNTER, 1),
+    "IO_READ_OPS": (COUNTER, 1),
+    "IO_WRITE_OPS": (COUNTER, 1),
+    "NETWORK_BYTES_RECEIVED": (COUNTER, 1),
+    "NETWORK_BYTES_SENT": (COUNTER, 1),
+    "MEMORY_PERCENT": (GAUGE, 1000),
+    "MEMORY_RSS_SIZE": (GAUGE, 1),
+    "MEMORY_VMS_SIZE": (GAUGE, 1),
+}
+
+# The clients take a load sample every 10 seconds.
+RAW_SAMPLE_INTERVAL = 10
+
+
+class Resolution(object):
+  """A resolution the series are stored at."""
+
+  def __init__(self, name, period, block):
+    self.name = name
+    # Seconds between two points, 0 for the samples as sent by the client.
+    self.period = period
+    # Seconds of points stored in a single segment.
+    self.block = block
+
+
+RAW = Resolution("raw", 0, 3600)
+ONE_MINUTE = Resolution("1m", 60, 24 * 3600)
+TEN_MINUTES = Resolution("10m", 600, 7 * 24 * 3600)
+ONE_HOUR = Resolution("1h", 3600, 28 * 24 * 3600)
+
+# From the finest to the coarsest.
+RESOLUTIONS = [RAW, ONE_MINUTE, TEN_MINUTES, ONE_HOUR]
+
+_COUNT = struct.Struct("<I")
+_RECORD_FORMAT = "Iq"
+_ROLLUP_RECORD_FORMAT = "IqI"
+
+
+def EncodeSegment(points, block_start, with_counts=False):
+  """Encodes the points of a single block.
+
+  Args:
+    points: A list of (timestamp, value) tuples sorted by timestamp, with
+      timestamps in microseconds and fixed point values. If with_counts is
+      set, (timestamp, value, count) tuples.
+    block_start: Start of the block in microseconds.
+    with_counts: Whether the points are rollups holding their sample count.
+
+  Returns:
+    The encoded segment.
+  """
+  fields = []
+  last_time = block_start // 1000
+  last_value = 0
+  for point in points:
+    timestamp = point[0] // 1000
+    fields.append(timestamp - last_time)
+    fields.append(point[1] - last_value)
+    if with_counts:
+      fields.append(point[2])
+    last_time = timestamp
+    last_value = point[1]
+
+  record_format = _ROLLUP_RECORD_FORMAT if with_counts else _RECORD_FORMAT
+  return _COUNT.pack(len(points)) + struct.pack(
+      "<" + record_format * len(points), *fields)
+
+
+def DecodeSegment(data, block_start, with_counts=False):
+  """Decodes a segment into a list of points as passed to EncodeSegment."""
+  count, = _COUNT.unpack_from(data)
+  record_format = _ROLLUP_RECORD_FORMAT if with_counts else _RECORD_FORMAT
+  fields = struct.unpack_from("<" + record_format * count, data, _COUNT.size)
+
+  points = []
+  timestamp = block_start // 1000
+  value = 0
+  for i in xrange(0, len(fields), len(record_format)):
+    timestamp += fields[i]
+    value += fields[i + 1]
+    if with_counts:
+      points.append((timestamp * 1000, value, fields[i + 2]))
+    else:
+      points.append((timestamp * 1000, value))
+
+  return points
+
+
+def _MergeValues(kind, value, count, other_value, other_count):
+  """Merges the rollups of two sets of samples of the same period.
+
+  Args:
+    kind: GAUGE or COUNTER.
+    value: The value rolled up from the older samples.
+    count: The number of the older samples.
+    other_value: The value rolled up from the newer samples.
+    other_count: The number of the newer samples.
+
+  Returns:
+    The value rolled up from all the samples.
+  """
+  if kind == GAUGE:
+    return (value * count + other_value * other_count) / float(
+        count + other_count)
+  return other_value
+
+
+def _RollUp(points, period, kind, open_points=None):
+  """Rolls points up into one point per period.
+
+  Args:
+    points: A list of (timestamp, value) tuples sorted by timestamp.
+    period: Length of the period in microseconds.
+    kind: GAUGE or COUNTER.
+    open_points: Rollups of older samples to merge the points into, a list of
+      (timestamp, value, count) tuples sorted by timestamp.
+
+  Returns:
+    A list of (timestamp, value, count, newest) tuples, where timestamp is the
+    start of the period, count the number of samples rolled up and newest the
+    timestamp of the newest one. Of open points newest is their timestamp.
+  """
+  result = [(t, v, c, t) for t, v, c in open_points or []]
+  for start, group in itertools.groupby(
+      points, key=lambda point: point[0] - point[0] % period):
+    group = list(group)
+    if kind == GAUGE:
+      value = sum(v for _, v in group) / float(len(group))
+    else:
+      value = group[-1][1]
+    count = len(group)
+
+    if result and result[-1][0] == start:
+      _, open_value, open_count, _ = result.pop()
+      value = _MergeValues(kind, open_value, open_count, value, count)
+      count += open_count
+    result.append((start, value, count, group[-1][0]))
+
+  return result
+
+
+def _MetricPoints(client_stats, timestamp):
+  """Returns the (timestamp, value) points of every metric in client_stats."""
+  points = dict((metric, []) for metric in METRICS)
+
+  for sample in client_stats.cpu_samples:
+    sample_time = sample.timestamp.AsMicroSecondsFromEpoch()
+    points["CPU_PERCENT"].append((sample_time, sample.cpu_percent))
+    points["CPU_SYSTEM"].append((sample_time, sample.system_cpu_time))
+    points["CPU_USER"].append((sample_time, sample.user_cpu_time))
+
+  for sample in client_stats.io_samples:
+    sample_time = sample.timestamp.AsMicroSecondsFromEpoch()
+    points["IO_READ_BYTES"].append((sample_time, sample.read_bytes))
+    points["IO_WRITE_BYTES"].append((sample_time, sample.write_bytes))
+    points["IO_READ_OPS"].append((sample_time, sample.read_count))
+    points["IO_WRITE_OPS"].append((sample_time, sample.write_count))
+
+  # These are only sampled when the stats are sent.
+  timestamp = timestamp.AsMicroSecondsFromEpoch()
+  points["NETWORK_BYTES_RECEIVED"].append((timestamp,
+                                           client_stats.bytes_received))
+  points["NETWORK_BYTES_SENT"].append((timestamp, client_stats.bytes_sent))
+  points["MEMORY_PERCENT"].append((timestamp, client_stats.memory_percent))
+  points["MEMORY_RSS_SIZE"].append((timestamp, client_stats.RSS_size))
+  points["MEMORY_VMS_SIZE"].append((timestamp, client_stats.VMS_size))
+
+  for metric_points in points.itervalues():
+    metric_points.sort()
+  return points
+
+
+def ChooseResolution(start, end, max_points, purged_until=None):
+  """Returns the coarsest resolution with max_points in [start, end].
+
+  Only resolutions whose samples in the range were not purged are considered,
+  since the raw samples are kept for a shorter time than the rollups.
+
+  Args:
+    start: Start of the range, an RDFDatetime.
+    end: End of the range, an RDFDatetime.
+    max_points: The number of points needed.
+    purged_until: A dict mapping resolution names to the time in microseconds
+      up to which their samples were purged.
+
+  Returns:
+    A Resolution. If even the finest resolution still kept for the range
+    doesn't cover it with max_points, that resolution is returned. If all of
+    them were purged, the coarsest one is returned.
+  """
+  purged_until = purged_until or {}
+  retained = [
+      resolution for resolution in RESOLUTIONS
+      if start.AsMicroSecondsFromEpoch() >= purged_until.get(resolution.name, 0)
+  ]
+  if not retained:
+    return RESOLUTIONS[-1]
+
+  seconds = (end - start).seconds
+  for resolution in reversed(retained):
+    if seconds >= (resolution.period or RAW_SAMPLE_INTERVAL) * max_points:
+      return resolution
+
+  return retained[0]
+
+
+class ClientStatsStore(object):
+  """The load stats of a single client."""
+
+  STORE_PATH = "stats_timeseries"
+
+  SERIES_PREFIX = "aff4:client_stats_series/"
+  LAST_PREFIX = "index:client_stats_last/"
+  PURGED_PREFIX = "index:client_stats_purged/"
+  SINCE_ATTRIBUTE = "index:client_stats_since"
+
+  def __init__(self, client_id, token=None):
+    self.client_id = rdf_client.ClientURN(client_id)
+    self.urn = self.client_id.Add(self.STORE_PATH)
+    self.token = token
+
+  def _SeriesAttribute(self, resolution, metric):
+    return "%s%s/%s" % (self.SERIES_PREFIX, resolution.name, metric)
+
+  def _OpenSegments(self, metrics):
+    """Returns the newest rollup segments of the given metrics.
+
+    Args:
+      metrics: Names of the metrics.
+
+    Returns:
+      A dict mapping series attributes to (data, version) tuples.
+    """
+    attributes = [
+        self._SeriesAttribute(resolution, metric)
+        for resolution in RESOLUTIONS if resolution.period
+        for metric in metrics
+    ]
+    segments = {}
+    for attribute, data, version in data_store.DB.ResolveMulti(
+        self.urn,
+        attributes,
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      if attribute not in segments or segments[attribute][1] < version:
+        segments[attribute] = (utils.SmartStr(data), version)
+
+    return segments
+
+  def AddClientStats(self, client_stats, timestamp=None):
+    """Adds the samples of a ClientStats message to the series.
+
+    Clients send overlapping samples, so samples which are not newer than the
+    newest sample stored for a metric are dropped.
+
+    Args:
+      client_stats: An rdf_client.ClientStats.
+      timestamp: The time the stats were sent, an RDFDatetime. The memory and
+        network metrics are only sampled at this time. Defaults to now.
+    """
+    if timestamp is None:
+      timestamp = rdfvalue.RDFDatetime.Now()
+
+    state = dict((attribute, int(value))
+                 for attribute, value, _ in data_store.DB.ResolvePrefix(
+                     self.urn, self.LAST_PREFIX, token=self.token))
+    since, _ = data_store.DB.Resolve(
+        self.urn, self.SINCE_ATTRIBUTE, token=self.token)
+
+    new_points = {}
+    for metric, points in _MetricPoints(client_stats, timestamp).iteritems():
+      last_time = state.get(self.LAST_PREFIX + metric, 0)
+      points = [point for point in points if point[0] > last_time]
+      if points:
+        new_points[metric] = points
+
+    if not new_points:
+      return
+
+    open_segments = self._OpenSegments(new_points)
+    values = {}
+    # Attributes whose newest segment is replaced, keyed by the block range.
+    replaced = {}
+    for metric, points in new_points.iteritems():
+      kind, scale = METRICS[metric]
+      points = [(t, v * scale) for t, v in points]
+
+      for resolution in RESOLUTIONS:
+        attribute = self._SeriesAttribute(resolution, metric)
+        block = resolution.block * 1000000
+        if resolution.period:
+          period = resolution.period * 1000000
+          open_points = None
+          if attribute in open_segments:
+            data, version = open_segments[attribute]
+            open_block = version - version % block
+            if points[0][0] - points[0][0] % block == open_block:
+              open_points = DecodeSegment(data, open_block, with_counts=True)
+              replaced.setdefault((open_block, open_block + block - 1),
+                                  []).append(attribute)
+          rolled_up = _RollUp(points, period, kind, open_points=open_points)
+        else:
+          rolled_up = [(t, v, 1, t) for t, v in points]
+
+        segments = values.setdefault(attribute, [])
+        for block_start, group in itertools.groupby(
+            rolled_up, key=lambda point: point[0] - point[0] % block):
+          group = list(group)
+          if resolution.period:
+            data = EncodeSegment([(t, int(round(v)), c)
+                                  for t, v, c, _ in group],
+                                 block_start,
+                                 with_counts=True)
+          else:
+            data = EncodeSegment([(t, int(round(v)))
+                                  for t, v, _, _ in group], block_start)
+          segments.append((data, max(newest for _, _, _, newest in group)))
+
+      values[self.LAST_PREFIX + metric] = [str(points[-1][0])]
+
+    if not since:
+      values[self.SINCE_ATTRIBUTE] = [
+          str(min(points[0][0] for points in new_points.itervalues()))
+      ]
+
+    # Segments are added as new versions, the state attributes are replaced.
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for (start, end), attributes in replaced.iteritems():
+        pool.DeleteAttributes(self.urn, attributes, start=start, end=end)
+      pool.MultiSet(
+          self.urn,
+          values,
+          replace=False,
+          to_delete=[
+              a for a in values if not a.startswith(self.SERIES_PREFIX)
+          ])
+
+  def Since(self):
+    """Returns the time of the oldest sample stored, None if there is none."""
+    since, _ = data_store.DB.Resolve(
+        self.urn, self.SINCE_ATTRIBUTE, token=self.token)
+    if not since:
+      return None
+    return rdfvalue.RDFDatetime(int(since))
+
+  def ReadMetric(self, metric, start, end, max_points):
+    """Returns the points of a metric in a time range.
+
+    Args:
+      metric: Name of the metric, one of METRICS.
+      start: Start of the range, an RDFDatetime.
+      end: End of the range, an RDFDatetime.
+      max_points: The number of points the caller needs. The points are read
+        from the coarsest resolution which still has this many points in the
+        range and was not purged in it.
+
+    Returns:
+      A list of (value, timestamp) tuples sorted by timestamp.
+    """
+    kind, scale = METRICS[metric]
+    purged_until = dict(
+        (attribute[len(self.PURGED_PREFIX):], int(value))
+        for attribute, value, _ in data_store.DB.ResolvePrefix(
+            self.urn, self.PURGED_PREFIX, token=self.token))
+    resolution = ChooseResolution(
+        start, end, max_points, purged_until=purged_until)
+    block = resolution.block * 1000000
+    start = start.AsMicroSecondsFromEpoch()
+    end = end.AsMicroSecondsFromEpoch()
+
+    with_counts = bool(resolution.period)
+
+    points = []
+    for _, data, version in data_store.DB.ResolveMulti(
+        self.urn, [self._SeriesAttribute(resolution, metric)],
+        timestamp=(start - start % block, end - end % block + block - 1),
+        token=self.token):
+      segment = DecodeSegment(
+          utils.SmartStr(data),
+          version - version % block,
+          with_counts=with_counts)
+      if not with_counts:
+        segment = [(t, v, 1) for t, v in segment]
+      points.extend(segment)
+    points.sort()
+
+    result = []
+    for timestamp, group in itertools.groupby(points, key=lambda p: p[0]):
+      if timestamp < start or timestamp > end:
+        continue
+
+      # A block written by two processes at once can have two versions with
+      # rollups of the same period.
+      _, value, count = next(group)
+      for _, other_value, other_count in group:
+        value = _MergeValues(kind, value, count, other_value, other_count)
+        count += other_count
+      if scale != 1:
+        value /= float(scale)
+      result.append((value, rdfvalue.RDFDatetime(timestamp)))
+
+    return result
+
+  def DeleteBefore(self, resolution, timestamp, mutation_pool):
+    """Deletes the segments of a resolution with samples before timestamp.
+
+    Args:
+      resolution: The Resolution to delete from.
+      timestamp: Segments with no sample at or after this time are deleted, in
+        microseconds.
+      mutation_pool: A MutationPool object to write to.
+    """
+    mutation_pool.DeleteAttributes(
+        self.urn, [self._SeriesAttribute(resolution, m) for m in METRICS],
+        start=0,
+        end=timestamp - 1)
+    # Readers use a resolution kept longer for the ranges purged here.
+    mutation_pool.Set(
+        self.urn, self.PURGED_PREFIX + resolution.name, str(timestamp))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""Tests for grr.server.client_stats_store."""
+
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import client_stats_store
+from grr.server import data_store
+from grr.test_lib import test_lib
+
+CLIENT_ID = "C.00aaeccbb45f33a3"
+
+
+def _Seconds(seconds):
+  return rdfvalue.RDFDatetime.FromSecondsFromEpoch(seconds)
+
+
+def _ClientStats(start, end, interval=10):
+  """Returns ClientStats sampled every interval seconds in [start, end)."""
+  stats = rdf_client.ClientStats(
+      bytes_received=end, bytes_sent=2 * end, memory_percent=1.5)
+  for seconds in xrange(start, end, interval):
+    stats.cpu_samples.Append(
+        rdf_client.CpuSample(
+            timestamp=_Seconds(seconds),
+            cpu_percent=seconds % 100,
+            user_cpu_time=seconds / 10.0,
+            system_cpu_time=seconds / 20.0))
+    stats.io_samples.Append(
+        rdf_client.IOSample(
+            timestamp=_Seconds(seconds),
+            read_bytes=seconds * 100,
+            write_bytes=seconds * 200))
+  return stats
+
+
+class SegmentEncodingTest(test_lib.GRRBaseTest):
+
+  def testRoundTrip(self):
+    block_start = 3600 * 1000000
+    points = [(block_start + 1000, 5), (block_start + 11000, -7),
+              (block_start + 3599000000, 2**40)]
+
+    data = client_stats_store.EncodeSegment(points, block_start)
+
+    self.assertEqual(len(data), 4 + 12 * len(points))
+    self.assertEqual(
+        client_stats_store.DecodeSegment(data, block_start), points)
+
+  def testRoundTripWithCounts(self):
+    points = [(1000, 5, 6), (61000, -7, 1), (121000, 2**40, 360)]
+
+    data = client_stats_store.EncodeSegment(points, 0, with_counts=True)
+
+    self.assertEqual(len(data), 4 + 16 * len(points))
+    self.assertEqual(
+        client_stats_store.DecodeSegment(data, 0, with_counts=True), points)
+
+  def testEmptySegment(self):
+    data = client_stats_store.EncodeSegment([], 0)
+    self.assertEqual(client_stats_store.DecodeSegment(data, 0), [])
+
+
+class ChooseResolutionTest(test_lib.GRRBaseTest):
+
+  def _Choose(self, seconds):
+    return client_stats_store.ChooseResolution(
+        _Seconds(0), _Seconds(seconds), 100)
+
+  def testCoarsestResolutionWithEnoughPointsIsChosen(self):
+    self.assertIs(self._Choose(1800), client_stats_store.RAW)
+    self.assertIs(self._Choose(6000), client_stats_store.ONE_MINUTE)
+    self.assertIs(self._Choose(24 * 3600), client_stats_store.TEN_MINUTES)
+    self.assertIs(self._Choose(31 * 24 * 3600), client_stats_store.ONE_HOUR)
+
+  def testPurgedResolutionsAreSkipped(self):
+    purged_until = {client_stats_store.RAW.name: 1000 * 1000000}
+
+    def Choose(start, end):
+      return client_stats_store.ChooseResolution(
+          _Seconds(start), _Seconds(end), 100, purged_until=purged_until)
+
+    self.assertIs(Choose(0, 1800), client_stats_store.ONE_MINUTE)
+    self.assertIs(Choose(1000, 2800), client_stats_store.RAW)
+
+    purged_until.update((resolution.name, 1000 * 1000000)
+                        for resolution in client_stats_store.RESOLUTIONS)
+    self.assertIs(Choose(0, 1800), client_stats_store.ONE_HOUR)
+
+
+class ClientStatsStoreTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(ClientStatsStoreTest, self).setUp()
+    self.store = client_stats_store.ClientStatsStore(
+        CLIENT_ID, token=self.token)
+
+  def _Values(self, metric, start, end, max_points=1000):
+    return [(value, timestamp.AsSecondsFromEpoch())
+            for value, timestamp in self.store.ReadMetric(
+                metric, _Seconds(start), _Seconds(end), max_points)]
+
+  def testSamplesAreReadBack(self):
+    self.store.AddClientStats(_ClientStats(100, 150), _Seconds(150))
+
+    self.assertEqual(
+        self._Values("IO_READ_BYTES", 0, 1000),
+        [(10000, 100), (11000, 110), (12000, 120), (13000, 130),
+         (14000, 140)])
+    self.assertEqual(
+        self._Values("CPU_USER", 0, 1000),
+        [(10.0, 100), (11.0, 110), (12.0, 120), (13.0, 130), (14.0, 140)])
+    self.assertEqual(
+        self._Values("NETWORK_BYTES_SENT", 0, 1000), [(300, 150)])
+    self.assertEqual(
+        self._Values("MEMORY_PERCENT", 0, 1000), [(1.5, 150)])
+
+  def testRangeIsRespected(self):
+    self.store.AddClientStats(_ClientStats(100, 150), _Seconds(150))
+
+    self.assertEqual([t for _, t in self._Values("CPU_PERCENT", 110, 130)],
+                     [110, 120, 130])
+
+  def testOverlappingSamplesAreDropped(self):
+    self.store.AddClientStats(_ClientStats(100, 150), _Seconds(150))
+    self.store.AddClientStats(_ClientStats(100, 200), _Seconds(200))
+
+    self.assertEqual([t for _, t in self._Values("CPU_PERCENT", 0, 1000)],
+                     range(100, 200, 10))
+
+  def testSamplesAcrossBlocksAreReadBack(self):
+    self.store.AddClientStats(_ClientStats(3500, 3700), _Seconds(3700))
+
+    self.assertEqual([t for _, t in self._Values("CPU_PERCENT", 0, 7200)],
+                     range(3500, 3700, 10))
+
+  def testRollupsAreComputedAtIngest(self):
+    self.store.AddClientStats(_ClientStats(0, 3600), _Seconds(3600))
+
+    # 60 points in an hour can only be read from the minute rollup.
+    values = self._Values("CPU_PERCENT", 0, 3600, max_points=60)
+    self.assertEqual(len(values), 60)
+    self.assertEqual(values[0], (25.0, 0))
+    # Counters keep the newest value of a period.
+    values = self._Values("IO_WRITE_BYTES", 0, 3600, max_points=6)
+    self.assertEqual(values[0], (590 * 200, 0))
+
+  def testRollupsOfSeveralWritesAreMerged(self):
+    self.store.AddClientStats(_ClientStats(0, 30), _Seconds(30))
+    self.store.AddClientStats(_ClientStats(30, 60), _Seconds(60))
+
+    # Both writes roll up into the first minute.
+    values = self._Values("CPU_PERCENT", 0, 3600, max_points=60)
+    self.assertEqual(values, [(25.0, 0)])
+
+  def testGaugeRollupsAreWeightedBySampleCount(self):
+    self.store.AddClientStats(_ClientStats(0, 10), _Seconds(10))
+    self.store.AddClientStats(_ClientStats(10, 60), _Seconds(60))
+
+    # The minute holds the samples 0, 10, 20, 30, 40 and 50.
+    values = self._Values("CPU_PERCENT", 0, 3600, max_points=60)
+    self.assertEqual(values, [(25.0, 0)])
+
+  def testEveryRollupBlockIsASingleVersion(self):
+    for start in xrange(0, 3 * 3600, 600):
+      self.store.AddClientStats(
+          _ClientStats(start, start + 600), _Seconds(start + 600))
+
+    for resolution in client_stats_store.RESOLUTIONS[1:]:
+      versions = list(
+          data_store.DB.ResolveMulti(
+              self.store.urn, [
+                  self.store._SeriesAttribute(resolution, "CPU_PERCENT")
+              ],
+              timestamp=data_store.DB.ALL_TIMESTAMPS,
+              token=self.token))
+      self.assertEqual(len(versions), 1)
+
+    values = self._Values("CPU_PERCENT", 0, 3 * 3600, max_points=3)
+    self.assertEqual([t for _, t in values], [0, 3600, 7200])
+    self.assertEqual([v for v, _ in values], [45.0, 45.0, 45.0])
+
+  def testSinceIsTheOldestSample(self):
+    self.assertIsNone(self.store.Since())
+
+    self.store.AddClientStats(_ClientStats(100, 150), _Seconds(150))
+    self.store.AddClientStats(_ClientStats(150, 200), _Seconds(200))
+
+    self.assertEqual(self.store.Since(), _Seconds(100))
+
+  def testDeleteBefore(self):
+    self.store.AddClientStats(_ClientStats(0, 3600), _Seconds(3600))
+    self.store.AddClientStats(_ClientStats(3600, 7200), _Seconds(7200))
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      self.store.DeleteBefore(client_stats_store.RAW, 3600 * 1000000, pool)
+
+    self.assertEqual([t for _, t in self._Values("CPU_PERCENT", 3600, 7200)],
+                     range(3600, 7200, 10))
+    # Rollups are kept.
+    self.assertEqual(
+        len(self._Values("CPU_PERCENT", 0, 7200, max_points=120)), 120)
+
+  def testPurgedRangesAreReadFromRollups(self):
+    self.store.AddClientStats(_ClientStats(0, 3600), _Seconds(3600))
+    self.store.AddClientStats(_ClientStats(3600, 7200), _Seconds(7200))
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      self.store.DeleteBefore(client_stats_store.RAW, 3600 * 1000000, pool)
+
+    # A short range would be read from the raw samples, which are gone.
+    values = self._Values("CPU_PERCENT", 600, 2400, max_points=100)
+    self.assertEqual([t for _, t in values], range(600, 2401, 60))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -125,7 +125,7 @@ def GetNotifications(user=None, token=None):
     user = getpass.getuser()
   user_obj = aff4.FACTORY.Open(
       aff4.ROOT_URN.Add("users").Add(user), token=token)
-  return list(user_obj.Get(user_obj.Schema.PENDING_NOTIFICATIONS))
+  return user_obj.GetPendingNotifications()
 
 
 def ApprovalRequest(client_id,
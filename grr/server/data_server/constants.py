@@ -10,6 +10,16 @@ REBALANCE_DIRECTORY = ".GRR_REBALANCE"
 TRANSACTION_FILENAME = ".TRANSACTION"
 REMOVE_FILENAME = ".TRANSACTION_REMOVE"
 
+# Files keeping the state of an online range migration.
+MIGRATION_FILENAME = ".MIGRATION"
+MIGRATION_COPIED_FILENAME = ".MIGRATION_COPIED"
+MIGRATION_DELTA_FILENAME = ".MIGRATION_DELTA"
+MIGRATION_REPLAYED_FILENAME = ".MIGRATION_REPLAYED"
+
+# Subject ranges of the database files of a file based data store. This file
+# describes the local database files and is never copied to other servers.
+MANIFEST_FILENAME = ".GRR_MANIFEST"
+
 # HTTP status codes.
 RESPONSE_OK = 200
 
@@ -33,3 +43,6 @@ RESPONSE_IS_MASTER_SERVER = 404
 RESPONSE_INCOMPLETE_SYNC = 503
 RESPONSE_DATA_SERVER_NOT_FOUND = 409
 RESPONSE_RANGE_NOT_EMPTY = 402
+RESPONSE_MIGRATION_NOT_FOUND = 400
+RESPONSE_MIGRATION_NOT_READY = 503
+RESPONSE_COMMANDS_NOT_REPLAYED = 500
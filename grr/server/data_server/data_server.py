@@ -62,6 +62,8 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
   CMDTABLE = None
   # Nonce store used for authentication.
   NONCE_STORE = None
+  # Online range migration this data server takes part in.
+  MIGRATION = None
 
   @classmethod
   def InitMasterServer(cls, port):
@@ -84,6 +86,34 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
     cls.DATA_SERVER.PeriodicallySendStatistics()
     logging.info("Starting Data Server on port %d ...", port)
 
+  @classmethod
+  def ResumeMigration(cls):
+    """Resumes an online range migration interrupted by a restart."""
+    reb = rebalance.LoadMigration(cls.SERVICE.GetLocation())
+    if not reb:
+      return
+    logging.info("Resuming range migration %s", reb.id)
+    cls.MIGRATION = rebalance.RangeMigration(reb, cls.ServerIndex(),
+                                             cls.SERVICE)
+    cls.MIGRATION.Start()
+    if cls.MASTER:
+      cls.MASTER.SetRebalancing(reb)
+
+  @classmethod
+  def DropFinishedMigration(cls, mapping):
+    """Stops forwarding writes once the mapping changes again."""
+    migration = cls.MIGRATION
+    if migration and migration.state == migration.FORWARDING:
+      if not migration.IsForwardingFor(mapping):
+        migration.Abandon()
+        cls.MIGRATION = None
+
+  @classmethod
+  def ServerIndex(cls):
+    if cls.MASTER:
+      return 0
+    return cls.DATA_SERVER.Index()
+
   @classmethod
   def InitHandlerTables(cls):
     """Initializes tables of handler callbacks."""
@@ -103,6 +133,16 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
         "/rebalance/commit": cls.HandleRebalanceCommit,
         "/rebalance/perform": cls.HandleRebalancePerform,
         "/rebalance/recover": cls.HandleRebalanceRecover,
+        "/rebalance/migrate": cls.HandleMigrate,
+        "/rebalance/migrate/status": cls.HandleMigrateStatus,
+        "/rebalance/migrate/commit": cls.HandleMigrateCommit,
+        "/rebalance/migrate/start": cls.HandleMigrateStart,
+        "/rebalance/migrate/progress": cls.HandleMigrateProgress,
+        "/rebalance/migrate/replay": cls.HandleMigrateReplay,
+        "/rebalance/migrate/forward": cls.HandleMigrateForward,
+        "/rebalance/migrate/freeze": cls.HandleMigrateFreeze,
+        "/rebalance/migrate/thaw": cls.HandleMigrateThaw,
+        "/rebalance/migrate/finish": cls.HandleMigrateFinish,
         "/servers/add/check": cls.HandleServerAddCheck,
         "/servers/add": cls.HandleServerAdd,
         "/servers/rem/check": cls.HandleServerRemCheck,
@@ -113,6 +153,7 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
 
     cls.STREAMING_TABLE = {
         "/rebalance/copy-file": cls.HandleRebalanceCopyFile,
+        "/rebalance/migrate/copy-file": cls.HandleMigrateCopyFile,
     }
 
   @classmethod
@@ -203,7 +244,13 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
       return ""
     method, perm = cmdinfo
     if perm in permissions:
-      response = method(request)
+      migration = self.MIGRATION
+      if not migration:
+        response = method(request)
+      elif op in rebalance.RangeMigration.WRITE_COMMANDS:
+        response = migration.ApplyWrite(cmd, method)
+      else:
+        response = migration.ApplyRead(cmd, method)
     else:
       status_desc = ("Operation not allowed: required %s but only have "
                      "%s permissions" % (perm, permissions))
@@ -435,6 +482,7 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
     if not new_mapping:
       self._EmptyResponse(constants.RESPONSE_NOT_COMMITED)
       return
+    self.DropFinishedMigration(new_mapping)
     self._Response(constants.RESPONSE_OK, self.MAPPING.SerializeToString())
 
   def HandleRebalancePerform(self):
@@ -474,6 +522,152 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
     body = reb.SerializeToString()
     self._Response(constants.RESPONSE_OK, body)
 
+  def HandleMigrate(self):
+    """Call master to move ranges while the data servers keep running."""
+    if not self.MASTER:
+      self._EmptyResponse(constants.RESPONSE_NOT_MASTER_SERVER)
+      return
+    if self.MASTER.IsRebalancing():
+      self._EmptyResponse(constants.RESPONSE_MASTER_IS_REBALANCING)
+      return
+    new_mapping = rdf_data_server.DataServerMapping.FromSerializedString(
+        self.post_data)
+    reb = rdf_data_server.DataServerRebalance(
+        id=str(uuid.uuid4()), mapping=new_mapping)
+    if not self.MASTER.SetRebalancing(reb):
+      logging.warning("Could not contact servers for migration")
+      self._EmptyResponse(constants.RESPONSE_DATA_SERVERS_UNREACHABLE)
+      return
+    if not self.MASTER.StartMigration():
+      logging.warning("Could not start migration on all servers")
+      self._EmptyResponse(constants.RESPONSE_DATA_SERVERS_UNREACHABLE)
+      return
+    self._Response(constants.RESPONSE_OK, reb.SerializeToString())
+
+  def _IsCurrentMigration(self):
+    """Checks that the posted migration is the one the master runs."""
+    reb = rdf_data_server.DataServerRebalance.FromSerializedString(
+        self.post_data)
+    current = self.MASTER.IsRebalancing()
+    return current and current.id == reb.id
+
+  def HandleMigrateStatus(self):
+    """Call master to report how much data the servers still need to copy."""
+    if not self.MASTER:
+      self._EmptyResponse(constants.RESPONSE_NOT_MASTER_SERVER)
+      return
+    if not self._IsCurrentMigration():
+      self._EmptyResponse(constants.RESPONSE_WRONG_TRANSACTION)
+      return
+    progress = self.MASTER.FetchMigrationProgress()
+    if not progress:
+      self._EmptyResponse(constants.RESPONSE_DATA_SERVERS_UNREACHABLE)
+      return
+    self._Response(constants.RESPONSE_OK, progress.SerializeToString())
+
+  def HandleMigrateCommit(self):
+    """Call master to flip the ownership of the migrated ranges."""
+    if not self.MASTER:
+      self._EmptyResponse(constants.RESPONSE_NOT_MASTER_SERVER)
+      return
+    if not self._IsCurrentMigration():
+      self._EmptyResponse(constants.RESPONSE_WRONG_TRANSACTION)
+      return
+    if not self.MASTER.CommitMigration():
+      self._EmptyResponse(constants.RESPONSE_MIGRATION_NOT_READY)
+      return
+    self._Response(constants.RESPONSE_OK, self.MAPPING.SerializeToString())
+
+  def _GetMigration(self):
+    """Returns the running migration if it is the posted one."""
+    reb = rdf_data_server.DataServerRebalance.FromSerializedString(
+        self.post_data)
+    migration = self.MIGRATION
+    if not migration or migration.rebalance.id != reb.id:
+      self._EmptyResponse(constants.RESPONSE_MIGRATION_NOT_FOUND)
+      return None
+    return migration
+
+  def HandleMigrateStart(self):
+    """Call data server to start migrating its ranges in the background."""
+    reb = rdf_data_server.DataServerRebalance.FromSerializedString(
+        self.post_data)
+    current = self.MIGRATION
+    if current and current.rebalance.id == reb.id:
+      # Already running, possibly resumed after a restart.
+      self._EmptyResponse(constants.RESPONSE_OK)
+      return
+    if current:
+      current.Abandon()
+    migration = rebalance.RangeMigration(reb, self.ServerIndex(), self.SERVICE)
+    type(self).MIGRATION = migration
+    migration.Start()
+    self._EmptyResponse(constants.RESPONSE_OK)
+
+  def HandleMigrateProgress(self):
+    """Call data server to report how many bytes it still needs to copy."""
+    migration = self._GetMigration()
+    if not migration:
+      return
+    reb = migration.rebalance.Copy()
+    reb.moving.Append(migration.Progress())
+    self._Response(constants.RESPONSE_OK, reb.SerializeToString())
+
+  def HandleMigrateCopyFile(self):
+    if not rebalance.InstallFile(self.rfile, self.SERVICE.GetLocation()):
+      return self._EmptyResponse(constants.RESPONSE_FILE_NOT_SAVED)
+    self._EmptyResponse(constants.RESPONSE_OK)
+
+  def HandleMigrateReplay(self):
+    """Applies writes logged by a data server whose ranges move here."""
+    data = self.post_data or ""
+    offset = 0
+    while offset < len(data):
+      size = sutils.SIZE_PACKER.unpack_from(data, offset)[0]
+      offset += sutils.SIZE_PACKER.size
+      cmd = rdf_data_server.DataStoreCommand.FromSerializedString(
+          data[offset:offset + size])
+      offset += size
+      cmdinfo = self.CMDTABLE.get(cmd.command)
+      if not cmdinfo:
+        logging.error("Unrecognized command %d", cmd.command)
+        return self._EmptyResponse(constants.RESPONSE_COMMANDS_NOT_REPLAYED)
+      method, _ = cmdinfo
+      method(cmd.request)
+    self._EmptyResponse(constants.RESPONSE_OK)
+
+  def HandleMigrateForward(self):
+    """Applies a request a data server received for a subject moved here."""
+    cmd = rdf_data_server.DataStoreCommand.FromSerializedString(self.post_data)
+    cmdinfo = self.CMDTABLE.get(cmd.command)
+    if not cmdinfo:
+      logging.error("Unrecognized command %d", cmd.command)
+      return self._EmptyResponse(constants.RESPONSE_COMMANDS_NOT_REPLAYED)
+    method, _ = cmdinfo
+    self._Response(constants.RESPONSE_OK, method(cmd.request))
+
+  def HandleMigrateFreeze(self):
+    migration = self._GetMigration()
+    if not migration:
+      return
+    if not migration.Freeze():
+      return self._EmptyResponse(constants.RESPONSE_MIGRATION_NOT_READY)
+    self._EmptyResponse(constants.RESPONSE_OK)
+
+  def HandleMigrateThaw(self):
+    migration = self._GetMigration()
+    if not migration:
+      return
+    migration.Thaw()
+    self._EmptyResponse(constants.RESPONSE_OK)
+
+  def HandleMigrateFinish(self):
+    migration = self._GetMigration()
+    if not migration:
+      return
+    migration.Finish()
+    self._EmptyResponse(constants.RESPONSE_OK)
+
   def _UnpackNewServer(self):
     data = self.post_data
     addrlen_str = data[:sutils.SIZE_PACKER.size]
@@ -520,6 +714,7 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
     addr, port = self._UnpackNewServer()
     logging.info("Adding new server %s:%d", addr, port)
     server = self.MASTER.AddServer(addr, port)
+    self.DropFinishedMigration(self.MAPPING)
     if self.MASTER.SyncMapping(skip=[server]):
       body = self.MAPPING.SerializeToString()
       self._Response(constants.RESPONSE_OK, body)
@@ -573,6 +768,7 @@ class DataServerHandler(BaseHTTPRequestHandler, object):
       return self._EmptyResponse(constants.RESPONSE_DATA_SERVER_NOT_FOUND)
     if not self.MASTER.RemoveServer(removed_server):
       return self._EmptyResponse(constants.RESPONSE_RANGE_NOT_EMPTY)
+    self.DropFinishedMigration(self.MAPPING)
     if self.MASTER.SyncMapping():
       body = self.MAPPING.SerializeToString()
       self._Response(constants.RESPONSE_OK, body)
@@ -705,6 +901,7 @@ class StandardDataServer(object):
   def SetMapping(self, mapping):
     self.handler_cls.SERVICE.SaveServerMapping(mapping)
     self.handler_cls.MAPPING = mapping
+    self.handler_cls.DropFinishedMigration(mapping)
 
   def _SendStatistics(self):
     """Send statistics to server."""
@@ -829,6 +1026,7 @@ def Start(db,
     reqhandler_cls.InitDataServer(server_port)
 
   reqhandler_cls.InitHandlerTables()
+  reqhandler_cls.ResumeMigration()
 
   logging.info("Starting! master: " + str(is_master) + " with handler " +
                reqhandler_cls.__name__)
@@ -224,6 +224,92 @@ class Manager(object):
         res.data)
     print "Rebalance with id %s fully performed." % rebalance.id
 
+  def _Migrate(self):
+    """Starts rebalancing while the data servers keep running."""
+    if not self.mapping:
+      print "Server information not available"
+      return
+    servers = list(self.mapping.servers)
+    num_servers = len(servers)
+    target = 1.0 / float(num_servers)
+    perc = [target] * num_servers
+    new_mapping = self._ComputeMappingFromPercentages(self.mapping, perc)
+    print "The new ranges will be:"
+    self._ShowRange(new_mapping)
+    print
+    answer = raw_input("Proceed with online re-sharding? (y/n) ")
+    if answer != "y":
+      return
+    self._DoMigration(new_mapping)
+
+  def _DoMigration(self, new_mapping):
+    """Moves ranges online and flips their ownership once they are copied."""
+    print "Contacting master server to start online re-sharding...",
+    pool = None
+    try:
+      pool = urllib3.connectionpool.HTTPConnectionPool(
+          self.addr, port=self.port)
+    except urllib3.exceptions.MaxRetryError:
+      print "Unable to contact master..."
+      return
+    body = new_mapping.SerializeToString()
+    headers = {"Content-Length": len(body)}
+    try:
+      res = pool.urlopen(
+          "POST", "/rebalance/migrate", headers=headers, body=body)
+    except urllib3.exceptions.MaxRetryError:
+      print "Unable to talk with master..."
+      pool.close()
+      return
+    if res.status != constants.RESPONSE_OK:
+      print "Re-sharding cannot be done!"
+      return
+    rebalance = rdf_data_server.DataServerRebalance.FromSerializedString(
+        res.data)
+    print "OK"
+
+    # The data servers keep serving requests while they copy their ranges.
+    body = rebalance.SerializeToString()
+    headers = {"Content-Length": len(body)}
+    while True:
+      try:
+        res = pool.urlopen(
+            "POST", "/rebalance/migrate/status", headers=headers, body=body)
+      except urllib3.exceptions.MaxRetryError:
+        print "Unable to talk with master..."
+        return
+      if res.status != constants.RESPONSE_OK:
+        print "Could not get the progress of migration %s" % rebalance.id
+        return
+      progress = rdf_data_server.DataServerRebalance.FromSerializedString(
+          res.data)
+      left = list(progress.moving)
+      for i, move in enumerate(left):
+        print "Server %d still has to copy %dKB" % (i, move / 1024)
+      if not any(left):
+        break
+      time.sleep(10)
+
+    while True:
+      try:
+        res = pool.urlopen(
+            "POST", "/rebalance/migrate/commit", headers=headers, body=body)
+      except urllib3.exceptions.MaxRetryError:
+        print "Unable to talk with master..."
+        return
+      if res.status != constants.RESPONSE_MIGRATION_NOT_READY:
+        break
+      # Some server is still catching up with its logged writes.
+      time.sleep(10)
+
+    if res.status != constants.RESPONSE_OK:
+      print "Could not commit migration %s" % rebalance.id
+      return
+
+    self.mapping = rdf_data_server.DataServerMapping.FromSerializedString(
+        res.data)
+    print "Migration with id %s fully performed." % rebalance.id
+
   def _Recover(self, transid):
     """Completes a rebalancing transaction that was unsuccessful."""
     print "Contacting master about transaction %s..." % transid,
@@ -535,6 +621,7 @@ class Manager(object):
     print "servers\t\t\t\tDisplay server information."
     print "ranges\t\t\t\tDisplay server range information."
     print "rebalance\t\t\tRebalance server load."
+    print "migrate\t\t\t\tRebalance server load without downtime."
     print "recover <transaction id>\tComplete a pending transaction."
     print "addserver <address> <port>\tAdd new server to the group."
     print("dropserver <address> <port>\tMove all the data from the server "
@@ -554,6 +641,8 @@ class Manager(object):
       self._ShowRanges()
     elif cmd == "rebalance":
       self._Rebalance()
+    elif cmd == "migrate":
+      self._Migrate()
     elif cmd == "recover":
       if len(args) != 1:
         print "Syntax: recover <transaction-id>"
@@ -393,3 +393,69 @@ class DataMaster(object):
     rebalance.RemoveDirectory(self.rebalance)
     self.CancelRebalancing()
     return self.mapping
+
+  def _PostMigration(self, pool, url):
+    """Sends the current migration to a data server."""
+    body = self.rebalance.SerializeToString()
+    headers = {"Content-Length": len(body)}
+    try:
+      res = pool.urlopen("POST", url, headers=headers, body=body)
+    except urllib3.exceptions.MaxRetryError:
+      return None
+    if res.status != constants.RESPONSE_OK:
+      return None
+    return res
+
+  def StartMigration(self):
+    """Tell servers to start migrating their ranges in the background."""
+    for pool in self.rebalance_pool:
+      if not self._PostMigration(pool, "/rebalance/migrate/start"):
+        self.CancelRebalancing()
+        return False
+    return True
+
+  def FetchMigrationProgress(self):
+    """Asks data servers how many bytes they still need to copy."""
+    progress = self.rebalance.Copy()
+    for pool in self.rebalance_pool:
+      res = self._PostMigration(pool, "/rebalance/migrate/progress")
+      if not res:
+        return None
+      reb = rdf_data_server.DataServerRebalance.FromSerializedString(res.data)
+      progress.moving.Append(list(reb.moving)[0])
+    return progress
+
+  def CommitMigration(self):
+    """Flips the ownership of the migrated ranges in the mapping.
+
+    Every data server stops writes to its moving subjects and replays the
+    writes it logged. Once all of them are frozen, the new intervals are
+    stored in the mapping and the data servers start forwarding writes for
+    the moved subjects.
+
+    Returns:
+      The new mapping or None if some data server was not ready.
+    """
+    frozen = []
+    for pool in self.rebalance_pool:
+      if not self._PostMigration(pool, "/rebalance/migrate/freeze"):
+        for frozen_pool in frozen:
+          self._PostMigration(frozen_pool, "/rebalance/migrate/thaw")
+        return None
+      frozen.append(pool)
+
+    # Update server intervals.
+    mapping = self.rebalance.mapping
+    for i, serv in enumerate(list(self.mapping.servers)):
+      serv.interval = mapping.servers[i].interval
+    self.mapping.version = mapping.version
+    self.service.SaveServerMapping(self.mapping)
+    if not self.SyncMapping():
+      logging.warning("Could not send the new mapping to all data servers")
+
+    for i, pool in enumerate(self.rebalance_pool):
+      if not self._PostMigration(pool, "/rebalance/migrate/finish"):
+        logging.error("Server %d failed to finish migration %s", i,
+                      self.rebalance.id)
+    self.CancelRebalancing()
+    return self.mapping
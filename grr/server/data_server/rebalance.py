@@ -3,33 +3,48 @@
 
 
 import os
+import re
 import shutil
+import sqlite3
 import StringIO
+import tempfile
+import threading
+import time
 import zlib
 
 from requests.packages import urllib3
 
 import logging
 
+from grr import config
 from grr.lib import utils
 from grr.lib.rdfvalues import data_server as rdf_data_server
+from grr.lib.rdfvalues import data_store as rdf_data_store
 from grr.server import data_store
 from grr.server.data_server import constants
 
 from grr.server.data_server import store
 from grr.server.data_server import utils as sutils
 from grr.server.data_stores import common
+from grr.server.data_stores import sqlite_data_store
 # pylint: enable=g-import-not-at-top
 
 # Database files that cannot be copied.
-COPY_EXCEPTIONS = [store.BASE_MAP_SUBJECT]
+COPY_EXCEPTIONS = [
+    store.BASE_MAP_SUBJECT, constants.MANIFEST_FILENAME,
+    constants.MANIFEST_FILENAME + "-journal"
+]
 # Files that cannot be moved from inside the transaction directory.
-MOVE_EXCEPTIONS = [constants.TRANSACTION_FILENAME, constants.REMOVE_FILENAME]
+MOVE_EXCEPTIONS = [
+    constants.TRANSACTION_FILENAME, constants.REMOVE_FILENAME,
+    constants.MIGRATION_FILENAME, constants.MIGRATION_COPIED_FILENAME,
+    constants.MIGRATION_DELTA_FILENAME, constants.MIGRATION_REPLAYED_FILENAME
+]
 # Level of compression when moving Sqlite files.
 COMPRESSION_LEVEL = 3
 
 
-def _RecComputeRebalanceSize(mapping, server_id, dspath, subpath):
+def _RecComputeRebalanceSize(routing, server_id, dspath, subpath):
   """Recursively compute the size of files that need to be moved."""
   total = 0
   fulldir = utils.JoinPath(dspath, subpath)
@@ -44,11 +59,11 @@ def _RecComputeRebalanceSize(mapping, server_id, dspath, subpath):
       logging.info("Skip %s", comp)
       continue
     if os.path.isdir(path):
-      total += _RecComputeRebalanceSize(mapping, server_id, dspath,
+      total += _RecComputeRebalanceSize(routing, server_id, dspath,
                                         utils.JoinPath(subpath, comp))
     elif os.path.isfile(path):
       key = common.MakeDestinationKey(subpath, name)
-      where = sutils.MapKeyToServer(mapping, key)
+      where = routing.MapKey(key)
       if where != server_id:
         logging.info("Need to move %s from %d to %d", path, server_id, where)
         total += os.path.getsize(path)
@@ -64,7 +79,8 @@ def ComputeRebalanceSize(mapping, server_id):
     return 0
   if not os.path.isdir(loc):
     return 0
-  return _RecComputeRebalanceSize(mapping, server_id, loc, "")
+  return _RecComputeRebalanceSize(
+      sutils.ServerRoutingTable(mapping), server_id, loc, "")
 
 
 class FileCopyWrapper(object):
@@ -134,7 +150,12 @@ class FileCopyWrapper(object):
     self.header.close()
 
 
-def _SendFileToServer(pool, fullpath, subpath, basename, rebalance):
+def _SendFileToServer(pool,
+                      fullpath,
+                      subpath,
+                      basename,
+                      rebalance,
+                      url="/rebalance/copy-file"):
   """Sends a specific data store file to the server."""
   fp = FileCopyWrapper(rebalance, subpath, basename, fullpath)
 
@@ -142,7 +163,7 @@ def _SendFileToServer(pool, fullpath, subpath, basename, rebalance):
     # Content-Length is 0 since we do not know the size of the compressed data.
     # We write the compressed data by blocks.
     headers = {"Content-Length": 0}
-    res = pool.urlopen("POST", "/rebalance/copy-file", headers=headers, body=fp)
+    res = pool.urlopen("POST", url, headers=headers, body=fp)
     if res.status != constants.RESPONSE_OK:
       return False
   except urllib3.exceptions.MaxRetryError:
@@ -173,7 +194,7 @@ def _FileWithRemoveList(database_dir, rebalance):
   return utils.JoinPath(tempdir, constants.REMOVE_FILENAME)
 
 
-def _RecCopyFiles(rebalance, server_id, dspath, subpath, pool_cache,
+def _RecCopyFiles(rebalance, routing, server_id, dspath, subpath, pool_cache,
                   removed_list):
   """Recursively send files for moving to the required data server."""
   fulldir = utils.JoinPath(dspath, subpath)
@@ -186,7 +207,7 @@ def _RecCopyFiles(rebalance, server_id, dspath, subpath, pool_cache,
     if name in COPY_EXCEPTIONS:
       continue
     if os.path.isdir(path):
-      result = _RecCopyFiles(rebalance, server_id, dspath,
+      result = _RecCopyFiles(rebalance, routing, server_id, dspath,
                              utils.JoinPath(subpath, comp), pool_cache,
                              removed_list)
       if not result:
@@ -195,7 +216,7 @@ def _RecCopyFiles(rebalance, server_id, dspath, subpath, pool_cache,
     if not os.path.isfile(path):
       continue
     key = common.MakeDestinationKey(subpath, name)
-    where = sutils.MapKeyToServer(mapping, key)
+    where = routing.MapKey(key)
     if where != server_id:
       server = mapping.servers[where]
       addr = server.address
@@ -224,7 +245,9 @@ def CopyFiles(rebalance, server_id):
     return True
   pool_cache = {}
   removed_list = []
-  ok = _RecCopyFiles(rebalance, server_id, loc, "", pool_cache, removed_list)
+  routing = sutils.ServerRoutingTable(rebalance.mapping)
+  ok = _RecCopyFiles(rebalance, routing, server_id, loc, "", pool_cache,
+                     removed_list)
   if not ok:
     return False
   # Write list of removed files to temporary directory
@@ -242,6 +265,39 @@ def SaveTemporaryFile(fp):
     return False
   if not os.path.isdir(loc):
     return False
+  return _ReceiveFile(fp, loc) is not None
+
+
+def InstallFile(fp, loc):
+  """Stores an incoming database file directly in the data store directory."""
+  if not os.path.isdir(loc):
+    return False
+  received = _ReceiveFile(fp, loc)
+  if not received:
+    return False
+  filecopy, filepath = received
+  filedir = utils.JoinPath(loc, filecopy.directory)
+  try:
+    os.makedirs(filedir)
+  except OSError:
+    pass
+  newpath = utils.JoinPath(filedir, filecopy.filename)
+  logging.info("Installing file %s", newpath)
+  os.rename(filepath, newpath)
+  return True
+
+
+def _ReceiveFile(fp, loc):
+  """Stores an incoming database file in the transaction directory.
+
+  Args:
+    fp: File-like object to read the file copy stream from.
+    loc: Location of the data store.
+
+  Returns:
+    A (DataServerFileCopy, path of the stored file) tuple or None if the file
+    could not be received.
+  """
   # Read DataServerFileCopy object.
   filecopy_len_str = fp.read(sutils.SIZE_PACKER.size)
   filecopy_len = sutils.SIZE_PACKER.unpack(filecopy_len_str)[0]
@@ -279,8 +335,8 @@ def SaveTemporaryFile(fp):
       wp.write(remaining)
   if os.path.getsize(filepath) != filecopy.size:
     logging.error("Size of file %s is not %d", filepath, filecopy.size)
-    return False
-  return True
+    return None
+  return filecopy, filepath
 
 
 def _RecMoveFiles(tempdir, dspath, subpath):
@@ -408,3 +464,599 @@ def RemoveDirectory(rebalance):
       shutil.rmtree(tempdir)
   except OSError:
     pass
+
+
+def _RecMovingFiles(routing, server_id, dspath, subpath):
+  """Recursively yields the database files which move to other servers.
+
+  Args:
+    routing: ServerRoutingTable of the new mapping.
+    server_id: Index of this data server.
+    dspath: Location of the data store.
+    subpath: Directory to look into, relative to dspath.
+
+  Yields:
+    (subpath, key, paths) tuples, where paths are all the files belonging to
+    the database with the given key.
+  """
+  fulldir = utils.JoinPath(dspath, subpath)
+  databases = {}
+  for comp in sorted(os.listdir(fulldir)):
+    if comp == constants.REBALANCE_DIRECTORY:
+      continue
+    path = utils.JoinPath(fulldir, comp)
+    name, unused_extension = os.path.splitext(comp)
+    if name in COPY_EXCEPTIONS:
+      continue
+    if os.path.isdir(path):
+      for moving in _RecMovingFiles(routing, server_id, dspath,
+                                    utils.JoinPath(subpath, comp)):
+        yield moving
+    elif os.path.isfile(path):
+      databases.setdefault(name, []).append(path)
+
+  for name, paths in sorted(databases.iteritems()):
+    key = common.MakeDestinationKey(subpath, name)
+    if routing.MapKey(key) != server_id:
+      yield subpath, key, paths
+
+
+def _SnapshotDatabase(path, snapshot_path):
+  """Writes a consistent copy of a SQLite database to snapshot_path.
+
+  The data server keeps its databases in WAL mode, so the read transaction
+  the copy is made in does not block the writers of the database.
+
+  Args:
+    path: Path of the database.
+    snapshot_path: Path of the copy, which must not exist yet.
+  """
+  conn = sqlite3.connect(snapshot_path, isolation_level=None)
+  try:
+    conn.text_factory = str
+    conn.execute("ATTACH DATABASE ? AS source", (path,))
+    page_size, = conn.execute("PRAGMA source.page_size").fetchone()
+    conn.execute("PRAGMA main.page_size = %d" % page_size)
+    conn.execute("BEGIN")
+    # Tables are created before their indexes.
+    schema = conn.execute("SELECT type, name, sql FROM source.sqlite_master "
+                          "WHERE sql IS NOT NULL ORDER BY type DESC").fetchall()
+    for table_type, name, sql in schema:
+      conn.execute(sql)
+      if table_type == "table":
+        conn.execute("INSERT INTO main.\"%s\" SELECT * FROM source.\"%s\"" %
+                     (name, name))
+    conn.execute("COMMIT")
+    conn.execute("DETACH DATABASE source")
+  finally:
+    conn.close()
+
+
+def _IdempotentRecord(serialized):
+  """Returns serialized commands which can be applied more than once.
+
+  Values added without replacing the previous versions of an attribute would
+  be stored twice if the command is applied again, so the versions they add
+  are deleted first.
+
+  Args:
+    serialized: A serialized DataStoreCommand.
+
+  Returns:
+    A list of serialized DataStoreCommands.
+  """
+  cmd = rdf_data_server.DataStoreCommand.FromSerializedString(serialized)
+  if cmd.command != rdf_data_server.DataStoreCommand.Command.MULTI_SET:
+    return [serialized]
+
+  records = []
+  request = cmd.request
+  for value in request.values:
+    if value.option == rdf_data_store.DataStoreValue.Option.REPLACE:
+      continue
+    if value.HasField("timestamp"):
+      timestamp = value.timestamp.start
+    else:
+      timestamp = request.timestamp.start
+    delete = rdf_data_server.DataStoreCommand(
+        command=rdf_data_server.DataStoreCommand.Command.DELETE_ATTRIBUTES,
+        request=rdf_data_store.DataStoreRequest(
+            subject=[request.subject[0]],
+            token=request.token,
+            timestamp=rdf_data_store.TimestampSpec(
+                start=timestamp,
+                end=timestamp,
+                type=rdf_data_store.TimestampSpec.Type.RANGED_TIME)))
+    delete.request.values.Append(attribute=value.attribute)
+    records.append(delete.SerializeToString())
+
+  records.append(serialized)
+  return records
+
+
+def LoadMigration(loc):
+  """Returns the online migration interrupted on this data server, if any."""
+  rebdir = utils.JoinPath(loc, constants.REBALANCE_DIRECTORY)
+  if not os.path.isdir(rebdir):
+    return None
+  for dirname in sorted(os.listdir(rebdir)):
+    path = utils.JoinPath(rebdir, dirname, constants.MIGRATION_FILENAME)
+    if os.path.isfile(path):
+      with open(path, "rb") as fp:
+        return rdf_data_server.DataServerRebalance.FromSerializedString(
+            fp.read())
+  return None
+
+
+class RangeMigration(object):
+  """Moves the ranges leaving a data server while it keeps serving requests.
+
+  Writes to subjects that move are applied locally and appended to a delta
+  log. In the background, snapshots of the database files that move are
+  copied to their new data servers one at a time and the delta log is
+  replayed there. Once the master flips the ownership of the ranges, requests
+  still arriving for the moved subjects are forwarded to their new data
+  servers.
+
+  The copied files, the delta log and the replayed position are stored in the
+  transaction directory, so an interrupted migration resumes where it stopped.
+  """
+
+  # The database files are being copied.
+  COPYING = 0
+  # Everything was copied, logged writes are replayed periodically.
+  CAUGHT_UP = 1
+  # Writes to moving subjects wait while the master flips the ownership.
+  FROZEN = 2
+  # The ranges have moved, writes to them go to their new data servers.
+  FORWARDING = 3
+  # The migration was replaced by another one, writes are applied locally.
+  ABANDONED = 4
+
+  WRITE_COMMANDS = frozenset([
+      rdf_data_server.DataStoreCommand.Command.MULTI_SET,
+      rdf_data_server.DataStoreCommand.Command.DELETE_ATTRIBUTES,
+      rdf_data_server.DataStoreCommand.Command.DELETE_SUBJECT
+  ])
+
+  # Maximum number of logged writes sent in a single replay request.
+  REPLAY_BATCH_SIZE = 1000
+
+  def __init__(self, rebalance, server_id, service):
+    self.rebalance = rebalance
+    self.server_id = server_id
+    self.service = service
+    self.location = service.GetLocation()
+    self.routing = sutils.ServerRoutingTable(rebalance.mapping)
+    self.path_regexes = [re.compile(x) for x in service.pathing]
+
+    # Guards the state and the delta log. Writes to moving subjects are
+    # applied while holding it, so the log has the order they were applied in.
+    self.condition = threading.Condition()
+    self.replay_lock = threading.Lock()
+    self.state = self.COPYING
+    # Keys of the databases whose logged writes are sent after their copy.
+    # Writes to them wait, so none is logged after the ones being sent.
+    self.catching_up = set()
+    self.bytes_left = 0
+    self.pools = {}
+    self.thread = None
+
+    self.state_dir = _CreateDirectory(self.location, rebalance.id)
+    with open(self._StatePath(constants.MIGRATION_FILENAME), "wb") as fp:
+      fp.write(rebalance.SerializeToString())
+
+    # Maps the keys of the copied databases to the size of the delta log at
+    # the time they were copied. Earlier writes are part of the copies.
+    self.copied = {}
+    copied_path = self._StatePath(constants.MIGRATION_COPIED_FILENAME)
+    if os.path.exists(copied_path):
+      with open(copied_path, "rb") as fp:
+        for line in fp:
+          offset, key = line.rstrip("\n").split(" ", 1)
+          self.copied[key] = int(offset)
+    self.copied_fp = open(copied_path, "ab")
+
+    self.replayed = 0
+    replayed_path = self._StatePath(constants.MIGRATION_REPLAYED_FILENAME)
+    if os.path.exists(replayed_path):
+      with open(replayed_path, "rb") as fp:
+        self.replayed = int(fp.read() or 0)
+
+    self.delta_fp = open(self._StatePath(constants.MIGRATION_DELTA_FILENAME),
+                         "ab")
+    self.delta_fp.seek(0, os.SEEK_END)
+
+  def _StatePath(self, filename):
+    return utils.JoinPath(self.state_dir, filename)
+
+  def _SubjectKey(self, subject):
+    filename, directory = common.ResolveSubjectDestination(
+        subject, self.path_regexes)
+    return common.MakeDestinationKey(directory, filename)
+
+  def _GetPool(self, server_id):
+    try:
+      return self.pools[server_id]
+    except KeyError:
+      server = self.rebalance.mapping.servers[server_id]
+      pool = urllib3.connectionpool.HTTPConnectionPool(
+          server.address, port=server.port)
+      self.pools[server_id] = pool
+      return pool
+
+  def Start(self):
+    """Starts copying and replaying in the background."""
+    bytes_left = 0
+    for _, key, paths in _RecMovingFiles(self.routing, self.server_id,
+                                         self.location, ""):
+      if key not in self.copied:
+        bytes_left += sum(os.path.getsize(path) for path in paths)
+    self.bytes_left = bytes_left
+
+    self.thread = utils.InterruptableThread(
+        name="DataServer range migration",
+        target=self._Iterate,
+        sleep_time=config.CONFIG["Dataserver.migration_replay_frequency"])
+    self.thread.start()
+
+  def Stop(self):
+    if self.thread:
+      self.thread.Stop()
+
+  def Abandon(self):
+    """Stops the migration and drops its state."""
+    self.Stop()
+    with self.condition:
+      self.copied_fp.close()
+      self.delta_fp.close()
+      self._RemoveState()
+      self.state = self.ABANDONED
+      self.condition.notify_all()
+
+  def _RemoveState(self):
+    try:
+      if self.state_dir.startswith(self.location):
+        shutil.rmtree(self.state_dir)
+    except OSError:
+      pass
+
+  def _Iterate(self):
+    """A step of the background thread."""
+    if self.state == self.COPYING:
+      if self._CopyFiles():
+        with self.condition:
+          if self.state == self.COPYING:
+            self.state = self.CAUGHT_UP
+    if self.state == self.CAUGHT_UP:
+      self.Replay()
+
+  def _CopyFiles(self):
+    """Copies the moving databases which were not copied yet."""
+    for subpath, key, paths in _RecMovingFiles(self.routing, self.server_id,
+                                               self.location, ""):
+      if key in self.copied:
+        continue
+      if self.thread and self.thread.exit:
+        return False
+      if not self._CopyDatabase(subpath, key, paths):
+        return False
+    return True
+
+  def _CopyDatabase(self, subpath, key, paths):
+    """Copies a database to its new data server while it is written to.
+
+    The database is copied from a snapshot, so writes go on during the copy.
+    The writes logged since the snapshot was started may or may not be part
+    of it. They are replayed on the new data server in a way that can be
+    applied twice, while only writes to this database wait.
+
+    Args:
+      subpath: Directory of the database, relative to the data store.
+      key: Key of the database.
+      paths: The files of the database.
+
+    Returns:
+      True if the database was copied.
+    """
+    server_id = self.routing.MapKey(key)
+    pool = self._GetPool(server_id)
+    started = time.time()
+    size = 0
+    with self.condition:
+      start = self.delta_fp.tell()
+
+    for path in paths:
+      if not path.endswith(sqlite_data_store.SQLITE_EXTENSION):
+        # The write-ahead log is part of the snapshot.
+        continue
+      fd, snapshot_path = tempfile.mkstemp(dir=self.state_dir)
+      os.close(fd)
+      os.unlink(snapshot_path)
+      try:
+        try:
+          _SnapshotDatabase(path, snapshot_path)
+        except sqlite3.Error as e:
+          logging.warning("Could not snapshot %s: %s", path, e)
+          return False
+        if not _SendFileToServer(
+            pool,
+            snapshot_path,
+            subpath,
+            os.path.basename(path),
+            self.rebalance,
+            url="/rebalance/migrate/copy-file"):
+          return False
+        size += os.path.getsize(snapshot_path)
+      finally:
+        if os.path.exists(snapshot_path):
+          os.unlink(snapshot_path)
+
+    with self.condition:
+      end = self.delta_fp.tell()
+      self.catching_up.add(key)
+
+    copied = False
+    try:
+      records = []
+      for _, serialized in self._ReadDelta(start, end):
+        cmd = rdf_data_server.DataStoreCommand.FromSerializedString(
+            serialized)
+        if self._SubjectKey(cmd.request.subject[0]) == key:
+          records.extend(_IdempotentRecord(serialized))
+      for batch in utils.Grouper(records, self.REPLAY_BATCH_SIZE):
+        if not self._SendRecords(server_id, batch):
+          return False
+      copied = True
+    finally:
+      with self.condition:
+        if copied and self.state != self.ABANDONED:
+          self.copied_fp.write("%d %s\n" % (end, key))
+          self.copied_fp.flush()
+          self.copied[key] = end
+          self.bytes_left = max(self.bytes_left - size, 0)
+        self.catching_up.discard(key)
+        self.condition.notify_all()
+
+    self._Throttle(size, time.time() - started)
+    return True
+
+  def _ReadDelta(self, start, end):
+    """Yields the (offset, serialized command) records logged in a range."""
+    with open(self._StatePath(constants.MIGRATION_DELTA_FILENAME), "rb") as fp:
+      fp.seek(start)
+      offset = start
+      while offset < end:
+        size = sutils.SIZE_PACKER.unpack(fp.read(sutils.SIZE_PACKER.size))[0]
+        yield offset, fp.read(size)
+        offset += sutils.SIZE_PACKER.size + size
+
+  def _Throttle(self, size, elapsed):
+    bandwidth = config.CONFIG["Dataserver.migration_bandwidth"]
+    if bandwidth:
+      delay = float(size) / bandwidth - elapsed
+      if delay > 0:
+        time.sleep(delay)
+
+  def ApplyWrite(self, cmd, method):
+    """Applies a write command, logging or forwarding it if its subject moves.
+
+    Args:
+      cmd: The DataStoreCommand.
+      method: Service method applying the command's request locally.
+
+    Returns:
+      The serialized DataStoreResponse.
+    """
+    key = self._SubjectKey(cmd.request.subject[0])
+    server_id = self.routing.MapKey(key)
+    if server_id == self.server_id:
+      return method(cmd.request)
+
+    with self.condition:
+      while self.state == self.FROZEN or (self.state == self.COPYING and
+                                          key in self.catching_up):
+        self.condition.wait()
+
+      if self.state == self.ABANDONED:
+        return method(cmd.request)
+
+      if self.state == self.FORWARDING:
+        response = rdf_data_store.DataStoreResponse(
+            status=rdf_data_store.DataStoreResponse.Status.OK)
+        if not self._SendRecords(server_id, [cmd.SerializeToString()]):
+          response.status = (
+              rdf_data_store.DataStoreResponse.Status.DATA_STORE_ERROR)
+          response.status_desc = "Could not forward write to moved subject."
+        return response.SerializeToString()
+
+      response = method(cmd.request)
+      serialized = cmd.SerializeToString()
+      self.delta_fp.write(sutils.SIZE_PACKER.pack(len(serialized)))
+      self.delta_fp.write(serialized)
+      self.delta_fp.flush()
+      return response
+
+  def _MovedSubjects(self, cmd):
+    """Groups the subjects of a command by the data server they moved to.
+
+    Args:
+      cmd: The DataStoreCommand.
+
+    Returns:
+      A dict mapping server ids to lists of subjects, or None if all the
+      subjects stayed on this data server.
+    """
+    if cmd.command == rdf_data_server.DataStoreCommand.Command.SCAN_ATTRIBUTES:
+      # Prefix scans are sent to all the data servers anyway.
+      return None
+    by_server = {}
+    for subject in cmd.request.subject:
+      server_id = self.routing.MapKey(self._SubjectKey(subject))
+      by_server.setdefault(server_id, []).append(subject)
+    if set(by_server) <= set([self.server_id]):
+      return None
+    return by_server
+
+  def ApplyRead(self, cmd, method):
+    """Applies a command which does not write, forwarding moved subjects.
+
+    Once the ranges moved, the databases of moved subjects are gone, so
+    requests from clients which still use the old mapping are answered by
+    the new data servers.
+
+    Args:
+      cmd: The DataStoreCommand.
+      method: Service method applying the command's request locally.
+
+    Returns:
+      The serialized DataStoreResponse.
+    """
+    if self.state != self.FORWARDING:
+      response = method(cmd.request)
+      # The moved databases may have been dropped during the read.
+      if self.state != self.FORWARDING:
+        return response
+
+    by_server = self._MovedSubjects(cmd)
+    if by_server is None:
+      return method(cmd.request)
+
+    response = rdf_data_store.DataStoreResponse(
+        status=rdf_data_store.DataStoreResponse.Status.OK)
+    for server_id, subjects in sorted(by_server.iteritems()):
+      part = cmd.Copy()
+      part.request.subject = subjects
+      if server_id == self.server_id:
+        serialized = method(part.request)
+      else:
+        serialized = self._ForwardCommand(server_id, part)
+      if serialized is None:
+        response.status = (
+            rdf_data_store.DataStoreResponse.Status.DATA_STORE_ERROR)
+        response.status_desc = "Could not forward request for moved subject."
+        return response.SerializeToString()
+
+      part_response = rdf_data_store.DataStoreResponse.FromSerializedString(
+          serialized)
+      if part_response.status != rdf_data_store.DataStoreResponse.Status.OK:
+        return serialized
+      response.results.Extend(part_response.results)
+
+    return response.SerializeToString()
+
+  def _ForwardCommand(self, server_id, cmd):
+    """Applies a command on another data server and returns its response."""
+    body = cmd.SerializeToString()
+    headers = {"Content-Length": len(body)}
+    try:
+      res = self._GetPool(server_id).urlopen(
+          "POST", "/rebalance/migrate/forward", headers=headers, body=body)
+    except urllib3.exceptions.MaxRetryError:
+      logging.warning("Failed to forward request to server %d", server_id)
+      return None
+    if res.status != constants.RESPONSE_OK:
+      return None
+    return res.data
+
+  def Replay(self):
+    """Sends the logged writes which were not replayed yet to their servers."""
+    with self.replay_lock:
+      with self.condition:
+        end = self.delta_fp.tell()
+      if end <= self.replayed:
+        return True
+
+      records = {}
+      for offset, serialized in self._ReadDelta(self.replayed, end):
+        cmd = rdf_data_server.DataStoreCommand.FromSerializedString(serialized)
+        key = self._SubjectKey(cmd.request.subject[0])
+        # Writes logged before their database was copied were replayed with
+        # the copy. The others may have been sent by a replay that failed
+        # later on, so they are sent in a way that can be applied twice.
+        if self.copied.get(key, 0) <= offset:
+          records.setdefault(self.routing.MapKey(key),
+                             []).extend(_IdempotentRecord(serialized))
+
+      for server_id, server_records in records.iteritems():
+        for batch in utils.Grouper(server_records, self.REPLAY_BATCH_SIZE):
+          if not self._SendRecords(server_id, batch):
+            return False
+
+      self.replayed = end
+      replayed_path = self._StatePath(constants.MIGRATION_REPLAYED_FILENAME)
+      with open(replayed_path, "wb") as fp:
+        fp.write(str(end))
+      return True
+
+  def _SendRecords(self, server_id, records):
+    """Sends serialized write commands to be applied by another server."""
+    body = "".join(
+        sutils.SIZE_PACKER.pack(len(record)) + record for record in records)
+    headers = {"Content-Length": len(body)}
+    try:
+      res = self._GetPool(server_id).urlopen(
+          "POST", "/rebalance/migrate/replay", headers=headers, body=body)
+    except urllib3.exceptions.MaxRetryError:
+      logging.warning("Failed to replay writes on server %d", server_id)
+      return False
+    return res.status == constants.RESPONSE_OK
+
+  def IsForwardingFor(self, mapping):
+    """Checks if writes are still forwarded under the given mapping."""
+    if self.state != self.FORWARDING:
+      return False
+    servers = list(mapping.servers)
+    moved = list(self.rebalance.mapping.servers)
+    if len(servers) != len(moved):
+      return False
+    for server, moved_server in zip(servers, moved):
+      if (server.address != moved_server.address or
+          server.port != moved_server.port or
+          server.interval.start != moved_server.interval.start or
+          server.interval.end != moved_server.interval.end):
+        return False
+    return True
+
+  def Progress(self):
+    """Returns the number of bytes which still need to be copied."""
+    return self.bytes_left
+
+  def Freeze(self):
+    """Stops writes to moving subjects and replays all the logged writes."""
+    with self.condition:
+      if self.state == self.FORWARDING:
+        return True
+      if self.state != self.CAUGHT_UP:
+        return False
+      self.state = self.FROZEN
+
+    if not self.Replay():
+      self.Thaw()
+      return False
+    return True
+
+  def Thaw(self):
+    """Lets writes to moving subjects through again after a failed flip."""
+    with self.condition:
+      if self.state == self.FROZEN:
+        self.state = self.CAUGHT_UP
+        self.condition.notify_all()
+
+  def Finish(self):
+    """Drops the moved databases once their ranges belong to other servers."""
+    self.Stop()
+    with self.condition:
+      if self.state in (self.FORWARDING, self.ABANDONED):
+        return
+      for _, _, paths in _RecMovingFiles(self.routing, self.server_id,
+                                         self.location, ""):
+        for path in paths:
+          logging.info("Removing moved file %s", path)
+          os.unlink(path)
+
+      self.copied_fp.close()
+      self.delta_fp.close()
+      self._RemoveState()
+      self.state = self.FORWARDING
+      self.condition.notify_all()
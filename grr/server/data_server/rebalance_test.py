@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+"""Tests for online range migration between data servers."""
+
+
+import os
+import socket
+import threading
+import time
+
+
+import ipaddr
+import portpicker
+from requests.packages import urllib3
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.lib.rdfvalues import data_server as rdf_data_server
+from grr.lib.rdfvalues import data_store as rdf_data_store
+from grr.server.data_server import constants
+from grr.server.data_server import data_server
+from grr.server.data_server import rebalance
+from grr.server.data_server import store
+from grr.server.data_stores import http_data_store
+from grr.server.data_stores import http_data_store_test
+from grr.server.data_stores import sqlite_data_store
+from grr.test_lib import test_lib
+
+SUBJECT = "aff4:/C.1000000000000000/fs/os/foo"
+
+
+class RangeMigrationTest(test_lib.GRRBaseTest):
+  """Tests the migration of the ranges leaving a data server."""
+
+  def setUp(self):
+    super(RangeMigrationTest, self).setUp()
+    self.db = sqlite_data_store.SqliteDataStore(
+        os.path.join(self.temp_dir, "db"))
+    self.service = store.DataStoreService(self.db)
+    self.db.MultiSet(SUBJECT, {"aff4:value": ["copied"]}, token=self.token)
+
+    # Server 0 gives up its whole range to server 1.
+    servers = [
+        rdf_data_server.DataServerInformation(
+            index=0,
+            address="localhost",
+            port=7000,
+            interval=rdf_data_server.DataServerInterval(start=0, end=0)),
+        rdf_data_server.DataServerInformation(
+            index=1,
+            address="localhost",
+            port=7001,
+            interval=rdf_data_server.DataServerInterval(
+                start=0, end=constants.MAX_RANGE))
+    ]
+    self.mapping = rdf_data_server.DataServerMapping(
+        version=1, num_servers=2, servers=servers)
+    self.rebalance = rdf_data_server.DataServerRebalance(
+        id="1234", mapping=self.mapping)
+
+    self.applied = []
+    self.copied_files = []
+    self.replayed = []
+
+    def SendFile(unused_pool, unused_path, subpath, filename, unused_rebalance,
+                 url=None):
+      _ = url
+      self.copied_files.append(utils.JoinPath(subpath, filename))
+      return True
+
+    def SendRecords(unused_migration, server_id, records):
+      subjects = [
+          rdf_data_server.DataStoreCommand.FromSerializedString(record)
+          .request.subject[0] for record in records
+      ]
+      self.replayed.append((server_id, subjects))
+      return True
+
+    self.file_stubber = utils.Stubber(rebalance, "_SendFileToServer", SendFile)
+    self.file_stubber.Start()
+    self.records_stubber = utils.Stubber(rebalance.RangeMigration,
+                                         "_SendRecords", SendRecords)
+    self.records_stubber.Start()
+
+  def tearDown(self):
+    self.records_stubber.Stop()
+    self.file_stubber.Stop()
+    super(RangeMigrationTest, self).tearDown()
+
+  def _Apply(self, request):
+    self.applied.append(request.subject[0])
+    return "applied"
+
+  def _Write(self, migration, subject):
+    cmd = rdf_data_server.DataStoreCommand(
+        command=rdf_data_server.DataStoreCommand.Command.DELETE_SUBJECT,
+        request=rdf_data_store.DataStoreRequest(subject=[subject]))
+    return migration.ApplyWrite(cmd, self._Apply)
+
+  def testWritesInTheCopyAreNotReplayed(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    self._Write(migration, SUBJECT + "/before")
+    migration._Iterate()
+
+    self.assertTrue(self.copied_files)
+    self.assertEqual(migration.state, migration.CAUGHT_UP)
+    self.assertEqual(migration.Progress(), 0)
+    # The write happened before the copy, so it is part of it.
+    self.assertEqual(self.replayed, [])
+
+    self._Write(migration, SUBJECT + "/after")
+    self.assertTrue(migration.Replay())
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/after"])])
+    self.assertEqual(self.applied, [SUBJECT + "/before", SUBJECT + "/after"])
+
+  def testWritesDuringTheCopyAreReplayedWithIt(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+
+    def WriteDuringCopy(*unused_args, **unused_kwargs):
+      # Writes are not blocked while the database is sent.
+      self._Write(migration, SUBJECT + "/during")
+      return True
+
+    with utils.Stubber(rebalance, "_SendFileToServer", WriteDuringCopy):
+      migration._Iterate()
+
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/during"])])
+    self.assertTrue(migration.Replay())
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/during"])])
+
+  def _MultiSet(self, migration, value, timestamp):
+    request = rdf_data_store.DataStoreRequest(subject=[SUBJECT])
+    new_value = request.values.Append(
+        attribute="aff4:value",
+        option=rdf_data_store.DataStoreValue.Option.DEFAULT,
+        timestamp=rdf_data_store.TimestampSpec(
+            start=timestamp,
+            type=rdf_data_store.TimestampSpec.Type.SPECIFIC_TIME))
+    new_value.value.SetValue(value)
+    cmd = rdf_data_server.DataStoreCommand(
+        command=rdf_data_server.DataStoreCommand.Command.MULTI_SET,
+        request=request)
+    return migration.ApplyWrite(cmd, self._Apply)
+
+  def testFailedReplayIsAppliedOnceWhenRetried(self):
+    target_db = sqlite_data_store.SqliteDataStore(
+        os.path.join(self.temp_dir, "target"))
+    target = store.DataStoreService(target_db)
+    methods = {
+        rdf_data_server.DataStoreCommand.Command.MULTI_SET: target.MultiSet,
+        rdf_data_server.DataStoreCommand.Command.DELETE_ATTRIBUTES:
+            target.DeleteAttributes
+    }
+    sent = []
+
+    def ApplyRecords(unused_migration, unused_server_id, records):
+      # The second batch fails the first time it is sent.
+      sent.append(records)
+      if len(sent) == 2:
+        return False
+      for record in records:
+        cmd = rdf_data_server.DataStoreCommand.FromSerializedString(record)
+        methods[cmd.command](cmd.request)
+      return True
+
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    migration._Iterate()
+    self._MultiSet(migration, "first", 1000)
+    self._MultiSet(migration, "second", 2000)
+
+    # A logged write is sent as the deletion of its version and the write.
+    with utils.MultiStubber(
+        (rebalance.RangeMigration, "_SendRecords", ApplyRecords),
+        (rebalance.RangeMigration, "REPLAY_BATCH_SIZE", 2)):
+      self.assertFalse(migration.Replay())
+      self.assertTrue(migration.Replay())
+
+    self.assertEqual(len(sent), 4)
+    self.assertEqual(
+        sorted((value, timestamp)
+               for _, value, timestamp in target_db.ResolvePrefix(
+                   SUBJECT,
+                   "aff4:value",
+                   timestamp=target_db.ALL_TIMESTAMPS,
+                   token=self.token)), [("first", 1000), ("second", 2000)])
+
+  def testOnlyWritesToTheCaughtUpDatabaseWait(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    other_subject = "aff4:/C.2000000000000000/fs/os/foo"
+    self.db.MultiSet(other_subject, {"aff4:value": ["copied"]},
+                     token=self.token)
+    self.assertNotEqual(
+        migration._SubjectKey(SUBJECT), migration._SubjectKey(other_subject))
+
+    def WriteDuringCopy(*unused_args, **unused_kwargs):
+      self._Write(migration, SUBJECT + "/during")
+      self._Write(migration, other_subject + "/during")
+      return True
+
+    writers = []
+
+    def WriteDuringCatchUp(unused_migration, unused_server_id, unused_records):
+      for subject in (SUBJECT + "/waiting", other_subject + "/waiting"):
+        writer = threading.Thread(
+            target=self._Write, args=(migration, subject))
+        writer.start()
+        writers.append(writer)
+      for writer in writers:
+        writer.join(0.5)
+      # Writes to the database being caught up wait, others go on.
+      self.assertEqual([writer.is_alive() for writer in writers],
+                       [True, False])
+      return True
+
+    databases = dict((key, (subpath, key, paths))
+                     for subpath, key, paths in rebalance._RecMovingFiles(
+                         migration.routing, 0, migration.location, ""))
+    with utils.MultiStubber(
+        (rebalance, "_SendFileToServer", WriteDuringCopy),
+        (rebalance.RangeMigration, "_SendRecords", WriteDuringCatchUp)):
+      self.assertTrue(
+          migration._CopyDatabase(*databases[migration._SubjectKey(SUBJECT)]))
+
+    writers[0].join()
+    self.assertIn(SUBJECT + "/waiting", self.applied)
+
+  def testMigrationResumesFromItsState(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    migration._Iterate()
+    self._Write(migration, SUBJECT + "/replayed")
+    self.assertTrue(migration.Replay())
+    self._Write(migration, SUBJECT + "/pending")
+    migration.Stop()
+
+    # The data server restarts.
+    self.copied_files = []
+    self.replayed = []
+    reb = rebalance.LoadMigration(self.service.GetLocation())
+    self.assertEqual(reb.id, self.rebalance.id)
+    migration = rebalance.RangeMigration(reb, 0, self.service)
+    migration._Iterate()
+
+    # Nothing is copied twice and only the pending write is replayed.
+    self.assertEqual(self.copied_files, [])
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/pending"])])
+
+  def testFreezeAndFinish(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    # Nothing was copied yet.
+    self.assertFalse(migration.Freeze())
+
+    migration._Iterate()
+    self._Write(migration, SUBJECT + "/logged")
+    self.assertTrue(migration.Freeze())
+    self.assertEqual(migration.state, migration.FROZEN)
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/logged"])])
+
+    migration.Thaw()
+    self.assertEqual(migration.state, migration.CAUGHT_UP)
+    self.assertTrue(migration.Freeze())
+
+    location = self.service.GetLocation()
+    migration.Finish()
+    self.assertEqual(migration.state, migration.FORWARDING)
+    self.assertIsNone(rebalance.LoadMigration(location))
+    self.assertTrue(migration.IsForwardingFor(self.mapping))
+
+    # Writes from clients with the old mapping go to the new data server.
+    self.applied = []
+    self.replayed = []
+    self._Write(migration, SUBJECT + "/forwarded")
+    self.assertEqual(self.applied, [])
+    self.assertEqual(self.replayed, [(1, [SUBJECT + "/forwarded"])])
+
+    # The moved database files are gone.
+    for path in self.copied_files:
+      self.assertFalse(os.path.exists(utils.JoinPath(location, path)))
+
+  def testAbandonedMigrationAppliesWritesLocally(self):
+    migration = rebalance.RangeMigration(self.rebalance, 0, self.service)
+    migration.Abandon()
+    self.assertIsNone(rebalance.LoadMigration(self.service.GetLocation()))
+
+    self._Write(migration, SUBJECT + "/local")
+    self.assertEqual(self.applied, [SUBJECT + "/local"])
+    self.assertEqual(self.replayed, [])
+
+
+class MigrationHTTPServer(http_data_store_test.StoppableHTTPServer):
+  """HTTP server of the data servers taking part in a migration."""
+
+  STOP = False
+
+
+class MigrationHandler0(data_server.DataServerHandler):
+  pass
+
+
+class MigrationHandler1(data_server.DataServerHandler):
+  pass
+
+
+class OnlineMigrationTest(test_lib.GRRBaseTest):
+  """Migrates ranges between data servers running on localhost."""
+
+  CLIENTS = 20
+
+  def setUp(self):
+    super(OnlineMigrationTest, self).setUp()
+    self.ports = [portpicker.PickUnusedPort(), portpicker.PickUnusedPort()]
+    local_ip = utils.ResolveHostnameToIP("localhost", 0)
+    if ipaddr.IPAddress(local_ip).version == 6:
+      urn_template = "http://[%s]:%d"
+      address_family = socket.AF_INET6
+    else:
+      urn_template = "http://%s:%d"
+      address_family = socket.AF_INET
+
+    self.config_overrider = test_lib.ConfigOverrider({
+        "Dataserver.server_list": [urn_template % (local_ip, port)
+                                   for port in self.ports],
+        "Dataserver.server_username": "root",
+        "Dataserver.server_password": "root",
+        "Dataserver.client_credentials": ["user:user:rw"],
+        "Dataserver.migration_bandwidth": 0,
+        "Dataserver.migration_replay_frequency": 1,
+        "HTTPDataStore.username": "user",
+        "HTTPDataStore.password": "user",
+        "Datastore.location": self.temp_dir
+    })
+    self.config_overrider.Start()
+
+    self.locations = []
+    threads = []
+    MigrationHTTPServer.STOP = False
+    handlers = [MigrationHandler0, MigrationHandler1]
+    for i, (port, handler) in enumerate(zip(self.ports, handlers)):
+      location = os.path.join(self.temp_dir, "server%d" % i)
+      os.mkdir(location)
+      self.locations.append(location)
+      threads.append(
+          threading.Thread(
+              target=data_server.Start,
+              args=(sqlite_data_store.SqliteDataStore(location), port,
+                    address_family, i == 0, MigrationHTTPServer, handler)))
+    for thread in threads:
+      thread.start()
+
+    self.pool = urllib3.connectionpool.HTTPConnectionPool(
+        "localhost", port=self.ports[0])
+
+  def tearDown(self):
+    MigrationHTTPServer.STOP = True
+    self.config_overrider.Stop()
+    super(OnlineMigrationTest, self).tearDown()
+
+  def _Post(self, url, message):
+    body = message.SerializeToString()
+    return self.pool.urlopen(
+        "POST", url, headers={"Content-Length": len(body)}, body=body)
+
+  def _Subject(self, i):
+    return "aff4:/C.%016X/fs/os/file" % i
+
+  def _Write(self, db, value):
+    for i in xrange(self.CLIENTS):
+      db.MultiSet(
+          self._Subject(i), {"aff4:value": [value]},
+          replace=False,
+          token=self.token)
+
+  def _CheckValues(self, db, values):
+    for i in xrange(self.CLIENTS):
+      stored = db.ResolveMulti(
+          self._Subject(i), ["aff4:value"], token=self.token)
+      self.assertEqual(sorted(value for _, value, _ in stored), values)
+
+  def testWritesAndReadsGoOnDuringMigration(self):
+    stale_db = http_data_store.HTTPDataStore()
+    self._Write(stale_db, "before")
+
+    # Data server 0 gives its whole range to data server 1.
+    mapping = stale_db.inquirer.GetMapping().Copy()
+    mapping.version += 1
+    servers = list(mapping.servers)
+    servers[0].interval = rdf_data_server.DataServerInterval(start=0, end=0)
+    servers[1].interval = rdf_data_server.DataServerInterval(
+        start=0, end=constants.MAX_RANGE)
+    mapping.servers = servers
+
+    res = self._Post("/rebalance/migrate", mapping)
+    self.assertEqual(res.status, constants.RESPONSE_OK)
+    reb = rdf_data_server.DataServerRebalance.FromSerializedString(res.data)
+
+    # Writes go on while the databases are copied.
+    self._Write(stale_db, "during")
+    for _ in xrange(60):
+      res = self._Post("/rebalance/migrate/status", reb)
+      self.assertEqual(res.status, constants.RESPONSE_OK)
+      progress = rdf_data_server.DataServerRebalance.FromSerializedString(
+          res.data)
+      if not any(progress.moving):
+        break
+      time.sleep(1)
+    self._Write(stale_db, "caught up")
+
+    for _ in xrange(60):
+      res = self._Post("/rebalance/migrate/commit", reb)
+      if res.status != constants.RESPONSE_MIGRATION_NOT_READY:
+        break
+      time.sleep(1)
+    self.assertEqual(res.status, constants.RESPONSE_OK)
+
+    # Clients which still use the old mapping are forwarded.
+    self._Write(stale_db, "forwarded")
+    values = ["before", "caught up", "during", "forwarded"]
+    self._CheckValues(stale_db, values)
+
+    db = http_data_store.HTTPDataStore()
+    self._CheckValues(db, values)
+
+    # Data server 0 dropped the moved databases.
+    for path, _, files in os.walk(self.locations[0]):
+      if constants.REBALANCE_DIRECTORY in path:
+        continue
+      self.assertFalse([
+          f for f in files
+          if f.startswith("C.") and f.endswith(
+              sqlite_data_store.SQLITE_EXTENSION)
+      ])
+
+
+def main(args):
+  test_lib.main(args)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
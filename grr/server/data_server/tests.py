@@ -4,4 +4,5 @@
 # These need to register plugins so, pylint: disable=unused-import
 from grr.server.data_server import auth_test
 from grr.server.data_server import master_test
+from grr.server.data_server import rebalance_test
 # pylint: enable=unused-import
@@ -2,7 +2,9 @@
 """Data server utilities."""
 
 
+import bisect
 import hashlib
+import re
 import struct
 
 from grr.lib.rdfvalues import data_server as rdf_data_server
@@ -24,32 +26,53 @@ def CreateStartInterval(index, total):
   return ret
 
 
+class ServerRoutingTable(object):
+  """An immutable snapshot of a data server mapping used to route keys.
+
+  The table is never modified after construction, so it can be shared between
+  threads without locking. A new table has to be built when the mapping
+  changes.
+  """
+
+  def __init__(self, mapping):
+    servers = sorted(mapping.servers, key=lambda server: server.interval.start)
+    self.starts = tuple(server.interval.start for server in servers)
+    self.indexes = tuple(server.index for server in servers)
+    self.path_regexes = tuple(re.compile(x) for x in mapping.pathing)
+
+  def FindServer(self, hashed):
+    """Find the data server id given an hashed subject."""
+    # Intervals are contiguous, so the server is the one with the last start
+    # not greater than the hash.
+    position = bisect.bisect_right(self.starts, hashed) - 1
+    return self.indexes[max(position, 0)]
+
+  def MapKey(self, key):
+    """Takes some key and returns the ID of the server."""
+    return self.FindServer(HashKey(key))
+
+
 def _FindServerInMapping(mapping, hashed):
   """Find the corresponding data server id given an hashed subject."""
-  server_list = list(mapping.servers)
-  val = _BisectHashList(server_list, 0, len(server_list) - 1, hashed).index
-  return val
-
-
-def _BisectHashList(ls, left, right, value):
-  """Select the server that allocates 'value' using a binary search."""
-  if right < left:
-    return None
-  if left == right:
-    return ls[left]
-  middle = left + (right - left) / 2
-  middleval = ls[middle]
-  start = middleval.interval.start
-  end = middleval.interval.end
-  if start <= value < end:
-    return middleval
-  if value >= end:
-    return _BisectHashList(ls, middle + 1, right, value)
-  if value < start:
-    return _BisectHashList(ls, left, middle - 1, value)
+  return ServerRoutingTable(mapping).FindServer(hashed)
+
+
+def HashKey(key):
+  """Returns the hash used to map a key to a data server."""
+  return int(hashlib.sha1(key).hexdigest()[:16], 16)
 
 
 def MapKeyToServer(mapping, key):
-  """Takes some key and returns the ID of the server."""
-  hsh = int(hashlib.sha1(key).hexdigest()[:16], 16)
-  return _FindServerInMapping(mapping, hsh)
+  """Takes some key and returns the ID of the server.
+
+  This builds a ServerRoutingTable for a single lookup. Callers mapping many
+  keys should build the table once and use its MapKey() method.
+
+  Args:
+    mapping: The DataServerMapping.
+    key: The key to map.
+
+  Returns:
+    The index of the data server.
+  """
+  return _FindServerInMapping(mapping, HashKey(key))
@@ -52,6 +52,7 @@ from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.server import access_control
 from grr.server import blob_store
+from grr.server import posting_list
 
 flags.DEFINE_bool("list_storage", False, "List all storage subsystems present.")
 
@@ -225,6 +226,21 @@ class MutationPool(object):
         1,
         timestamp=0)
 
+  def AddWellKnownFlowResponses(self, session_id, responses, timestamp=None):
+    """Queues serialized responses for a well known flow.
+
+    Args:
+      session_id: The session id of the well known flow.
+      responses: A list of (response_id, serialized GrrMessage) tuples. The
+          messages have to be addressed to request id 0.
+      timestamp: The timestamp to write the responses at.
+    """
+    self.MultiSet(
+        DB.GetFlowResponseSubject(session_id, 0),
+        dict((DataStore.FLOW_RESPONSE_TEMPLATE % (0, response_id), [serialized])
+             for response_id, serialized in responses),
+        timestamp=timestamp)
+
   def QueueAddItem(self, queue_id, item, timestamp):
     result_subject, timestamp, _ = DataStore.CollectionMakeURN(
         queue_id, timestamp, suffix=None, subpath="Records")
@@ -1106,14 +1122,58 @@ class DataStore(object):
       yield rdf_flows.GrrMessage.FromSerializedString(serialized)
 
   # Index handling.
+  #
+  # Every keyword of an index is stored in a row of its own. New postings are
+  # written to one "kw_index:<name>" column each and are periodically
+  # compacted into a single posting_list.PostingList which is stored in the
+  # _INDEX_POSTING_LIST_ATTRIBUTE column of the row.
 
   _INDEX_PREFIX = "kw_index:"
   _INDEX_PREFIX_LEN = len(_INDEX_PREFIX)
   _INDEX_COLUMN_FORMAT = _INDEX_PREFIX + "%s"
+  _INDEX_POSTING_LIST_ATTRIBUTE = "index:kw_posting_list"
+
+  # Keywords with at least this many uncompacted postings are compacted when
+  # they are read.
+  INDEX_COMPACTION_THRESHOLD = 1000
+  INDEX_COMPACTION_LEASE_TIME = 60
 
   def _KeywordToURN(self, urn, keyword):
     return urn.Add(keyword)
 
+  def _IndexReadPostings(self, keyword_urns, token=None):
+    """Reads compacted and uncompacted postings of keywords.
+
+    Args:
+      keyword_urns: A list of urns of keyword rows.
+      token: A data store token.
+    Returns:
+      A dict mapping each keyword urn to a tuple (compacted, postings), where
+      compacted is a PostingList and postings a list of uncompacted
+      (name, timestamp) tuples sorted by name.
+    """
+    compacted = {}
+    for keyword_urn, values in self.MultiResolvePrefix(
+        keyword_urns, self._INDEX_POSTING_LIST_ATTRIBUTE, token=token):
+      for _, serialized, _ in values:
+        compacted[utils.SmartStr(keyword_urn)] = (
+            posting_list.PostingList.FromSerializedString(serialized))
+
+    postings = {}
+    for keyword_urn, values in self.MultiResolvePrefix(
+        keyword_urns, self._INDEX_PREFIX, token=token):
+      postings[utils.SmartStr(keyword_urn)] = sorted(
+          (utils.SmartStr(column[self._INDEX_PREFIX_LEN:]), ts)
+          for column, _, ts in values)
+
+    result = {}
+    for keyword_urn in keyword_urns:
+      keyword_urn = utils.SmartStr(keyword_urn)
+      result[keyword_urn] = (compacted.get(keyword_urn,
+                                           posting_list.PostingList()),
+                             postings.get(keyword_urn, []))
+    return result
+
   def IndexAddKeywordsForName(self, index_urn, name, keywords, token=None):
     timestamp = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
     with self.GetMutationPool(token=token) as mutation_pool:
@@ -1125,11 +1185,119 @@ class DataStore(object):
             timestamp=timestamp)
 
   def IndexRemoveKeywordsForName(self, index_urn, name, keywords, token=None):
+    column = self._INDEX_COLUMN_FORMAT % name
+    name = utils.SmartStr(name)
+    for keyword in set(keywords):
+      keyword_urn = self._KeywordToURN(index_urn, keyword)
+      # Compactions hold the same lock, so the posting can't be moved into
+      # the compacted list between the delete and the check below.
+      with self.LockRetryWrapper(
+          keyword_urn,
+          lease_time=self.INDEX_COMPACTION_LEASE_TIME,
+          token=token):
+        self.DeleteAttributes(keyword_urn, [column], sync=True, token=token)
+
+        # Compacted posting lists containing the name have to be rewritten.
+        compacted, _ = self._IndexReadPostings(
+            [keyword_urn], token=token)[utils.SmartStr(keyword_urn)]
+        posting = compacted.Cursor().Seek(name)
+        if posting is None or posting[0] != name:
+          continue
+
+        self.Set(
+            keyword_urn,
+            self._INDEX_POSTING_LIST_ATTRIBUTE,
+            posting_list.PostingList.FromEntries(
+                p for p in compacted if p[0] != name).SerializeToString(),
+            token=token)
+
+  def _IndexCompactPostingList(self, keyword_urn, token=None):
+    """Compacts the postings of a single keyword, must be called under lock."""
+    compacted, postings = self._IndexReadPostings(
+        [keyword_urn], token=token)[keyword_urn]
+    if not postings:
+      return
+
+    merged = posting_list.PostingList.FromEntries(
+        posting_list.MergePostings(compacted, postings))
+
+    # The compacted list has to be written before the postings are deleted so
+    # concurrent readers always see all postings. Only the versions which were
+    # compacted are deleted, names added again in the meantime are kept.
+    self.Set(
+        keyword_urn,
+        self._INDEX_POSTING_LIST_ATTRIBUTE,
+        merged.SerializeToString(),
+        token=token)
     with self.GetMutationPool(token=token) as mutation_pool:
-      for keyword in set(keywords):
+      for name, ts in postings:
         mutation_pool.DeleteAttributes(
-            self._KeywordToURN(index_urn, keyword),
-            [self._INDEX_COLUMN_FORMAT % name])
+            keyword_urn, [self._INDEX_COLUMN_FORMAT % name], start=ts, end=ts)
+
+  def IndexCompactPostingLists(self, index_urn, keywords, token=None):
+    """Compacts the postings of keywords into posting lists.
+
+    Args:
+      index_urn: The base urn of the index.
+      keywords: A collection of keywords to compact.
+      token: A data store token.
+    """
+    for keyword in keywords:
+      keyword_urn = self._KeywordToURN(index_urn, keyword)
+      with self.LockRetryWrapper(
+          keyword_urn,
+          lease_time=self.INDEX_COMPACTION_LEASE_TIME,
+          token=token):
+        self._IndexCompactPostingList(keyword_urn, token=token)
+
+  def IndexReadSortedPostingLists(self,
+                                  index_urn,
+                                  keywords,
+                                  start_time,
+                                  end_time,
+                                  token=None):
+    """Reads the posting lists of keywords.
+
+    Keywords with many uncompacted postings are compacted on the way.
+
+    Args:
+      index_urn: The base urn of the index.
+      keywords: A collection of keywords that we are interested in.
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+      token: A data store token.
+    Returns:
+      A dict mapping each keyword to a posting_list.PostingList of
+      (name, timestamp) postings, where timestamp is the time the keyword was
+      last added for name.
+    """
+    keyword_urns = {
+        utils.SmartStr(self._KeywordToURN(index_urn, k)): k for k in keywords
+    }
+
+    result = {}
+    for keyword_urn, (compacted, postings) in self._IndexReadPostings(
+        keyword_urns.keys(), token=token).iteritems():
+      if postings:
+        merged = posting_list.PostingList.FromEntries(
+            posting_list.MergePostings(compacted, postings))
+      else:
+        merged = compacted
+      result[keyword_urns[keyword_urn]] = merged.Filter(start_time, end_time)
+
+      if len(postings) >= self.INDEX_COMPACTION_THRESHOLD:
+        try:
+          with self.LockRetryWrapper(
+              keyword_urn,
+              lease_time=self.INDEX_COMPACTION_LEASE_TIME,
+              blocking=False,
+              token=token):
+            self._IndexCompactPostingList(keyword_urn, token=token)
+        except DBSubjectLockError:
+          # Someone else is already compacting this keyword.
+          pass
+
+    return result
 
   def IndexReadPostingLists(self,
                             index_urn,
@@ -1151,22 +1319,14 @@ class DataStore(object):
     Returns:
       A dict mapping each keyword to a set of relevant names.
     """
-    keyword_urns = {self._KeywordToURN(index_urn, k): k for k in keywords}
     result = {}
-    for kw in keywords:
+    for kw, postings in self.IndexReadSortedPostingLists(
+        index_urn, keywords, start_time, end_time, token=token).iteritems():
       result[kw] = set()
-
-    for keyword_urn, value in self.MultiResolvePrefix(
-        keyword_urns.keys(),
-        self._INDEX_PREFIX,
-        timestamp=(start_time, end_time + 1),
-        token=token):
-      for column, _, ts in value:
-        kw = keyword_urns[keyword_urn]
-        name = column[self._INDEX_PREFIX_LEN:]
+      for name, ts in postings:
         result[kw].add(name)
         if last_seen_map is not None:
-          last_seen_map[(kw, name)] = max(last_seen_map.get((kw, name), -1), ts)
+          last_seen_map[(kw, name)] = ts
 
     return result
 
@@ -1655,7 +1655,9 @@ class _DataStoreTest(test_lib.GRRBaseTest):
         "GetMutationPool",
         "GetNotifications",
         "IndexAddKeywordsForName",
+        "IndexCompactPostingLists",
         "IndexReadPostingLists",
+        "IndexReadSortedPostingLists",
         "IndexRemoveKeywordsForName",
         "MultiDeleteAttributes",
         "MultiDestroyFlowStates",
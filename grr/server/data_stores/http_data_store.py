@@ -4,9 +4,10 @@
 
 import base64
 import binascii
+import collections
 import httplib
+import Queue
 import random
-import re
 import socket
 import threading
 import time
@@ -16,6 +17,7 @@ import logging
 
 from grr import config
 from grr.lib import rdfvalue
+from grr.lib import threadpool
 from grr.lib import utils
 from grr.lib.rdfvalues import data_server as rdf_data_server
 from grr.lib.rdfvalues import data_store as rdf_data_store
@@ -365,6 +367,7 @@ class RemoteInquirer(object):
       self.servers.append(DataServer(loc.hostname, loc.port))
     self.mapping_server = random.choice(self.servers)
     self.mapping = self.mapping_server.LoadMapping()
+    self.routing = sutils.ServerRoutingTable(self.mapping)
 
     if len(self.mapping.servers) != len(server_list):
       logging.warning("There is a mismatch between the data "
@@ -383,15 +386,21 @@ class RemoteInquirer(object):
 
   def MapKey(self, key):
     """Return the data server responsible for a given key."""
-    sid = sutils.MapKeyToServer(self.mapping, key)
+    sid = self.routing.MapKey(key)
     return self.servers[sid]
 
   def GetPathing(self):
     return self.GetMapping().pathing
 
+  def GetRouting(self):
+    return self.routing
+
   def RenewMapping(self):
-    self.mapping = self.mapping_server.LoadMapping()
-    return self.mapping
+    mapping = self.mapping_server.LoadMapping()
+    # Readers pick up either the old or the new routing table, never a mix.
+    self.routing = sutils.ServerRoutingTable(mapping)
+    self.mapping = mapping
+    return mapping
 
   def GetMapping(self):
     return self.mapping
@@ -405,32 +414,47 @@ class RemoteInquirer(object):
       serv.Close()
 
 
-class RemoteMappingCache(utils.FastStore):
-  """A local cache for mappings between paths and data servers."""
+class RemoteMappingCache(object):
+  """A local cache for mappings between subjects and data servers.
+
+  Lookups do not take any lock. The cache is a dictionary tied to the routing
+  table it was filled from: it is replaced as a whole when it grows too large
+  or when the mapping is renewed, so readers never observe a partial update.
+  """
 
   def __init__(self, size):
-    super(RemoteMappingCache, self).__init__(size)
+    self.size = size
     self.inquirer = RemoteInquirer()
-    self.path_regexes = [re.compile(x) for x in self.inquirer.GetPathing()]
+    self._routes = (self.inquirer.GetRouting(), {})
 
-  def KillObject(self, obj):
-    pass
+  @property
+  def path_regexes(self):
+    return self.inquirer.GetRouting().path_regexes
 
   def GetInquirer(self):
     return self.inquirer
 
-  @utils.Synchronized
   def Get(self, subject):
     """This will create the object if needed so should not fail."""
-    filename, directory = common.ResolveSubjectDestination(
-        subject, self.path_regexes)
-    key = common.MakeDestinationKey(directory, filename)
+    cache_key = utils.SmartStr(subject)
+    routing = self.inquirer.GetRouting()
+    cached_routing, routes = self._routes
+    if cached_routing is not routing:
+      routes = {}
+      self._routes = (routing, routes)
+
     try:
-      return super(RemoteMappingCache, self).Get(key)
+      return routes[cache_key]
     except KeyError:
-      data_server = self.inquirer.MapKey(key)
+      filename, directory = common.ResolveSubjectDestination(
+          subject, routing.path_regexes)
+      key = common.MakeDestinationKey(directory, filename)
+      data_server = self.inquirer.servers[routing.MapKey(key)]
 
-      super(RemoteMappingCache, self).Put(key, data_server)
+      if len(routes) >= self.size:
+        routes = {}
+        self._routes = (routing, routes)
+      routes[cache_key] = data_server
 
       return data_server
 
@@ -465,11 +489,20 @@ class HTTPDataStore(data_store.DataStore):
   cache = None
   inquirer = None
 
+  THREAD_POOL_NAME = "HTTPDataStore requests"
+
   def __init__(self):
     super(HTTPDataStore, self).__init__()
-    self.cache = RemoteMappingCache(1000)
+    self.cache = RemoteMappingCache(10000)
     self.inquirer = self.cache.GetInquirer()
     self._ComputeNewSize(self.inquirer.GetMapping(), time.time())
+    # Sends the requests to the other data servers when a call needs several
+    # of them.
+    self.thread_pool = threadpool.ThreadPool.Factory(
+        self.THREAD_POOL_NAME,
+        min_threads=len(self.inquirer.GetMapping().servers),
+        max_threads=config.CONFIG["Threadpool.size"])
+    self.thread_pool.Start()
 
   def GetServer(self, subject):
     return self.cache.Get(subject).GetConnection()
@@ -595,38 +628,114 @@ class HTTPDataStore(data_store.DataStore):
 
     return request
 
+  def _MakeSyncRequestsConcurrently(self, commands):
+    """Sends commands to different data servers and waits for all responses.
+
+    Args:
+      commands: A list of (DataServer, DataStoreCommand) tuples. Every data
+          server must appear at most once.
+
+    Returns:
+      A list with the response to each command, in the order of commands.
+    """
+    responses = [None] * len(commands)
+    errors = []
+    done = Queue.Queue()
+
+    def _Request(i, server, cmd):
+      try:
+        responses[i] = server.GetConnection().SyncAndMakeRequest(cmd)
+      except Exception as e:  # pylint: disable=broad-except
+        errors.append(e)
+      finally:
+        done.put(i)
+
+    # The first command is sent from this thread, the others go to the thread
+    # pool so that all data servers work on their part of the request in
+    # parallel. When the pool is full, the pool runs the task inline instead.
+    for i, (server, cmd) in enumerate(commands[1:], 1):
+      self.thread_pool.AddTask(
+          _Request, (i, server, cmd), name="MultiResolvePrefix")
+
+    if commands:
+      server, cmd = commands[0]
+      _Request(0, server, cmd)
+
+    for _ in commands:
+      done.get()
+
+    if errors:
+      raise errors[0]
+
+    return responses
+
   def MultiResolvePrefix(self,
                          subjects,
                          attribute_prefix,
                          timestamp=None,
                          limit=None,
                          token=None):
-    """MultiResolvePrefix."""
+    """MultiResolvePrefix.
+
+    Subjects are grouped by the data server owning them and every data server
+    receives a single request for all its subjects. The requests are sent
+    concurrently.
+
+    Args:
+      subjects: A list of subjects.
+      attribute_prefix: A string or list of strings prefixing the attributes.
+      timestamp: A range of times for consideration.
+      limit: The total number of values to return over all subjects.
+      token: The security token used in this call.
+
+    Returns:
+      A list of (subject, [(attribute, value, timestamp)]) tuples for the
+      subjects which have values, in the order the subjects were given.
+    """
+    subjects = list(subjects)
+
+    # Every data server gets the subjects it owns in the caller's order.
+    server_subjects = collections.OrderedDict()
+    for subject in subjects:
+      server = self.cache.Get(subject)
+      server_subjects.setdefault(server, []).append(subject)
+
+    # Each data server applies the limit to its subjects in order, so the
+    # values it returns include all of its values that are within the limit
+    # once the results of all data servers are merged.
     typ = rdf_data_server.DataStoreCommand.Command.MULTI_RESOLVE_PREFIX
-    results = {}
+    commands = []
+    for server, batch in server_subjects.iteritems():
+      request = self._MakeRequest(
+          batch, attribute_prefix, timestamp=timestamp, token=token,
+          limit=limit)
+      commands.append(
+          (server, rdf_data_server.DataStoreCommand(
+              command=typ, request=request)))
+
+    subject_values = {}
+    for response in self._MakeSyncRequestsConcurrently(commands):
+      for result_set in response.results:
+        subject_values[utils.SmartStr(result_set.subject)] = [
+            (pred, self._Decode(value), ts)
+            for (pred, value, ts) in result_set.payload
+        ]
+
+    results = []
     remaining_limit = limit
     for subject in subjects:
-      request = self._MakeRequest(
-          [subject],
-          attribute_prefix,
-          timestamp=timestamp,
-          token=token,
-          limit=remaining_limit)
-
-      response = self._MakeSyncRequest(request, typ)
-
-      if response.results:
-        result_set = response.results[0]
-        values = [(pred, self._Decode(value), ts)
-                  for (pred, value, ts) in result_set.payload]
-        if limit:
-          if len(values) >= remaining_limit:
-            results[subject] = values[:remaining_limit]
-            return results.iteritems()
-          remaining_limit -= len(values)
-
-        results[subject] = values
-    return results.iteritems()
+      values = subject_values.pop(utils.SmartStr(subject), None)
+      if not values:
+        continue
+
+      if limit:
+        if len(values) >= remaining_limit:
+          results.append((subject, values[:remaining_limit]))
+          return results
+        remaining_limit -= len(values)
+
+      results.append((subject, values))
+    return results
 
   def ScanAttributes(self,
                      subject_prefix,
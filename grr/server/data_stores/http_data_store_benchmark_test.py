@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 """Benchmark tests for HTTP datastore."""
 
+
+import re
+import threading
+import time
+
 from grr.lib import flags
+from grr.lib import utils
+from grr.lib.rdfvalues import data_server as rdf_data_server
+from grr.server import aff4
+from grr.server import data_store
 from grr.server import data_store_test
+from grr.server.data_stores import common
+from grr.server.data_stores import http_data_store
 from grr.server.data_stores import http_data_store_test
+from grr.test_lib import benchmark_test_lib
 from grr.test_lib import test_lib
 
 
@@ -17,6 +29,147 @@ class HTTPDataStoreCSVBenchmarks(http_data_store_test.HTTPDataStoreMixin,
   """Benchmark the HTTP remote data store."""
 
 
+def _MultiResolvePrefixPerSubject(self,
+                                  subjects,
+                                  attribute_prefix,
+                                  timestamp=None,
+                                  limit=None,
+                                  token=None):
+  """The previous implementation: one request per subject."""
+  typ = rdf_data_server.DataStoreCommand.Command.MULTI_RESOLVE_PREFIX
+  results = {}
+  remaining_limit = limit
+  for subject in subjects:
+    request = self._MakeRequest(
+        [subject],
+        attribute_prefix,
+        timestamp=timestamp,
+        token=token,
+        limit=remaining_limit)
+
+    response = self._MakeSyncRequest(request, typ)
+
+    if response.results:
+      result_set = response.results[0]
+      values = [(pred, self._Decode(value), ts)
+                for (pred, value, ts) in result_set.payload]
+      if limit:
+        if len(values) >= remaining_limit:
+          results[subject] = values[:remaining_limit]
+          return results.iteritems()
+        remaining_limit -= len(values)
+
+      results[subject] = values
+  return results.iteritems()
+
+
+class HTTPDataStoreMultiOpenBenchmarks(
+    http_data_store_test.HTTPDataStoreMixin,
+    benchmark_test_lib.MicroBenchmarks):
+  """Benchmark opening many objects spread over the in-process data servers."""
+
+  units = "s"
+
+  OBJECTS = 1000
+
+  def setUp(self):
+    super(HTTPDataStoreMultiOpenBenchmarks, self).setUp(["Objects"], ["<10"])
+
+    self.urns = ["aff4:/multiopen/object%d" % i for i in xrange(self.OBJECTS)]
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for urn in self.urns:
+        aff4.FACTORY.Create(
+            urn, aff4.AFF4Volume, mutation_pool=pool, token=self.token).Close()
+    data_store.DB.Flush()
+
+  def _MultiOpen(self, name):
+    start = time.time()
+    fds = list(aff4.FACTORY.MultiOpen(self.urns, mode="r", token=self.token))
+    self.AddResult(name, time.time() - start, 1, len(fds))
+    self.assertEqual(len(fds), self.OBJECTS)
+
+  def testMultiOpen(self):
+    """Opens objects owned by two data servers with a single MultiOpen."""
+    with utils.Stubber(http_data_store.HTTPDataStore, "MultiResolvePrefix",
+                       _MultiResolvePrefixPerSubject):
+      self._MultiOpen("Request per subject")
+
+    self._MultiOpen("Request per data server")
+
+
+class LegacyRemoteMappingCache(utils.FastStore):
+  """The previous cache: a locked LRU keyed by the subject's database."""
+
+  def __init__(self, size, inquirer):
+    super(LegacyRemoteMappingCache, self).__init__(size)
+    self.inquirer = inquirer
+    self.path_regexes = [re.compile(x) for x in inquirer.GetPathing()]
+
+  def KillObject(self, obj):
+    pass
+
+  @utils.Synchronized
+  def Get(self, subject):
+    filename, directory = common.ResolveSubjectDestination(
+        subject, self.path_regexes)
+    key = common.MakeDestinationKey(directory, filename)
+    try:
+      return super(LegacyRemoteMappingCache, self).Get(key)
+    except KeyError:
+      data_server = self.inquirer.MapKey(key)
+
+      super(LegacyRemoteMappingCache, self).Put(key, data_server)
+
+      return data_server
+
+
+class HTTPDataStoreRoutingBenchmarks(http_data_store_test.HTTPDataStoreMixin,
+                                     benchmark_test_lib.MicroBenchmarks):
+  """Benchmark routing subjects to data servers from many threads."""
+
+  units = "s"
+
+  THREADS = 50
+  LOOKUPS_PER_THREAD = 2000
+  SUBJECTS = 500
+
+  def setUp(self):
+    super(HTTPDataStoreRoutingBenchmarks, self).setUp(["Threads", "Lookups/s"],
+                                                      ["<10", "<12"])
+    self.subjects = [
+        "aff4:/C.%016X/fs/os/file%d" % (i, i) for i in xrange(self.SUBJECTS)
+    ]
+
+  def _LookupFromThreads(self, name, cache):
+    def Lookup(offset):
+      for i in xrange(self.LOOKUPS_PER_THREAD):
+        cache.Get(self.subjects[(offset + i) % self.SUBJECTS])
+
+    threads = [
+        threading.Thread(target=Lookup, args=(i,)) for i in xrange(self.THREADS)
+    ]
+    start = time.time()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    time_taken = time.time() - start
+
+    lookups = self.THREADS * self.LOOKUPS_PER_THREAD
+    self.AddResult(name, time_taken, lookups, self.THREADS,
+                   "%d" % (lookups / time_taken))
+
+  def testRoutingContention(self):
+    """Routes subjects to data servers concurrently."""
+    inquirer = data_store.DB.cache.GetInquirer()
+    legacy_cache = LegacyRemoteMappingCache(1000, inquirer)
+    self._LookupFromThreads("Locked cache", legacy_cache)
+    self._LookupFromThreads("Lock-free cache", data_store.DB.cache)
+
+    for subject in self.subjects:
+      self.assertIs(legacy_cache.Get(subject), data_store.DB.cache.Get(subject))
+
+
 def main(args):
   test_lib.main(args)
 
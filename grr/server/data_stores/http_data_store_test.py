@@ -201,6 +201,55 @@ class HTTPDataStoreMixin(object):
 class HTTPDataStoreTest(HTTPDataStoreMixin, data_store_test._DataStoreTest):
   """Test the remote data store."""
 
+  def _SubjectsOnBothServers(self, count):
+    """Returns subjects alternating between the two data servers."""
+    servers = data_store.DB.inquirer.servers
+    self.assertEqual(len(servers), 2)
+
+    by_server = ([], [])
+    i = 0
+    while min(len(by_server[0]), len(by_server[1])) < count:
+      subject = "aff4:/C.%016X" % i
+      i += 1
+      by_server[servers.index(data_store.DB.cache.Get(subject))].append(subject)
+
+    subjects = []
+    for first, second in zip(by_server[0][:count], by_server[1][:count]):
+      subjects.extend([first, second])
+    return subjects
+
+  def testMultiResolvePrefixAcrossServersKeepsOrderAndLimit(self):
+    subjects = self._SubjectsOnBothServers(3)
+    # Reverse so that neither server's subjects come first.
+    subjects.reverse()
+    for i, subject in enumerate(subjects):
+      data_store.DB.MultiSet(
+          subject, {
+              "metadata:a": [("a%d" % i, 1000)],
+              "metadata:b": [("b%d" % i, 2000)]
+          },
+          token=self.token)
+
+    results = data_store.DB.MultiResolvePrefix(
+        subjects, "metadata:", token=self.token)
+    self.assertEqual([subject for subject, _ in results], subjects)
+    for i, (_, values) in enumerate(results):
+      self.assertEqual(
+          sorted((attribute, value) for attribute, value, _ in values),
+          [("metadata:a", "a%d" % i), ("metadata:b", "b%d" % i)])
+
+    # The limit applies to the merged results of both servers in the
+    # subjects' order.
+    results = data_store.DB.MultiResolvePrefix(
+        subjects, "metadata:", limit=5, token=self.token)
+    self.assertEqual([(subject, len(values)) for subject, values in results],
+                     [(subjects[0], 2), (subjects[1], 2), (subjects[2], 1)])
+
+    results = data_store.DB.MultiResolvePrefix(
+        subjects, "metadata:", limit=2, token=self.token)
+    self.assertEqual([(subject, len(values)) for subject, values in results],
+                     [(subjects[0], 2)])
+
 
 def main(args):
   test_lib.main(args)
@@ -6,8 +6,9 @@ SQLite database files are created by taking the root of each AFF4 object.
 
 
 
-import itertools
+import heapq
 import os
+import Queue
 import re
 import shutil
 import stat
@@ -24,6 +25,7 @@ from grr import config
 from grr.lib import utils
 from grr.server import aff4
 from grr.server import data_store
+from grr.server.data_server import constants
 from grr.server.data_stores import common
 
 SQLITE_EXTENSION = ".sqlite"
@@ -36,6 +38,105 @@ SQLITE_CACHED_STATEMENTS = 20
 SQLITE_PAGE_SIZE = 1024
 
 
+class SqliteManifest(object):
+  """The range of subjects stored in each database file.
+
+  Prefix scans only open the database files whose range can hold subjects
+  beginning with the prefix. Ranges are only ever extended by writes, so they
+  can be wider than the data left in a file but never narrower. Entries are
+  keyed by path and inode, files moved into place by a rebalance have a new
+  inode and their range is read from the file again.
+  """
+
+  def __init__(self, root_path):
+    self.root_path = root_path
+    self.lock = threading.RLock()
+    path = utils.SmartStr(
+        utils.JoinPath(root_path, constants.MANIFEST_FILENAME))
+    self.conn = sqlite3.connect(path, SQLITE_TIMEOUT, SQLITE_DETECT_TYPES,
+                                SQLITE_ISOLATION, False, SQLITE_FACTORY,
+                                SQLITE_CACHED_STATEMENTS)
+    self.conn.text_factory = str
+    self.conn.execute("PRAGMA synchronous = NORMAL")
+    # pylint: disable=bad-continuation
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                         path TEXT PRIMARY KEY NOT NULL,
+                         inode BIG INTEGER NOT NULL,
+                         min_subject TEXT,
+                         max_subject TEXT)""")
+    # pylint: enable=bad-continuation
+    self.conn.commit()
+
+  def _Key(self, filename):
+    """Returns the manifest key and inode of a database file."""
+    try:
+      inode = os.stat(filename).st_ino
+    except OSError:
+      inode = -1
+    return os.path.relpath(filename, self.root_path), inode
+
+  @utils.Synchronized
+  def GetRange(self, filename):
+    """Returns the subject range of a database file.
+
+    Args:
+     filename: The path of the database file.
+
+    Returns:
+     A (min_subject, max_subject) tuple, both None for empty files, or None if
+     the file has no entry.
+    """
+    path, inode = self._Key(filename)
+    query = """SELECT min_subject, max_subject FROM files
+               WHERE path = ? AND inode = ?"""
+    return self.conn.execute(query, (path, inode)).fetchone()
+
+  @utils.Synchronized
+  def AddRange(self, filename, min_subject, max_subject):
+    """Adds an entry for a file, unless it has a current one already."""
+    path, inode = self._Key(filename)
+    self.conn.execute("DELETE FROM files WHERE path = ? AND inode != ?",
+                      (path, inode))
+    self.conn.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?)",
+                      (path, inode, min_subject, max_subject))
+    self.conn.commit()
+
+  @utils.Synchronized
+  def ExtendRange(self, filename, min_subject, max_subject):
+    """Extends the range of a file to include [min_subject, max_subject].
+
+    Args:
+     filename: The path of the database file.
+     min_subject: The smallest subject to include.
+     max_subject: The largest subject to include.
+
+    Returns:
+     False if the file has no entry that could be extended.
+    """
+    if min_subject is None:
+      return True
+
+    path, inode = self._Key(filename)
+    query = """UPDATE files
+               SET min_subject = MIN(IFNULL(min_subject, :min), :min),
+                   max_subject = MAX(IFNULL(max_subject, :max), :max)
+               WHERE path = :path AND inode = :inode"""
+    args = dict(min=min_subject, max=max_subject, path=path, inode=inode)
+    updated = self.conn.execute(query, args).rowcount
+    self.conn.commit()
+    return updated > 0
+
+  @utils.Synchronized
+  def Version(self):
+    """Returns a number which changes when other processes write entries."""
+    return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+  @utils.Synchronized
+  def Close(self):
+    self.conn.close()
+    self.conn = None
+
+
 class SqliteConnectionCache(utils.FastStore):
   """A local cache of SQLite connection objects."""
 
@@ -111,6 +212,8 @@ class SqliteConnectionCache(utils.FastStore):
     if os.path.exists(target_path):
       self._WaitUntilReadable(target_path)
       return
+    # The new file is not part of the databases found for any prefix yet.
+    self.prefix_index.Flush()
     # Copy database file to a file that has no read permissions.
     umask_original = os.umask(0)
     write_permissions = stat.S_IWUSR | stat.S_IWGRP
@@ -137,7 +240,15 @@ class SqliteConnectionCache(utils.FastStore):
   def __init__(self, max_size, path):
     super(SqliteConnectionCache, self).__init__(max_size=max_size)
     self.root_path = path or config.CONFIG.Get("Datastore.location")
+    # Maps path prefixes to the database files which might hold subjects
+    # beginning with them. Dropped when a database file is created by this
+    # process or written to the manifest by another one.
+    self.prefix_index = utils.AgeBasedCache(
+        max_size=1000,
+        max_age=config.CONFIG["SqliteDatastore.prefix_index_max_age"])
     self._CreateModelDatabase()
+    self.manifest = SqliteManifest(self.root_path)
+    self.manifest_version = self.manifest.Version()
     self.RecreatePathing()
 
   def RecreatePathing(self, pathing=None):
@@ -148,6 +259,7 @@ class SqliteConnectionCache(utils.FastStore):
       self.pathing = pathing
     except re.error:
       raise data_store.Error("Invalid regular expression in Datastore.pathing")
+    self.prefix_index.Flush()
 
   def RootPath(self):
     return self.root_path
@@ -155,20 +267,22 @@ class SqliteConnectionCache(utils.FastStore):
   def KillObject(self, conn):
     conn.Close()
 
-  @utils.Synchronized
-  def Get(self, subject):
-    """This will create the connection if needed so should not fail."""
+  def _DatabasePath(self, subject):
+    """Returns the cache key, directory and file of the subject's database."""
     filename, directory = common.ResolveSubjectDestination(
         subject, self.path_regexes)
     key = common.MakeDestinationKey(directory, filename)
+    dirname = utils.JoinPath(self.root_path, directory)
+    path = utils.JoinPath(dirname, filename) + SQLITE_EXTENSION
+    return key, utils.SmartStr(dirname), utils.SmartStr(path)
+
+  @utils.Synchronized
+  def Get(self, subject):
+    """This will create the connection if needed so should not fail."""
+    key, dirname, path = self._DatabasePath(subject)
     try:
       return super(SqliteConnectionCache, self).Get(key)
     except KeyError:
-      dirname = utils.JoinPath(self.root_path, directory)
-      path = utils.JoinPath(dirname, filename) + SQLITE_EXTENSION
-      dirname = utils.SmartStr(dirname)
-      path = utils.SmartStr(path)
-
       # Make sure directory exists.
       if not os.path.isdir(dirname):
         try:
@@ -176,14 +290,14 @@ class SqliteConnectionCache(utils.FastStore):
         except OSError:
           pass
       self._EnsureDatabaseExists(path)
-      connection = SqliteConnection(path)
+      connection = SqliteConnection(path, manifest=self.manifest)
 
       super(SqliteConnectionCache, self).Put(key, connection)
 
       return connection
 
-  def GetPrefix(self, subject_prefix):
-    """Return list of databases matching subject_prefix."""
+  def DatabasesByPrefix(self, subject_prefix):
+    """Returns the database files which might hold subjects with the prefix."""
 
     components = common.Components(subject_prefix)
 
@@ -191,16 +305,37 @@ class SqliteConnectionCache(utils.FastStore):
     path_prefix = utils.JoinPath(*components)
     if path_prefix == "/":
       path_prefix = ""
+
     for regex in self.path_regexes:
       result = common.EvaluatePrefix(path_prefix, regex)
-      if result == "MATCH":
-        yield self.Get(subject_prefix)
-        return
       if result == "POSSIBLE":
-        for conn in self.DatabasesByPath(path_prefix):
-          yield conn
-        return
-    yield self.Get(subject_prefix)
+        break
+      if result == "MATCH":
+        return self._DatabaseOfSubject(subject_prefix)
+    else:
+      return self._DatabaseOfSubject(subject_prefix)
+
+    # Files created by other processes are in the manifest before any of
+    # their data is committed.
+    version = self.manifest.Version()
+    if version != self.manifest_version:
+      self.prefix_index.Flush()
+      self.manifest_version = version
+
+    try:
+      return self.prefix_index.Get(path_prefix)
+    except KeyError:
+      pass
+
+    databases = list(self.DatabasesByPath(path_prefix))
+    self.prefix_index.Put(path_prefix, databases)
+    return databases
+
+  def _DatabaseOfSubject(self, subject):
+    _, _, path = self._DatabasePath(subject)
+    if os.path.exists(path):
+      return [path]
+    return []
 
   def DatabasesInDir(self, directory):
     """Returns a list of the database files in directory."""
@@ -214,7 +349,7 @@ class SqliteConnectionCache(utils.FastStore):
 
   @utils.Synchronized
   def DatabasesByPath(self, path_prefix):
-    """Yields connections which might contain data prefixed by path_prefix."""
+    """Yields database files which might hold data prefixed by path_prefix."""
 
     # We are looking for database files which start with this prefix, or
     # which could be extended to match this prefix.
@@ -236,7 +371,7 @@ class SqliteConnectionCache(utils.FastStore):
             mod_db = self.root_path
           if mod_db.startswith(dir_prefix) or dir_prefix.startswith(mod_db):
             databases_found.add(db)
-            yield SqliteConnection(db + SQLITE_EXTENSION)
+            yield db + SQLITE_EXTENSION
       if not shortened_path_prefix:
         break
       components = shortened_path_prefix.split(os.path.sep)
@@ -248,8 +383,14 @@ class SqliteConnectionCache(utils.FastStore):
 class SqliteConnection(object):
   """A wrapper around the raw SQLite connection."""
 
-  def __init__(self, filename):
+  def __init__(self, filename, manifest=None):
     self.filename = filename
+    self.manifest = manifest
+    # Range of the subjects written since the manifest was last updated.
+    self.min_subject = None
+    self.max_subject = None
+    # The range of this file last read from or written to the manifest.
+    self.manifest_range = None
     self.conn = sqlite3.connect(filename, SQLITE_TIMEOUT, SQLITE_DETECT_TYPES,
                                 SQLITE_ISOLATION, False, SQLITE_FACTORY,
                                 SQLITE_CACHED_STATEMENTS)
@@ -482,6 +623,10 @@ class SqliteConnection(object):
     args = (subject, attribute, timestamp, value)
     self.Execute(query, args)
     self.dirty = True
+    if self.min_subject is None or subject < self.min_subject:
+      self.min_subject = subject
+    if self.max_subject is None or subject > self.max_subject:
+      self.max_subject = subject
     self.deleted = max(0, self.deleted - self.cursor.rowcount)
 
   @utils.Synchronized
@@ -506,6 +651,56 @@ class SqliteConnection(object):
     self.dirty = True
     self.deleted += self.cursor.rowcount
 
+  @utils.Synchronized
+  def SubjectRange(self):
+    """Returns the smallest and the largest subject in the database."""
+    query = "SELECT MIN(subject), MAX(subject) FROM tbl"
+    min_subject, max_subject = self.Execute(query).fetchone()
+    return min_subject, max_subject
+
+  @utils.Synchronized
+  def AddToManifest(self, manifest):
+    """Adds an entry with the range of the subjects in this database."""
+    subject_range = self.SubjectRange()
+    # Another writer may have added the entry in the meantime.
+    manifest.AddRange(self.filename, *subject_range)
+    manifest.ExtendRange(self.filename, *subject_range)
+    self.manifest_range = manifest.GetRange(self.filename)
+
+  def _InManifestRange(self, min_subject, max_subject):
+    if self.manifest_range is None:
+      return False
+    known_min, known_max = self.manifest_range
+    if known_min is None:
+      return False
+    return known_min <= min_subject and max_subject <= known_max
+
+  @utils.Synchronized
+  def UpdateManifest(self, manifest):
+    """Extends the range of this database in the manifest to the new writes.
+
+    This is called before the writes are committed, so the manifest never
+    holds a range narrower than the committed data. The manifest is only
+    written to when the range grows.
+
+    Args:
+      manifest: The SqliteManifest to update.
+    """
+    if self.min_subject is None:
+      return
+
+    if self.manifest_range is None:
+      self.manifest_range = manifest.GetRange(self.filename)
+
+    if not self._InManifestRange(self.min_subject, self.max_subject):
+      if manifest.ExtendRange(self.filename, self.min_subject,
+                              self.max_subject):
+        self.manifest_range = manifest.GetRange(self.filename)
+      else:
+        self.AddToManifest(manifest)
+
+    self.min_subject = self.max_subject = None
+
   def PrettyPrint(self):
     """Print the SQLite database."""
     query = "SELECT subject, predicate, timestamp, value FROM tbl"
@@ -527,6 +722,9 @@ class SqliteConnection(object):
   def Flush(self):
     """Flush the database."""
     if self.conn:
+      if self.manifest:
+        self.UpdateManifest(self.manifest)
+
       try:
         self.conn.commit()
       except sqlite3.OperationalError:
@@ -603,6 +801,31 @@ class SqliteConnection(object):
     self.cursor = None
 
 
+def _MayHoldSubjects(subject_range, subject_prefix, after_urn):
+  """Checks if a database file with the given range can hold scanned subjects.
+
+  Args:
+   subject_range: The (min_subject, max_subject) range of the file from the
+     manifest.
+   subject_prefix: The prefix of the subjects scanned.
+   after_urn: If set, only subjects after this are scanned.
+
+  Returns:
+   False if the file cannot hold any of the subjects scanned.
+  """
+  if not subject_range or subject_range[0] is None:
+    # The file is empty or gone.
+    return False
+  min_subject, max_subject = subject_range
+  if max_subject < subject_prefix:
+    return False
+  if after_urn and max_subject <= after_urn:
+    return False
+  # All subjects beginning with the prefix sort before any subject which is
+  # larger than the prefix but does not begin with it.
+  return min_subject <= subject_prefix or min_subject.startswith(subject_prefix)
+
+
 class SqliteDataStore(data_store.DataStore):
   """A file based data store using the SQLite database."""
 
@@ -832,51 +1055,119 @@ class SqliteDataStore(data_store.DataStore):
     subject_prefix = self._CleanSubjectPrefix(subject_prefix)
     after_urn = self._CleanAfterURN(after_urn, subject_prefix)
 
-    connection_iter = self.cache.GetPrefix(subject_prefix)
+    databases = self._DatabasesToScan(subject_prefix, after_urn)
     if relaxed_order:
-      for sqlite_connection in connection_iter:
-        with sqlite_connection:
-          for r in self._GroupSubjects(
-              list(
-                  sqlite_connection.ScanAttributes(
-                      subject_prefix,
-                      attributes,
-                      after_urn=after_urn,
-                      max_records=max_records)), max_records):
-            yield r
-      return
-    first_connections = []
-    try:
-      first_connections.append(connection_iter.next())
-      first_connections.append(connection_iter.next())
-    except StopIteration:
-      pass
-    if not first_connections:
-      return
-    if len(first_connections) == 1:
-      with first_connections[0] as sqlite_connection:
+      for filename in databases:
         for r in self._GroupSubjects(
-            list(
-                sqlite_connection.ScanAttributes(
-                    subject_prefix,
-                    attributes,
-                    after_urn=after_urn,
-                    max_records=max_records)), max_records):
+            self._ScanDatabase(filename, subject_prefix, attributes, after_urn,
+                               max_records), max_records):
           yield r
       return
-    raw_results = []
-    for sqlite_connection in itertools.chain(first_connections,
-                                             connection_iter):
-      for record in sqlite_connection.ScanAttributes(
-          subject_prefix,
-          attributes,
-          after_urn=after_urn,
-          max_records=max_records):
-        raw_results.append(record)
-    for r in self._GroupSubjects(
-        sorted(raw_results, key=lambda x: x[0]), max_records):
+
+    if len(databases) == 1:
+      records = self._ScanDatabase(databases[0], subject_prefix, attributes,
+                                   after_urn, max_records)
+    else:
+      records = self._ParallelScan(databases, subject_prefix, attributes,
+                                   after_urn, max_records)
+    for r in self._GroupSubjects(records, max_records):
       yield r
 
+  def _DatabasesToScan(self, subject_prefix, after_urn):
+    """Returns the database files which can hold the subjects to scan."""
+    manifest = self.cache.manifest
+    databases = []
+    for filename in self.cache.DatabasesByPrefix(subject_prefix):
+      subject_range = manifest.GetRange(filename)
+      if subject_range is None:
+        # Files written before the manifest existed or moved here by a
+        # rebalance are added the first time they are scanned.
+        sqlite_connection = SqliteConnection(filename)
+        try:
+          sqlite_connection.AddToManifest(manifest)
+        finally:
+          sqlite_connection.Close()
+        subject_range = sqlite_connection.manifest_range
+
+      if _MayHoldSubjects(subject_range, subject_prefix, after_urn):
+        databases.append(filename)
+
+    return databases
+
+  def _ScanDatabase(self, filename, subject_prefix, attributes, after_urn,
+                    max_records):
+    """Returns the records of a single database file, ordered by subject."""
+    # Scans might be long running, so they don't hold the lock of the cached
+    # connection.
+    sqlite_connection = SqliteConnection(filename)
+    try:
+      return list(
+          sqlite_connection.ScanAttributes(
+              subject_prefix,
+              attributes,
+              after_urn=after_urn,
+              max_records=max_records))
+    finally:
+      sqlite_connection.Close()
+
+  def _ParallelScan(self, databases, subject_prefix, attributes, after_urn,
+                    max_records):
+    """Scans database files in parallel and merges the records by subject.
+
+    Every subject is stored in exactly one database file, so a k-way merge of
+    the ordered records of each file is ordered as well. Each file returns at
+    most as many records as the whole scan, the merge stops once max_records
+    subjects were grouped.
+
+    Args:
+     databases: The database files to scan.
+     subject_prefix: Returns records for all subjects which begin with
+       subject_prefix.
+     attributes: A list of the attributes of interest.
+     after_urn: If set, restrict to records which come after.
+     max_records: The maximum number of subjects to return.
+
+    Yields:
+     Records of the form (subject, attribute, timestamp, value).
+    """
+    work = Queue.Queue()
+    for item in enumerate(databases):
+      work.put(item)
+    results = [[] for _ in databases]
+    errors = []
+
+    def Worker():
+      while True:
+        try:
+          index, filename = work.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          records = self._ScanDatabase(filename, subject_prefix, attributes,
+                                       after_urn, max_records)
+        except Exception as e:  # pylint: disable=broad-except
+          errors.append(e)
+          return
+        # The index keeps records of different files from being compared.
+        results[index] = [(record[0], index, record) for record in records]
+
+    threads = []
+    num_threads = min(
+        len(databases), config.CONFIG["SqliteDatastore.scan_threads"])
+    for _ in xrange(num_threads):
+      t = threading.Thread(target=Worker, name="SqliteScanThread")
+      t.daemon = True
+      t.start()
+      threads.append(t)
+    for t in threads:
+      t.join()
+
+    if errors:
+      raise errors[0]
+
+    for _, _, record in heapq.merge(*results):
+      yield record
+
   def ResolveMulti(self,
                    subject,
                    attributes,
@@ -964,6 +1255,7 @@ class SqliteDataStore(data_store.DataStore):
     # close them, subsequent access to SQLite files with the same name
     # might fail randomly.
     self.cache.Flush()
+    self.cache.manifest.Close()
     self.cache = SqliteConnectionCache(
         config.CONFIG["SqliteDatastore.connection_cache_size"], root_path)
 
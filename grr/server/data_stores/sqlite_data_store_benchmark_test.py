@@ -2,10 +2,17 @@
 """Benchmark tests for sqlite datastore."""
 
 
+import time
+
 from grr.lib import flags
+from grr.lib import utils
+from grr.server import data_store
 from grr.server import data_store_test
+from grr.server.data_stores import common
+from grr.server.data_stores import sqlite_data_store
 from grr.server.data_stores import sqlite_data_store_test
 
+from grr.test_lib import benchmark_test_lib
 from grr.test_lib import test_lib
 
 
@@ -19,6 +26,111 @@ class SqliteDataStoreCSVBenchmarks(sqlite_data_store_test.SqliteTestMixin,
   """Benchmark the SQLite data store abstraction."""
 
 
+def LegacyScanAttributes(db, subject_prefix, attributes, after_urn=None,
+                         max_records=None):
+  """The previous implementation: every database file is scanned in turn."""
+  # pylint: disable=protected-access
+  subject_prefix = db._CleanSubjectPrefix(subject_prefix)
+  after_urn = db._CleanAfterURN(after_urn, subject_prefix)
+
+  components = [
+      common.ConvertStringToFilename(x)
+      for x in common.Components(subject_prefix)
+  ]
+  path_prefix = utils.JoinPath(*components)
+  if path_prefix == "/":
+    path_prefix = ""
+
+  raw_results = []
+  for filename in db.cache.DatabasesByPath(path_prefix):
+    sqlite_connection = sqlite_data_store.SqliteConnection(filename)
+    raw_results.extend(
+        sqlite_connection.ScanAttributes(
+            subject_prefix,
+            attributes,
+            after_urn=after_urn,
+            max_records=max_records))
+    sqlite_connection.Close()
+
+  return list(
+      db._GroupSubjects(sorted(raw_results, key=lambda x: x[0]), max_records))
+
+
+class SqlitePrefixScanBenchmarks(sqlite_data_store_test.SqliteTestMixin,
+                                 benchmark_test_lib.MicroBenchmarks):
+  """Benchmark prefix scans over many SQLite database files."""
+
+  units = "s"
+
+  HUNTS = 200
+  RESULTS_PER_HUNT = 20
+  CLIENTS = 200
+  PAGE_SIZE = 100
+  REPEATS = 5
+
+  def setUp(self):
+    super(SqlitePrefixScanBenchmarks, self).setUp(["Prefix", "Subjects"],
+                                                  ["<15", "<10"])
+    for i in xrange(self.HUNTS):
+      for j in xrange(self.RESULTS_PER_HUNT):
+        subject = "aff4:/hunts/H:%06X/Results/%04d" % (i, j)
+        data_store.DB.MultiSet(
+            subject, {"aff4:type": ["HuntResult"]}, token=self.token)
+
+    for i in xrange(self.CLIENTS):
+      data_store.DB.MultiSet(
+          "aff4:/C.%016X" % i, {"aff4:type": ["VFSGRRClient"]},
+          token=self.token)
+
+  def _Page(self, scan_func, prefix):
+    """Reads all subjects with the prefix a page at a time."""
+    subjects = []
+    after_urn = None
+    while True:
+      page = scan_func(
+          prefix, ["aff4:type"], after_urn=after_urn,
+          max_records=self.PAGE_SIZE)
+      if not page:
+        return subjects
+      subjects.extend(subject for subject, _ in page)
+      after_urn = page[-1][0]
+
+  def _Time(self, name, prefix, func, *args):
+    start = time.time()
+    for _ in xrange(self.REPEATS):
+      count = len(func(*args))
+    self.AddResult(name, (time.time() - start) / self.REPEATS, self.REPEATS,
+                   prefix, count)
+
+  def _BenchmarkScans(self, name, scan_func):
+    self._Time("%s full scan" % name, "aff4:/hunts", scan_func, "aff4:/hunts",
+               ["aff4:type"])
+    self._Time("%s paged scan" % name, "aff4:/hunts", self._Page, scan_func,
+               "aff4:/hunts")
+    self._Time("%s first page" % name, "aff4:/", scan_func, "aff4:/",
+               ["aff4:type"], None, self.PAGE_SIZE)
+
+  def _LegacyScan(self, subject_prefix, attributes, after_urn=None,
+                  max_records=None):
+    return LegacyScanAttributes(data_store.DB, subject_prefix, attributes,
+                                after_urn, max_records)
+
+  def _Scan(self, subject_prefix, attributes, after_urn=None,
+            max_records=None):
+    return list(
+        data_store.DB.ScanAttributes(
+            subject_prefix,
+            attributes,
+            after_urn=after_urn,
+            max_records=max_records,
+            token=self.token))
+
+  def testPrefixScans(self):
+    """Scans wide prefixes with and without the manifest."""
+    self._BenchmarkScans("Sequential", self._LegacyScan)
+    self._BenchmarkScans("Manifest", self._Scan)
+
+
 def main(args):
   test_lib.main(args)
 
@@ -3,6 +3,7 @@
 
 
 from grr.lib import flags
+from grr.lib import utils
 from grr.server import data_store
 from grr.server import data_store_test
 from grr.server.data_stores import sqlite_data_store
@@ -29,6 +30,105 @@ class SqliteDataStoreTest(SqliteTestMixin, data_store_test._DataStoreTest):
   """Test the sqlite data store."""
 
 
+class SqlitePrefixScanTest(SqliteTestMixin, test_lib.GRRBaseTest):
+  """Tests prefix scans over many database files."""
+
+  def _Write(self, subject):
+    data_store.DB.MultiSet(
+        subject, {"aff4:type": [subject]}, timestamp=1, token=self.token)
+
+  def _Scan(self, prefix, **kwargs):
+    opened = []
+
+    class RecordingConnection(sqlite_data_store.SqliteConnection):
+
+      def __init__(self, filename, manifest=None):
+        opened.append(filename)
+        super(RecordingConnection, self).__init__(filename, manifest=manifest)
+
+    with utils.Stubber(sqlite_data_store, "SqliteConnection",
+                       RecordingConnection):
+      results = list(
+          data_store.DB.ScanAttributes(
+              prefix, ["aff4:type"], token=self.token, **kwargs))
+    return [subject for subject, _ in results], opened
+
+  def testManifestKeepsSubjectRanges(self):
+    self._Write("aff4:/hunts/H:000001/b")
+    self._Write("aff4:/hunts/H:000001/a")
+    self._Write("aff4:/hunts/H:000001/c")
+
+    filename = data_store.DB.cache.Get("aff4:/hunts/H:000001").Filename()
+    self.assertEqual(
+        data_store.DB.cache.manifest.GetRange(filename),
+        ("aff4:/hunts/H:000001/a", "aff4:/hunts/H:000001/c"))
+
+  def testManifestIsOnlyWrittenWhenTheRangeGrows(self):
+    self._Write("aff4:/hunts/H:000001/a")
+    self._Write("aff4:/hunts/H:000001/c")
+
+    manifest = data_store.DB.cache.manifest
+    extend_range = manifest.ExtendRange
+    extended = []
+
+    def ExtendRange(filename, min_subject, max_subject):
+      extended.append((min_subject, max_subject))
+      return extend_range(filename, min_subject, max_subject)
+
+    with utils.Stubber(manifest, "ExtendRange", ExtendRange):
+      self._Write("aff4:/hunts/H:000001/b")
+      self.assertEqual(extended, [])
+      self._Write("aff4:/hunts/H:000001/d")
+      self.assertEqual(extended,
+                       [("aff4:/hunts/H:000001/d", "aff4:/hunts/H:000001/d")])
+
+  def testFilesWrittenByOtherProcessesAreScanned(self):
+    # Both prefixes are scanned while nothing is stored under them.
+    self.assertEqual(self._Scan("aff4:/hunts")[0], [])
+    self.assertEqual(self._Scan("aff4:/hunts/H:000001")[0], [])
+
+    other = sqlite_data_store.SqliteDataStore(data_store.DB.Location())
+    try:
+      other.MultiSet(
+          "aff4:/hunts/H:000001/foo", {"aff4:type": ["foo"]},
+          timestamp=1,
+          token=self.token)
+    finally:
+      other.cache.Flush()
+      other.cache.manifest.Close()
+
+    self.assertEqual(self._Scan("aff4:/hunts")[0], ["aff4:/hunts/H:000001/foo"])
+    self.assertEqual(
+        self._Scan("aff4:/hunts/H:000001")[0], ["aff4:/hunts/H:000001/foo"])
+
+  def testScanIsOrderedAndLimited(self):
+    subjects = []
+    for i in xrange(10):
+      for j in xrange(3):
+        subjects.append("aff4:/hunts/H:%06d/%d" % (i, j))
+    for subject in reversed(subjects):
+      self._Write(subject)
+
+    self.assertEqual(self._Scan("aff4:/hunts")[0], subjects)
+    self.assertEqual(self._Scan("aff4:/hunts", max_records=7)[0], subjects[:7])
+    self.assertEqual(
+        self._Scan("aff4:/hunts", after_urn=subjects[4], max_records=7)[0],
+        subjects[5:12])
+
+  def testScanOnlyOpensDatabasesInRange(self):
+    for i in xrange(10):
+      self._Write("aff4:/hunts/H:%06d/foo" % i)
+
+    # The first scan caches the files found for the prefix.
+    self._Scan("aff4:/hunts")
+
+    subjects, opened = self._Scan(
+        "aff4:/hunts", after_urn="aff4:/hunts/H:000007/foo")
+    self.assertEqual(subjects,
+                     ["aff4:/hunts/H:000008/foo", "aff4:/hunts/H:000009/foo"])
+    self.assertEqual(len(opened), 2)
+
+
 def main(args):
   test_lib.main(args)
 
@@ -14,6 +14,7 @@ from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import jobs_pb2
+from grr.server import data_store
 from grr.server import queue_manager
 
 
@@ -116,6 +117,24 @@ class Events(object):
     """
     cls.PublishMultipleEvents({event_name: [msg]}, delay=delay, token=token)
 
+  @classmethod
+  def _GetHandlerUrns(cls, event_name):
+    """Returns the session ids of the listeners to an event."""
+    # Allow the event name to be either a string or a URN of an event
+    # listener.
+    if not isinstance(event_name, basestring):
+      return [event_name]
+
+    handler_urns = []
+    for event_cls in registry.EventRegistry.EVENT_NAME_MAP.get(event_name, []):
+      if event_cls.well_known_session_id is None:
+        logging.error("Well known flow %s has no session_id.",
+                      event_cls.__name__)
+      else:
+        handler_urns.append(event_cls.well_known_session_id)
+
+    return handler_urns
+
   @classmethod
   def PublishMultipleEvents(cls, events, delay=None, token=None):
     """Publish the message into all listeners of the event.
@@ -125,6 +144,10 @@ class Events(object):
     be sent to multiple interested listeners. Alternatively, the event_name can
     specify a single URN of an event listener to receive the message.
 
+    Every message is serialized only once, no matter how many listeners it is
+    sent to. All messages are written in a single mutation pool and every
+    listener gets a single notification.
+
     Args:
 
       events: A dict with keys being event names and values being lists of
@@ -137,51 +160,59 @@ class Events(object):
       ValueError: If the message is invalid. The message must be a Semantic
         Value (instance of RDFValue) or a full GrrMessage.
     """
-    with queue_manager.WellKnownQueueManager(token=token) as manager:
-      event_name_map = registry.EventRegistry.EVENT_NAME_MAP
-      for event_name, messages in events.iteritems():
-        handler_urns = []
-        if isinstance(event_name, basestring):
-          for event_cls in event_name_map.get(event_name, []):
-            if event_cls.well_known_session_id is None:
-              logging.error("Well known flow %s has no session_id.",
-                            event_cls.__name__)
-            else:
-              handler_urns.append(event_cls.well_known_session_id)
-
-        else:
-          handler_urns.append(event_name)
-
-        for msg in messages:
-          # Allow the event name to be either a string or a URN of an event
-          # listener.
-          if not isinstance(msg, rdfvalue.RDFValue):
-            raise ValueError("Can only publish RDFValue instances.")
-
-          # Wrap the message in a GrrMessage if needed.
-          if not isinstance(msg, rdf_flows.GrrMessage):
-            msg = rdf_flows.GrrMessage(payload=msg)
-
-          # Randomize the response id or events will get overwritten.
-          msg.response_id = msg.task_id = msg.GenerateTaskID()
-          # Well known flows always listen for request id 0.
-          msg.request_id = 0
-
-          timestamp = None
-          if delay:
-            timestamp = (
-                rdfvalue.RDFDatetime.Now() + delay).AsMicroSecondsFromEpoch()
-
-          # Forward the message to the well known flow's queue.
-          for event_urn in handler_urns:
-            tmp_msg = msg.Copy()
-            tmp_msg.session_id = event_urn
-            manager.QueueResponse(tmp_msg)
-            manager.QueueNotification(
-                rdf_flows.GrrNotification(
-                    session_id=event_urn,
-                    priority=msg.priority,
-                    timestamp=timestamp))
+    # Lists of (response_id, serialized message) by listener session id.
+    responses = {}
+    priorities = {}
+
+    for event_name, messages in events.iteritems():
+      # A message is sent to a listener by appending the listener's session id
+      # to the serialized message.
+      session_ids = [(urn, rdf_flows.GrrMessage(session_id=urn)
+                      .SerializeToString())
+                     for urn in cls._GetHandlerUrns(event_name)]
+
+      for msg in messages:
+        if not isinstance(msg, rdfvalue.RDFValue):
+          raise ValueError("Can only publish RDFValue instances.")
+
+        # Wrap the message in a GrrMessage if needed.
+        if not isinstance(msg, rdf_flows.GrrMessage):
+          msg = rdf_flows.GrrMessage(payload=msg)
+        elif msg.HasField("session_id"):
+          msg = msg.Copy()
+          msg.session_id = None
+
+        # Randomize the response id or events will get overwritten.
+        msg.response_id = msg.task_id = msg.GenerateTaskID()
+        # Well known flows always listen for request id 0.
+        msg.request_id = 0
+
+        serialized = msg.SerializeToString()
+        for urn, serialized_session_id in session_ids:
+          responses.setdefault(urn, []).append(
+              (msg.response_id, serialized + serialized_session_id))
+          priorities[urn] = max(priorities.get(urn, msg.priority), msg.priority)
+
+    if not responses:
+      return
+
+    timestamp = rdfvalue.RDFDatetime.Now()
+    notifications = [
+        rdf_flows.GrrNotification(
+            session_id=urn,
+            priority=priorities[urn],
+            timestamp=timestamp + delay if delay else timestamp)
+        for urn in responses
+    ]
+
+    manager = queue_manager.WellKnownQueueManager(token=token)
+    with data_store.DB.GetMutationPool(token=token) as mutation_pool:
+      for urn, handler_responses in responses.iteritems():
+        mutation_pool.AddWellKnownFlowResponses(
+            urn, handler_responses, timestamp=timestamp)
+
+      # Notifications are only written once all responses are.
+      manager.MultiNotifyQueue(notifications, mutation_pool=mutation_pool)
 
   @classmethod
   def PublishEventInline(cls, event_name, msg, token=None):
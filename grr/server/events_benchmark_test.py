@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Benchmarks for publishing events."""
+
+
+import time
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import data_store
+from grr.server import events
+from grr.server import flow
+from grr.server import queue_manager
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class BenchmarkListener1(flow.EventListener):
+  well_known_session_id = rdfvalue.SessionID(flow_name="BenchmarkListener1")
+  EVENTS = ["BenchmarkEvent"]
+
+
+class BenchmarkListener2(flow.EventListener):
+  well_known_session_id = rdfvalue.SessionID(flow_name="BenchmarkListener2")
+  EVENTS = ["BenchmarkEvent"]
+
+
+class BenchmarkListener3(flow.EventListener):
+  well_known_session_id = rdfvalue.SessionID(flow_name="BenchmarkListener3")
+  EVENTS = ["BenchmarkEvent"]
+
+
+class BenchmarkListener4(flow.EventListener):
+  well_known_session_id = rdfvalue.SessionID(flow_name="BenchmarkListener4")
+  EVENTS = ["BenchmarkEvent"]
+
+
+LISTENERS = [
+    BenchmarkListener1, BenchmarkListener2, BenchmarkListener3,
+    BenchmarkListener4
+]
+
+
+def _PublishPerListener(messages, token=None):
+  """Publishes messages by copying and queueing them for every listener."""
+  with queue_manager.WellKnownQueueManager(token=token) as manager:
+    for msg in messages:
+      msg.response_id = msg.task_id = msg.GenerateTaskID()
+      msg.request_id = 0
+
+      for listener in LISTENERS:
+        tmp_msg = msg.Copy()
+        tmp_msg.session_id = listener.well_known_session_id
+        manager.QueueResponse(tmp_msg)
+        manager.QueueNotification(
+            rdf_flows.GrrNotification(
+                session_id=listener.well_known_session_id,
+                priority=msg.priority))
+
+
+class EventsBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Measures publishing many events to several listeners."""
+
+  units = "s"
+
+  EVENTS = 100000
+
+  def setUp(self):
+    super(EventsBenchmark, self).setUp(["Events", "Listeners"], ["<10", "<10"])
+
+  def _Messages(self):
+    return [
+        rdf_flows.GrrMessage(
+            payload=rdf_paths.PathSpec(path="/event/%d" % i),
+            source="Source",
+            auth_state="AUTHENTICATED") for i in xrange(self.EVENTS)
+    ]
+
+  def _CountResponses(self):
+    """Counts and deletes the responses queued for the listeners."""
+    count = 0
+    for listener in LISTENERS:
+      count += len(
+          list(
+              data_store.DB.FetchResponsesForWellKnownFlow(
+                  listener.well_known_session_id,
+                  self.EVENTS + 1, (0, rdfvalue.RDFDatetime.Now()),
+                  token=self.token)))
+      data_store.DB.DeleteSubject(
+          data_store.DB.GetFlowResponseSubject(listener.well_known_session_id,
+                                               0),
+          sync=True,
+          token=self.token)
+
+    return count
+
+  def testPublishMultipleEvents(self):
+    """Publishes 100k events to several listeners at once."""
+    messages = self._Messages()
+    start = time.time()
+    _PublishPerListener(messages, token=self.token)
+    self.AddResult("Copy per listener", time.time() - start, 1,
+                   self.EVENTS, len(LISTENERS))
+    self.assertEqual(self._CountResponses(), self.EVENTS * len(LISTENERS))
+
+    messages = self._Messages()
+    start = time.time()
+    events.Events.PublishMultipleEvents(
+        {"BenchmarkEvent": messages}, token=self.token)
+    self.AddResult("Serialize once", time.time() - start, 1,
+                   self.EVENTS, len(LISTENERS))
+    self.assertEqual(self._CountResponses(), self.EVENTS * len(LISTENERS))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
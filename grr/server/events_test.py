@@ -6,6 +6,7 @@ from grr.lib import flags
 from grr.lib import rdfvalue
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import data_store
 from grr.server import events
 from grr.server import flow
 from grr.server import maintenance_utils
@@ -164,6 +165,50 @@ class EventsTest(flow_test_lib.FlowTestsBaseclass):
                        "aff4:/Source%d" % i)
       self.assertEqual(NoClientListener.received_events[i][1].path, "foobar")
 
+  def testPublishMultipleEventsToMultipleListeners(self):
+    ClientListener.received_events = []
+    NoClientListener.received_events = []
+
+    messages = []
+    for i in xrange(10):
+      messages.append(
+          rdf_flows.GrrMessage(
+              session_id=rdfvalue.SessionID(flow_name="SomeFlow"),
+              payload=rdf_paths.PathSpec(path="foobar%d" % i),
+              source="Source",
+              auth_state="AUTHENTICATED"))
+
+    with test_lib.Instrument(data_store.DB,
+                             "CreateNotifications") as instrument:
+      events.Events.PublishMultipleEvents(
+          {
+              "TestEvent": messages[:5],
+              ClientListener.well_known_session_id: messages[5:]
+          },
+          token=self.token)
+
+    # Every listener is notified once.
+    self.assertEqual(
+        sorted(notification.session_id
+               for _, notifications in instrument.args
+               for notification in notifications),
+        sorted([
+            ClientListener.well_known_session_id,
+            NoClientListener.well_known_session_id
+        ]))
+
+    worker_test_lib.MockWorker(token=self.token).Simulate()
+
+    for listener, paths in [(NoClientListener, range(5)),
+                            (ClientListener, range(10))]:
+      received = sorted(
+          listener.received_events, key=lambda x: x[1].path)
+      self.assertEqual([event.path for _, event in received],
+                       ["foobar%d" % i for i in paths])
+      for message, _ in received:
+        self.assertEqual(message.session_id, listener.well_known_session_id)
+        self.assertEqual(message.source, "aff4:/Source")
+
   def testUserModificationAudit(self):
     audit.AuditEventListener.created_logs.clear()
     worker = worker_test_lib.MockWorker(token=self.token)
@@ -24,11 +24,14 @@ runner stores internal flow management information inside the flow's state, in a
 variable called "context". This context should only be used by the runner itself
 and not manipulated by the flow.
 
-The flow state is a normal dict (even though only types supported by
+The flow state is a dict (even though only types supported by
 the ProtoDict class are supported in the state):
 
 self.state.parameter_name = parameter_name
 
+The state keeps track of its changes so only the changed parts of it are
+written when the flow is flushed, see flow_state.FlowState.
+
 The following defaults parameters exist in the flow's state:
 
 self.args: The flow's protocol buffer args - an instance of
@@ -65,6 +68,7 @@ from grr.server import aff4
 from grr.server import data_store
 from grr.server import events
 from grr.server import flow_runner
+from grr.server import flow_state
 from grr.server import grr_collections
 from grr.server import multi_type_collection
 from grr.server import queue_manager
@@ -326,6 +330,12 @@ class AttributedDict(dict):
     self.__dict__ = self
 
 
+def _SerializeOrNone(value):
+  if value is None:
+    return None
+  return value.SerializeToString()
+
+
 class PendingFlowTermination(rdf_structs.RDFProtoStruct):
   """Descriptor of a pending flow termination."""
   protobuf = jobs_pb2.PendingFlowTermination
@@ -771,6 +781,14 @@ class GRRFlow(FlowBase):
         versioned=False,
         creates_new_object_version=False)
 
+    FLOW_STATE_DELTA = aff4.Attribute(
+        "aff4:flow_state_delta",
+        rdf_protodict.Dict,
+        "Changes to the state of this flow made after FlowStateDict was "
+        "written, one version per flush.",
+        "FlowStateDelta",
+        creates_new_object_version=False)
+
     FLOW_ARGS = aff4.Attribute(
         "aff4:flow_args",
         rdf_protodict.EmbeddedRDFValue,
@@ -828,27 +846,66 @@ class GRRFlow(FlowBase):
   # is killed when the client crashes.
   handles_crashes = False
 
+  # The maximum number of state deltas kept before the state is compacted
+  # into a new snapshot. Deltas are also compacted once they take more space
+  # than the snapshot itself.
+  MAX_STATE_DELTAS = 50
+
   def Initialize(self):
     """The initialization method."""
     super(GRRFlow, self).Initialize()
 
+    self._persisted_args = None
+    self._persisted_runner_args = None
+    self._state_persisted = False
+    self._state_size = 0
+    self._state_delta_size = 0
+    self._state_delta_count = 0
+    self._state_delta_age = 0
+
     if "r" in self.mode:
-      state = self.Get(self.Schema.FLOW_STATE_DICT)
       self.context = self.Get(self.Schema.FLOW_CONTEXT)
       self.runner_args = self.Get(self.Schema.FLOW_RUNNER_ARGS)
       args = self.Get(self.Schema.FLOW_ARGS)
       if args:
         self.args = args.payload
 
-      if state:
-        self.state = AttributedDict(state.ToDict())
-      else:
-        self.state = AttributedDict()
+      self._persisted_args = _SerializeOrNone(self.args)
+      self._persisted_runner_args = _SerializeOrNone(self.runner_args)
+      self.state = self._ReadState()
 
       self.Load()
 
     if self.state is None:
-      self.state = AttributedDict()
+      self.state = flow_state.FlowState()
+
+  def _ReadState(self):
+    """Reads the state snapshot and applies the deltas written after it."""
+    snapshot = self.Get(self.Schema.FLOW_STATE_DICT)
+    if snapshot is None:
+      return flow_state.FlowState()
+
+    state = snapshot.ToDict()
+    self._state_persisted = True
+    for value in self.synced_attributes.get(self.Schema.FLOW_STATE_DICT, []):
+      self._state_size = len(value.serialized or "")
+
+    if self.Schema.FLOW_STATE_DELTA in self.synced_attributes:
+      deltas = data_store.DB.ResolvePrefix(
+          self.urn,
+          self.Schema.FLOW_STATE_DELTA.predicate,
+          timestamp=data_store.DB.ALL_TIMESTAMPS,
+          token=self.token)
+      for _, serialized, timestamp in sorted(deltas, key=lambda x: x[2]):
+        flow_state.ApplyDelta(
+            state, rdf_protodict.Dict.FromSerializedString(serialized).ToDict())
+        self._state_delta_size += len(serialized)
+        self._state_delta_count += 1
+        self._state_delta_age = timestamp
+
+    result = flow_state.FlowState(state)
+    result.MarkPersisted()
+    return result
 
   def CreateRunner(self, **kw):
     """Make a new runner."""
@@ -886,13 +943,63 @@ class GRRFlow(FlowBase):
       raise IOError("Trying to write a flow without context: %s." % self.urn)
 
   def WriteState(self):
+    """Writes the state of the flow.
+
+    Only the parts of the flow state which changed are written, as a new
+    version of the FLOW_STATE_DELTA attribute. Deltas are compacted into a new
+    snapshot of the whole state once there are too many of them.
+    """
     if "w" in self.mode:
       self._ValidateState()
-      self.Set(self.Schema.FLOW_ARGS(self.args))
       self.Set(self.Schema.FLOW_CONTEXT(self.context))
-      self.Set(self.Schema.FLOW_RUNNER_ARGS(self.runner_args))
+
+      serialized_args = _SerializeOrNone(self.args)
+      if (not self._state_persisted or
+          serialized_args != self._persisted_args):
+        self.Set(self.Schema.FLOW_ARGS(self.args))
+        self._persisted_args = serialized_args
+
+      serialized_runner_args = _SerializeOrNone(self.runner_args)
+      if (not self._state_persisted or
+          serialized_runner_args != self._persisted_runner_args):
+        self.Set(self.Schema.FLOW_RUNNER_ARGS(self.runner_args))
+        self._persisted_runner_args = serialized_runner_args
+
+      if not isinstance(self.state, flow_state.FlowState):
+        self.state = flow_state.FlowState(self.state)
+        self._state_persisted = False
+
+      if self._state_persisted:
+        delta = self.state.GetDelta()
+        if not delta:
+          return
+
+        protodict = rdf_protodict.Dict().FromDict(delta)
+        delta_size = len(protodict.SerializeToString())
+        if (self._state_delta_count < self.MAX_STATE_DELTAS and
+            self._state_delta_size + delta_size <= self._state_size):
+          # Deltas have to be applied in order so their ages have to be
+          # unique.
+          self._state_delta_age = max(self._state_delta_age + 1,
+                                      int(rdfvalue.RDFDatetime.Now()))
+          self.AddAttribute(
+              self.Schema.FLOW_STATE_DELTA(protodict),
+              age=rdfvalue.RDFDatetime(self._state_delta_age))
+          self._state_delta_size += delta_size
+          self._state_delta_count += 1
+          self.state.MarkPersisted()
+          return
+
       protodict = rdf_protodict.AttributedDict().FromDict(self.state)
       self.Set(self.Schema.FLOW_STATE_DICT(protodict))
+      if self._state_delta_count:
+        self.DeleteAttribute(self.Schema.FLOW_STATE_DELTA)
+
+      self._state_persisted = True
+      self._state_size = len(protodict.SerializeToString())
+      self._state_delta_size = 0
+      self._state_delta_count = 0
+      self.state.MarkPersisted()
 
   def Status(self, format_str, *args):
     """Flows can call this method to set a status message visible to users."""
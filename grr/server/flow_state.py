@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+"""Flow state containers which keep track of their changes.
+
+The state of a flow used to be serialized and written in full every time the
+flow was flushed. For flows keeping large dicts or lists in their state
+(MultiGetFile keeps a tracker for every file it fetches) this dominates the
+cost of processing responses.
+
+FlowState remembers which of its keys changed since it was last persisted.
+Dicts, lists and sets stored in the state are converted into tracked
+containers which report changes of their elements up to the state, so changing
+a single tracker in a large dict only requires writing that tracker. Other
+values, RDFValues in particular, can be changed in place and are therefore
+compared with the serialized form they had when they were last persisted.
+
+The same applies to such values stored inside dicts and lists: an element of
+a container holding them is written if their serialized form changed.
+
+The changes are collected into a delta by FlowState.GetDelta(). Deltas can be
+applied to a plain dict holding the previous state using ApplyDelta().
+"""
+
+
+import hashlib
+
+from grr.lib.rdfvalues import protodict as rdf_protodict
+
+# Passed instead of an element key if the whole container changed.
+_ALL = object()
+
+_SCALAR_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+
+def _Wrap(value):
+  """Converts dicts, lists and sets into tracked containers."""
+  if isinstance(value, _Tracked):
+    return value
+  if isinstance(value, dict):
+    return TrackedDict(value)
+  if isinstance(value, list):
+    return TrackedList(value)
+  if isinstance(value, set):
+    return TrackedSet(value)
+  return value
+
+
+def _Unwrap(value):
+  """Converts tracked containers back into plain dicts, lists and sets."""
+  if isinstance(value, dict):
+    return dict((k, _Unwrap(v)) for k, v in value.iteritems())
+  if isinstance(value, list):
+    return [_Unwrap(v) for v in value]
+  if isinstance(value, set):
+    return set(value)
+  return value
+
+
+def _Link(value, parent, key):
+  if isinstance(value, _Tracked):
+    if not value._parents:  # pylint: disable=protected-access
+      value._parents = []  # pylint: disable=protected-access
+    value._parents.append((parent, key))  # pylint: disable=protected-access
+
+
+def _Unlink(value, parent, key=_ALL):
+  """Removes the link to parent (for the given key only, if set)."""
+  if isinstance(value, _Tracked):
+    # pylint: disable=protected-access
+    value._parents = [(p, k)
+                      for p, k in value._parents
+                      if p is not parent or (key is not _ALL and k != key)]
+    # pylint: enable=protected-access
+
+
+def _Digest(value):
+  return hashlib.sha1(
+      rdf_protodict.DataBlob().SetValue(value).SerializeToString()).digest()
+
+
+def _UntrackedValues(value):
+  """Yields the values in value which can only be changed in place."""
+  if isinstance(value, dict):
+    for item in value.itervalues():
+      for untracked in _UntrackedValues(item):
+        yield untracked
+  elif isinstance(value, list):
+    for item in value:
+      for untracked in _UntrackedValues(item):
+        yield untracked
+  elif not isinstance(value, (set,) + _SCALAR_TYPES):
+    yield value
+
+
+def _NestedDigest(value):
+  """Returns a digest of the untracked values in value, None if there are none.
+
+  Sets are skipped, their elements can't be changed in place.
+
+  Args:
+    value: A container element.
+
+  Returns:
+    A digest or None.
+  """
+  digest = None
+  for untracked in _UntrackedValues(value):
+    if digest is None:
+      digest = hashlib.sha1()
+    digest.update(_Digest(untracked))
+  return digest and digest.digest()
+
+
+def _Items(container):
+  if isinstance(container, dict):
+    return container.iteritems()
+  return enumerate(container)
+
+
+class _Tracked(object):
+  """Base class of containers reporting their changes to their parents."""
+
+  # (parent, key) tuples of all containers holding this one.
+  _parents = ()
+
+  # The container type copies are made of.
+  _PLAIN_TYPE = None
+
+  def _Notify(self, key):
+    """Reports a change of the element at key (or _ALL elements)."""
+    for parent, parent_key in self._parents:
+      parent._ChildChanged(parent_key, key)  # pylint: disable=protected-access
+
+  def _ChildChanged(self, key, unused_child_key):
+    self._Notify(key)
+
+  def __reduce__(self):
+    return self._PLAIN_TYPE, (self._PLAIN_TYPE(self),)
+
+
+class TrackedDict(_Tracked, dict):
+  """A dict reporting changes of its items."""
+
+  _PLAIN_TYPE = dict
+
+  def __init__(self, *args, **kwargs):
+    super(TrackedDict, self).__init__()
+    for key, value in dict(*args, **kwargs).iteritems():
+      value = _Wrap(value)
+      dict.__setitem__(self, key, value)
+      _Link(value, self, key)
+
+  def __setitem__(self, key, value):
+    old_value = dict.get(self, key)
+    if old_value is value and isinstance(value, _Tracked):
+      # Changes of the container itself are already tracked.
+      return
+
+    _Unlink(old_value, self, key)
+    value = _Wrap(value)
+    dict.__setitem__(self, key, value)
+    _Link(value, self, key)
+    self._Notify(key)
+
+  def __delitem__(self, key):
+    value = self[key]
+    dict.__delitem__(self, key)
+    _Unlink(value, self, key)
+    self._Notify(key)
+
+  def pop(self, key, *default):
+    if key not in self:
+      return dict.pop(self, key, *default)
+
+    value = dict.pop(self, key)
+    _Unlink(value, self, key)
+    self._Notify(key)
+    return value
+
+  def popitem(self):
+    key, value = dict.popitem(self)
+    _Unlink(value, self, key)
+    self._Notify(key)
+    return key, value
+
+  def setdefault(self, key, default=None):
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+  def update(self, *args, **kwargs):
+    for key, value in dict(*args, **kwargs).iteritems():
+      self[key] = value
+
+  def clear(self):
+    for value in dict.itervalues(self):
+      _Unlink(value, self)
+    dict.clear(self)
+    self._Notify(_ALL)
+
+
+class TrackedList(_Tracked, list):
+  """A list reporting changes of its items.
+
+  Appending to the list reports a change of the new last item. Any operation
+  moving existing items reports a change of the whole list.
+  """
+
+  _PLAIN_TYPE = list
+
+  def __init__(self, values=()):
+    super(TrackedList, self).__init__()
+    self.extend(values)
+
+  def _Restructure(self, method, *args, **kwargs):
+    """Runs a method which moves items and relinks all children."""
+    for value in self:
+      _Unlink(value, self)
+
+    try:
+      return method(self, *args, **kwargs)
+    finally:
+      for index, value in enumerate(self):
+        _Link(value, self, index)
+      self._Notify(_ALL)
+
+  def __setitem__(self, index, value):
+    if isinstance(index, slice):
+      self._Restructure(list.__setitem__, index, [_Wrap(v) for v in value])
+      return
+
+    if index < 0:
+      index += len(self)
+
+    old_value = self[index]
+    if old_value is value and isinstance(value, _Tracked):
+      return
+
+    _Unlink(old_value, self, index)
+    value = _Wrap(value)
+    list.__setitem__(self, index, value)
+    _Link(value, self, index)
+    self._Notify(index)
+
+  def __setslice__(self, i, j, values):
+    self._Restructure(list.__setslice__, i, j, [_Wrap(v) for v in values])
+
+  def __delitem__(self, index):
+    self._Restructure(list.__delitem__, index)
+
+  def __delslice__(self, i, j):
+    self._Restructure(list.__delslice__, i, j)
+
+  def __iadd__(self, values):
+    self.extend(values)
+    return self
+
+  def __imul__(self, n):
+    return self._Restructure(list.__imul__, n)
+
+  def append(self, value):
+    value = _Wrap(value)
+    list.append(self, value)
+    _Link(value, self, len(self) - 1)
+    self._Notify(len(self) - 1)
+
+  def extend(self, values):
+    start = len(self)
+    list.extend(self, [_Wrap(v) for v in values])
+    if len(self) > start:
+      for index in xrange(start, len(self)):
+        _Link(self[index], self, index)
+      self._Notify(len(self) - 1)
+
+  def insert(self, index, value):
+    self._Restructure(list.insert, index, _Wrap(value))
+
+  def pop(self, *index):
+    return self._Restructure(list.pop, *index)
+
+  def remove(self, value):
+    self._Restructure(list.remove, value)
+
+  def reverse(self):
+    self._Restructure(list.reverse)
+
+  def sort(self, *args, **kwargs):
+    self._Restructure(list.sort, *args, **kwargs)
+
+
+class TrackedSet(_Tracked, set):
+  """A set reporting any change as a change of the whole set."""
+
+  _PLAIN_TYPE = set
+
+  def _Mutate(method):  # pylint: disable=no-self-argument
+    """Wraps a set method to report a change after calling it."""
+
+    def Mutate(self, *args):
+      result = method(self, *args)  # pylint: disable=not-callable
+      self._Notify(_ALL)
+      return result
+
+    return Mutate
+
+  add = _Mutate(set.add)
+  clear = _Mutate(set.clear)
+  discard = _Mutate(set.discard)
+  pop = _Mutate(set.pop)
+  remove = _Mutate(set.remove)
+  update = _Mutate(set.update)
+  difference_update = _Mutate(set.difference_update)
+  intersection_update = _Mutate(set.intersection_update)
+  symmetric_difference_update = _Mutate(set.symmetric_difference_update)
+  __ior__ = _Mutate(set.__ior__)
+  __iand__ = _Mutate(set.__iand__)
+  __isub__ = _Mutate(set.__isub__)
+  __ixor__ = _Mutate(set.__ixor__)
+
+  del _Mutate
+
+
+class FlowState(TrackedDict):
+  """The state of a flow.
+
+  Keys can be accessed as attributes:
+
+  self.state.parameter_name = parameter_name
+  """
+
+  def __init__(self, *args, **kwargs):
+    # Keys which were set or deleted.
+    object.__setattr__(self, "_dirty_keys", set())
+    # Keys of changed items of containers, by state key.
+    object.__setattr__(self, "_dirty_items", {})
+    # Persisted lengths of lists, by state key.
+    object.__setattr__(self, "_list_lengths", {})
+    # Digests of persisted values which are not tracked, by state key.
+    object.__setattr__(self, "_digests", {})
+    # Digests of container elements holding values which are not tracked, by
+    # state key and element key.
+    object.__setattr__(self, "_item_digests", {})
+    super(FlowState, self).__init__(*args, **kwargs)
+
+  def __getattribute__(self, name):
+    # Keys take precedence over methods, so flows can use keys like "values".
+    try:
+      return dict.__getitem__(self, name)
+    except KeyError:
+      return object.__getattribute__(self, name)
+
+  def __setattr__(self, name, value):
+    self[name] = value
+
+  def __delattr__(self, name):
+    try:
+      del self[name]
+    except KeyError:
+      raise AttributeError(name)
+
+  def _Notify(self, key):
+    if key is not _ALL:
+      self._dirty_keys.add(key)
+
+  def clear(self):
+    self._dirty_keys.update(self)
+    super(FlowState, self).clear()
+
+  def _ChildChanged(self, key, child_key):
+    if child_key is _ALL:
+      self._dirty_keys.add(key)
+    else:
+      self._dirty_items.setdefault(key, set()).add(child_key)
+
+  def _IsUntracked(self, value):
+    return not isinstance(value, (_Tracked,) + _SCALAR_TYPES)
+
+  def _DirtyItems(self, key, value):
+    """Returns the keys of changed elements of the container at key."""
+    dirty_items = set(self._dirty_items.get(key, ()))
+    for item_key, digest in self._item_digests.get(key, {}).iteritems():
+      if item_key in dirty_items:
+        continue
+      try:
+        item = value[item_key]
+      except (KeyError, IndexError):
+        continue
+      if _NestedDigest(item) != digest:
+        dirty_items.add(item_key)
+    return dirty_items
+
+  def GetDelta(self):
+    """Collects the changes since the state was last persisted.
+
+    Returns:
+      A dict of changes, empty if nothing changed. It can be stored using a
+      protodict and applied to the previous state using ApplyDelta().
+    """
+    delta = {}
+    for key in self._dirty_keys:
+      if key in self:
+        delta.setdefault("set", {})[key] = self[key]
+      else:
+        delta.setdefault("deleted", []).append(key)
+
+    for key, value in dict.iteritems(self):
+      if key in self._dirty_keys:
+        continue
+
+      if isinstance(value, TrackedDict):
+        for item_key in self._DirtyItems(key, value):
+          if item_key in value:
+            delta.setdefault("items", {}).setdefault(key, {})[item_key] = (
+                value[item_key])
+          else:
+            delta.setdefault("deleted_items", {}).setdefault(
+                key, []).append(item_key)
+
+      elif isinstance(value, TrackedList):
+        length = self._list_lengths.get(key, 0)
+        for index in sorted(self._DirtyItems(key, value)):
+          if index < length:
+            delta.setdefault("list_items", {}).setdefault(key, []).append(
+                [index, value[index]])
+        if len(value) > length:
+          delta.setdefault("appends", {})[key] = value[length:]
+
+      elif self._IsUntracked(value):
+        if _Digest(value) != self._digests.get(key):
+          delta.setdefault("set", {})[key] = value
+
+    return delta
+
+  def MarkPersisted(self):
+    """Marks the current state as persisted."""
+    self._dirty_keys.clear()
+    self._dirty_items.clear()
+    self._list_lengths.clear()
+    self._digests.clear()
+    self._item_digests.clear()
+
+    for key, value in dict.iteritems(self):
+      if isinstance(value, TrackedList):
+        self._list_lengths[key] = len(value)
+      elif self._IsUntracked(value):
+        self._digests[key] = _Digest(value)
+
+      if isinstance(value, (TrackedDict, TrackedList)):
+        for item_key, item in _Items(value):
+          digest = _NestedDigest(item)
+          if digest is not None:
+            self._item_digests.setdefault(key, {})[item_key] = digest
+
+  def ToDict(self):
+    """Returns a copy of the state using plain dicts, lists and sets."""
+    return _Unwrap(self)
+
+
+def ApplyDelta(state, delta):
+  """Applies a delta returned by FlowState.GetDelta() to a plain dict.
+
+  Args:
+    state: A dict holding the state the delta was taken against.
+    delta: The delta, as returned by the ToDict() method of the protodict it
+        was stored in.
+  """
+  for key in delta.get("deleted", []):
+    state.pop(key, None)
+
+  state.update(delta.get("set", {}))
+
+  for key, item_keys in delta.get("deleted_items", {}).iteritems():
+    for item_key in item_keys:
+      state[key].pop(item_key, None)
+
+  for key, items in delta.get("items", {}).iteritems():
+    state[key].update(items)
+
+  for key, items in delta.get("list_items", {}).iteritems():
+    for index, value in items:
+      state[key][index] = value
+
+  for key, values in delta.get("appends", {}).iteritems():
+    state[key].extend(values)
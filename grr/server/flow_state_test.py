@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""Tests for grr.server.flow_state."""
+
+
+import copy
+import random
+
+from grr.lib import flags
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import protodict as rdf_protodict
+from grr.server import flow_state
+from grr.test_lib import test_lib
+
+
+def _Persisted(state):
+  """Returns a plain dict as read back from a snapshot of the state."""
+  protodict = rdf_protodict.AttributedDict().FromDict(state)
+  return rdf_protodict.AttributedDict.FromSerializedString(
+      protodict.SerializeToString()).ToDict()
+
+
+def _ApplyDelta(persisted, delta):
+  protodict = rdf_protodict.Dict().FromDict(delta)
+  flow_state.ApplyDelta(
+      persisted,
+      rdf_protodict.Dict.FromSerializedString(
+          protodict.SerializeToString()).ToDict())
+
+
+class FlowStateTest(test_lib.GRRBaseTest):
+
+  def _CreateState(self, **kwargs):
+    state = flow_state.FlowState(kwargs)
+    state.MarkPersisted()
+    return state
+
+  def testAttributeAccess(self):
+    state = flow_state.FlowState()
+    state.foo = 1
+    self.assertEqual(state["foo"], 1)
+    self.assertEqual(state.get("foo"), 1)
+
+    del state.foo
+    self.assertFalse(hasattr(state, "foo"))
+    with self.assertRaises(AttributeError):
+      del state.foo
+
+    # Keys take precedence over dict methods.
+    state.values = [1]
+    self.assertEqual(state.values, [1])
+
+  def testUnchangedStateHasEmptyDelta(self):
+    state = self._CreateState(
+        number=1,
+        trackers={1: {"a": [1, 2]}},
+        stat_entry=rdf_client.StatEntry(st_size=1))
+    self.assertEqual(state.GetDelta(), {})
+
+    # Assigning an unchanged container again is not a change either.
+    state.trackers = state.trackers
+    self.assertEqual(state.GetDelta(), {})
+
+  def testOnlyChangedItemsAreInDelta(self):
+    state = self._CreateState(
+        trackers=dict((i, {"index": i}) for i in range(10000)), number=0)
+
+    state.number += 1
+    state.trackers[5]["hash"] = "abc"
+    state.trackers.pop(6)
+    state.trackers[7] = {"index": 7}
+
+    self.assertEqual(state.GetDelta(), {
+        "set": {
+            "number": 1
+        },
+        "items": {
+            "trackers": {
+                5: {
+                    "index": 5,
+                    "hash": "abc"
+                },
+                7: {
+                    "index": 7
+                }
+            }
+        },
+        "deleted_items": {
+            "trackers": [6]
+        }
+    })
+
+    state.MarkPersisted()
+    self.assertEqual(state.GetDelta(), {})
+
+  def testMovedContainersAreTracked(self):
+    state = self._CreateState(pending={1: {"index": 1}}, done={})
+
+    tracker = state.pending.pop(1)
+    state.done[1] = tracker
+    state.MarkPersisted()
+
+    tracker["size"] = 10
+    self.assertEqual(state.GetDelta(), {
+        "items": {
+            "done": {
+                1: {
+                    "index": 1,
+                    "size": 10
+                }
+            }
+        }
+    })
+
+  def testAppendsOnlyWriteNewItems(self):
+    state = self._CreateState(values=range(1000))
+
+    state.values.append(1000)
+    state.values.extend([1001, 1002])
+    state.values += [1003]
+    state.values[3] = None
+
+    self.assertEqual(state.GetDelta(), {
+        "list_items": {
+            "values": [[3, None]]
+        },
+        "appends": {
+            "values": [1000, 1001, 1002, 1003]
+        }
+    })
+
+  def testRestructuredListsAreWrittenInFull(self):
+    state = self._CreateState(values=[[1], [2], [3]])
+
+    inner = state.values[2]
+    state.values.pop(0)
+    state.MarkPersisted()
+
+    # The inner list moved to index 1.
+    inner.append(4)
+    self.assertEqual(state.GetDelta(), {
+        "list_items": {
+            "values": [[1, [3, 4]]]
+        }
+    })
+
+    state.values.sort(reverse=True)
+    self.assertEqual(state.GetDelta(), {"set": {"values": [[3, 4], [2]]}})
+
+  def testSetChangesWriteTheWholeSet(self):
+    state = self._CreateState(seen=set([1, 2]), nested={"seen": set()})
+
+    state.seen.add(3)
+    state.nested["seen"] |= set([4])
+
+    self.assertEqual(state.GetDelta(), {
+        "set": {
+            "seen": set([1, 2, 3])
+        },
+        "items": {
+            "nested": {
+                "seen": set([4])
+            }
+        }
+    })
+
+  def testRDFValuesChangedInPlaceAreDetected(self):
+    state = self._CreateState(stat_entry=rdf_client.StatEntry(st_size=1))
+
+    state.stat_entry.st_size = 2
+    self.assertEqual(state.GetDelta(), {
+        "set": {
+            "stat_entry": rdf_client.StatEntry(st_size=2)
+        }
+    })
+
+  def testNestedRDFValuesChangedInPlaceAreDetected(self):
+    state = self._CreateState(
+        trackers=dict((i, {
+            "stat_entry": rdf_client.StatEntry(st_size=i)
+        }) for i in range(10)),
+        stat_entries=[rdf_client.StatEntry(st_size=i) for i in range(10)])
+    persisted = _Persisted(state)
+
+    state.trackers[5]["stat_entry"].st_size = 50
+    state.stat_entries[3].st_size = 30
+    delta = state.GetDelta()
+    self.assertEqual(delta, {
+        "items": {
+            "trackers": {
+                5: {
+                    "stat_entry": rdf_client.StatEntry(st_size=50)
+                }
+            }
+        },
+        "list_items": {
+            "stat_entries": [[3, rdf_client.StatEntry(st_size=30)]]
+        }
+    })
+
+    # The changes survive reloading the state.
+    _ApplyDelta(persisted, delta)
+    self.assertEqual(persisted, _Persisted(state))
+
+    state.MarkPersisted()
+    self.assertEqual(state.GetDelta(), {})
+
+  def testClearedStateDeletesAllKeys(self):
+    state = self._CreateState(a=1, b=2)
+
+    state.clear()
+    self.assertEqual(sorted(state.GetDelta()["deleted"]), ["a", "b"])
+
+  def testCopiesAreNotTracked(self):
+    state = self._CreateState(trackers={1: {"index": 1}})
+
+    trackers = copy.deepcopy(state.trackers)
+    self.assertEqual(type(trackers), dict)
+    self.assertEqual(type(trackers[1]), dict)
+
+    trackers[1]["size"] = 10
+    self.assertEqual(state.GetDelta(), {})
+    self.assertEqual(state.ToDict(), {"trackers": {1: {"index": 1}}})
+
+  def testAppliedDeltasMatchSnapshots(self):
+    rand = random.Random(42)
+    state = self._CreateState(
+        trackers=dict((i, {"index": i}) for i in range(100)),
+        values=range(100),
+        seen=set(),
+        counter=0)
+    persisted = _Persisted(state)
+
+    for _ in range(20):
+      for _ in range(rand.randint(1, 20)):
+        operation = rand.randint(0, 7)
+        index = rand.randint(0, 99)
+        if operation == 0:
+          state.counter += 1
+        elif operation == 1:
+          state.trackers.pop(index, None)
+        elif operation == 2:
+          state.trackers.setdefault(index, {"index": index}).setdefault(
+              "hashes", []).append(rand.random())
+        elif operation == 3:
+          state.values.append({"new": index})
+        elif operation == 4:
+          state.values[index] = [index]
+        elif operation == 5:
+          state.seen.add(index)
+        elif operation == 6:
+          state.values.insert(0, index)
+        else:
+          state["key_%d" % index] = {"value": index}
+
+      _ApplyDelta(persisted, state.GetDelta())
+      state.MarkPersisted()
+
+      self.assertEqual(persisted, _Persisted(state))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -221,6 +221,80 @@ class FlowCreationTest(BasicFlowTest):
         client_id=self.client_id):
       pass
 
+  def _ChangeFlowState(self, session_id, callback):
+    with aff4.FACTORY.Open(session_id, mode="rw", token=self.token) as flow_obj:
+      callback(flow_obj.state)
+
+  def _ReadFlowState(self, session_id):
+    return aff4.FACTORY.Open(session_id, token=self.token).state.ToDict()
+
+  def _CountStateDeltas(self, session_id):
+    return len(
+        data_store.DB.ResolvePrefix(
+            session_id,
+            flow.GRRFlow.SchemaCls.FLOW_STATE_DELTA.predicate,
+            timestamp=data_store.DB.ALL_TIMESTAMPS,
+            token=self.token))
+
+  def testFlowStateChangesAreWrittenAsDeltas(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name=flow_test_lib.FlowOrderTest.__name__,
+        token=self.token)
+
+    def AddTrackers(state):
+      state.trackers = dict((i, {"index": i}) for i in range(1000))
+      state.done = []
+
+    def ChangeTracker(state):
+      tracker = state.trackers.pop(5)
+      tracker["size"] = 10
+      state.done.append(tracker)
+
+    self._ChangeFlowState(session_id, AddTrackers)
+    for _ in range(3):
+      self._ChangeFlowState(session_id, lambda state: None)
+    self.assertEqual(self._CountStateDeltas(session_id), 0)
+
+    self._ChangeFlowState(session_id, ChangeTracker)
+    self.assertEqual(self._CountStateDeltas(session_id), 1)
+
+    state = self._ReadFlowState(session_id)
+    self.assertEqual(len(state["trackers"]), 999)
+    self.assertEqual(state["trackers"][6], {"index": 6})
+    self.assertEqual(state["done"][0].ToDict(), {"index": 5, "size": 10})
+
+  def testFlowStateDeltasAreCompacted(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name=flow_test_lib.FlowOrderTest.__name__,
+        token=self.token)
+    self._ChangeFlowState(session_id,
+                          lambda state: state.update(values=range(1000)))
+
+    with utils.Stubber(flow.GRRFlow, "MAX_STATE_DELTAS", 3):
+      for i in range(10):
+        self._ChangeFlowState(session_id,
+                              lambda state, i=i: state["values"].append(i))
+        self.assertLessEqual(self._CountStateDeltas(session_id), 3)
+
+    self.assertEqual(
+        self._ReadFlowState(session_id)["values"], range(1000) + range(10))
+
+  def testUnchangedFlowArgsAreNotWritten(self):
+    session_id = flow.GRRFlow.StartFlow(
+        client_id=self.client_id,
+        flow_name=flow_test_lib.FlowOrderTest.__name__,
+        token=self.token)
+
+    with aff4.FACTORY.Open(session_id, mode="rw", token=self.token) as flow_obj:
+      flow_obj.state.foo = "bar"
+      flow_obj.WriteState()
+      self.assertNotIn(flow_obj.Schema.FLOW_ARGS, flow_obj.new_attributes)
+      self.assertNotIn(flow_obj.Schema.FLOW_RUNNER_ARGS,
+                       flow_obj.new_attributes)
+      self.assertIn(flow_obj.Schema.FLOW_STATE_DELTA, flow_obj.new_attributes)
+
   def testTerminate(self):
     session_id = flow.GRRFlow.StartFlow(
         client_id=self.client_id,
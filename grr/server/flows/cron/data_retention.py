@@ -2,13 +2,18 @@
 """These cron flows do the datastore cleanup."""
 
 
+import time
 
 from grr import config
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib import utils
 from grr.server import aff4
 from grr.server import client_index
+from grr.server import data_store
 from grr.server import flow
+from grr.server import retention_index
 
 from grr.server.aff4_objects import aff4_grr
 from grr.server.aff4_objects import cronjobs
@@ -16,36 +21,172 @@ from grr.server.aff4_objects import cronjobs
 from grr.server.hunts import implementation
 
 
-class CleanHunts(cronjobs.SystemCronFlow):
-  """Cleaner that deletes old hunts."""
+class IndexedCleanerCronFlow(cronjobs.SystemCronFlow):
+  """Base class of the cleaners reading expired objects from an index.
+
+  Only the buckets of the retention index older than the deadline are read,
+  so the cost of a run depends on the number of objects which expire rather
+  than on the number of all objects.
+  """
 
   frequency = rdfvalue.Duration("1d")
   lifetime = rdfvalue.Duration("1d")
 
+  # Name of the retention index of the objects to delete.
+  index_name = None
+
+  # Type of the objects to delete.
+  aff4_type = None
+
+  # Maximum number of objects opened and deleted at once.
+  batch_size = 1000
+
+  __abstract = True  # pylint: disable=g-bad-name
+
+  def ListAllObjects(self):
+    """Lists all the objects, used to fill the index when it is created."""
+    raise NotImplementedError()
+
+  def GetTime(self, obj):
+    """Returns the time the given object expires from."""
+    raise NotImplementedError()
+
+  def DeleteExpired(self, ttl, exception_label):
+    """Deletes the objects whose time is older than ttl.
+
+    Args:
+      ttl: An rdfvalue.Duration.
+      exception_label: Objects with this label are never deleted.
+    """
+    index = retention_index.RetentionIndex(self.index_name, token=self.token)
+    if not index.IsInitialized():
+      self._FillIndex(index)
+
+    deadline = rdfvalue.RDFDatetime.Now() - ttl
+    start = time.time()
+    checked = deleted = 0
+    for bucket in index.ListBuckets(deadline):
+      bucket_checked, bucket_deleted = self._CleanBucket(
+          index, bucket, deadline, exception_label)
+      checked += bucket_checked
+      deleted += bucket_deleted
+
+    self.Log("Deleted %d of %d checked objects in %.1fs.", deleted, checked,
+             time.time() - start)
+
+  def ResetIndex(self):
+    """Makes the index be filled again by the next run with a TTL.
+
+    Nothing is recorded in the index while its TTL is not configured.
+    """
+    retention_index.RetentionIndex(
+        self.index_name, token=self.token).MarkUninitialized()
+
+  def _FillIndex(self, index):
+    """Adds the objects which were created before the index to it."""
+    for urns in utils.Grouper(self.ListAllObjects(), self.batch_size):
+      with data_store.DB.GetMutationPool(token=self.token) as pool:
+        for obj in aff4.FACTORY.MultiOpen(
+            urns, aff4_type=self.aff4_type, mode="r", token=self.token):
+          index.Add(obj.urn, self.GetTime(obj), pool)
+      self.HeartBeat()
+
+    index.MarkInitialized()
+
+  def _CleanBucket(self, index, bucket, deadline, exception_label):
+    """Deletes the expired objects recorded in a bucket of the index.
+
+    Args:
+      index: The RetentionIndex.
+      bucket: The bucket to read.
+      deadline: Objects with a time before this are deleted.
+      exception_label: Objects with this label are never deleted.
+
+    Returns:
+      A tuple of the number of checked and the number of deleted objects.
+    """
+    checked = deleted = 0
+    # Urns which have to be removed from the bucket and whether any urn has
+    # to stay in it.
+    removed = []
+    keep_bucket = False
+
+    for urns in utils.Grouper(index.ReadBucket(bucket), self.batch_size):
+      objects = {}
+      for obj in aff4.FACTORY.MultiOpen(
+          urns, aff4_type=self.aff4_type, mode="r", token=self.token):
+        objects[obj.urn] = obj
+
+      expired_urns = []
+      with data_store.DB.GetMutationPool(token=self.token) as pool:
+        for urn in urns:
+          obj = objects.get(urn)
+          if obj is None:
+            # The object was deleted already.
+            removed.append(urn)
+            continue
+
+          if exception_label in obj.GetLabelsNames():
+            keep_bucket = True
+            continue
+
+          timestamp = self.GetTime(obj)
+          if timestamp < deadline:
+            expired_urns.append(urn)
+            removed.append(urn)
+          elif index.Add(urn, timestamp, pool) != bucket:
+            # The object was written to since it was recorded.
+            removed.append(urn)
+          else:
+            keep_bucket = True
+
+      aff4.FACTORY.MultiDelete(expired_urns, token=self.token)
+
+      checked += len(urns)
+      deleted += len(expired_urns)
+      stats.STATS.IncrementCounter(
+          "data_retention_checked_objects",
+          delta=len(urns),
+          fields=[self.index_name])
+      stats.STATS.IncrementCounter(
+          "data_retention_deleted_objects",
+          delta=len(expired_urns),
+          fields=[self.index_name])
+      self.HeartBeat()
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      if keep_bucket or not index.IsBucketExpired(bucket, deadline):
+        for urn in removed:
+          index.Remove(urn, bucket, pool)
+      else:
+        index.DeleteBucket(bucket, pool)
+
+    return checked, deleted
+
+
+class CleanHunts(IndexedCleanerCronFlow):
+  """Cleaner that deletes old hunts."""
+
+  index_name = retention_index.HUNTS
+  aff4_type = implementation.GRRHunt
+
+  def ListAllObjects(self):
+    hunts_root = aff4.FACTORY.Open("aff4:/hunts", token=self.token)
+    return list(hunts_root.ListChildren())
+
+  def GetTime(self, obj):
+    return obj.GetRunner().context.expires
+
   @flow.StateHandler()
   def Start(self):
     hunts_ttl = config.CONFIG["DataRetention.hunts_ttl"]
     if not hunts_ttl:
       self.Log("TTL not set - nothing to do...")
+      self.ResetIndex()
       return
 
-    exception_label = config.CONFIG["DataRetention.hunts_ttl_exception_label"]
-
-    hunts_root = aff4.FACTORY.Open("aff4:/hunts", token=self.token)
-    hunts_urns = list(hunts_root.ListChildren())
-
-    deadline = rdfvalue.RDFDatetime.Now() - hunts_ttl
-
-    hunts = aff4.FACTORY.MultiOpen(
-        hunts_urns, aff4_type=implementation.GRRHunt, token=self.token)
-    for hunt in hunts:
-      if exception_label in hunt.GetLabelsNames():
-        continue
-
-      runner = hunt.GetRunner()
-      if runner.context.expires < deadline:
-        aff4.FACTORY.Delete(hunt.urn, token=self.token)
-        self.HeartBeat()
+    self.DeleteExpired(
+        hunts_ttl, config.CONFIG["DataRetention.hunts_ttl_exception_label"])
 
 
 class CleanCronJobs(cronjobs.SystemCronFlow):
@@ -71,74 +212,60 @@ class CleanCronJobs(cronjobs.SystemCronFlow):
       self.HeartBeat()
 
 
-class CleanTemp(cronjobs.SystemCronFlow):
+class CleanTemp(IndexedCleanerCronFlow):
   """Cleaner that deletes temp objects."""
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("1d")
+  index_name = retention_index.TMP
+
+  def ListAllObjects(self):
+    tmp_root = aff4.FACTORY.Open("aff4:/tmp", mode="r", token=self.token)
+    return list(tmp_root.ListChildren())
+
+  def GetTime(self, obj):
+    return obj.Get(obj.Schema.LAST, rdfvalue.RDFDatetime(0))
 
   @flow.StateHandler()
   def Start(self):
     tmp_ttl = config.CONFIG["DataRetention.tmp_ttl"]
     if not tmp_ttl:
       self.Log("TTL not set - nothing to do...")
+      self.ResetIndex()
       return
 
-    exception_label = config.CONFIG["DataRetention.tmp_ttl_exception_label"]
+    self.DeleteExpired(
+        tmp_ttl, config.CONFIG["DataRetention.tmp_ttl_exception_label"])
 
-    tmp_root = aff4.FACTORY.Open("aff4:/tmp", mode="r", token=self.token)
-    tmp_urns = list(tmp_root.ListChildren())
-
-    deadline = rdfvalue.RDFDatetime.Now() - tmp_ttl
-
-    for tmp_group in utils.Grouper(tmp_urns, 10000):
-      expired_tmp_urns = []
-      for tmp_obj in aff4.FACTORY.MultiOpen(
-          tmp_group, mode="r", token=self.token):
-        if exception_label in tmp_obj.GetLabelsNames():
-          continue
 
-        if tmp_obj.Get(tmp_obj.Schema.LAST) < deadline:
-          expired_tmp_urns.append(tmp_obj.urn)
-
-      aff4.FACTORY.MultiDelete(expired_tmp_urns, token=self.token)
-      self.HeartBeat()
+class CleanInactiveClients(IndexedCleanerCronFlow):
+  """Cleaner that deletes inactive clients."""
 
+  index_name = retention_index.CLIENTS
+  aff4_type = aff4_grr.VFSGRRClient
 
-class CleanInactiveClients(cronjobs.SystemCronFlow):
-  """Cleaner that deletes inactive clients."""
+  def ListAllObjects(self):
+    index = client_index.CreateClientIndex(token=self.token)
+    return index.LookupClients(["."])
 
-  frequency = rdfvalue.Duration("1d")
-  lifetime = rdfvalue.Duration("1d")
+  def GetTime(self, obj):
+    return obj.Get(obj.Schema.LAST, rdfvalue.RDFDatetime(0))
 
   @flow.StateHandler()
   def Start(self):
     inactive_client_ttl = config.CONFIG["DataRetention.inactive_client_ttl"]
     if not inactive_client_ttl:
       self.Log("TTL not set - nothing to do...")
+      self.ResetIndex()
       return
 
-    exception_label = config.CONFIG[
-        "DataRetention.inactive_client_ttl_exception_label"]
+    self.DeleteExpired(
+        inactive_client_ttl,
+        config.CONFIG["DataRetention.inactive_client_ttl_exception_label"])
 
-    index = client_index.CreateClientIndex(token=self.token)
-
-    client_urns = index.LookupClients(["."])
-
-    deadline = rdfvalue.RDFDatetime.Now() - inactive_client_ttl
 
-    for client_group in utils.Grouper(client_urns, 1000):
-      inactive_client_urns = []
-      for client in aff4.FACTORY.MultiOpen(
-          client_group,
-          mode="r",
-          aff4_type=aff4_grr.VFSGRRClient,
-          token=self.token):
-        if exception_label in client.GetLabelsNames():
-          continue
+class DataRetentionInit(registry.InitHook):
 
-        if client.Get(client.Schema.LAST) < deadline:
-          inactive_client_urns.append(client.urn)
-
-      aff4.FACTORY.MultiDelete(inactive_client_urns, token=self.token)
-      self.HeartBeat()
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric(
+        "data_retention_checked_objects", fields=[("index", str)])
+    stats.STATS.RegisterCounterMetric(
+        "data_retention_deleted_objects", fields=[("index", str)])
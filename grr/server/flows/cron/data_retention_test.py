@@ -8,10 +8,12 @@ import re
 from grr import config
 from grr.lib import flags
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import utils
 from grr.server import aff4
 from grr.server import data_store
 from grr.server import flow
+from grr.server import retention_index
 from grr.server.aff4_objects import cronjobs
 from grr.server.aff4_objects import standard as aff4_standard
 from grr.server.data_stores import fake_data_store
@@ -299,6 +301,110 @@ class CleanTempTest(flow_test_lib.FlowTestsBaseclass):
       self.assertEqual(len(tmp_urns), 3)
 
 
+class CleanTempIndexTest(flow_test_lib.FlowTestsBaseclass):
+  """Test that the CleanTemp flow only reads the expired part of the index."""
+
+  NUM_TMP = 5
+  DAY = 24 * 3600
+
+  def setUp(self):
+    super(CleanTempIndexTest, self).setUp()
+    # Objects are only recorded in the index while a TTL is configured.
+    self.config_overrider = test_lib.ConfigOverrider({
+        "DataRetention.tmp_ttl": rdfvalue.Duration("2d")
+    })
+    self.config_overrider.Start()
+
+    # Every object is written to in a different day.
+    for i in range(self.NUM_TMP):
+      self._WriteTemp(i, self.DAY * i + 40)
+
+    # All the objects were recorded when they were written, so there is
+    # nothing to fill the index with.
+    retention_index.RetentionIndex(
+        retention_index.TMP, token=self.token).MarkInitialized()
+
+  def tearDown(self):
+    self.config_overrider.Stop()
+    super(CleanTempIndexTest, self).tearDown()
+
+  def _WriteTemp(self, i, timestamp):
+    with test_lib.FakeTime(timestamp):
+      aff4.FACTORY.Create(
+          "aff4:/tmp/%s" % i,
+          aff4_standard.TempMemoryFile,
+          mode="rw",
+          token=self.token).Close()
+
+  def _RunCleanTemp(self, timestamp):
+    """Runs CleanTemp and returns the number of objects it checked."""
+    checked = stats.STATS.GetMetricValue(
+        "data_retention_checked_objects", fields=[retention_index.TMP])
+    with test_lib.FakeTime(timestamp):
+      flow.GRRFlow.StartFlow(
+          flow_name=data_retention.CleanTemp.__name__,
+          sync=True,
+          token=self.token)
+
+    return stats.STATS.GetMetricValue(
+        "data_retention_checked_objects",
+        fields=[retention_index.TMP]) - checked
+
+  def _ListTemp(self):
+    return sorted(
+        urn.Basename()
+        for urn in aff4.FACTORY.Open("aff4:/tmp", token=self.token)
+        .ListChildren())
+
+  def testOnlyObjectsInExpiredBucketsAreChecked(self):
+    self.assertEqual(self._RunCleanTemp(4 * self.DAY + 100), 3)
+    self.assertEqual(self._ListTemp(), ["3", "4"])
+
+    # The buckets of the deleted objects are empty now.
+    self.assertEqual(self._RunCleanTemp(4 * self.DAY + 100), 0)
+    self.assertEqual(self._ListTemp(), ["3", "4"])
+
+  def testObjectWrittenToAgainIsMovedInTheIndex(self):
+    self._WriteTemp(0, 3 * self.DAY + 40)
+
+    # The object is not in its old bucket anymore.
+    self.assertEqual(self._RunCleanTemp(4 * self.DAY + 100), 2)
+    self.assertEqual(self._ListTemp(), ["0", "3", "4"])
+
+    # The object is deleted once its new bucket expires.
+    self.assertEqual(self._RunCleanTemp(6 * self.DAY), 2)
+    self.assertEqual(self._ListTemp(), ["4"])
+
+  def testBucketsAreListedOnceByEveryProcess(self):
+    index = retention_index.RetentionIndex(
+        retention_index.TMP, token=self.token)
+    subjects = []
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      original_set = pool.Set
+
+      def Set(subject, attribute, value, **kwargs):
+        subjects.append(subject)
+        original_set(subject, attribute, value, **kwargs)
+
+      with utils.Stubber(pool, "Set", Set):
+        for i in range(10):
+          index.Add("aff4:/tmp/other%d" % i,
+                    rdfvalue.RDFDatetime.FromSecondsFromEpoch(40), pool)
+
+    # Day 0 was listed on the index row when the objects were written.
+    self.assertEqual(len(subjects), 10)
+    self.assertNotIn(index.urn, subjects)
+
+  def testNothingIsRecordedWithoutTTL(self):
+    self.config_overrider.Stop()
+    self._WriteTemp(5, 40)
+    self.config_overrider.Start()
+
+    self.assertEqual(self._RunCleanTemp(4 * self.DAY + 100), 3)
+    self.assertEqual(self._ListTemp(), ["3", "4", "5"])
+
+
 class CleanInactiveClientsTest(flow_test_lib.FlowTestsBaseclass):
   """Test the CleanTemp flow."""
 
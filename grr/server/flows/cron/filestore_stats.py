@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """Filestore stats crons."""
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import stats as stats_lib
 from grr.lib import utils
@@ -8,6 +9,7 @@ from grr.server import aff4
 from grr.server import flow
 
 from grr.server.aff4_objects import cronjobs
+from grr.server.aff4_objects import filestore
 from grr.server.aff4_objects import stats as aff4_stats
 
 
@@ -19,9 +21,8 @@ class ClassCounter(object):
     self.value_dict = {}
     self.graph = self.attribute(title=title)
 
-  def ProcessFile(self, fd):
-    classname = fd.__class__.__name__
-    self.value_dict[classname] = self.value_dict.get(classname, 0) + 1
+  def Load(self, totals):
+    self.value_dict = dict(totals.counts)
 
   def Save(self, fd):
     for classname, count in self.value_dict.items():
@@ -34,10 +35,8 @@ class ClassFileSizeCounter(ClassCounter):
 
   GB = 1024 * 1024 * 1024
 
-  def ProcessFile(self, fd):
-    classname = fd.__class__.__name__
-    self.value_dict[classname] = self.value_dict.get(
-        classname, 0) + fd.Get(fd.Schema.SIZE)
+  def Load(self, totals):
+    self.value_dict = dict(totals.sizes)
 
   def Save(self, fd):
     for classname, count in self.value_dict.items():
@@ -55,7 +54,7 @@ class GraphDistribution(stats_lib.Distribution):
     self.graph = self.attribute(title=title)
     super(GraphDistribution, self).__init__(bins=self._bins)
 
-  def ProcessFile(self, fd):
+  def Load(self, totals):
     raise NotImplementedError()
 
   def Save(self, fd):
@@ -69,18 +68,22 @@ class GraphDistribution(stats_lib.Distribution):
 class FileSizeHistogram(GraphDistribution):
   """Graph filesize."""
 
-  _bins = [
-      0, 2, 50, 100, 1e3, 10e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6, 100e6,
-      500e6, 1e9, 5e9, 10e9
-  ]
+  _bins = filestore.FileStoreStatsTotals.SIZE_BINS
 
-  def ProcessFile(self, fd):
-    self.Record(fd.Get(fd.Schema.SIZE))
+  def Load(self, totals):
+    for size_bin, count in totals.histogram.iteritems():
+      self.heights[list(self.bins).index(size_bin)] = count
 
 
 class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
-  """Build statistics about the filestore."""
-  frequency = rdfvalue.Duration("1w")
+  """Build statistics about the filestore.
+
+  The statistics are kept up to date by HashFileStore.AddFile in sharded
+  counters, so a run only merges the files added since the last one. All the
+  files are counted on the first run and then every
+  FileStore.stats_full_scan_interval, if set.
+  """
+  frequency = rdfvalue.Duration("1d")
   lifetime = rdfvalue.Duration("1d")
   HASH_PATH = "aff4:/files/hash/generic/sha256"
   FILESTORE_STATS_URN = rdfvalue.RDFURN("aff4:/stats/FileStoreStats")
@@ -97,9 +100,41 @@ class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
                           "Filesize distribution in bytes"),
     ]
 
+  def _NeedsFullScan(self, counters):
+    last_full_scan = counters.LastFullScan()
+    if last_full_scan is None:
+      return True
+
+    interval = config.CONFIG["FileStore.stats_full_scan_interval"]
+    return bool(
+        interval and last_full_scan < rdfvalue.RDFDatetime.Now() - interval)
+
+  def _FullScan(self, counters):
+    """Counts all the files in the filestore and resets the counters."""
+    scan_start = rdfvalue.RDFDatetime.Now()
+    totals = filestore.FileStoreStatsTotals()
+    hashes = aff4.FACTORY.Open(
+        self.HASH_PATH, token=self.token).ListChildren(limit=10**8)
+
+    for urns in utils.Grouper(hashes, self.OPEN_FILES_LIMIT):
+      for fd in aff4.FACTORY.MultiOpen(
+          urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
+        totals.Record(fd.__class__.__name__, fd.Get(fd.Schema.SIZE))
+      self.HeartBeat()
+
+    counters.Reset(totals, scan_start)
+    self.Log("Counted %d files in the filestore.", sum(totals.counts.values()))
+    return totals
+
   @flow.StateHandler()
   def Start(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
+    """Merges the filestore counters and saves them as graphs."""
+    counters = filestore.FileStoreStatsCounters(token=self.token)
+    if self._NeedsFullScan(counters):
+      totals = self._FullScan(counters)
+    else:
+      totals = counters.Merge()
+
     self.stats = aff4.FACTORY.Create(
         self.FILESTORE_STATS_URN,
         aff4_stats.FilestoreStats,
@@ -107,19 +142,7 @@ class FilestoreStatsCronFlow(cronjobs.SystemCronFlow):
         token=self.token)
 
     self._CreateConsumers()
-    hashes = aff4.FACTORY.Open(
-        self.HASH_PATH, token=self.token).ListChildren(limit=10**8)
-
-    try:
-      for urns in utils.Grouper(hashes, self.OPEN_FILES_LIMIT):
-        for fd in aff4.FACTORY.MultiOpen(
-            urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
-
-          for consumer in self.consumers:
-            consumer.ProcessFile(fd)
-        self.HeartBeat()
-
-    finally:
-      for consumer in self.consumers:
-        consumer.Save(self.stats)
-      self.stats.Close()
+    for consumer in self.consumers:
+      consumer.Load(totals)
+      consumer.Save(self.stats)
+    self.stats.Close()
@@ -2,6 +2,7 @@
 """Tests for grr.server.flows.cron.filestore_stats."""
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.server import aff4
 from grr.server.aff4_objects import filestore as aff4_filestore
 from grr.server.flows.cron import filestore_stats
@@ -75,6 +76,60 @@ class FilestoreStatsCronFlowTest(flow_test_lib.FlowTestsBaseclass):
     self.assertEqual(filesizes.data[9].y_value, 5)
     self.assertEqual(filesizes.data[-1].y_value, 1)
 
+  def _RunCron(self, timestamp):
+    with test_lib.FakeTime(timestamp):
+      for _ in flow_test_lib.TestFlowHelper(
+          filestore_stats.FilestoreStatsCronFlow.__name__, token=self.token):
+        pass
+
+    fd = aff4.FACTORY.Open(
+        filestore_stats.FilestoreStatsCronFlow.FILESTORE_STATS_URN,
+        token=self.token)
+    return fd.Get(fd.Schema.FILESTORE_FILETYPES).data[0].y_value
+
+  def _AddFile(self, name, record):
+    with test_lib.FakeTime(200):
+      with aff4.FACTORY.Create(
+          "aff4:/files/hash/generic/sha256/%s" % name,
+          aff4_filestore.FileStoreImage,
+          token=self.token) as newfd:
+        newfd.size = 100
+
+      if record:
+        aff4_filestore.FileStoreStatsCounters(token=self.token).RecordFile(
+            name, aff4_filestore.FileStoreImage.__name__, 100)
+
+  def testOnlyRecordedFilesAreMerged(self):
+    self.assertEqual(self._RunCron(100), 12)
+
+    self._AddFile("recorded", True)
+    self._AddFile("unrecorded", False)
+    # Adding the same file again doesn't count it twice.
+    self._AddFile("recorded", True)
+
+    self.assertEqual(self._RunCron(300), 13)
+    self.assertEqual(self._RunCron(400), 13)
+
+    fd = aff4.FACTORY.Open(
+        filestore_stats.FilestoreStatsCronFlow.FILESTORE_STATS_URN,
+        token=self.token)
+    filesizes = fd.Get(fd.Schema.FILESTORE_FILESIZE_HISTOGRAM)
+    self.assertEqual(filesizes.data[3].x_value, 100)
+    self.assertEqual(filesizes.data[3].y_value, 1)
+
+  def testFullScanCountsUnrecordedFiles(self):
+    self._RunCron(100)
+    self._AddFile("recorded", True)
+    self._AddFile("unrecorded", False)
+
+    with test_lib.ConfigOverrider({
+        "FileStore.stats_full_scan_interval": rdfvalue.Duration("1d")
+    }):
+      self.assertEqual(self._RunCron(300), 13)
+      self.assertEqual(self._RunCron(2 * 24 * 3600), 14)
+      self.assertEqual(self._RunCron(2 * 24 * 3600 + 100), 14)
+
+
 
 def main(argv):
   # Run the full test suite
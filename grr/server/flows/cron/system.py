@@ -15,6 +15,7 @@ from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import stats as rdfstats
 from grr.server import access_control
 from grr.server import aff4
+from grr.server import client_stats_store
 from grr.server import data_store
 from grr.server import export_utils
 from grr.server import flow
@@ -305,6 +306,8 @@ class PurgeClientStats(cronjobs.SystemCronFlow):
 
   # Keep stats for one month.
   MAX_AGE = 31 * 24 * 3600
+  # Samples which are not rolled up take the most space, keep them one week.
+  MAX_RAW_AGE = 7 * 24 * 3600
 
   @flow.StateHandler()
   def Start(self):
@@ -316,6 +319,7 @@ class PurgeClientStats(cronjobs.SystemCronFlow):
     """Does the work."""
     self.start = 0
     self.end = int(1e6 * (time.time() - self.MAX_AGE))
+    raw_end = int(1e6 * (time.time() - self.MAX_RAW_AGE))
 
     client_urns = export_utils.GetAllClients(token=self.token)
 
@@ -326,6 +330,14 @@ class PurgeClientStats(cronjobs.SystemCronFlow):
               client_urn.Add("stats"), [u"aff4:stats"],
               start=self.start,
               end=self.end)
+
+          store = client_stats_store.ClientStatsStore(
+              client_urn, token=self.token)
+          for resolution in client_stats_store.RESOLUTIONS:
+            if resolution is client_stats_store.RAW:
+              store.DeleteBefore(resolution, raw_end, mutation_pool)
+            else:
+              store.DeleteBefore(resolution, self.end, mutation_pool)
       self.HeartBeat()
 
 
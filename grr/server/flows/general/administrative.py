@@ -24,6 +24,7 @@ from grr.lib.rdfvalues import standard
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import flows_pb2
 from grr.server import aff4
+from grr.server import client_stats_store
 from grr.server import data_store
 from grr.server import email_alerts
 from grr.server import events
@@ -103,8 +104,12 @@ class GetClientStatsProcessResponseMixin(object):
 
     with aff4.FACTORY.Create(
         urn, aff4_stats.ClientStats, token=self.token, mode="w") as stats_fd:
-      # Only keep the average of all values that fall within one minute.
-      stats_fd.AddAttribute(stats_fd.Schema.STATS, response.DownSample())
+      if config.CONFIG["Server.legacy_client_stats"]:
+        # Only keep the average of all values that fall within one minute.
+        stats_fd.AddAttribute(stats_fd.Schema.STATS, response.DownSample())
+
+    client_stats_store.ClientStatsStore(
+        client_id, token=self.token).AddClientStats(response)
 
 
 class GetClientStats(flow.GRRFlow, GetClientStatsProcessResponseMixin):
@@ -83,7 +83,7 @@ class TestClientInterrogate(flow_test_lib.FlowTestsBaseclass):
   def _CheckNotificationsCreated(self):
     user_fd = aff4.FACTORY.Open(
         "aff4:/users/%s" % self.token.username, token=self.token)
-    notifications = user_fd.Get(user_fd.Schema.PENDING_NOTIFICATIONS)
+    notifications = user_fd.GetPendingNotifications()
 
     self.assertEqual(len(notifications), 1)
     notification = notifications[0]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Benchmarks for the file transfer flows."""
+
+
+import os
+import time
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import data_store
+from grr.server import flow
+from grr.server.flows.general import transfer
+from grr.test_lib import action_mocks
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import flow_test_lib
+from grr.test_lib import test_lib
+
+
+class MultiGetFileBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Measures the cost of persisting the state of MultiGetFile."""
+
+  units = "s"
+
+  FILES = 10000
+
+  def setUp(self):
+    super(MultiGetFileBenchmark, self).setUp(["State bytes written"], ["<20"])
+    self.client_id = self.SetupClients(1)[0]
+
+  def _RunFlow(self, name):
+    # Every run fetches new files so none of them is in the file store yet.
+    pathspecs = []
+    for i in xrange(self.FILES):
+      path = os.path.join(self.temp_dir, "%s_%d.txt" % (name, i))
+      with open(path, "wb") as fd:
+        fd.write("%s %d" % (name, i))
+
+      pathspecs.append(
+          rdf_paths.PathSpec(pathtype=rdf_paths.PathSpec.PathType.OS,
+                             path=path))
+
+    state_bytes = [0]
+    original_multi_set = data_store.DB.MultiSet
+
+    def MultiSet(subject, values, *args, **kwargs):
+      for attribute, attribute_values in values.iteritems():
+        if utils.SmartStr(attribute).startswith("aff4:flow_state"):
+          for value in attribute_values:
+            if isinstance(value, tuple):
+              value = value[0]
+            state_bytes[0] += len(value)
+
+      return original_multi_set(subject, values, *args, **kwargs)
+
+    args = transfer.MultiGetFileArgs(pathspecs=pathspecs)
+    start = time.time()
+    with utils.Stubber(data_store.DB, "MultiSet", MultiSet):
+      for _ in flow_test_lib.TestFlowHelper(
+          transfer.MultiGetFile.__name__,
+          action_mocks.MultiGetFileClientMock(),
+          token=self.token,
+          client_id=self.client_id,
+          args=args):
+        pass
+
+    self.AddResult(name, time.time() - start, 1, state_bytes[0])
+
+  def testMultiGetFile(self):
+    """Fetches many files, writing the whole state or deltas on each flush."""
+    with utils.Stubber(flow.GRRFlow, "MAX_STATE_DELTAS", 0):
+      self._RunFlow("full_state")
+
+    self._RunFlow("state_deltas")
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -31,6 +31,7 @@ from grr.server.flows.general import memory_test
 from grr.server.flows.general import network_test
 from grr.server.flows.general import processes_test
 from grr.server.flows.general import registry_test
+from grr.server.flows.general import transfer_benchmark_test
 from grr.server.flows.general import transfer_test
 from grr.server.flows.general import webhistory_test
 from grr.server.flows.general import windows_vsc_test
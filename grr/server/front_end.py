@@ -255,7 +255,8 @@ class FrontEndServer(object):
           response_comms,
           destination=str(source),
           timestamp=timestamp,
-          api_version=request_comms.api_version)
+          api_version=request_comms.api_version,
+          remote_compression=request_comms.supported_compression)
     except communicator.UnknownClientCert:
       # We can not encode messages to the client yet because we do not have the
       # client certificate - return them to the queue so we can try again later.
@@ -526,6 +527,8 @@ class FrontendInit(registry.InitHook):
         "frontend_inactive_request_count", fields=[("source", str)])
     stats.STATS.RegisterEventMetric(
         "frontend_request_latency", fields=[("source", str)])
+    stats.STATS.RegisterCounterMetric(
+        "frontend_response_cache", fields=[("type", str)])
 
     stats.STATS.RegisterEventMetric("grr_frontendserver_handle_time")
     stats.STATS.RegisterCounterMetric("grr_frontendserver_handle_num")
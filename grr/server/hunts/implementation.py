@@ -32,6 +32,7 @@ from grr.server import grr_collections
 from grr.server import multi_type_collection
 from grr.server import output_plugin as output_plugin_lib
 from grr.server import queue_manager
+from grr.server import retention_index
 from grr.server.aff4_objects import aff4_grr
 from grr.server.aff4_objects import users as aff4_users
 from grr.server.hunts import results as hunts_results
@@ -1518,6 +1519,12 @@ class GRRHunt(flow.FlowBase):
       self.Set(self.Schema.HUNT_ARGS(self.args))
       self.Set(self.Schema.HUNT_CONTEXT(self.context))
       self.Set(self.Schema.HUNT_RUNNER_ARGS(self.runner_args))
+      if self.context is not None and self.context.expires:
+        retention_index.RecordTime(
+            retention_index.HUNTS,
+            self.urn,
+            self.context.expires,
+            token=self.token)
 
 
 class HuntInitHook(registry.InitHook):
@@ -3,8 +3,10 @@
 
 
 
-import itertools
+import collections
 import re
+import struct
+import tempfile
 
 from grr.lib import rdfvalue
 from grr.lib import registry
@@ -94,6 +96,60 @@ class InstantOutputPlugin(object):
     """
 
 
+class SpillBuffer(object):
+  """An append-only buffer of RDFValues of a single type.
+
+  Values are kept in memory up to a bound and spilled to a temporary file
+  afterwards.
+  """
+
+  def __init__(self, value_cls, max_in_memory=10000):
+    self.value_cls = value_cls
+    self.max_in_memory = max_in_memory
+    self._values = []
+    self._fd = None
+    self._spilled_count = 0
+
+  def __len__(self):
+    return self._spilled_count + len(self._values)
+
+  def Append(self, value):
+    self._values.append(value)
+    if len(self._values) >= self.max_in_memory:
+      self._Spill()
+
+  def _Spill(self):
+    if self._fd is None:
+      self._fd = tempfile.TemporaryFile()
+
+    records = []
+    for value in self._values:
+      serialized = value.SerializeToString()
+      records.append(struct.pack("<I", len(serialized)))
+      records.append(serialized)
+    self._fd.write("".join(records))
+    self._spilled_count += len(self._values)
+    self._values = []
+
+  def Drain(self):
+    """Yields all the values in the order they were appended."""
+    if self._fd is not None:
+      self._fd.seek(0)
+      for _ in xrange(self._spilled_count):
+        (length,) = struct.unpack("<I", self._fd.read(4))
+        yield self.value_cls.FromSerializedString(self._fd.read(length))
+
+    for value in self._values:
+      yield value
+
+  def Close(self):
+    if self._fd is not None:
+      self._fd.close()
+      self._fd = None
+    self._spilled_count = 0
+    self._values = []
+
+
 class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
   """Instant output plugin that flattens data before exporting."""
 
@@ -101,6 +157,10 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
 
   BATCH_SIZE = 5000
 
+  # Number of exported values of a single type kept in memory before they are
+  # spilled to a temporary file.
+  SPILL_BUFFER_SIZE = 10000
+
   def GetDefaultMetadata(self):
     """Returns metadata to be used by export converters."""
     return export.ExportedMetadata(source_urn=self.source_urn)
@@ -130,66 +190,18 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
     """
     raise NotImplementedError()
 
-  def _GenerateSingleTypeIteration(self, next_types, processed_types,
-                                   converted_responses):
-    """Yields responses of a given type only.
-
-    _GenerateSingleTypeIteration iterates through converted_responses and
-    only yields responses of the same type. The type is either popped from
-    next_types or inferred from the first item of converted_responses.
-    The type is added to a set of processed_types.
-
-    Along the way _GenerateSingleTypeIteration updates next_types set.
-    All newly encountered and not previously processed types are added to
-    next_types set.
-
-    Calling _GenerateSingleTypeIteration multiple times allows doing
-    multiple passes on converted responses and emitting converted responses
-    of the same type continuously (so that they can be written into
-    the same file by the plugin).
-
-    Args:
-      next_types: List of value type classes that will be used in further
-          iterations.
-      processed_types: List of value type classes that have been used
-          already.
-      converted_responses: Iterable with values to iterate over.
-
-    Yields:
-      Values from converted_response with the same type. Type is either
-      popped from the next_types set or inferred from the first
-      converted_responses value.
-    """
-    if not next_types:
-      current_type = None
-    else:
-      current_type = next_types.pop()
-      processed_types.add(current_type)
-
-    for converted_response in converted_responses:
-      if not current_type:
-        current_type = converted_response.__class__
-        processed_types.add(current_type)
-
-      if converted_response.__class__ != current_type:
-        if converted_response.__class__ not in processed_types:
-          next_types.add(converted_response.__class__)
-        continue
-
-      yield converted_response
-
-  def _GenerateConvertedValues(self, converter, grr_messages):
-    """Generates converted values using given converter from given messages.
+  def _GenerateConvertedValues(self, converters, grr_messages):
+    """Generates converted values using given converters from given messages.
 
-    Groups values in batches of BATCH_SIZE size and applies the converter
-    to each batch.
+    Groups values in batches of BATCH_SIZE size and applies every converter
+    to each batch, so the messages are only read once.
 
     Args:
-      converter: ExportConverter instance.
+      converters: A list of ExportConverter instances.
       grr_messages: An iterable (a generator is assumed) with GRRMessage values.
 
     Yields:
-      Values generated by the converter.
+      Values generated by the converters.
 
     Raises:
       ValueError: if any of the GrrMessage objects doesn't have "source" set.
@@ -204,31 +216,67 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
         metadata.client_urn = grr_message.source
         batch_with_metadata.append((metadata, grr_message.payload))
 
-      for result in converter.BatchConvert(
-          batch_with_metadata, token=self.token):
-        yield result
+      for converter in converters:
+        for result in converter.BatchConvert(
+            batch_with_metadata, token=self.token):
+          yield result
 
   def ProcessValues(self, value_type, values_generator_fn):
+    """Converts values in a single pass and processes them type by type.
+
+    Values of the first exported type are streamed straight to
+    ProcessSingleTypeExportedValues. Values of all other exported types are
+    demultiplexed into spill buffers while doing so and processed afterwards,
+    one type after another.
+
+    Args:
+      value_type: Class identifying type of the values to be processed.
+      values_generator_fn: Function returning an iterable with values.
+
+    Yields:
+      Chunks of bytes.
+    """
     converter_classes = export.ExportConverter.GetConvertersByClass(value_type)
     if not converter_classes:
       return
     converters = [cls(self.GetExportOptions()) for cls in converter_classes]
 
-    next_types = set()
-    processed_types = set()
-    while True:
-      converted_responses = itertools.chain.from_iterable(
-          self._GenerateConvertedValues(converter, values_generator_fn())
-          for converter in converters)
-
-      generator = self._GenerateSingleTypeIteration(next_types, processed_types,
-                                                    converted_responses)
-
-      for chunk in self.ProcessSingleTypeExportedValues(value_type, generator):
-        yield chunk
+    converted_responses = self._GenerateConvertedValues(converters,
+                                                        values_generator_fn())
+    spill_buffers = collections.OrderedDict()
+    first_type = []
+
+    def Demultiplex(responses):
+      """Yields values of the first type, buffers all the others."""
+      for converted_response in responses:
+        cls = converted_response.__class__
+        if not first_type:
+          first_type.append(cls)
+
+        if cls == first_type[0]:
+          yield converted_response
+        else:
+          if cls not in spill_buffers:
+            spill_buffers[cls] = SpillBuffer(
+                cls, max_in_memory=self.SPILL_BUFFER_SIZE)
+          spill_buffers[cls].Append(converted_response)
+
+    for chunk in self.ProcessSingleTypeExportedValues(
+        value_type, Demultiplex(converted_responses)):
+      yield chunk
 
-      if not next_types:
-        break
+    # Make sure the conversion pass is complete even if the plugin did not
+    # consume all the values.
+    for _ in Demultiplex(converted_responses):
+      pass
+
+    for spill_buffer in spill_buffers.values():
+      try:
+        for chunk in self.ProcessSingleTypeExportedValues(
+            value_type, spill_buffer.Drain()):
+          yield chunk
+      finally:
+        spill_buffer.Close()
 
 
 def ApplyPluginToMultiTypeCollection(plugin, output_collection,
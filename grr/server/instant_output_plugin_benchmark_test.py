@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Benchmarks for instant output plugins with export conversion."""
+
+
+import time
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.server import export
+from grr.server.output_plugins import test_plugins
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class BenchmarkSourceValue(rdfvalue.RDFString):
+  pass
+
+
+class BenchmarkExportedFile(rdfvalue.RDFString):
+  pass
+
+
+class BenchmarkExportedMatch(rdfvalue.RDFString):
+  pass
+
+
+class BenchmarkConverter(export.ExportConverter):
+  """Converts every value into two exported values, like FileFinderResult."""
+
+  input_rdf_type = "BenchmarkSourceValue"
+
+  batch_convert_calls = 0
+
+  def BatchConvert(self, metadata_value_pairs, token=None):
+    BenchmarkConverter.batch_convert_calls += 1
+    return super(BenchmarkConverter, self).BatchConvert(
+        metadata_value_pairs, token=token)
+
+  def Convert(self, metadata, value, token=None):
+    _ = metadata
+    _ = token
+    return [BenchmarkExportedFile(value), BenchmarkExportedMatch(value)]
+
+
+class InstantOutputPluginBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Exports a large hunt collection producing two exported types."""
+
+  units = "s"
+
+  RESULTS = 1000000
+
+  def setUp(self):
+    super(InstantOutputPluginBenchmark, self).setUp(
+        ["Results", "Reads", "BatchConvert calls"], ["<10", "<10", "<10"])
+    self.client_id = self.SetupClients(1)[0]
+
+  def testMultiTypeExport(self):
+    """Every result is read and converted exactly once."""
+    plugin = test_plugins.TestInstantOutputPluginWithExportConverstion(
+        source_urn=rdfvalue.RDFURN("aff4:/hunts/H:123456"), token=self.token)
+    message = rdf_flows.GrrMessage(
+        source=self.client_id, payload=BenchmarkSourceValue("result"))
+
+    reads = []
+
+    def ReadResults():
+      reads.append(1)
+      for _ in xrange(self.RESULTS):
+        yield message
+
+    BenchmarkConverter.batch_convert_calls = 0
+    start = time.time()
+    for _ in plugin.ProcessValues(BenchmarkSourceValue, ReadResults):
+      pass
+
+    self.AddResult("ProcessValues", time.time() - start, 1, self.RESULTS,
+                   len(reads), BenchmarkConverter.batch_convert_calls)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -4,6 +4,7 @@
 
 from grr.lib import flags
 from grr.lib import rdfvalue
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.server import data_store
@@ -225,6 +226,80 @@ class InstantOutputPluginWithExportConversionTest(
         "Finish"
     ])  # pyformat: disable
 
+  def testValuesAreReadAndConvertedOnce(self):
+    messages = [
+        rdf_flows.GrrMessage(
+            source=self.client_id, payload=DummySrcValue2(name))
+        for name in ["foo", "bar"]
+    ]
+    reads = []
+    converts = []
+
+    def ReadValues():
+      reads.append(1)
+      return messages
+
+    batch_convert = TestConverter2.BatchConvert
+
+    def CountingBatchConvert(converter, *args, **kwargs):
+      converts.append(1)
+      return batch_convert(converter, *args, **kwargs)
+
+    with utils.Stubber(TestConverter2, "BatchConvert", CountingBatchConvert):
+      chunks = list(self.plugin.ProcessValues(DummySrcValue2, ReadValues))
+
+    self.assertEqual(len(reads), 1)
+    self.assertEqual(len(converts), 1)
+    self.assertListEqual(chunks, [
+        "Original: DummySrcValue2\n",
+        "Exported value: exp1-foo\n",
+        "Exported value: exp1-bar\n",
+        "Original: DummySrcValue2\n",
+        "Exported value: exp2-foo\n",
+        "Exported value: exp2-bar\n",
+    ])  # pyformat: disable
+
+  def testSpilledValuesAreExportedInOrder(self):
+    self.plugin.SPILL_BUFFER_SIZE = 2
+    names = ["v%d" % i for i in range(5)]
+    lines = self.ProcessValuesToLines(
+        {DummySrcValue2: [DummySrcValue2(name) for name in names]})
+    self.assertListEqual(
+        lines, ["Start", "Original: DummySrcValue2"] +
+        ["Exported value: exp1-%s" % name for name in names] +
+        ["Original: DummySrcValue2"] +
+        ["Exported value: exp2-%s" % name for name in names] + ["Finish"])
+
+
+class SpillBufferTest(test_lib.GRRBaseTest):
+  """Tests for SpillBuffer."""
+
+  def testKeepsValuesInMemoryUpToTheLimit(self):
+    spill_buffer = instant_output_plugin.SpillBuffer(
+        DummyOutValue1, max_in_memory=10)
+    values = [DummyOutValue1("value %d" % i) for i in range(5)]
+    for value in values:
+      spill_buffer.Append(value)
+
+    self.assertEqual(len(spill_buffer), 5)
+    self.assertListEqual(list(spill_buffer.Drain()), values)
+
+  def testSpillsToDisk(self):
+    spill_buffer = instant_output_plugin.SpillBuffer(
+        DummyOutValue1, max_in_memory=3)
+    values = [DummyOutValue1("value %d" % i) for i in range(10)]
+    for value in values:
+      spill_buffer.Append(value)
+
+    self.assertEqual(len(spill_buffer), 10)
+    drained = list(spill_buffer.Drain())
+    self.assertListEqual(drained, values)
+    for value in drained:
+      self.assertIsInstance(value, DummyOutValue1)
+
+    spill_buffer.Close()
+    self.assertEqual(len(spill_buffer), 0)
+
 
 def main(argv):
   test_lib.main(argv)
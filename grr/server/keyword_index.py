@@ -7,8 +7,11 @@ possible to search for those names which match all keywords.
 """
 
 
+import itertools
+
 from grr.server import aff4
 from grr.server import data_store
+from grr.server import posting_list
 
 
 class AFF4KeywordIndex(aff4.AFF4Object):
@@ -32,27 +35,79 @@ class AFF4KeywordIndex(aff4.AFF4Object):
       start_time: Only considers keywords added at or after this point in time.
       end_time: Only considers keywords at or before this point in time.
       last_seen_map: If present, is treated as a dict and populated to map pairs
-        (keyword, name) to the timestamp of the latest connection found.
+        (keyword, name) to the timestamp of the latest connection found for
+        all names returned.
     Returns:
       A set of potentially relevant names.
 
     """
-    posting_lists = self.ReadPostingLists(
-        keywords,
-        start_time=start_time,
-        end_time=end_time,
-        last_seen_map=last_seen_map)
+    return set(
+        self.LookupSorted(
+            keywords,
+            start_time=start_time,
+            end_time=end_time,
+            last_seen_map=last_seen_map))
+
+  def LookupSorted(self,
+                   keywords,
+                   start_time=FIRST_TIMESTAMP,
+                   end_time=LAST_TIMESTAMP,
+                   offset=0,
+                   limit=None,
+                   last_seen_map=None):
+    """Finds objects associated with keywords, sorted by name.
+
+    Only the postings needed to produce the requested page are decoded, so
+    small pages of large results are cheap.
 
-    results = posting_lists.values()
-    relevant_set = results[0]
-
-    for hits in results:
-      relevant_set &= hits
-
-      if not relevant_set:
-        return relevant_set
+    Args:
+      keywords: A collection of keywords that we are interested in.
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+      offset: The number of names to skip.
+      limit: The maximum number of names to return. All if None.
+      last_seen_map: If present, is treated as a dict and populated to map pairs
+        (keyword, name) to the timestamp of the latest connection found for
+        all names returned.
+    Returns:
+      A sorted list of potentially relevant names.
+    """
+    keywords = list(keywords)
+    posting_lists = self.ReadSortedPostingLists(
+        keywords, start_time=start_time, end_time=end_time)
+
+    matches = posting_list.IntersectPostingLists(
+        [posting_lists[kw] for kw in keywords])
+    if limit is None:
+      matches = itertools.islice(matches, offset, None)
+    else:
+      matches = itertools.islice(matches, offset, offset + limit)
+
+    result = []
+    for name, timestamps in matches:
+      result.append(name)
+      if last_seen_map is not None:
+        for kw, ts in zip(keywords, timestamps):
+          last_seen_map[(kw, name)] = ts
+
+    return result
+
+  def ReadSortedPostingLists(self,
+                             keywords,
+                             start_time=FIRST_TIMESTAMP,
+                             end_time=LAST_TIMESTAMP):
+    """Reads the posting lists of keywords.
 
-    return relevant_set
+    Args:
+      keywords: A collection of keywords that we are interested in.
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+    Returns:
+      A dict mapping each keyword to a posting_list.PostingList of
+      (name, timestamp) postings sorted by name.
+    """
+    return data_store.DB.IndexReadSortedPostingLists(
+        self.urn, keywords, start_time, end_time, token=self.token)
 
   def ReadPostingLists(self,
                        keywords,
@@ -100,3 +155,15 @@ class AFF4KeywordIndex(aff4.AFF4Object):
     """
     data_store.DB.IndexRemoveKeywordsForName(
         self.urn, name, keywords, token=self.token)
+
+  def CompactPostingLists(self, keywords):
+    """Compacts recently added postings of keywords.
+
+    This happens automatically when posting lists are read, it is only needed
+    to compact keywords which are written a lot but rarely read.
+
+    Args:
+      keywords: A collection of keywords.
+    """
+    data_store.DB.IndexCompactPostingLists(
+        self.urn, keywords, token=self.token)
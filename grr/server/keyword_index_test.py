@@ -2,8 +2,12 @@
 """Tests for grr.lib.keyword_index."""
 
 
+import time
+
 from grr.lib import flags
+from grr.lib import utils
 from grr.server import aff4
+from grr.server import data_store
 from grr.server import keyword_index
 from grr.test_lib import aff4_test_lib
 from grr.test_lib import test_lib
@@ -86,6 +90,101 @@ class KeywordIndexTest(aff4_test_lib.AFF4ObjectTest):
     self.assertEqual(2004 * 1000000, ls_map[("popular_keyword1", "C.000000")])
     self.assertEqual(1009 * 1000000, ls_map[("popular_keyword2", "C.000000")])
 
+  def testLookupSortedPagination(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index3/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(100):
+      keywords = ["all"]
+      if i % 2 == 0:
+        keywords.append("even")
+      index.AddKeywordsForName("C.%03d" % i, keywords)
+
+    names = ["C.%03d" % i for i in range(0, 100, 2)]
+    self.assertEqual(index.LookupSorted(["all", "even"]), names)
+    self.assertEqual(
+        index.LookupSorted(["all", "even"], offset=10, limit=5), names[10:15])
+    self.assertEqual(index.LookupSorted(["even"], offset=48), names[48:])
+    self.assertEqual(index.LookupSorted(["even", "unknown"]), [])
+
+  def testCompaction(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index4/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(20):
+      with test_lib.FakeTime(1000 + i):
+        index.AddKeywordsForName("C.%03d" % i, ["keyword"])
+    index.CompactPostingLists(["keyword"])
+
+    # Postings added after the compaction are merged with the compacted ones.
+    with test_lib.FakeTime(2000):
+      index.AddKeywordsForName("C.005", ["keyword"])
+      index.AddKeywordsForName("C.100", ["keyword"])
+
+    ls_map = {}
+    results = index.Lookup(["keyword"], last_seen_map=ls_map)
+    self.assertEqual(len(results), 21)
+    self.assertEqual(ls_map[("keyword", "C.005")], 2000 * 1000000)
+    self.assertEqual(ls_map[("keyword", "C.006")], 1006 * 1000000)
+
+    self.assertEqual(
+        len(index.Lookup(["keyword"], start_time=1010 * 1000000)), 12)
+
+    # Removing names also removes them from compacted posting lists.
+    index.RemoveKeywordsForName("C.005", ["keyword"])
+    index.RemoveKeywordsForName("C.006", ["keyword"])
+    index.CompactPostingLists(["keyword"])
+    results = index.Lookup(["keyword"])
+    self.assertEqual(len(results), 19)
+    self.assertNotIn("C.005", results)
+    self.assertNotIn("C.006", results)
+
+  def testPostingListsAreCompactedWhenRead(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index5/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    with utils.Stubber(data_store.DB, "INDEX_COMPACTION_THRESHOLD", 10):
+      for i in range(10):
+        index.AddKeywordsForName("C.%03d" % i, ["keyword"])
+      self.assertEqual(len(index.Lookup(["keyword"])), 10)
+
+    self.assertEqual(
+        data_store.DB.ResolvePrefix(
+            index.urn.Add("keyword"), "kw_index:", token=self.token), [])
+    self.assertEqual(len(index.Lookup(["keyword"])), 10)
+
+  def testRemovalWaitsForCompaction(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index6/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    index.AddKeywordsForName("C.001", ["keyword"])
+    keyword_urn = index.urn.Add("keyword")
+
+    # A compaction holds the lock of the keyword.
+    lock = data_store.DB.DBSubjectLock(
+        keyword_urn, lease_time=60, token=self.token)
+    postings_while_locked = []
+
+    def Sleep(_):
+      postings_while_locked.extend(
+          data_store.DB.ResolvePrefix(
+              keyword_urn, "kw_index:", token=self.token))
+      lock.Release()
+
+    with utils.Stubber(time, "sleep", Sleep):
+      index.RemoveKeywordsForName("C.001", ["keyword"])
+
+    self.assertEqual(len(postings_while_locked), 1)
+    self.assertEqual(index.Lookup(["keyword"]), set())
+
 
 def main(argv):
   test_lib.main(argv)
@@ -5,15 +5,89 @@
 
 import cStringIO
 import csv
+import itertools
 import os
 import zipfile
+import zlib
 
 import yaml
 
 from grr.lib import utils
+from grr.lib.rdfvalues import structs as rdf_structs
 from grr.server import instant_output_plugin
 
 
+class CSVRowWriter(object):
+  """Writes RDFProtoStructs of a single class as CSV rows.
+
+  The struct's descriptors are walked once, when the writer is created.
+  Writing a value then only visits the fields of the flattened header. Rows
+  are accumulated in a buffer which the caller drains in large blocks.
+  """
+
+  def __init__(self, proto_struct_class):
+    self.header = []
+    self._fields = self._Compile(proto_struct_class, "")
+    self._buf = cStringIO.StringIO()
+    self._writer = csv.writer(self._buf)
+
+  def _Compile(self, proto_struct_class, prefix):
+    """Returns a list of (name, nested fields, default cells) tuples."""
+    fields = []
+    for type_info in proto_struct_class.type_infos:
+      if type_info.__class__ is rdf_structs.ProtoEmbedded:
+        nested_fields = self._Compile(
+            type_info.type, "%s%s." % (prefix, type_info.name))
+        # Unset structs are written like empty ones, so their cells are
+        # always the same.
+        default_cells = []
+        self._WriteStruct(type_info.type(), nested_fields, default_cells)
+        fields.append((type_info.name, nested_fields, default_cells))
+      else:
+        self.header.append(utils.SmartStr(prefix + type_info.name))
+        fields.append((type_info.name, None, None))
+
+    return fields
+
+  def _WriteStruct(self, value, fields, row):
+    # pylint: disable=protected-access
+    data = value._data
+    for name, nested_fields, default_cells in fields:
+      entry = data.get(name)
+      if nested_fields is None:
+        if entry is None or entry[0] is None:
+          # Not set or not decoded yet, Get() takes care of both.
+          row.append(utils.SmartStr(value.Get(name)))
+        else:
+          row.append(utils.SmartStr(entry[0]))
+      elif entry is None:
+        row.extend(default_cells)
+      else:
+        self._WriteStruct(value.Get(name), nested_fields, row)
+
+  def GetRow(self, value):
+    """Returns the list of CSV cells for the given struct."""
+    row = []
+    self._WriteStruct(value, self._fields, row)
+    return row
+
+  def WriteHeader(self):
+    self._writer.writerow(self.header)
+
+  def WriteRow(self, value):
+    self._writer.writerow(self.GetRow(value))
+
+  def BufferSize(self):
+    return self._buf.tell()
+
+  def GetValueAndReset(self):
+    """Returns the CSV written since the last call."""
+    value = self._buf.getvalue()
+    self._buf.seek(0)
+    self._buf.truncate()
+    return value
+
+
 class CSVInstantOutputPlugin(
     instant_output_plugin.InstantOutputPluginWithExportConversion):
   """Instant Output plugin that writes results to an archive of CSV files."""
@@ -23,29 +97,12 @@ class CSVInstantOutputPlugin(
   description = "Output ZIP archive with CSV files."
   output_file_extension = ".zip"
 
-  ROW_BATCH = 100
-
-  def _GetCSVHeader(self, value_class, prefix=""):
-    header = []
-    for type_info in value_class.type_infos:
-      if type_info.__class__.__name__ == "ProtoEmbedded":
-        header.extend(
-            self._GetCSVHeader(
-                type_info.type, prefix=prefix + type_info.name + "."))
-      else:
-        header.append(utils.SmartStr(prefix + type_info.name))
-
-    return header
+  # CSV output is passed to the archive generator in blocks of this size.
+  FLUSH_SIZE = 1024 * 1024
 
-  def _GetCSVRow(self, value):
-    row = []
-    for type_info in value.__class__.type_infos:
-      if type_info.__class__.__name__ == "ProtoEmbedded":
-        row.extend(self._GetCSVRow(value.Get(type_info.name)))
-      else:
-        row.append(utils.SmartStr(value.Get(type_info.name)))
-
-    return row
+  # If set, every CSV file is gzipped on its own and stored uncompressed in
+  # the archive.
+  gzip_members = False
 
   @property
   def path_prefix(self):
@@ -64,31 +121,38 @@ class CSVInstantOutputPlugin(
     if not first_value:
       return
 
-    yield self.archive_generator.WriteFileHeader(
-        "%s/%s/from_%s.csv" % (self.path_prefix, first_value.__class__.__name__,
-                               original_value_type.__name__))
-
-    buf = cStringIO.StringIO()
-    writer = csv.writer(buf)
-    # Write the CSV header based on first value class and write
-    # the first value itself. All other values are guaranteed
-    # to have the same class (see ProcessSingleTypeExportedValues definition).
-    writer.writerow(self._GetCSVHeader(first_value.__class__))
-    writer.writerow(self._GetCSVRow(first_value))
-    yield self.archive_generator.WriteFileChunk(buf.getvalue())
-
-    # Counter starts from 1, as 1 value has already been written.
-    counter = 1
-    for batch in utils.Grouper(exported_values, self.ROW_BATCH):
-      counter += len(batch)
-
-      buf = cStringIO.StringIO()
-      writer = csv.writer(buf)
-      for value in batch:
-        writer.writerow(self._GetCSVRow(value))
-
-      yield self.archive_generator.WriteFileChunk(buf.getvalue())
-
+    # All values are guaranteed to have the same class (see
+    # ProcessSingleTypeExportedValues definition).
+    row_writer = CSVRowWriter(first_value.__class__)
+    path = "%s/%s/from_%s.csv" % (self.path_prefix,
+                                  first_value.__class__.__name__,
+                                  original_value_type.__name__)
+    if self.gzip_members:
+      yield self.archive_generator.WriteFileHeader(
+          path + ".gz", compress_type=zipfile.ZIP_STORED)
+      # Window bits of 16 + 15 produce the gzip format.
+      compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                    31)
+    else:
+      yield self.archive_generator.WriteFileHeader(path)
+      compressor = None
+
+    row_writer.WriteHeader()
+    counter = 0
+    for value in itertools.chain([first_value], exported_values):
+      row_writer.WriteRow(value)
+      counter += 1
+
+      if row_writer.BufferSize() >= self.FLUSH_SIZE:
+        chunk = row_writer.GetValueAndReset()
+        if compressor:
+          chunk = compressor.compress(chunk)
+        yield self.archive_generator.WriteFileChunk(chunk)
+
+    chunk = row_writer.GetValueAndReset()
+    if compressor:
+      chunk = compressor.compress(chunk) + compressor.flush()
+    yield self.archive_generator.WriteFileChunk(chunk)
     yield self.archive_generator.WriteFileFooter()
 
     self.export_counts.setdefault(
@@ -102,3 +166,17 @@ class CSVInstantOutputPlugin(
     yield self.archive_generator.WriteFileChunk(yaml.safe_dump(manifest))
     yield self.archive_generator.WriteFileFooter()
     yield self.archive_generator.Close()
+
+
+class CSVGzipInstantOutputPlugin(CSVInstantOutputPlugin):
+  """Instant Output plugin that writes results to an archive of gzipped CSVs.
+
+  The CSV files are compressed separately, so each of them can be extracted
+  and read by tools understanding gzip.
+  """
+
+  plugin_name = "csv-gzip-zip"
+  friendly_name = "CSV (gzipped, in a ZIP)"
+  description = "Output ZIP archive with gzipped CSV files."
+
+  gzip_members = True
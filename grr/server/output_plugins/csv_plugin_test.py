@@ -2,15 +2,20 @@
 # -*- mode: python; encoding: utf-8 -*-
 """Tests for CSV output plugin."""
 
+import cStringIO
 import csv
+import gzip
 import os
+import tempfile
 import zipfile
 
 import yaml
 
 from grr.lib import flags
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import export
 from grr.server.output_plugins import csv_plugin
 from grr.server.output_plugins import test_plugins
 from grr.test_lib import test_lib
@@ -169,7 +174,7 @@ class CSVInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
                      self.client_id.Add("/fs/os/中国新闻网新闻中"))
 
   def testCSVPluginWritesMoreThanOneBatchOfRowsCorrectly(self):
-    num_rows = csv_plugin.CSVInstantOutputPlugin.ROW_BATCH * 2 + 1
+    num_rows = 201
 
     responses = []
     for i in range(num_rows):
@@ -177,7 +182,11 @@ class CSVInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
           rdf_client.StatEntry(pathspec=rdf_paths.PathSpec(
               path="/foo/bar/%d" % i, pathtype="OS")))
 
-    zip_fd, prefix = self.ProcessValuesToZip({rdf_client.StatEntry: responses})
+    # Flush after every few rows.
+    with utils.Stubber(csv_plugin.CSVInstantOutputPlugin, "FLUSH_SIZE", 1024):
+      zip_fd, prefix = self.ProcessValuesToZip({
+          rdf_client.StatEntry: responses
+      })
     parsed_output = list(
         csv.DictReader(
             zip_fd.open("%s/ExportedFile/from_StatEntry.csv" % prefix)))
@@ -187,6 +196,60 @@ class CSVInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
                        self.client_id.Add("/fs/os/foo/bar/%d" % i))
 
 
+class CSVGzipInstantOutputPluginTest(CSVInstantOutputPluginTest):
+  """Tests the CSV output plugin writing gzipped CSV files."""
+
+  plugin_cls = csv_plugin.CSVGzipInstantOutputPlugin
+
+  def ProcessValuesToZip(self, values_by_cls):
+    zip_fd, file_basename = super(CSVGzipInstantOutputPluginTest,
+                                  self).ProcessValuesToZip(values_by_cls)
+
+    # Extract the gzipped members so that the tests above can read them.
+    fd, result_path = tempfile.mkstemp(dir=self.temp_dir, suffix=".zip")
+    os.close(fd)
+    with zipfile.ZipFile(result_path, "w") as result_fd:
+      for name in zip_fd.namelist():
+        data = zip_fd.read(name)
+        if name.endswith(".gz"):
+          self.assertEqual(zip_fd.getinfo(name).compress_type,
+                           zipfile.ZIP_STORED)
+          data = gzip.GzipFile(fileobj=cStringIO.StringIO(data)).read()
+          name = name[:-len(".gz")]
+        result_fd.writestr(name, data)
+
+    return zipfile.ZipFile(result_path), file_basename
+
+
+class CSVRowWriterTest(test_lib.GRRBaseTest):
+  """Tests for CSVRowWriter."""
+
+  def testUnsetStructsAreWrittenAsEmptyStructs(self):
+    row_writer = csv_plugin.CSVRowWriter(export.ExportedFile)
+
+    value = export.ExportedFile(urn="aff4:/C.0000000000000001/fs/os/foo")
+    expected_value = value.Copy()
+    expected_value.metadata = export.ExportedMetadata()
+    expected_value.hash_md5 = ""
+
+    row = row_writer.GetRow(value)
+    self.assertEqual(len(row), len(row_writer.header))
+    self.assertEqual(row, row_writer.GetRow(expected_value))
+    self.assertEqual(row[row_writer.header.index("urn")],
+                     "aff4:/C.0000000000000001/fs/os/foo")
+
+  def testRowsAreBuffered(self):
+    row_writer = csv_plugin.CSVRowWriter(export.ExportedFile)
+    row_writer.WriteHeader()
+    for i in range(3):
+      row_writer.WriteRow(export.ExportedFile(urn="aff4:/foo/%d" % i))
+
+    rows = list(csv.reader(cStringIO.StringIO(row_writer.GetValueAndReset())))
+    self.assertEqual(len(rows), 4)
+    self.assertEqual(rows[0], row_writer.header)
+    self.assertEqual(row_writer.BufferSize(), 0)
+
+
 def main(argv):
   test_lib.main(argv)
 
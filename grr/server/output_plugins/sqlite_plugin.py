@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 """Plugin that exports results as SQLite db scripts."""
 
+import base64
 import collections
 import cStringIO
+import itertools
+import math
 import os
+import tempfile
 import zipfile
 
 import sqlite3
@@ -66,6 +70,100 @@ class Rdf2SqliteAdapter(object):
           type_info.__class__, Rdf2SqliteAdapter.DEFAULT_CONVERTER)
 
 
+class SqliteRowEncoder(object):
+  """Encodes RDFProtoStructs of a single class as SQLite rows.
+
+  The struct's descriptors are walked once, when the encoder is created.
+  Encoding a value then only visits the fields of the flattened schema.
+  """
+
+  def __init__(self, proto_struct_class):
+    self.schema = collections.OrderedDict()
+    self._fields = self._Compile(proto_struct_class, "")
+
+  def _Compile(self, proto_struct_class, prefix):
+    """Returns a list of (name, nested fields, width, convert_fn) tuples."""
+    fields = []
+    for type_info in proto_struct_class.type_infos:
+      if type_info.__class__ is rdf_structs.ProtoEmbedded:
+        start = len(self.schema)
+        nested_fields = self._Compile(
+            type_info.type, "%s%s." % (prefix, type_info.name))
+        fields.append((type_info.name, nested_fields, len(self.schema) - start,
+                       None))
+      else:
+        converter = Rdf2SqliteAdapter.GetConverter(type_info)
+        self.schema[utils.SmartStr(prefix + type_info.name)] = converter
+        fields.append((type_info.name, None, 1, converter.convert_fn))
+
+    return fields
+
+  def EncodeRow(self, value):
+    """Returns a list of SQLite-ready column values for the given struct.
+
+    Fields which are not set are encoded as None.
+
+    Args:
+      value: An instance of the struct class this encoder was created for.
+
+    Returns:
+      A list of values, one per column of the schema.
+    """
+    row = []
+    self._EncodeStruct(value, self._fields, row)
+    return row
+
+  def _EncodeStruct(self, value, fields, row):
+    for name, nested_fields, width, convert_fn in fields:
+      if not value.HasField(name):
+        row.extend([None] * width)
+      elif nested_fields is not None:
+        self._EncodeStruct(value.Get(name), nested_fields, row)
+      else:
+        row.append(convert_fn(_ToPrimitive(value.Get(name))))
+
+  def EncodeLiterals(self, value):
+    """Returns the row for value as a SQL tuple literal."""
+    return "(%s)" % ",".join(_SqlLiteral(v) for v in self.EncodeRow(value))
+
+
+def _ToPrimitive(value):
+  """Converts a leaf field value the way RDFProtoStruct.ToPrimitiveDict does."""
+  if isinstance(value, rdf_structs.EnumNamedValue):
+    return str(value)
+  elif isinstance(value, (basestring, int, long, float)):
+    return value
+  elif isinstance(value, rdfvalue.RDFBytes):
+    return base64.encodestring(value.SerializeToString())
+  elif isinstance(value, rdf_structs.RepeatedFieldHelper):
+    return [_ToPrimitive(v) for v in value]
+  elif isinstance(value, rdf_structs.RDFProtoStruct):
+    return value.ToPrimitiveDict()
+
+  return value
+
+
+def _SqlLiteral(value):
+  """Escapes a Python value as a SQLite literal."""
+  if value is None:
+    return "NULL"
+  elif isinstance(value, bool):
+    return "1" if value else "0"
+  elif isinstance(value, (int, long)):
+    return str(value)
+  elif isinstance(value, float):
+    if math.isnan(value):
+      # SQLite stores NaN as NULL.
+      return "NULL"
+    elif math.isinf(value):
+      return "1e999" if value > 0 else "-1e999"
+    return repr(value)
+
+  # PySQLite would have stored these as TEXT, so this is what we emit too.
+  value = utils.SmartUnicode(value).encode("utf-8")
+  return "'%s'" % value.replace("'", "''")
+
+
 class SqliteInstantOutputPlugin(
     instant_output_plugin.InstantOutputPluginWithExportConversion):
   """Instant output plugin that converts results into SQLite db commands."""
@@ -75,6 +173,7 @@ class SqliteInstantOutputPlugin(
   description = "Output ZIP archive containing SQLite scripts."
   output_file_extension = ".zip"
 
+  # Number of rows per INSERT statement.
   ROW_BATCH = 100
 
   def __init__(self, *args, **kwargs):
@@ -93,105 +192,62 @@ class SqliteInstantOutputPlugin(
     self.export_counts = {}
     return []
 
-  def ProcessSingleTypeExportedValues(self, original_value_type,
-                                      exported_values):
+  def _CreateTableStatement(self, table_name, encoder):
+    buf = cStringIO.StringIO()
+    buf.write("CREATE TABLE \"%s\" (\n  " % table_name)
+    column_types = [(k, v.sqlite_type) for k, v in encoder.schema.items()]
+    buf.write(",\n  ".join(["\"%s\" %s" % (k, v) for k, v in column_types]))
+    buf.write("\n);")
+    return buf.getvalue()
+
+  def _GetFirstValue(self, original_value_type, exported_values):
     first_value = next(exported_values, None)
-    if not first_value:
-      return
+    if first_value is None:
+      return None, None, None
 
     if not isinstance(first_value, rdf_structs.RDFProtoStruct):
       raise ValueError("The SQLite plugin only supports export-protos")
+
+    table_name = "%s.from_%s" % (first_value.__class__.__name__,
+                                 original_value_type.__name__)
+    return first_value, table_name, SqliteRowEncoder(first_value.__class__)
+
+  def _CountExport(self, original_value_type, first_value, counter):
+    counts_for_original_type = self.export_counts.setdefault(
+        original_value_type.__name__, dict())
+    counts_for_original_type[first_value.__class__.__name__] = counter
+
+  def ProcessSingleTypeExportedValues(self, original_value_type,
+                                      exported_values):
+    first_value, table_name, encoder = self._GetFirstValue(
+        original_value_type, exported_values)
+    if first_value is None:
+      return
+
     yield self.archive_generator.WriteFileHeader(
         "%s/%s_from_%s.sql" % (self.path_prefix, first_value.__class__.__name__,
                                original_value_type.__name__))
-    table_name = "%s.from_%s" % (first_value.__class__.__name__,
-                                 original_value_type.__name__)
-    schema = self._GetSqliteSchema(first_value.__class__)
-
-    # We will buffer the sql statements into an in-memory sql database before
-    # dumping them to the zip archive. We rely on the PySQLite library for
-    # string escaping.
-    db_connection = sqlite3.connect(":memory:")
-    db_cursor = db_connection.cursor()
-
-    yield self.archive_generator.WriteFileChunk("BEGIN TRANSACTION;\n")
-    with db_connection:
-      buf = cStringIO.StringIO()
-      buf.write("CREATE TABLE \"%s\" (\n  " % table_name)
-      column_types = [(k, v.sqlite_type) for k, v in schema.items()]
-      buf.write(",\n  ".join(["\"%s\" %s" % (k, v) for k, v in column_types]))
-      buf.write("\n);")
-      db_cursor.execute(buf.getvalue())
-      yield self.archive_generator.WriteFileChunk(buf.getvalue() + "\n")
-      self._InsertValueIntoDb(table_name, schema, first_value, db_cursor)
-
-    for sql in self._FlushAllRows(db_connection, table_name):
-      yield sql
-    counter = 1
-    for batch in utils.Grouper(exported_values, self.ROW_BATCH):
+    yield self.archive_generator.WriteFileChunk(
+        "BEGIN TRANSACTION;\n%s\n" % self._CreateTableStatement(
+            table_name, encoder))
+
+    insert_statement = "INSERT INTO \"%s\" VALUES\n" % table_name
+    counter = 0
+    values = itertools.chain([first_value], exported_values)
+    for batch in utils.Grouper(values, self.ROW_BATCH):
       counter += len(batch)
-      with db_connection:
-        for value in batch:
-          self._InsertValueIntoDb(table_name, schema, value, db_cursor)
-      for sql in self._FlushAllRows(db_connection, table_name):
-        yield sql
+      rows = ",\n".join(encoder.EncodeLiterals(value) for value in batch)
+      yield self.archive_generator.WriteFileChunk(
+          "%s%s;\n" % (insert_statement, rows))
 
-    db_connection.close()
     yield self.archive_generator.WriteFileChunk("COMMIT;\n")
     yield self.archive_generator.WriteFileFooter()
 
-    counts_for_original_type = self.export_counts.setdefault(
-        original_value_type.__name__, dict())
-    counts_for_original_type[first_value.__class__.__name__] = counter
+    self._CountExport(original_value_type, first_value, counter)
 
-  def _GetSqliteSchema(self, proto_struct_class, prefix=""):
+  def _GetSqliteSchema(self, proto_struct_class):
     """Returns a mapping of SQLite column names to Converter objects."""
-    schema = collections.OrderedDict()
-    for type_info in proto_struct_class.type_infos:
-      if type_info.__class__ is rdf_structs.ProtoEmbedded:
-        schema.update(
-            self._GetSqliteSchema(
-                type_info.type, prefix="%s%s." % (prefix, type_info.name)))
-      else:
-        field_name = utils.SmartStr(prefix + type_info.name)
-        schema[field_name] = Rdf2SqliteAdapter.GetConverter(type_info)
-    return schema
-
-  def _InsertValueIntoDb(self, table_name, schema, value, db_cursor):
-    sql_dict = self._ConvertToCanonicalSqlDict(schema, value.ToPrimitiveDict())
-    buf = cStringIO.StringIO()
-    buf.write("INSERT INTO \"%s\" (\n  " % table_name)
-    buf.write(",\n  ".join(["\"%s\"" % k for k in sql_dict.keys()]))
-    buf.write("\n)")
-    buf.write("VALUES (%s);" % ",".join(["?"] * len(sql_dict)))
-    db_cursor.execute(buf.getvalue(), sql_dict.values())
-
-  def _ConvertToCanonicalSqlDict(self, schema, raw_dict, prefix=""):
-    """Converts a dict of RDF values into a SQL-ready form."""
-    flattened_dict = {}
-    for k, v in raw_dict.items():
-      if isinstance(v, dict):
-        flattened_dict.update(
-            self._ConvertToCanonicalSqlDict(
-                schema, v, prefix="%s%s." % (prefix, k)))
-      else:
-        field_name = prefix + k
-        flattened_dict[field_name] = schema[field_name].convert_fn(v)
-    return flattened_dict
-
-  def _FlushAllRows(self, db_connection, table_name):
-    """Copies rows from the given db into the output file then deletes them."""
-    for sql in db_connection.iterdump():
-      # The archive generator expects strings (not Unicode objects returned by
-      # the pysqlite library).
-      sql = utils.SmartStr(sql)
-      if (sql.startswith("CREATE TABLE") or
-          sql.startswith("BEGIN TRANSACTION") or sql.startswith("COMMIT")):
-        # These statements only need to be written once.
-        continue
-      yield self.archive_generator.WriteFileChunk(sql + "\n")
-    with db_connection:
-      db_connection.cursor().execute("DELETE FROM \"%s\";" % table_name)
+    return SqliteRowEncoder(proto_struct_class).schema
 
   def Finish(self):
     manifest = {"export_stats": self.export_counts}
@@ -200,3 +256,75 @@ class SqliteInstantOutputPlugin(
     yield self.archive_generator.WriteFileChunk(yaml.safe_dump(manifest))
     yield self.archive_generator.WriteFileFooter()
     yield self.archive_generator.Close()
+
+
+class SqliteDatabaseInstantOutputPlugin(SqliteInstantOutputPlugin):
+  """Instant output plugin that writes results into a SQLite database file.
+
+  All exported types end up as tables of a single database which is added to
+  the archive when the export is finished.
+  """
+
+  plugin_name = "sqlite-db-zip"
+  friendly_name = "SQLite database"
+  description = "Output ZIP archive containing a SQLite database."
+
+  READ_BLOCK_SIZE = 1024 * 1024
+
+  def __init__(self, *args, **kwargs):
+    super(SqliteDatabaseInstantOutputPlugin, self).__init__(*args, **kwargs)
+    self.db_path = None
+    self.db_connection = None
+
+  def Start(self):
+    result = super(SqliteDatabaseInstantOutputPlugin, self).Start()
+
+    fd, self.db_path = tempfile.mkstemp(suffix=".sqlite")
+    os.close(fd)
+    self.db_connection = sqlite3.connect(self.db_path)
+    # The database is a scratch file until it is added to the archive.
+    self.db_connection.execute("PRAGMA journal_mode = OFF;")
+    self.db_connection.execute("PRAGMA synchronous = OFF;")
+    return result
+
+  def ProcessSingleTypeExportedValues(self, original_value_type,
+                                      exported_values):
+    first_value, table_name, encoder = self._GetFirstValue(
+        original_value_type, exported_values)
+    if first_value is None:
+      return []
+
+    insert_statement = "INSERT INTO \"%s\" VALUES (%s);" % (
+        table_name, ",".join(["?"] * len(encoder.schema)))
+    counter = 0
+    with self.db_connection:
+      self.db_connection.execute(
+          self._CreateTableStatement(table_name, encoder))
+
+      values = itertools.chain([first_value], exported_values)
+      for batch in utils.Grouper(values, self.ROW_BATCH):
+        counter += len(batch)
+        self.db_connection.executemany(
+            insert_statement, [encoder.EncodeRow(value) for value in batch])
+
+    self._CountExport(original_value_type, first_value, counter)
+    # Nothing is written to the archive until the database is complete.
+    return []
+
+  def Finish(self):
+    self.db_connection.close()
+    try:
+      yield self.archive_generator.WriteFileHeader(
+          "%s/results.sqlite" % self.path_prefix)
+      with open(self.db_path, "rb") as fd:
+        while True:
+          data = fd.read(self.READ_BLOCK_SIZE)
+          if not data:
+            break
+          yield self.archive_generator.WriteFileChunk(data)
+      yield self.archive_generator.WriteFileFooter()
+    finally:
+      os.remove(self.db_path)
+
+    for chunk in super(SqliteDatabaseInstantOutputPlugin, self).Finish():
+      yield chunk
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Benchmarks for the SQLite instant output plugins."""
+
+
+import cStringIO
+import time
+
+import sqlite3
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server.output_plugins import sqlite_plugin
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class LegacySqliteInstantOutputPlugin(sqlite_plugin.SqliteInstantOutputPlugin):
+  """The previous implementation: one INSERT per row, dumped by PySQLite."""
+
+  plugin_name = "sqlite-zip-legacy-benchmark"
+
+  def ProcessSingleTypeExportedValues(self, original_value_type,
+                                      exported_values):
+    first_value = next(exported_values, None)
+    if not first_value:
+      return
+
+    yield self.archive_generator.WriteFileHeader(
+        "%s/%s_from_%s.sql" % (self.path_prefix, first_value.__class__.__name__,
+                               original_value_type.__name__))
+    table_name = "%s.from_%s" % (first_value.__class__.__name__,
+                                 original_value_type.__name__)
+    schema = self._GetSqliteSchema(first_value.__class__)
+
+    db_connection = sqlite3.connect(":memory:")
+    db_cursor = db_connection.cursor()
+
+    yield self.archive_generator.WriteFileChunk("BEGIN TRANSACTION;\n")
+    with db_connection:
+      buf = cStringIO.StringIO()
+      buf.write("CREATE TABLE \"%s\" (\n  " % table_name)
+      column_types = [(k, v.sqlite_type) for k, v in schema.items()]
+      buf.write(",\n  ".join(["\"%s\" %s" % (k, v) for k, v in column_types]))
+      buf.write("\n);")
+      db_cursor.execute(buf.getvalue())
+      yield self.archive_generator.WriteFileChunk(buf.getvalue() + "\n")
+      self._InsertValueIntoDb(table_name, schema, first_value, db_cursor)
+
+    for sql in self._FlushAllRows(db_connection, table_name):
+      yield sql
+    for batch in utils.Grouper(exported_values, self.ROW_BATCH):
+      with db_connection:
+        for value in batch:
+          self._InsertValueIntoDb(table_name, schema, value, db_cursor)
+      for sql in self._FlushAllRows(db_connection, table_name):
+        yield sql
+
+    db_connection.close()
+    yield self.archive_generator.WriteFileChunk("COMMIT;\n")
+    yield self.archive_generator.WriteFileFooter()
+
+  def _InsertValueIntoDb(self, table_name, schema, value, db_cursor):
+    sql_dict = self._ConvertToCanonicalSqlDict(schema, value.ToPrimitiveDict())
+    buf = cStringIO.StringIO()
+    buf.write("INSERT INTO \"%s\" (\n  " % table_name)
+    buf.write(",\n  ".join(["\"%s\"" % k for k in sql_dict.keys()]))
+    buf.write("\n)")
+    buf.write("VALUES (%s);" % ",".join(["?"] * len(sql_dict)))
+    db_cursor.execute(buf.getvalue(), sql_dict.values())
+
+  def _ConvertToCanonicalSqlDict(self, schema, raw_dict, prefix=""):
+    flattened_dict = {}
+    for k, v in raw_dict.items():
+      if isinstance(v, dict):
+        flattened_dict.update(
+            self._ConvertToCanonicalSqlDict(
+                schema, v, prefix="%s%s." % (prefix, k)))
+      else:
+        field_name = prefix + k
+        flattened_dict[field_name] = schema[field_name].convert_fn(v)
+    return flattened_dict
+
+  def _FlushAllRows(self, db_connection, table_name):
+    for sql in db_connection.iterdump():
+      sql = utils.SmartStr(sql)
+      if (sql.startswith("CREATE TABLE") or
+          sql.startswith("BEGIN TRANSACTION") or sql.startswith("COMMIT")):
+        continue
+      yield self.archive_generator.WriteFileChunk(sql + "\n")
+    with db_connection:
+      db_connection.cursor().execute("DELETE FROM \"%s\";" % table_name)
+
+
+class SqlitePluginBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares the throughput of the SQLite export implementations."""
+
+  units = "s"
+
+  RESULTS = 20000
+
+  def setUp(self):
+    super(SqlitePluginBenchmark, self).setUp(["Rows/s", "Output bytes"],
+                                             ["<12", "<12"])
+    self.client_id = self.SetupClients(1)[0]
+    self.messages = [
+        rdf_flows.GrrMessage(
+            source=self.client_id,
+            payload=rdf_client.StatEntry(
+                pathspec=rdf_paths.PathSpec(
+                    path="/foo/bar/it's %d" % i, pathtype="OS"),
+                st_mode=33184,
+                st_ino=1063090,
+                st_size=i,
+                st_atime=1493596800,
+                st_mtime=1493683200)) for i in xrange(self.RESULTS)
+    ]
+
+  def _Export(self, plugin_cls):
+    plugin = plugin_cls(
+        source_urn=rdfvalue.RDFURN("aff4:/hunts/H:123456"), token=self.token)
+
+    output_size = 0
+    start = time.time()
+    for chunks in (plugin.Start(),
+                   plugin.ProcessValues(rdf_client.StatEntry,
+                                        lambda: self.messages),
+                   plugin.Finish()):
+      for chunk in chunks:
+        output_size += len(chunk)
+    time_taken = time.time() - start
+
+    self.AddResult(plugin_cls.__name__, time_taken, 1,
+                   "%d" % (self.RESULTS / time_taken), output_size)
+
+  def testThroughput(self):
+    """Exports StatEntries with each SQLite plugin."""
+    for plugin_cls in (LegacySqliteInstantOutputPlugin,
+                       sqlite_plugin.SqliteInstantOutputPlugin,
+                       sqlite_plugin.SqliteDatabaseInstantOutputPlugin):
+      self._Export(plugin_cls)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -115,7 +115,7 @@ class SqliteInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
         "embedded_field.e_double_field": "REAL"
     })
 
-  def testConversionToCanonicalSqlDict(self):
+  def testRowEncoding(self):
     schema = self.plugin._GetSqliteSchema(SqliteTestStruct)
     test_struct = SqliteTestStruct(
         string_field="string_value",
@@ -134,8 +134,8 @@ class SqliteInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
         duration_field=rdfvalue.Duration.FromSeconds(123),
         embedded_field=TestEmbeddedStruct(
             e_string_field="e_string_value", e_double_field=0.789))
-    sql_dict = self.plugin._ConvertToCanonicalSqlDict(
-        schema, test_struct.ToPrimitiveDict())
+    encoder = sqlite_plugin.SqliteRowEncoder(SqliteTestStruct)
+    sql_dict = dict(zip(schema.keys(), encoder.EncodeRow(test_struct)))
     self.assertEqual(
         sql_dict,
         {
@@ -155,6 +155,26 @@ class SqliteInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
             "embedded_field.e_double_field": 0.789
         })
 
+  def testUnsetFieldsAreEncodedAsNull(self):
+    encoder = sqlite_plugin.SqliteRowEncoder(SqliteTestStruct)
+    row = encoder.EncodeRow(
+        SqliteTestStruct(
+            string_field="it's",
+            embedded_field=TestEmbeddedStruct(e_double_field=0.5)))
+    row_dict = dict(zip(encoder.schema.keys(), row))
+    self.assertEqual(row_dict["string_field"], "it's")
+    self.assertIsNone(row_dict["uint_field"])
+    self.assertIsNone(row_dict["embedded_field.e_string_field"])
+    self.assertEqual(row_dict["embedded_field.e_double_field"], 0.5)
+
+    # The SQL literals round trip through SQLite.
+    self.db_cursor.execute("SELECT %s;" % encoder.EncodeLiterals(
+        SqliteTestStruct(string_field="it's", double_field=0.1))[1:-1])
+    result = self.db_cursor.fetchone()
+    self.assertEqual(result[0], "it's")
+    self.assertEqual(result[5], 0.1)
+    self.assertIsNone(result[2])
+
   def testExportedFilenamesAndManifestForValuesOfSameType(self):
     zip_fd, prefix = self.ProcessValuesToZip({
         rdf_client.StatEntry: self.STAT_ENTRY_RESPONSES
@@ -349,6 +369,58 @@ class SqliteInstantOutputPluginTest(test_plugins.InstantOutputPluginTestBase):
                        self.client_id.Add("/fs/os/foo/bar/%d" % i))
 
 
+class SqliteDatabaseInstantOutputPluginTest(
+    test_plugins.InstantOutputPluginTestBase):
+  """Tests the SQLite database instant output plugin."""
+
+  plugin_cls = sqlite_plugin.SqliteDatabaseInstantOutputPlugin
+
+  def testExportsAllTypesIntoOneDatabase(self):
+    fd_path = self.ProcessValues({
+        rdf_client.StatEntry: [
+            rdf_client.StatEntry(pathspec=rdf_paths.PathSpec(
+                path="/foo/bar/%d" % i, pathtype="OS")) for i in range(250)
+        ],
+        rdf_client.Process: [rdf_client.Process(pid=42)]
+    })
+    prefix, _ = os.path.splitext(os.path.basename(fd_path))
+    zip_fd = zipfile.ZipFile(fd_path)
+    self.assertEqual(
+        set(zip_fd.namelist()),
+        {"%s/MANIFEST" % prefix,
+         "%s/results.sqlite" % prefix})
+
+    db_path = os.path.join(self.temp_dir, "results.sqlite")
+    with open(db_path, "wb") as fd:
+      fd.write(zip_fd.read("%s/results.sqlite" % prefix))
+
+    db_connection = sqlite3.connect(db_path)
+    try:
+      cursor = db_connection.cursor()
+      cursor.execute("SELECT urn FROM \"ExportedFile.from_StatEntry\";")
+      results = cursor.fetchall()
+      self.assertEqual(len(results), 250)
+      for i, result in enumerate(results):
+        self.assertEqual(result[0], self.client_id.Add("/fs/os/foo/bar/%d" % i))
+
+      cursor.execute("SELECT pid FROM \"ExportedProcess.from_Process\";")
+      self.assertEqual(cursor.fetchall(), [(42,)])
+    finally:
+      db_connection.close()
+
+    parsed_manifest = yaml.load(zip_fd.read("%s/MANIFEST" % prefix))
+    self.assertEqual(parsed_manifest, {
+        "export_stats": {
+            "StatEntry": {
+                "ExportedFile": 250
+            },
+            "Process": {
+                "ExportedProcess": 1
+            }
+        }
+    })
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -7,7 +7,9 @@ try:
 except ImportError:
   pass
 
+from grr.server.output_plugins import csv_plugin_benchmark_test
 from grr.server.output_plugins import csv_plugin_test
 from grr.server.output_plugins import email_plugin_test
+from grr.server.output_plugins import sqlite_plugin_benchmark_test
 from grr.server.output_plugins import sqlite_plugin_test
 from grr.server.output_plugins import yaml_plugin_test
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""Lazy loading of server plugins.
+
+Importing grr.lib.server_plugins imports and registers every flow, output
+plugin, data store, blob store, cron job and GUI plugin which makes server tools
+slow to start. Entry points can instead pass the subsystems they need to
+server_startup.Init(). Only those are imported at startup, all other plugins
+are listed in a generated manifest and imported the first time they are looked
+up in their registry.
+
+The manifest is (re)generated by importing everything whenever it is missing or
+any of the modules it lists has changed.
+"""
+
+import json
+import os
+import sys
+
+import logging
+
+from grr.lib import registry
+from grr.lib import utils
+
+# Modules imported at startup for each subsystem.
+SUBSYSTEMS = {
+    "aff4_objects": ["grr.server.aff4_objects.registry_init"],
+    "blob_stores": ["grr.server.blob_stores.registry_init"],
+    "client_actions": ["grr.client.client_plugins"],
+    "cron": ["grr.server.flows.cron.registry_init"],
+    "data_stores": ["grr.server.data_stores.registry_init"],
+    "endtoend_tests": ["grr.endtoend_tests"],
+    "export": ["grr.server.export", "grr.server.file_store"],
+    "flows": [
+        "grr.server.flow", "grr.server.flows.general.registry_init",
+        "grr.server.flows.local.registry_init"
+    ],
+    "gui": ["grr.gui.gui_plugins"],
+    "hunts": ["grr.server.foreman", "grr.server.hunts"],
+    "output_plugins": ["grr.server.output_plugin", "grr.server.output_plugins"],
+    "parsers": ["grr.parsers.registry_init"],
+}
+
+# Modules that are always imported: deployment specific plugins and the modules
+# whose init hooks every server component depends on.
+CORE_MODULES = [
+    "grr.lib.stats",
+    "grr.lib.local.plugins",
+    "grr.server.access_control",
+    "grr.server.ip_resolver",
+    "grr.server.local",
+    "grr.server.master",
+    "grr.server.stats_server",
+]
+
+# Subsystems needed by the usual server components.
+STORAGE_SUBSYSTEMS = ["aff4_objects", "blob_stores", "data_stores"]
+
+
+def ImportModules(module_names):
+  for module_name in module_names:
+    __import__(module_name)
+
+
+def ImportSubsystems(subsystems):
+  """Eagerly imports the modules of the given subsystems."""
+  ImportModules(CORE_MODULES)
+  for subsystem in subsystems:
+    try:
+      ImportModules(SUBSYSTEMS[subsystem])
+    except KeyError:
+      raise ValueError("Unknown plugin subsystem: %s" % subsystem)
+
+
+def _SourceFile(module):
+  filename = getattr(module, "__file__", None)
+  if not filename:
+    return None
+
+  if filename.endswith((".pyc", ".pyo")):
+    filename = filename[:-1]
+
+  return filename
+
+
+def GenerateManifest():
+  """Imports all plugins and returns a manifest describing them.
+
+  Returns:
+    A dict which can be written with WriteManifest().
+  """
+  # grr.lib.server_plugins is where deployments add their own plugins.
+  ImportModules(["grr.lib.server_plugins"])
+  ImportSubsystems(sorted(SUBSYSTEMS))
+
+  manifest = registry.GetPluginManifest()
+
+  # Remember the files we got the plugins from, so we can tell when the
+  # manifest goes stale.
+  files = {}
+  for module_name, module in sys.modules.items():
+    if module is None or not module_name.startswith("grr."):
+      continue
+
+    filename = _SourceFile(module)
+    if filename and os.path.exists(filename):
+      files[filename] = os.path.getmtime(filename)
+
+  manifest["files"] = files
+  return manifest
+
+
+def WriteManifest(path, manifest):
+  """Writes the manifest to path. Failures are logged but not fatal."""
+  try:
+    utils.EnsureDirExists(os.path.dirname(path))
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as fd:
+      json.dump(manifest, fd, sort_keys=True)
+    os.rename(tmp_path, path)
+  except (IOError, OSError) as e:
+    logging.warning("Unable to write plugin manifest %s: %s", path, e)
+
+
+def ReadManifest(path):
+  """Reads the manifest at path.
+
+  Args:
+    path: The path of the manifest.
+
+  Returns:
+    The manifest dict or None if there is no manifest or it is out of date.
+  """
+  try:
+    with open(path, "rb") as fd:
+      manifest = json.load(fd)
+  except (IOError, ValueError):
+    return None
+
+  try:
+    for filename, mtime in manifest["files"].iteritems():
+      if os.path.getmtime(filename) != mtime:
+        logging.info("Plugin manifest %s is out of date: %s changed.", path,
+                     filename)
+        return None
+  except (KeyError, AttributeError, OSError):
+    return None
+
+  return manifest
+
+
+def LoadSubsystems(subsystems, manifest_path):
+  """Imports the requested subsystems and makes other plugins available lazily.
+
+  Args:
+    subsystems: Names of subsystems (keys of SUBSYSTEMS) to import now.
+    manifest_path: Where the plugin manifest is stored. If empty, all plugins
+      are imported.
+  """
+  manifest = None
+  if manifest_path:
+    manifest = ReadManifest(manifest_path)
+
+  if manifest is None:
+    # This imports all the plugins.
+    manifest = GenerateManifest()
+    if manifest_path:
+      WriteManifest(manifest_path, manifest)
+    return
+
+  registry.SetPluginManifest(manifest)
+  ImportSubsystems(subsystems)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Tests for lazy plugin loading."""
+
+
+import os
+import sys
+
+from grr.lib import flags
+from grr.lib import registry
+from grr.server import plugin_manifest
+from grr.test_lib import test_lib
+
+
+class LazyTestPlugin(object):
+  __metaclass__ = registry.MetaclassRegistry
+
+
+PLUGIN_MODULE = """
+import sys
+
+from grr.lib import registry
+
+base = sys.modules[%(base_module)r]
+
+
+class %(name)s(base.LazyTestPlugin):
+  pass
+
+
+class %(name)sHook(registry.InitHook):
+
+  def RunOnce(self):
+    base.HOOKS_RUN.append(%(name)r)
+"""
+
+HOOKS_RUN = []
+
+
+class PluginManifestTest(test_lib.GRRBaseTest):
+  """Tests for lazy plugin loading."""
+
+  def setUp(self):
+    super(PluginManifestTest, self).setUp()
+    sys.path.insert(0, self.temp_dir)
+    self.registry_name = LazyTestPlugin.classes.registry_name
+    self.module_names = []
+
+  def tearDown(self):
+    super(PluginManifestTest, self).tearDown()
+    sys.path.remove(self.temp_dir)
+    for module_name in self.module_names:
+      sys.modules.pop(module_name, None)
+
+  def _WritePluginModule(self, name):
+    module_name = "lazy_plugin_%s_%d" % (name.lower(), os.getpid())
+    with open(os.path.join(self.temp_dir, module_name + ".py"), "wb") as fd:
+      fd.write(PLUGIN_MODULE % dict(base_module=__name__, name=name))
+
+    self.module_names.append(module_name)
+    return module_name
+
+  def _SetManifest(self, **plugins):
+    registry.SetPluginManifest(
+        dict(plugins={self.registry_name: plugins}, events={}))
+
+  def testPluginIsImportedOnLookup(self):
+    module_name = self._WritePluginModule("LazyA")
+    self._SetManifest(LazyA=module_name)
+
+    self.assertNotIn(module_name, sys.modules)
+    plugin_cls = LazyTestPlugin.GetPlugin("LazyA")
+    self.assertIn(module_name, sys.modules)
+    self.assertEqual(plugin_cls.__name__, "LazyA")
+    self.assertIs(LazyTestPlugin.classes["LazyA"], plugin_cls)
+
+  def testContainsAndGet(self):
+    module_name = self._WritePluginModule("LazyB")
+    self._SetManifest(LazyB=module_name)
+
+    self.assertNotIn("LazyC", LazyTestPlugin.classes)
+    self.assertIsNone(LazyTestPlugin.classes.get("LazyC"))
+    self.assertNotIn(module_name, sys.modules)
+
+    self.assertIn("LazyB", LazyTestPlugin.classes)
+    self.assertIn(module_name, sys.modules)
+
+  def testListingImportsAllPlugins(self):
+    module_names = [
+        self._WritePluginModule(name) for name in ("LazyD", "LazyE")
+    ]
+    self._SetManifest(LazyD=module_names[0], LazyE=module_names[1])
+
+    self.assertIn("LazyD", LazyTestPlugin.classes.keys())
+    self.assertIn("LazyE", LazyTestPlugin.classes.keys())
+    for module_name in module_names:
+      self.assertIn(module_name, sys.modules)
+
+  def testMissingPluginRaises(self):
+    self._SetManifest(LazyF="grr_module_that_does_not_exist")
+
+    with self.assertRaises(KeyError):
+      LazyTestPlugin.GetPlugin("LazyF")
+
+  def testInitHooksOfLazyPluginsRun(self):
+    module_name = self._WritePluginModule("LazyG")
+    self._SetManifest(LazyG=module_name)
+
+    LazyTestPlugin.GetPlugin("LazyG")
+    self.assertIn("LazyG", HOOKS_RUN)
+
+  def testManifestRoundTrip(self):
+    manifest_path = os.path.join(self.temp_dir, "manifest.json")
+    self.assertIsNone(plugin_manifest.ReadManifest(manifest_path))
+
+    manifest = plugin_manifest.GenerateManifest()
+    self.assertIn("GRRFlow",
+                  [name.split(".")[-1] for name in manifest["plugins"]])
+
+    plugin_manifest.WriteManifest(manifest_path, manifest)
+    self.assertEqual(
+        plugin_manifest.ReadManifest(manifest_path)["plugins"],
+        manifest["plugins"])
+
+  def testStaleManifestIsIgnored(self):
+    module_name = self._WritePluginModule("LazyH")
+    source = os.path.join(self.temp_dir, module_name + ".py")
+    manifest_path = os.path.join(self.temp_dir, "manifest.json")
+    plugin_manifest.WriteManifest(
+        manifest_path,
+        dict(plugins={}, events={}, files={source: os.path.getmtime(source)}))
+    self.assertIsNotNone(plugin_manifest.ReadManifest(manifest_path))
+
+    os.utime(source, (0, 0))
+    self.assertIsNone(plugin_manifest.ReadManifest(manifest_path))
+
+  def testUnknownSubsystem(self):
+    with self.assertRaises(ValueError):
+      plugin_manifest.ImportSubsystems(["no_such_subsystem"])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
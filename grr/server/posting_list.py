@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""Compressed posting lists used by keyword indexes.
+
+A posting list is a list of (name, timestamp) postings sorted by name. Names
+are front coded: every posting only stores the suffix that differs from the
+previous name. Timestamps are stored as zigzag encoded differences to the
+previous timestamp.
+
+Postings are grouped into blocks which are encoded independently of each
+other. A skip table holding the first name of every block makes it possible to
+seek to a name by decoding just the one block which can contain it, which is
+what makes intersecting a small list with a large one cheap.
+"""
+
+
+import bisect
+import heapq
+
+from grr.lib.rdfvalues import structs
+
+
+def _ZigZagEncode(value):
+  return structs.VarintEncode((value << 1) ^ (value >> 63))
+
+
+def _ZigZagReader(buf, pos):
+  value, pos = structs.VarintReader(buf, pos)
+  return (value >> 1) ^ -(value & 1), pos
+
+
+class PostingList(object):
+  """An immutable, sorted list of (name, timestamp) postings.
+
+  A posting list can be restricted to a time range using Filter(). Postings
+  with timestamps outside of the range are skipped when the list is read.
+  """
+
+  FORMAT_VERSION = 1
+
+  # Number of postings per block.
+  BLOCK_SIZE = 128
+
+  def __init__(self,
+               data="",
+               count=0,
+               block_size=BLOCK_SIZE,
+               first_names=None,
+               offsets=None,
+               start_time=None,
+               end_time=None):
+    self._data = data
+    self._count = count
+    self._block_size = block_size
+    self._first_names = first_names or []
+    self._offsets = offsets or []
+    self.start_time = start_time
+    self.end_time = end_time
+
+  @classmethod
+  def FromEntries(cls, entries, block_size=BLOCK_SIZE):
+    """Encodes postings into a posting list.
+
+    Args:
+      entries: An iterable of (name, timestamp) tuples, sorted by name. Names
+          have to be unique.
+      block_size: The number of postings per block.
+
+    Returns:
+      A PostingList.
+
+    Raises:
+      ValueError: The entries are not sorted or names are not unique.
+    """
+    chunks = []
+    size = 0
+    first_names = []
+    offsets = []
+    count = 0
+    previous_name = None
+    previous_timestamp = 0
+
+    for name, timestamp in entries:
+      if previous_name is not None and name <= previous_name:
+        raise ValueError("Postings have to be sorted by unique names.")
+
+      if count % block_size == 0:
+        first_names.append(name)
+        offsets.append(size)
+        shared = 0
+        previous_timestamp = 0
+      else:
+        shared = 0
+        max_shared = min(len(name), len(previous_name))
+        while shared < max_shared and name[shared] == previous_name[shared]:
+          shared += 1
+
+      suffix = name[shared:]
+      chunk = "".join((structs.VarintEncode(shared),
+                       structs.VarintEncode(len(suffix)), suffix,
+                       _ZigZagEncode(timestamp - previous_timestamp)))
+      chunks.append(chunk)
+      size += len(chunk)
+
+      count += 1
+      previous_name = name
+      previous_timestamp = timestamp
+
+    return cls(
+        data="".join(chunks),
+        count=count,
+        block_size=block_size,
+        first_names=first_names,
+        offsets=offsets)
+
+  @classmethod
+  def FromSerializedString(cls, serialized):
+    """Decodes the header of a serialized posting list."""
+    version, pos = structs.VarintReader(serialized, 0)
+    if version != cls.FORMAT_VERSION:
+      raise ValueError("Unknown posting list format version: %d" % version)
+
+    count, pos = structs.VarintReader(serialized, pos)
+    block_size, pos = structs.VarintReader(serialized, pos)
+    num_blocks, pos = structs.VarintReader(serialized, pos)
+
+    first_names = []
+    offsets = []
+    offset = 0
+    for _ in xrange(num_blocks):
+      length, pos = structs.VarintReader(serialized, pos)
+      first_names.append(serialized[pos:pos + length])
+      pos += length
+      delta, pos = structs.VarintReader(serialized, pos)
+      offset += delta
+      offsets.append(offset)
+
+    return cls(
+        data=serialized[pos:],
+        count=count,
+        block_size=block_size,
+        first_names=first_names,
+        offsets=offsets)
+
+  def SerializeToString(self):
+    header = [
+        structs.VarintEncode(self.FORMAT_VERSION),
+        structs.VarintEncode(self._count),
+        structs.VarintEncode(self._block_size),
+        structs.VarintEncode(len(self._first_names))
+    ]
+
+    previous_offset = 0
+    for first_name, offset in zip(self._first_names, self._offsets):
+      header.append(structs.VarintEncode(len(first_name)))
+      header.append(first_name)
+      header.append(structs.VarintEncode(offset - previous_offset))
+      previous_offset = offset
+
+    return "".join(header) + self._data
+
+  def Filter(self, start_time=None, end_time=None):
+    """Returns a view of this list restricted to a time range.
+
+    Args:
+      start_time: If set, only postings at or after this time are returned.
+      end_time: If set, only postings at or before this time are returned.
+
+    Returns:
+      A PostingList sharing the encoded postings with this one.
+    """
+    return self.__class__(
+        data=self._data,
+        count=self._count,
+        block_size=self._block_size,
+        first_names=self._first_names,
+        offsets=self._offsets,
+        start_time=start_time,
+        end_time=end_time)
+
+  def __len__(self):
+    """The number of stored postings, including filtered ones."""
+    return self._count
+
+  def __iter__(self):
+    cursor = self.Cursor()
+    entry = cursor.Next()
+    while entry is not None:
+      yield entry
+      entry = cursor.Next()
+
+  def Cursor(self):
+    return PostingListCursor(self)
+
+  def InRange(self, timestamp):
+    return ((self.start_time is None or timestamp >= self.start_time) and
+            (self.end_time is None or timestamp <= self.end_time))
+
+  @property
+  def num_blocks(self):
+    return len(self._first_names)
+
+  @property
+  def first_names(self):
+    return self._first_names
+
+  def DecodeBlock(self, index):
+    """Decodes a block into a list of names and a list of timestamps."""
+    data = self._data
+    pos = self._offsets[index]
+    length = min(self._block_size, self._count - index * self._block_size)
+
+    names = []
+    timestamps = []
+    name = ""
+    timestamp = 0
+    for _ in xrange(length):
+      shared, pos = structs.VarintReader(data, pos)
+      suffix_length, pos = structs.VarintReader(data, pos)
+      name = name[:shared] + data[pos:pos + suffix_length]
+      pos += suffix_length
+      delta, pos = _ZigZagReader(data, pos)
+      timestamp += delta
+
+      names.append(name)
+      timestamps.append(timestamp)
+
+    return names, timestamps
+
+
+class PostingListCursor(object):
+  """A forward-only cursor over a posting list."""
+
+  def __init__(self, posting_list):
+    self._list = posting_list
+    self._block_index = -1
+    self._names = []
+    self._timestamps = []
+    self._position = 0
+
+  def _LoadBlock(self, index):
+    self._block_index = index
+    self._names, self._timestamps = self._list.DecodeBlock(index)
+    self._position = 0
+
+  def _Current(self):
+    """Returns the first posting in range at or after the cursor position."""
+    while True:
+      if self._position >= len(self._names):
+        if self._block_index + 1 >= self._list.num_blocks:
+          return None
+
+        self._LoadBlock(self._block_index + 1)
+        continue
+
+      timestamp = self._timestamps[self._position]
+      if self._list.InRange(timestamp):
+        return self._names[self._position], timestamp
+
+      self._position += 1
+
+  def Next(self):
+    """Advances the cursor.
+
+    Returns:
+      The next (name, timestamp) posting or None if the list is exhausted.
+    """
+    if self._block_index < 0:
+      if not self._list.num_blocks:
+        return None
+      self._LoadBlock(0)
+    else:
+      self._position += 1
+
+    return self._Current()
+
+  def Seek(self, name):
+    """Moves the cursor forward to the first posting not before name.
+
+    The block holding name is found by galloping through the skip table from
+    the current block, so seeking to nearby names is cheap no matter how long
+    the list is. The cursor never moves backwards.
+
+    Args:
+      name: The name to seek to.
+
+    Returns:
+      The first (name, timestamp) posting with a name not before the given
+      one, or None if there is no such posting.
+    """
+    first_names = self._list.first_names
+    num_blocks = len(first_names)
+    if not num_blocks:
+      return None
+
+    current = max(self._block_index, 0)
+    low = current
+    step = 1
+    while low + step < num_blocks and first_names[low + step] <= name:
+      low += step
+      step *= 2
+
+    block = bisect.bisect_right(first_names, name, low,
+                                min(low + step, num_blocks)) - 1
+    block = max(block, current)
+    if block != self._block_index:
+      self._LoadBlock(block)
+
+    self._position = bisect.bisect_left(self._names, name, self._position)
+    return self._Current()
+
+
+def IntersectPostingLists(posting_lists):
+  """Intersects posting lists.
+
+  The intersection is driven by the shortest list: every name read from it is
+  looked up in the others using PostingListCursor.Seek(). Since results are
+  produced lazily in name order, callers can stop reading as soon as they have
+  enough of them.
+
+  Args:
+    posting_lists: A list of PostingList objects.
+
+  Yields:
+    Tuples (name, timestamps) for all names contained in all posting lists,
+    sorted by name. timestamps holds the timestamp of the name in each of the
+    posting lists, in the order they were passed in.
+  """
+  if not posting_lists:
+    return
+
+  order = sorted(
+      range(len(posting_lists)), key=lambda i: len(posting_lists[i]))
+  cursors = [posting_lists[i].Cursor() for i in order]
+
+  timestamps = [None] * len(posting_lists)
+  entry = cursors[0].Next()
+  while entry is not None:
+    name, timestamps[order[0]] = entry
+
+    for i, cursor in zip(order[1:], cursors[1:]):
+      other = cursor.Seek(name)
+      if other is None:
+        return
+
+      if other[0] != name:
+        # Skip ahead to the next name which may be contained in all lists.
+        entry = cursors[0].Seek(other[0])
+        break
+
+      timestamps[i] = other[1]
+
+    else:
+      yield name, tuple(timestamps)
+      entry = cursors[0].Next()
+
+
+def MergePostings(*entry_lists):
+  """Merges sorted (name, timestamp) iterables keeping the latest timestamps.
+
+  Args:
+    *entry_lists: Iterables of (name, timestamp) tuples, each sorted by name.
+
+  Yields:
+    (name, timestamp) tuples sorted by unique names.
+  """
+  previous_name = None
+  previous_timestamp = None
+  for name, timestamp in heapq.merge(*entry_lists):
+    if name == previous_name:
+      previous_timestamp = max(previous_timestamp, timestamp)
+      continue
+
+    if previous_name is not None:
+      yield previous_name, previous_timestamp
+    previous_name, previous_timestamp = name, timestamp
+
+  if previous_name is not None:
+    yield previous_name, previous_timestamp
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Tests for grr.server.posting_list."""
+
+
+import random
+
+from grr.lib import flags
+from grr.server import posting_list
+from grr.test_lib import test_lib
+
+
+def _Postings(numbers, timestamp=None):
+  return [("C.%016x" % i, i if timestamp is None else timestamp)
+          for i in sorted(numbers)]
+
+
+class PostingListTest(test_lib.GRRBaseTest):
+
+  def testSerialization(self):
+    for count in [0, 1, 127, 128, 129, 1000]:
+      postings = _Postings(range(0, count * 3, 3))
+      serialized = posting_list.PostingList.FromEntries(
+          postings).SerializeToString()
+
+      decoded = posting_list.PostingList.FromSerializedString(serialized)
+      self.assertEqual(len(decoded), count)
+      self.assertEqual(list(decoded), postings)
+
+  def testNegativeTimestampDeltas(self):
+    postings = [("a", 1000), ("b", 5), ("c", 2**62), ("d", 0)]
+    serialized = posting_list.PostingList.FromEntries(
+        postings, block_size=3).SerializeToString()
+
+    self.assertEqual(
+        list(posting_list.PostingList.FromSerializedString(serialized)),
+        postings)
+
+  def testNamesAreFrontCoded(self):
+    postings = _Postings(range(1000), timestamp=0)
+    serialized = posting_list.PostingList.FromEntries(
+        postings).SerializeToString()
+
+    names_size = sum(len(name) for name, _ in postings)
+    self.assertLess(len(serialized), names_size / 3)
+
+  def testUnsortedEntriesRaise(self):
+    with self.assertRaises(ValueError):
+      posting_list.PostingList.FromEntries([("b", 1), ("a", 1)])
+
+    with self.assertRaises(ValueError):
+      posting_list.PostingList.FromEntries([("a", 1), ("a", 2)])
+
+  def testFilter(self):
+    postings = posting_list.PostingList.FromEntries(_Postings(range(100)))
+
+    self.assertEqual(
+        list(postings.Filter(10, 12)), _Postings([10, 11, 12]))
+    self.assertEqual(list(postings.Filter(start_time=98)), _Postings([98, 99]))
+    self.assertEqual(list(postings.Filter(end_time=1)), _Postings([0, 1]))
+    self.assertEqual(len(list(postings)), 100)
+
+  def testSeek(self):
+    postings = _Postings(range(0, 1000, 2))
+    cursor = posting_list.PostingList.FromEntries(
+        postings, block_size=16).Cursor()
+
+    self.assertEqual(cursor.Seek("C.%016x" % 10), postings[5])
+    self.assertEqual(cursor.Seek("C.%016x" % 11), postings[6])
+    # Seeking to the current position does not advance the cursor.
+    self.assertEqual(cursor.Seek("C.%016x" % 11), postings[6])
+    self.assertEqual(cursor.Next(), postings[7])
+    # The cursor never moves backwards.
+    self.assertEqual(cursor.Seek("C.%016x" % 0), postings[7])
+    self.assertEqual(cursor.Seek("C.%016x" % 801), postings[401])
+    self.assertEqual(cursor.Seek("C.%016x" % 998), postings[499])
+    self.assertIsNone(cursor.Seek("C.%016x" % 999))
+    self.assertIsNone(cursor.Next())
+
+  def testSeekSkipsFilteredPostings(self):
+    postings = posting_list.PostingList.FromEntries(
+        _Postings(range(100)), block_size=8).Filter(50, 60)
+    cursor = postings.Cursor()
+
+    self.assertEqual(cursor.Seek("C.%016x" % 3), _Postings([50])[0])
+    self.assertIsNone(cursor.Seek("C.%016x" % 61))
+
+  def testEmptyList(self):
+    postings = posting_list.PostingList.FromSerializedString(
+        posting_list.PostingList().SerializeToString())
+
+    self.assertEqual(list(postings), [])
+    self.assertIsNone(postings.Cursor().Seek("a"))
+
+  def testIntersection(self):
+    lists = [
+        posting_list.PostingList.FromEntries(
+            _Postings(range(0, 10000, step)), block_size=32)
+        for step in (2, 3, 5)
+    ]
+
+    result = list(posting_list.IntersectPostingLists(lists))
+    self.assertEqual([name for name, _ in result],
+                     [name for name, _ in _Postings(range(0, 10000, 30))])
+    self.assertEqual(result[1][1], (30, 30, 30))
+
+  def testIntersectionMatchesSets(self):
+    rand = random.Random(42)
+    for _ in range(20):
+      sets = [
+          set(rand.sample(xrange(2000), rand.choice([0, 5, 100, 1500])))
+          for _ in range(rand.randint(1, 4))
+      ]
+      lists = [
+          posting_list.PostingList.FromEntries(
+              _Postings(numbers), block_size=rand.choice([1, 4, 128]))
+          for numbers in sets
+      ]
+
+      self.assertEqual([
+          name for name, _ in posting_list.IntersectPostingLists(lists)
+      ], [name for name, _ in _Postings(set.intersection(*sets))])
+
+  def testIntersectionIsLazy(self):
+    small = posting_list.PostingList.FromEntries(_Postings(range(10)))
+    large = posting_list.PostingList.FromEntries(
+        _Postings(range(100000)), block_size=64)
+
+    decoded_blocks = []
+    original_decode = large.DecodeBlock
+
+    def DecodeBlock(index):
+      decoded_blocks.append(index)
+      return original_decode(index)
+
+    large.DecodeBlock = DecodeBlock
+    matches = posting_list.IntersectPostingLists([large, small])
+    self.assertEqual(next(matches)[0], "C.%016x" % 0)
+    self.assertEqual(decoded_blocks, [0])
+
+  def testMergePostings(self):
+    merged = posting_list.MergePostings([("a", 1), ("b", 5)],
+                                        [("b", 3), ("c", 2)])
+    self.assertEqual(list(merged), [("a", 1), ("b", 5), ("c", 2)])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""Time bucketed indexes of the objects removed by the data retention crons.
+
+Objects are recorded in the bucket of the time they expire from: the time of
+their last write for clients and temporary objects and the expiry time for
+hunts. Every bucket is a data store row with one attribute per urn, so the
+retention crons only read the buckets older than their retention horizon
+instead of opening every object.
+
+Buckets are one day long, so an object which is written to all the time is
+moved to a new bucket once a day, and the process moving it removes it from
+its previous bucket. The list of buckets kept on the row of the index is only
+written when a process records the first urn of a bucket. Nothing is recorded
+for an index whose TTL is not configured.
+
+Entries may still be stale, e.g. when a client was written to again by a
+process which did not record it before. The crons check every object they
+read from the index and move the ones which did not expire yet to their
+current bucket.
+"""
+
+
+import re
+
+from grr import config
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.server import data_store
+
+# Names of the indexes.
+CLIENTS = "clients"
+HUNTS = "hunts"
+TMP = "tmp"
+
+# The config options of the TTL of the objects in every index.
+TTL_OPTIONS = {
+    CLIENTS: "DataRetention.inactive_client_ttl",
+    HUNTS: "DataRetention.hunts_ttl",
+    TMP: "DataRetention.tmp_ttl",
+}
+
+_CLIENT_PATH_RE = re.compile(r"^/[cC]\.[0-9a-fA-F]{16}$")
+_TMP_PATH_RE = re.compile(r"^/tmp/[^/]+$")
+
+# The buckets urns were last recorded in by this process. Objects are written
+# to all the time, but only need to be recorded once per bucket.
+_RECORDED_BUCKETS = utils.FastStore(max_size=100000)
+
+# The buckets this process listed on the rows of the indexes.
+_LISTED_BUCKETS = utils.FastStore(max_size=1000)
+
+
+def FlushCaches():
+  """Forgets what this process recorded, e.g. when the data store is reset."""
+  _RECORDED_BUCKETS.Flush()
+  _LISTED_BUCKETS.Flush()
+
+
+class RetentionIndex(object):
+  """An index of urns bucketed by time."""
+
+  INDEX_ROOT = rdfvalue.RDFURN("aff4:/retention_index")
+
+  BUCKET_PREFIX = "index:retention_bucket/"
+  URN_PREFIX = "index:retention_urn/"
+  INITIALIZED_ATTRIBUTE = "index:retention_initialized"
+
+  # One day, in microseconds.
+  BUCKET_SIZE = 24 * 3600 * 1000000
+
+  def __init__(self, name, token=None):
+    self.name = name
+    self.urn = self.INDEX_ROOT.Add(name)
+    self.token = token
+
+  def Bucket(self, timestamp):
+    return int(timestamp) // self.BUCKET_SIZE
+
+  def _BucketAttribute(self, bucket):
+    return self.BUCKET_PREFIX + "%016x" % bucket
+
+  def _BucketSubject(self, bucket):
+    return self.urn.Add("%016x" % bucket)
+
+  def Add(self, urn, timestamp, mutation_pool):
+    """Records urn in the bucket of the given time.
+
+    Args:
+      urn: The urn to record.
+      timestamp: The time the object expires from, an RDFDatetime.
+      mutation_pool: A MutationPool object to write to.
+
+    Returns:
+      The bucket the urn was recorded in.
+    """
+    bucket = self.Bucket(timestamp)
+    key = (self.name, bucket)
+    if key not in _LISTED_BUCKETS:
+      mutation_pool.Set(self.urn, self._BucketAttribute(bucket), "")
+      _LISTED_BUCKETS.Put(key, True)
+    mutation_pool.Set(
+        self._BucketSubject(bucket), self.URN_PREFIX + utils.SmartStr(urn),
+        "")
+    return bucket
+
+  def Remove(self, urn, bucket, mutation_pool):
+    mutation_pool.DeleteAttributes(
+        self._BucketSubject(bucket), [self.URN_PREFIX + utils.SmartStr(urn)])
+
+  def ListBuckets(self, deadline):
+    """Returns the buckets starting before deadline, oldest first."""
+    buckets = []
+    for attribute, _, _ in data_store.DB.ResolvePrefix(
+        self.urn, self.BUCKET_PREFIX, token=self.token):
+      bucket = int(attribute[len(self.BUCKET_PREFIX):], 16)
+      if bucket * self.BUCKET_SIZE < deadline:
+        buckets.append(bucket)
+
+    return sorted(buckets)
+
+  def IsBucketExpired(self, bucket, deadline):
+    """Checks if all the times in the given bucket are before deadline."""
+    return (bucket + 1) * self.BUCKET_SIZE <= deadline
+
+  def ReadBucket(self, bucket):
+    """Returns the urns recorded in the given bucket."""
+    return [
+        rdfvalue.RDFURN(attribute[len(self.URN_PREFIX):])
+        for attribute, _, _ in data_store.DB.ResolvePrefix(
+            self._BucketSubject(bucket), self.URN_PREFIX, token=self.token)
+    ]
+
+  def DeleteBucket(self, bucket, mutation_pool):
+    """Deletes a bucket all the times of which are older than the TTL.
+
+    Nothing is recorded in such a bucket anymore, so other processes which
+    still consider it listed do not write to it again.
+
+    Args:
+      bucket: The bucket to delete.
+      mutation_pool: A MutationPool object to write to.
+    """
+    mutation_pool.DeleteSubject(self._BucketSubject(bucket))
+    mutation_pool.DeleteAttributes(self.urn, [self._BucketAttribute(bucket)])
+    _LISTED_BUCKETS.ExpireObject((self.name, bucket))
+
+  def IsInitialized(self):
+    """Checks if the objects which existed before the index were added."""
+    value, _ = data_store.DB.Resolve(
+        self.urn, self.INITIALIZED_ATTRIBUTE, token=self.token)
+    return bool(value)
+
+  def MarkInitialized(self):
+    data_store.DB.Set(
+        self.urn, self.INITIALIZED_ATTRIBUTE, "1", token=self.token)
+
+  def MarkUninitialized(self):
+    """Makes the index be filled again, e.g. when it was not maintained."""
+    data_store.DB.DeleteAttributes(
+        self.urn, [self.INITIALIZED_ATTRIBUTE], token=self.token)
+
+
+def RecordTime(name, urn, timestamp, mutation_pool=None, token=None):
+  """Records urn in the given index unless it is in the right bucket already.
+
+  The urn is removed from the bucket this process recorded it in before.
+  Nothing is recorded if the TTL of the index is not configured.
+
+  Args:
+    name: Name of the index.
+    urn: The urn to record.
+    timestamp: The time the object expires from, an RDFDatetime.
+    mutation_pool: A MutationPool object to write to. If not given, the entry
+      is written immediately.
+    token: An ACL token.
+  """
+  if not config.CONFIG[TTL_OPTIONS[name]]:
+    return
+
+  index = RetentionIndex(name, token=token)
+  key = "%s:%s" % (name, utils.SmartStr(urn))
+  bucket = index.Bucket(timestamp)
+  try:
+    previous_bucket = _RECORDED_BUCKETS.Get(key)
+  except KeyError:
+    previous_bucket = None
+  if previous_bucket == bucket:
+    return
+
+  if mutation_pool is None:
+    with data_store.DB.GetMutationPool(token=token) as pool:
+      _MoveToBucket(index, urn, timestamp, previous_bucket, pool)
+  else:
+    _MoveToBucket(index, urn, timestamp, previous_bucket, mutation_pool)
+  _RECORDED_BUCKETS.Put(key, bucket)
+
+
+def _MoveToBucket(index, urn, timestamp, previous_bucket, mutation_pool):
+  if previous_bucket is not None:
+    index.Remove(urn, previous_bucket, mutation_pool)
+  index.Add(urn, timestamp, mutation_pool)
+
+
+def RecordWrite(urn, mutation_pool):
+  """Records a write to a client or a temporary object."""
+  path = urn.Path()
+  if _CLIENT_PATH_RE.match(path):
+    name = CLIENTS
+  elif _TMP_PATH_RE.match(path):
+    name = TMP
+  else:
+    return
+
+  RecordTime(name, urn, rdfvalue.RDFDatetime.Now(), mutation_pool)
@@ -7,11 +7,13 @@ import platform
 from grr import config
 from grr.lib import config_lib
 from grr.lib import local
+from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import stats
 # pylint: disable=unused-import
 from grr.lib.local import plugins
 # pylint: enable=unused-import
+from grr.server import plugin_manifest
 from grr.server import server_logging
 
 # pylint: disable=g-import-not-at-top
@@ -35,8 +37,14 @@ def DropPrivileges():
 INIT_RAN = False
 
 
-def Init():
-  """Run all required startup routines and initialization hooks."""
+def Init(subsystems=None):
+  """Run all required startup routines and initialization hooks.
+
+  Args:
+    subsystems: The plugin subsystems (see plugin_manifest.SUBSYSTEMS) this
+      component needs at startup. Other plugins are imported when first used.
+      If None, all plugins are imported.
+  """
   global INIT_RAN
   if INIT_RAN:
     return
@@ -63,9 +71,21 @@ def Init():
     syslog_logger.exception("Died during config initialization")
     raise
 
+  if subsystems is None:
+    # pylint: disable=unused-variable,g-import-not-at-top
+    from grr.lib import server_plugins
+    # pylint: enable=unused-variable,g-import-not-at-top
+  else:
+    plugin_manifest.LoadSubsystems(subsystems,
+                                   config.CONFIG["Server.plugin_manifest_path"])
+
   server_logging.ServerLoggingStartupInit()
   registry.Init()
 
+  intern_table_size = config.CONFIG["Server.rdfurn_intern_table_size"]
+  if intern_table_size:
+    rdfvalue.RDFURN.EnableInterning(max_size=intern_table_size)
+
   # Exempt config updater from this check because it is the one responsible for
   # setting the variable.
   if not config.CONFIG.ContextApplied("ConfigUpdater Context"):
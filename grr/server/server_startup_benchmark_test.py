@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Benchmarks the plugin loading part of server startup for each entry point."""
+
+
+import os
+import subprocess
+import sys
+
+from grr.lib import flags
+from grr.server import plugin_manifest
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+# Entry point modules, each defines the PLUGIN_SUBSYSTEMS it needs.
+ENTRY_POINTS = [
+    "grr.gui.admin_ui",
+    "grr.tools.config_updater",
+    "grr.tools.console",
+    "grr.tools.frontend",
+    "grr.worker.worker",
+]
+
+# Runs in a fresh interpreter, prints the time taken and the number of modules
+# imported.
+STARTUP_SCRIPT = """
+import sys
+import time
+
+start = time.time()
+import %(entry_point)s as entry_point
+from grr.server import plugin_manifest
+if %(lazy)r:
+  plugin_manifest.LoadSubsystems(entry_point.PLUGIN_SUBSYSTEMS,
+                                 %(manifest_path)r)
+else:
+  from grr.lib import server_plugins
+print time.time() - start, len(sys.modules)
+"""
+
+
+class ServerStartupBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Compares eager and lazy plugin loading of the server entry points."""
+
+  units = "s"
+
+  REPEATS = 3
+
+  def setUp(self):
+    super(ServerStartupBenchmark, self).setUp(["Modules"], ["<20"])
+    self.manifest_path = os.path.join(self.temp_dir, "manifest.json")
+    plugin_manifest.WriteManifest(self.manifest_path,
+                                  plugin_manifest.GenerateManifest())
+
+  def _Startup(self, entry_point, lazy):
+    script = STARTUP_SCRIPT % dict(
+        entry_point=entry_point, lazy=lazy, manifest_path=self.manifest_path)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    time_taken, modules = output.split()[-2:]
+    return float(time_taken), int(modules)
+
+  def testEntryPointStartup(self):
+    """Time to import an entry point and the plugins it needs."""
+    for entry_point in ENTRY_POINTS:
+      for lazy in [False, True]:
+        results = [
+            self._Startup(entry_point, lazy) for _ in range(self.REPEATS)
+        ]
+        self.AddResult("%s (%s)" % (entry_point, "lazy" if lazy else "eager"),
+                       min(t for t, _ in results), self.REPEATS, results[0][1])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
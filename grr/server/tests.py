@@ -13,28 +13,36 @@ try:
 except ImportError:
   pass
 from grr.server import client_index_test
+from grr.server import client_stats_store_test
 from grr.server import console_utils_test
 from grr.server import data_store_test
 if platform.system() == "Linux":
   # Trying to import this module on non-Linux platforms won't work.
   from grr.server import fuse_mount_test
 from grr.server import email_alerts_test
+from grr.server import events_benchmark_test
 from grr.server import events_test
 from grr.server import export_test
 from grr.server import export_utils_test
+from grr.server import flow_state_test
 from grr.server import flow_test
 from grr.server import flow_utils_test
 from grr.server import front_end_test
 from grr.server import hunt_test
+from grr.server import instant_output_plugin_benchmark_test
 from grr.server import instant_output_plugin_test
 from grr.server import multi_type_collection_test
 from grr.server import output_plugin_test
+from grr.server import plugin_manifest_test
+from grr.server import posting_list_test
 from grr.server import queue_manager_test
 from grr.server import rekall_profile_server_test
 from grr.server import sequential_collection_test
 from grr.server import server_logging_test
+from grr.server import server_startup_benchmark_test
 from grr.server import server_stubs_test
 from grr.server import stats_server_test
+from grr.server import timeline_index_test
 from grr.server.aff4_objects import tests
 from grr.server.authorization import tests
 from grr.server.checks import tests
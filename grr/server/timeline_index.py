@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+"""A per-client index of VFS MAC times used to build timelines.
+
+Every time a StatEntry is written to a client's VFS, an event is recorded for
+each of its MAC times. Events are grouped by the directory of the file they
+belong to, and every directory keeps its events sorted by time: events are
+stored in one data store row each, named after the inverted event timestamp,
+so that a lexicographic scan of a directory returns the newest events first.
+
+The timeline of a subtree is produced by a streaming k-way merge of the
+directories it contains, so neither all events nor all stat entries ever have
+to be held in memory. The listing of every directory is versioned with the
+time of its newest event, so a directory is only scanned once the merge
+reaches that time, and later pages of a timeline seek to their first event
+with a cursor instead of reading all earlier events again.
+"""
+
+
+import hashlib
+import heapq
+import itertools
+
+from grr.lib import rdfvalue
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import data_store
+
+# The AFF4 attribute holding StatEntries of VFS files.
+STAT_ATTRIBUTE = "aff4:stat"
+
+# Event actions, named after the StatEntry fields they are taken from.
+MODIFICATION = "m"
+ACCESS = "a"
+METADATA_CHANGED = "c"
+
+
+class VfsTimelineIndex(object):
+  """The timeline index of a single client."""
+
+  INDEX_PATH = "timeline_index"
+
+  EVENT_ATTRIBUTE = "aff4:timeline_event"
+  DIRECTORY_PREFIX = "index:timeline_dir/"
+  INDEXED_PREFIX = "index:timeline_indexed/"
+
+  MAX_TIMESTAMP = 2**64 - 1
+
+  # Directories are read in pages. The first page is small since a timeline
+  # of a large subtree merges many directories at once.
+  FIRST_PAGE_SIZE = 10
+  PAGE_SIZE = 1000
+
+  def __init__(self, client_id, token=None):
+    self.client_id = rdf_client.ClientURN(client_id)
+    self.urn = self.client_id.Add(self.INDEX_PATH)
+    self.token = token
+
+  def _DirectorySubject(self, dir_path):
+    digest = hashlib.sha256(utils.SmartStr(dir_path)).hexdigest()[:32]
+    return utils.SmartStr(self.urn.Add(digest))
+
+  def _EventSubject(self, dir_path, basename, timestamp, action):
+    return "%s/%016x.%s.%s" % (self._DirectorySubject(dir_path),
+                               self.MAX_TIMESTAMP - timestamp, action,
+                               hashlib.sha256(basename).hexdigest()[:16])
+
+  def AddStatEntries(self, path, stat_entries, mutation_pool):
+    """Records the MAC times of the given stat entries.
+
+    Adding the same stat entry more than once has no effect.
+
+    Args:
+      path: Path of the file, relative to the client.
+      stat_entries: An iterable of rdf_client.StatEntry.
+      mutation_pool: A MutationPool object to write to.
+    """
+    dir_path, _, basename = utils.SmartStr(path).rpartition("/")
+
+    newest = None
+    for stat_entry in stat_entries:
+      for action in (MODIFICATION, ACCESS, METADATA_CHANGED):
+        timestamp = getattr(stat_entry, "st_%stime" % action)
+        if timestamp is None:
+          continue
+
+        timestamp = int(timestamp) * 1000000
+        mutation_pool.Set(
+            self._EventSubject(dir_path, basename, timestamp, action),
+            self.EVENT_ATTRIBUTE, basename)
+        if newest is None or timestamp > newest:
+          newest = timestamp
+
+    if newest is None:
+      return
+
+    # The newest version of the listing is the time of the directory's newest
+    # event. Only older versions are deleted, so concurrent writers can't
+    # lower it.
+    attribute = self.DIRECTORY_PREFIX + dir_path
+    mutation_pool.DeleteAttributes(self.urn, [attribute], start=0, end=newest)
+    mutation_pool.Set(self.urn, attribute, "", timestamp=newest, replace=False)
+
+  def IndexStatHistory(self, urns):
+    """Indexes all stat entries ever written to the given VFS urns.
+
+    This is used for files written before the index was maintained.
+
+    Args:
+      urns: An iterable of VFS urns of this client.
+    """
+    for batch in utils.Grouper(urns, 1000):
+      with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+        for subject, values in data_store.DB.MultiResolvePrefix(
+            batch,
+            STAT_ATTRIBUTE,
+            timestamp=data_store.DB.ALL_TIMESTAMPS,
+            token=self.token):
+          stat_entries = [
+              rdf_client.StatEntry.FromSerializedString(serialized)
+              for _, serialized, _ in values
+          ]
+          path = "/".join(rdfvalue.RDFURN(subject).Split()[1:])
+          self.AddStatEntries(path, stat_entries, mutation_pool)
+
+  def MarkIndexed(self, path):
+    """Marks the subtree at path as indexed by IndexStatHistory."""
+    data_store.DB.Set(
+        self.urn,
+        self.INDEXED_PREFIX + utils.SmartStr(path),
+        "",
+        token=self.token)
+
+  def IsIndexed(self, path):
+    """Checks whether the subtree at path (or its parent) was indexed."""
+    path = utils.SmartStr(path)
+    for attribute, _, _ in data_store.DB.ResolvePrefix(
+        self.urn, self.INDEXED_PREFIX, token=self.token):
+      indexed_path = attribute[len(self.INDEXED_PREFIX):]
+      if _IsInSubtree(path, indexed_path):
+        return True
+
+    return False
+
+  def ListDirectories(self, path):
+    """Lists all directories with events in the subtree at path."""
+    return [dir_path for dir_path, _ in self._ListDirectories(path)]
+
+  def _ListDirectories(self, path):
+    """Returns (dir_path, newest event time) of the subtree's directories."""
+    path = utils.SmartStr(path)
+    newest = {}
+    for attribute, _, timestamp in data_store.DB.ResolvePrefix(
+        self.urn,
+        self.DIRECTORY_PREFIX + path,
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      dir_path = attribute[len(self.DIRECTORY_PREFIX):]
+      if _IsInSubtree(dir_path, path):
+        newest[dir_path] = max(newest.get(dir_path, 0), timestamp)
+
+    return sorted(newest.iteritems())
+
+  def _ScanDirectory(self, dir_path, after_urn=None):
+    """Yields (subject, basename) of a directory's events, newest first."""
+    subject_prefix = self._DirectorySubject(dir_path)
+    page_size = self.FIRST_PAGE_SIZE
+    while True:
+      page = list(
+          data_store.DB.ScanAttribute(
+              subject_prefix,
+              self.EVENT_ATTRIBUTE,
+              after_urn=after_urn,
+              max_records=page_size,
+              token=self.token))
+      for subject, _, basename in page:
+        yield subject, basename
+
+      if len(page) < page_size:
+        return
+
+      after_urn = page[-1][0]
+      page_size = min(page_size * 10, self.PAGE_SIZE)
+
+  def ReadDirectory(self, dir_path, start_time=None, end_time=None):
+    """Reads events of files in a directory, newest first.
+
+    Args:
+      dir_path: Path of the directory, relative to the client.
+      start_time: If set, only events at or after this time (in microseconds
+          since epoch) are returned.
+      end_time: If set, only events at or before this time are returned.
+
+    Yields:
+      Tuples (row, inverted_timestamp, file_path, action), sorted. row is the
+      name of the event's row within the directory, which starts with the
+      inverted timestamp. These can be merged with the events of other
+      directories.
+    """
+    dir_path = utils.SmartStr(dir_path)
+    subject_prefix = self._DirectorySubject(dir_path)
+
+    after_urn = None
+    if end_time is not None and end_time < self.MAX_TIMESTAMP:
+      # "~" sorts after the rest of the subject name, so this skips all events
+      # newer than end_time.
+      after_urn = "%s/%016x~" % (subject_prefix,
+                                 self.MAX_TIMESTAMP - end_time - 1)
+
+    for subject, basename in self._ScanDirectory(dir_path, after_urn=after_urn):
+      row = subject[len(subject_prefix) + 1:]
+      inverted_timestamp, action, _ = row.split(".", 2)
+      inverted_timestamp = int(inverted_timestamp, 16)
+
+      if (start_time is not None and
+          self.MAX_TIMESTAMP - inverted_timestamp < start_time):
+        return
+
+      if dir_path:
+        file_path = dir_path + "/" + basename
+      else:
+        file_path = basename
+      yield row, inverted_timestamp, utils.SmartUnicode(file_path), action
+
+  def _MergeDirectories(self, path, start_time, end_time):
+    """Merges the events of a subtree's directories, newest first.
+
+    A directory is only scanned once the merge reaches the time of its newest
+    event.
+
+    Args:
+      path: Path of the subtree's root, relative to the client.
+      start_time: If set, only events at or after this time are returned.
+      end_time: If set, only events at or before this time are returned.
+
+    Yields:
+      Tuples (inverted_timestamp, file_path, action).
+    """
+    # Directories sorted by the inverted time of the newest event they can
+    # hold, the next one to scan last.
+    directories = []
+    for dir_path, newest in self._ListDirectories(path):
+      if start_time is not None and newest < start_time:
+        continue
+      if end_time is not None:
+        newest = min(newest, end_time)
+      directories.append((self.MAX_TIMESTAMP - newest, dir_path))
+    directories.sort(reverse=True)
+
+    # The next event of every scanned directory. Events of the same time are
+    # ordered by their row and directory, like the rows within a directory.
+    heap = []
+
+    def Push(events, dir_path):
+      event = next(events, None)
+      if event is not None:
+        row, inverted_timestamp, file_path, action = event
+        heapq.heappush(heap, (inverted_timestamp, row, dir_path, file_path,
+                              action, events))
+
+    while heap or directories:
+      while directories and (not heap or directories[-1][0] <= heap[0][0]):
+        _, dir_path = directories.pop()
+        Push(
+            self.ReadDirectory(
+                dir_path, start_time=start_time, end_time=end_time), dir_path)
+
+      if heap:
+        inverted_timestamp, _, dir_path, file_path, action, events = (
+            heapq.heappop(heap))
+        yield inverted_timestamp, file_path, action
+        Push(events, dir_path)
+
+  def Read(self,
+           path,
+           start_time=None,
+           end_time=None,
+           offset=0,
+           count=None,
+           cursor=None):
+    """Reads the timeline of a subtree, newest events first.
+
+    Args:
+      path: Path of the subtree's root, relative to the client. Events of all
+          files below it are returned.
+      start_time: If set, only events at or after this time (in microseconds
+          since epoch) are returned.
+      end_time: If set, only events at or before this time are returned.
+      offset: Number of events to skip.
+      count: Maximum number of events to return. All if None.
+      cursor: If set, only events following the ones a previous read returned
+          are returned, see NextCursor. Unlike offset, this does not read the
+          earlier events again.
+
+    Returns:
+      An iterator of (timestamp, file_path, action) tuples, where timestamp is
+      in microseconds since epoch and action one of MODIFICATION, ACCESS and
+      METADATA_CHANGED.
+    """
+    if cursor:
+      cursor_time, returned = _ParseCursor(cursor)
+      if end_time is None or cursor_time < end_time:
+        end_time = cursor_time
+      # Events at the time of the cursor were returned already.
+      if end_time == cursor_time:
+        offset += returned
+
+    events = ((self.MAX_TIMESTAMP - inverted_timestamp, file_path, action)
+              for inverted_timestamp, file_path, action in
+              self._MergeDirectories(path, start_time, end_time))
+
+    if count is None:
+      return itertools.islice(events, offset, None)
+    return itertools.islice(events, offset, offset + count)
+
+  def DeleteSubtrees(self, paths, mutation_pool):
+    """Removes the events of all files in the subtrees at the given paths.
+
+    Args:
+      paths: Paths of the subtrees' roots, relative to the client. The empty
+          path removes the whole index.
+      mutation_pool: A MutationPool object to write to.
+    """
+    paths = set(utils.SmartStr(path) for path in paths)
+
+    # The events of the subtrees' roots themselves are kept in their parent
+    # directories, which are scanned once for all roots they contain.
+    basenames = {}
+    for path in paths:
+      for dir_path in self.ListDirectories(path):
+        mutation_pool.DeleteSubjects(
+            [subject for subject, _ in self._ScanDirectory(dir_path)])
+        mutation_pool.DeleteAttributes(self.urn,
+                                       [self.DIRECTORY_PREFIX + dir_path])
+
+      if path:
+        dir_path, _, basename = path.rpartition("/")
+        basenames.setdefault(dir_path, set()).add(basename)
+
+    if "" in paths:
+      mutation_pool.DeleteSubject(self.urn)
+      return
+
+    for dir_path, dir_basenames in basenames.iteritems():
+      mutation_pool.DeleteSubjects([
+          subject for subject, name in self._ScanDirectory(dir_path)
+          if name in dir_basenames
+      ])
+
+
+def NextCursor(timestamps, cursor=None):
+  """Returns the cursor to read the events following a page of events.
+
+  Args:
+    timestamps: Timestamps of the events returned by Read, newest first.
+    cursor: The cursor the events were read with, if any.
+
+  Returns:
+    A cursor to pass to Read.
+  """
+  timestamp = timestamps[-1]
+  returned = len(timestamps) - timestamps.index(timestamp)
+  if cursor:
+    cursor_time, cursor_returned = _ParseCursor(cursor)
+    if cursor_time == timestamp:
+      returned += cursor_returned
+
+  return "%d:%d" % (timestamp, returned)
+
+
+def _ParseCursor(cursor):
+  """Returns the time and the number of events at it a cursor skips."""
+  timestamp, returned = cursor.split(":")
+  return int(timestamp), int(returned)
+
+
+def _IsInSubtree(path, root):
+  return not root or path == root or path.startswith(root + "/")
+
+
+def _SplitClientPath(urn):
+  """Splits a VFS urn into a client id and path, or returns (None, None)."""
+  components = rdfvalue.RDFURN(urn).Split()
+  if not components or not rdf_client.ClientURN.Validate(components[0]):
+    return None, None
+
+  return components[0], "/".join(components[1:])
+
+
+def AddStatEntries(urn, stat_entries, mutation_pool=None, token=None):
+  """Records the MAC times of stat entries written to the given urn.
+
+  Urns outside of a client's VFS are ignored.
+
+  Args:
+    urn: The urn the stat entries are written to.
+    stat_entries: An iterable of rdf_client.StatEntry.
+    mutation_pool: A MutationPool object to write to. If not set, changes are
+        written immediately.
+    token: The security token.
+  """
+  client_id, path = _SplitClientPath(urn)
+  if not path:
+    return
+
+  index = VfsTimelineIndex(client_id, token=token)
+  if mutation_pool:
+    index.AddStatEntries(path, stat_entries, mutation_pool)
+  else:
+    with data_store.DB.GetMutationPool(token=token) as pool:
+      index.AddStatEntries(path, stat_entries, pool)
+
+
+def DeleteSubtrees(urns, mutation_pool, token=None):
+  """Removes the events of all files below the given urns from the index.
+
+  Deleting a client's urn removes its whole index.
+
+  Args:
+    urns: Urns of the deleted subtrees.
+    mutation_pool: A MutationPool object to write to.
+    token: The security token.
+  """
+  paths = {}
+  for urn in urns:
+    client_id, path = _SplitClientPath(urn)
+    if client_id is not None:
+      paths.setdefault(client_id, []).append(path)
+
+  for client_id, client_paths in paths.iteritems():
+    VfsTimelineIndex(
+        client_id, token=token).DeleteSubtrees(client_paths, mutation_pool)
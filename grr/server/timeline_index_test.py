@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- mode: python; encoding: utf-8 -*-
+"""Tests for grr.server.timeline_index."""
+
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import aff4
+from grr.server import data_store
+from grr.server import timeline_index
+from grr.server.aff4_objects import aff4_grr
+from grr.test_lib import aff4_test_lib
+from grr.test_lib import test_lib
+
+CLIENT_ID = "C.00aaeccbb45f33a3"
+
+
+class VfsTimelineIndexTest(aff4_test_lib.AFF4ObjectTest):
+
+  def setUp(self):
+    super(VfsTimelineIndexTest, self).setUp()
+    self.client_urn = rdf_client.ClientURN(CLIENT_ID)
+    self.index = timeline_index.VfsTimelineIndex(CLIENT_ID, token=self.token)
+
+  def _WriteStat(self, path, mtime=None, atime=None, ctime=None):
+    with aff4.FACTORY.Create(
+        self.client_urn.Add(path),
+        aff4_grr.VFSFile,
+        mode="w",
+        token=self.token) as fd:
+      fd.Set(fd.Schema.STAT,
+             rdf_client.StatEntry(
+                 st_mtime=mtime, st_atime=atime, st_ctime=ctime))
+
+  def _Read(self, path, **kwargs):
+    return [(timestamp / 1000000, file_path, action)
+            for timestamp, file_path, action in self.index.Read(path, **kwargs)]
+
+  def testStatEntriesAreIndexedWhenWritten(self):
+    self._WriteStat("fs/os/a/file1", mtime=10, atime=30, ctime=20)
+    self._WriteStat("fs/os/a/file2", mtime=15)
+
+    self.assertEqual(
+        self._Read("fs/os/a"), [(30, u"fs/os/a/file1", timeline_index.ACCESS),
+                                (20, u"fs/os/a/file1",
+                                 timeline_index.METADATA_CHANGED),
+                                (15, u"fs/os/a/file2",
+                                 timeline_index.MODIFICATION),
+                                (10, u"fs/os/a/file1",
+                                 timeline_index.MODIFICATION)])
+
+  def testHistoryIsKept(self):
+    for mtime in [1, 2, 3]:
+      self._WriteStat("fs/os/a/file", mtime=mtime)
+
+    self.assertEqual([timestamp for timestamp, _, _ in self._Read("fs/os")],
+                     [3, 2, 1])
+
+  def testRewritingTheSameStatEntryDoesNotDuplicateEvents(self):
+    for _ in range(3):
+      self._WriteStat("fs/os/a/file", mtime=1)
+
+    self.assertEqual(len(self._Read("fs/os")), 1)
+
+  def testSubtreesAreMergedInTimeOrder(self):
+    self._WriteStat("fs/os/a/file", mtime=1)
+    self._WriteStat("fs/os/a/b/file", mtime=4)
+    self._WriteStat("fs/os/a/b/c/file", mtime=2)
+    self._WriteStat("fs/os/a/d/file", mtime=3)
+    self._WriteStat("fs/os/ab/file", mtime=5)
+
+    self.assertEqual(
+        [file_path for _, file_path, _ in self._Read("fs/os/a")],
+        [u"fs/os/a/b/file", u"fs/os/a/d/file", u"fs/os/a/b/c/file",
+         u"fs/os/a/file"])
+    self.assertEqual(
+        [file_path for _, file_path, _ in self._Read("fs/os/a/b")],
+        [u"fs/os/a/b/file", u"fs/os/a/b/c/file"])
+    self.assertEqual(len(self._Read("")), 5)
+
+  def testTimeRangeAndOffsetQueries(self):
+    for i in range(20):
+      self._WriteStat("fs/os/a/file%d" % (i % 3), mtime=i)
+
+    self.assertEqual(
+        [timestamp for timestamp, _, _ in self._Read(
+            "fs/os", start_time=5 * 1000000, end_time=8 * 1000000)],
+        [8, 7, 6, 5])
+    self.assertEqual(
+        [timestamp for timestamp, _, _ in self._Read(
+            "fs/os", offset=3, count=4)],
+        [16, 15, 14, 13])
+    self.assertEqual(
+        [timestamp for timestamp, _, _ in self._Read(
+            "fs/os", end_time=4 * 1000000, offset=1, count=2)],
+        [3, 2])
+
+  def testCursorSkipsTheEventsOfPreviousPages(self):
+    # Events of the same time are split across pages.
+    for i in range(6):
+      self._WriteStat("fs/os/a%d/file%d" % (i % 2, i), mtime=i // 3)
+
+    events = []
+    cursor = None
+    while True:
+      page = list(self.index.Read("fs/os", count=2, cursor=cursor))
+      events.extend(page)
+      if len(page) < 2:
+        break
+      cursor = timeline_index.NextCursor(
+          [timestamp for timestamp, _, _ in page], cursor=cursor)
+
+    self.assertEqual(events, list(self.index.Read("fs/os")))
+    self.assertEqual(len(events), 6)
+
+  def testDirectoriesAreOnlyScannedWhenReached(self):
+    for i in range(10):
+      self._WriteStat("fs/os/dir%d/file" % i, mtime=i)
+
+    scanned = []
+    read_directory = self.index.ReadDirectory
+
+    def ReadDirectory(dir_path, **kwargs):
+      scanned.append(dir_path)
+      return read_directory(dir_path, **kwargs)
+
+    with utils.Stubber(self.index, "ReadDirectory", ReadDirectory):
+      self.assertEqual(
+          [timestamp / 1000000
+           for timestamp, _, _ in self.index.Read("fs/os", count=2)], [9, 8])
+
+    self.assertEqual(scanned, ["fs/os/dir9", "fs/os/dir8"])
+
+  def testLargeDirectoriesAreReadInPages(self):
+    with utils.Stubber(timeline_index.VfsTimelineIndex, "PAGE_SIZE", 20):
+      for i in range(50):
+        self._WriteStat("fs/os/a/file%d" % i, mtime=i)
+      self._WriteStat("fs/os/b/file", mtime=25)
+
+      timestamps = [timestamp for timestamp, _, _ in self._Read("fs/os")]
+
+    self.assertEqual(timestamps, sorted(range(50) + [25], reverse=True))
+
+  def testDeletedFilesAreRemoved(self):
+    self._WriteStat("fs/os/a/file", mtime=1)
+    self._WriteStat("fs/os/a/b/file", mtime=2)
+    self._WriteStat("fs/os/c/file", mtime=3)
+
+    aff4.FACTORY.Delete(self.client_urn.Add("fs/os/a/b"), token=self.token)
+    self.assertEqual([file_path for _, file_path, _ in self._Read("fs/os")],
+                     [u"fs/os/c/file", u"fs/os/a/file"])
+
+    aff4.FACTORY.Delete(self.client_urn.Add("fs/os/c/file"), token=self.token)
+    self.assertEqual([file_path for _, file_path, _ in self._Read("fs/os")],
+                     [u"fs/os/a/file"])
+
+  def testSiblingsAreDeletedWithOneScanOfTheirParent(self):
+    for i in range(5):
+      self._WriteStat("fs/os/a/file%d" % i, mtime=i)
+
+    scanned = []
+    scan_directory = self.index._ScanDirectory
+
+    def ScanDirectory(dir_path, **kwargs):
+      scanned.append(dir_path)
+      return scan_directory(dir_path, **kwargs)
+
+    with utils.Stubber(self.index, "_ScanDirectory", ScanDirectory):
+      with data_store.DB.GetMutationPool(token=self.token) as pool:
+        self.index.DeleteSubtrees(
+            ["fs/os/a/file%d" % i for i in range(4)], pool)
+
+    self.assertEqual(scanned, ["fs/os/a"])
+    self.assertEqual([file_path for _, file_path, _ in self._Read("fs/os")],
+                     [u"fs/os/a/file4"])
+
+  def testIndexIsDeletedWithTheClient(self):
+    self._WriteStat("fs/os/a/file", mtime=1)
+    self.index.MarkIndexed("fs/os")
+
+    aff4.FACTORY.Delete(self.client_urn, token=self.token)
+
+    self.assertEqual(
+        data_store.DB.ResolvePrefix(self.index.urn, "", token=self.token), [])
+    self.assertEqual(self._Read(""), [])
+
+  def testIndexStatHistory(self):
+    urn = self.client_urn.Add("fs/os/a/file")
+    for mtime in [1, 2]:
+      data_store.DB.Set(
+          urn,
+          timeline_index.STAT_ATTRIBUTE,
+          rdf_client.StatEntry(st_mtime=mtime).SerializeToString(),
+          timestamp=mtime,
+          replace=False,
+          token=self.token)
+
+    self.assertFalse(self.index.IsIndexed("fs/os"))
+    self.assertEqual(self._Read("fs/os"), [])
+
+    self.index.IndexStatHistory([urn])
+    self.index.MarkIndexed("fs/os")
+
+    self.assertTrue(self.index.IsIndexed("fs/os"))
+    self.assertTrue(self.index.IsIndexed("fs/os/a"))
+    self.assertFalse(self.index.IsIndexed("fs"))
+    self.assertFalse(self.index.IsIndexed("fs/osx"))
+    self.assertEqual([timestamp for timestamp, _, _ in self._Read("fs/os")],
+                     [2, 1])
+
+  def testUnicodePaths(self):
+    self._WriteStat(u"fs/os/中国新闻网新闻中/a.txt", mtime=1)
+
+    self.assertEqual(
+        self._Read(u"fs/os/中国新闻网新闻中"),
+        [(1, u"fs/os/中国新闻网新闻中/a.txt", timeline_index.MODIFICATION)])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -17,10 +17,6 @@ import urlparse
 import pkg_resources
 import yaml
 
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=g-bad-import-order,unused-import
-
 from grr import config as grr_config
 from grr.config import contexts
 from grr.lib import config_lib
@@ -35,10 +31,14 @@ from grr.server import aff4
 from grr.server import artifact
 from grr.server import artifact_registry
 from grr.server import maintenance_utils
+from grr.server import plugin_manifest
 from grr.server import rekall_profile_server
 from grr.server import server_startup
 from grr.server.aff4_objects import users as aff4_users
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS
+
 parser = flags.PARSER
 parser.description = ("Set configuration parameters for the GRR Server."
                       "\nThis script has numerous subcommands to perform "
@@ -649,7 +649,7 @@ server and the admin user interface.\n"""
 
 def AddUsers(token=None):
   # Now initialize with our modified config.
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   print "\nStep 3: Adding Admin User"
   try:
@@ -837,7 +837,7 @@ def main(argv):
       Initialize(grr_config.CONFIG, token=token)
     return
 
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   try:
     print "Using configuration %s" % grr_config.CONFIG
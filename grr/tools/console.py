@@ -16,11 +16,6 @@ import re
 import sys
 import time
 
-
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=g-bad-import-order
-
 import logging
 
 from grr import config
@@ -42,6 +37,7 @@ from grr.server import flow_utils
 from grr.server import hunts
 from grr.server import ipshell
 from grr.server import maintenance_utils
+from grr.server import plugin_manifest
 from grr.server import server_startup
 from grr.server import worker
 from grr.server.aff4_objects import aff4_grr
@@ -59,6 +55,9 @@ from grr.server.flows.general import memory
 
 from grr.tools import end_to_end_tests
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS
+
 flags.DEFINE_string("client", None,
                     "Initialise the console with this client id "
                     "(e.g. C.1234345).")
@@ -97,7 +96,7 @@ def main(argv):
   config.CONFIG.AddContext(contexts.COMMAND_LINE_CONTEXT)
   config.CONFIG.AddContext(contexts.CONSOLE_CONTEXT,
                            "Context applied when running the console binary.")
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   # To make the console easier to use, we make a default token which will be
   # used in StartFlow operations.
@@ -5,19 +5,21 @@ import unittest
 
 import logging
 
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=unused-import,g-bad-import-order
-
 from grr import config
 from grr.config import contexts
 from grr.endtoend_tests import base
 from grr.lib import flags
 from grr.server import access_control
 from grr.server import aff4
+from grr.server import plugin_manifest
 from grr.server import server_startup
 from grr.server.aff4_objects import users as aff4_users
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS + [
+    "client_actions", "endtoend_tests", "flows"
+]
+
 flags.DEFINE_bool("local_client", True,
                   "The target client(s) are running locally.")
 
@@ -42,7 +44,7 @@ def RunEndToEndTests():
   # We are running a test so let the config system know that.
   config.CONFIG.AddContext(contexts.TEST_CONTEXT,
                            "Context applied when we run tests.")
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   token = access_control.ACLToken(
       username="GRREndToEndTest", reason="Running end to end client tests.")
@@ -6,10 +6,14 @@
 import BaseHTTPServer
 import cgi
 import cStringIO
+import email.utils
+import hashlib
 import pdb
 import socket
 import SocketServer
 import threading
+import time
+import zlib
 
 
 import ipaddr
@@ -18,10 +22,6 @@ from google.protobuf import json_format
 
 import logging
 
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=unused-import, g-bad-import-order
-
 from grr import config
 from grr.lib import communicator
 from grr.lib import flags
@@ -32,15 +32,148 @@ from grr.lib.rdfvalues import flows as rdf_flows
 from grr.server import aff4
 from grr.server import front_end
 from grr.server import master
+from grr.server import plugin_manifest
 from grr.server import server_logging
 from grr.server import server_startup
 
+# Plugin subsystems imported at startup, see plugin_manifest. Well known flows
+# are run on the frontend.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS + ["flows"]
+
+
+class CachedResponse(object):
+  """A fully rendered response body together with its gzip encoding."""
+
+  # Bodies smaller than this are not worth compressing.
+  MIN_GZIP_SIZE = 256
+
+  def __init__(self, data, ctype, additional_headers=None, last_modified=None):
+    self.data = data
+    self.ctype = ctype
+    self.additional_headers = additional_headers or {}
+    self.last_modified = int(
+        time.time() if last_modified is None else last_modified)
+    digest = hashlib.sha256(data).hexdigest()
+    self.etag = "\"%s\"" % digest
+
+    # The gzip encoding is a different representation, so it gets its own
+    # strong ETag.
+    self.gzip_data = None
+    self.gzip_etag = None
+    if len(data) >= self.MIN_GZIP_SIZE:
+      compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+      gzip_data = compressor.compress(data) + compressor.flush()
+      if len(gzip_data) < len(data):
+        self.gzip_data = gzip_data
+        self.gzip_etag = "\"%s-gzip\"" % digest
+
+    self.created = time.time()
+
+  @property
+  def size(self):
+    return len(self.data) + len(self.gzip_data or "")
+
+
+class ResponseCache(utils.FastStore):
+  """A cache of CachedResponse objects bounded by their total size in bytes."""
+
+  def __init__(self, max_bytes=256 * 1024 * 1024, max_age=600):
+    """Constructor.
+
+    Args:
+      max_bytes: The maximum number of bytes held in the cache.
+      max_age: The number of seconds after which a response is rendered again.
+    """
+    super(ResponseCache, self).__init__()
+    self.max_bytes = max_bytes
+    self.max_age = max_age
+    self.total_bytes = 0
+    self._render_locks = {}
+
+  def KillObject(self, obj):
+    self.total_bytes -= obj.size
+
+  @utils.Synchronized
+  def Expire(self):
+    while self._age and self.total_bytes > self.max_bytes:
+      node = self._age.PopLeft()
+      self._hash.pop(node.key, None)
+      self.KillObject(node.data)
+
+  @utils.Synchronized
+  def Put(self, key, obj):
+    self.Pop(key)
+    self.total_bytes += obj.size
+    return super(ResponseCache, self).Put(key, obj)
+
+  @utils.Synchronized
+  def Pop(self, key):
+    obj = super(ResponseCache, self).Pop(key)
+    if obj is not None:
+      self.KillObject(obj)
+    return obj
+
+  @utils.Synchronized
+  def Get(self, key):
+    obj = super(ResponseCache, self).Get(key)
+    if obj.created + self.max_age < time.time():
+      self.Pop(key)
+      raise KeyError("Expired")
+
+    return obj
+
+  def GetOrRender(self, key, render_callback):
+    """Returns the cached response for key, rendering it if necessary.
+
+    Concurrent requests for the same key wait for a single rendering instead
+    of all recomputing the response.
+
+    Args:
+      key: The cache key.
+      render_callback: A callable returning a CachedResponse or None.
+
+    Returns:
+      The CachedResponse or None if render_callback returned None.
+    """
+    try:
+      response = self.Get(key)
+      stats.STATS.IncrementCounter("frontend_response_cache", fields=["hit"])
+      return response
+    except KeyError:
+      pass
+
+    with self.lock:
+      render_lock = self._render_locks.setdefault(key, threading.Lock())
+
+    try:
+      with render_lock:
+        try:
+          response = self.Get(key)
+          stats.STATS.IncrementCounter(
+              "frontend_response_cache", fields=["hit"])
+          return response
+        except KeyError:
+          pass
+
+        stats.STATS.IncrementCounter("frontend_response_cache", fields=["miss"])
+        response = render_callback()
+        # Negative responses and bodies larger than the whole cache are not
+        # kept.
+        if response is not None and response.size <= self.max_bytes:
+          self.Put(key, response)
+
+        return response
+    finally:
+      with self.lock:
+        self._render_locks.pop(key, None)
+
 
 class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
   """GRR HTTP handler for receiving client posts."""
 
   statustext = {
       200: "200 OK",
+      304: "304 Not Modified",
       404: "404 Not Found",
       406: "406 Not Acceptable",
       500: "500 Internal Server Error"
@@ -75,6 +208,71 @@ class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                      "".join(header_strings), data)
     self.wfile.write(data)
 
+  def _AcceptsGzip(self):
+    for coding in (self.headers.get("Accept-Encoding") or "").split(","):
+      params = coding.split(";")
+      if params[0].strip().lower() not in ("gzip", "*"):
+        continue
+
+      for param in params[1:]:
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+          try:
+            if float(value) == 0:
+              break
+          except ValueError:
+            break
+      else:
+        return True
+
+    return False
+
+  def _IsNotModified(self, response, etag):
+    """Checks the conditional GET headers against a cached response."""
+    if_none_match = self.headers.get("If-None-Match")
+    if if_none_match:
+      etags = [e.strip() for e in if_none_match.split(",")]
+      return "*" in etags or etag in etags
+
+    if_modified_since = self.headers.get("If-Modified-Since")
+    if if_modified_since:
+      parsed = email.utils.parsedate_tz(if_modified_since)
+      if parsed is not None:
+        return response.last_modified <= email.utils.mktime_tz(parsed)
+
+    return False
+
+  def SendCachedResponse(self, response):
+    """Sends a CachedResponse honouring conditional GETs and gzip."""
+    headers = dict(response.additional_headers)
+    headers["Vary"] = "Accept-Encoding"
+
+    data = response.data
+    etag = response.etag
+    if response.gzip_data is not None and self._AcceptsGzip():
+      data = response.gzip_data
+      etag = response.gzip_etag
+      headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = etag
+
+    if self._IsNotModified(response, etag):
+      # A 304 response has no body to be encoded.
+      headers.pop("Content-Encoding", None)
+      self.Send(
+          "",
+          status=304,
+          ctype=response.ctype,
+          additional_headers=headers,
+          last_modified=response.last_modified)
+      return
+
+    self.Send(
+        data,
+        status=200,
+        ctype=response.ctype,
+        additional_headers=headers,
+        last_modified=response.last_modified)
+
   rekall_profile_path = "/rekall_profiles"
 
   static_content_path = "/static/"
@@ -109,41 +307,61 @@ class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
       self.Send("Error serving profile.", status=500, ctype="text/plain")
       return
     version, name = components
-    profile = self.server.frontend.GetRekallProfile(name, version=version)
-    if not profile:
-      self.Send("Profile not found.", status=404, ctype="text/plain")
-      return
 
-    json_data = json_format.MessageToJson(profile.AsPrimitiveProto())
+    def RenderProfile():
+      profile = self.server.frontend.GetRekallProfile(name, version=version)
+      if not profile:
+        return None
 
-    sanitized_data = ")]}'\n" + json_data.replace("<", r"\u003c").replace(
-        ">", r"\u003e")
+      json_data = json_format.MessageToJson(profile.AsPrimitiveProto())
 
-    additional_headers = {
-        "Content-Disposition": "attachment; filename=response.json",
-        "X-Content-Type-Options": "nosniff"
-    }
-    self.Send(
-        sanitized_data,
-        status=200,
-        ctype="application/json",
-        additional_headers=additional_headers)
+      sanitized_data = ")]}'\n" + json_data.replace("<", r"\u003c").replace(
+          ">", r"\u003e")
+
+      additional_headers = {
+          "Content-Disposition": "attachment; filename=response.json",
+          "X-Content-Type-Options": "nosniff"
+      }
+      return CachedResponse(
+          utils.SmartStr(sanitized_data),
+          ctype="application/json",
+          additional_headers=additional_headers)
+
+    response = self.server.response_cache.GetOrRender(
+        ("rekall_profile", version, name), RenderProfile)
+    if response is None:
+      self.Send("Profile not found.", status=404, ctype="text/plain")
+      return
+
+    self.SendCachedResponse(response)
 
   AFF4_READ_BLOCK_SIZE = 10 * 1024 * 1024
 
   def ServeStatic(self, path):
+    """Serves static content stored in the AFF4 static content path."""
     aff4_path = aff4.FACTORY.GetStaticContentPath().Add(path)
-    try:
+
+    def RenderStatic():
       logging.info("Serving %s", aff4_path)
       fd = aff4.FACTORY.Open(aff4_path, token=aff4.FACTORY.root_token)
+      chunks = []
       while True:
         data = fd.Read(self.AFF4_READ_BLOCK_SIZE)
         if not data:
           break
 
-        self.Send(data)
+        chunks.append(data)
+
+      return CachedResponse("".join(chunks), ctype="application/octet-stream")
+
+    try:
+      response = self.server.response_cache.GetOrRender(("static", path),
+                                                        RenderStatic)
     except (IOError, AttributeError):
       self.Send("", status=404)
+      return
+
+    self.SendCachedResponse(response)
 
   def ServerPem(self):
     self.Send(self.server.server_cert.AsPEM())
@@ -323,6 +541,9 @@ class GRRHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
           max_retransmission_time=config.CONFIG[
               "Frontend.max_retransmission_time"])
     self.server_cert = config.CONFIG["Frontend.certificate"]
+    self.response_cache = ResponseCache(
+        max_bytes=config.CONFIG["Frontend.response_cache_size"],
+        max_age=config.CONFIG["Frontend.response_cache_max_age"])
 
     (address, _) = server_address
     version = ipaddr.IPAddress(address).version
@@ -364,7 +585,7 @@ def main(argv):
   del argv  # Unused.
   config.CONFIG.AddContext("HTTPServer Context")
 
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   httpd = CreateServer()
 
@@ -6,6 +6,7 @@ import hashlib
 import os
 import socket
 import threading
+import zlib
 
 
 import ipaddr
@@ -398,6 +399,111 @@ class GRRHTTPServerTest(test_lib.GRRBaseTest):
     self.assertEqual(profile.version, "v1.0")
     self.assertEqual(profile.data[:2], "\x1f\x8b")
 
+  def testRekallProfilesAreCached(self):
+    self.httpd.response_cache.Flush()
+    url = (self.base_url +
+           "rekall_profiles/v1.0/nt/GUID/F8E2A8B5C9B74BF4A6E4A48F180099942")
+
+    calls = []
+    get_profile = self.httpd.frontend.GetRekallProfile
+
+    def CountingGetRekallProfile(*args, **kwargs):
+      calls.append(args)
+      return get_profile(*args, **kwargs)
+
+    with utils.Stubber(self.httpd.frontend, "GetRekallProfile",
+                       CountingGetRekallProfile):
+      req = requests.get(url, headers={"Accept-Encoding": "gzip"})
+      self.assertEqual(req.status_code, 200)
+      self.assertEqual(req.headers["Content-Encoding"], "gzip")
+      etag = req.headers["ETag"]
+      last_modified = req.headers["Last-Modified"]
+      content = req.content
+
+      req = requests.get(url, headers={"Accept-Encoding": "identity"})
+      self.assertEqual(req.status_code, 200)
+      self.assertNotIn("Content-Encoding", req.headers)
+      self.assertEqual(req.headers["Vary"], "Accept-Encoding")
+      # Both encodings are different representations.
+      self.assertNotEqual(req.headers["ETag"], etag)
+      self.assertEqual(req.content, content)
+
+      # Each ETag only matches its own encoding.
+      req = requests.get(
+          url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+      self.assertEqual(req.status_code, 304)
+      req = requests.get(
+          url, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+      self.assertEqual(req.status_code, 200)
+
+    # The profile was only rendered once.
+    self.assertEqual(len(calls), 1)
+
+  def testRekallProfilesConditionalGet(self):
+    url = (self.base_url +
+           "rekall_profiles/v1.0/nt/GUID/F8E2A8B5C9B74BF4A6E4A48F180099942")
+    req = requests.get(url)
+    self.assertEqual(req.status_code, 200)
+
+    req = requests.get(url, headers={"If-None-Match": req.headers["ETag"]})
+    self.assertEqual(req.status_code, 304)
+    self.assertEqual(req.content, "")
+
+    req = requests.get(url, headers={"If-None-Match": "\"other\""})
+    self.assertEqual(req.status_code, 200)
+
+    req = requests.get(
+        url, headers={"If-Modified-Since": req.headers["Last-Modified"]})
+    self.assertEqual(req.status_code, 304)
+
+    req = requests.get(
+        url, headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+    self.assertEqual(req.status_code, 200)
+
+
+class ResponseCacheTest(test_lib.GRRBaseTest):
+  """Tests for the frontend response cache."""
+
+  def testCacheIsBoundedBySize(self):
+    cache = frontend.ResponseCache(max_bytes=1000)
+    for i in range(10):
+      cache.Put(i, frontend.CachedResponse("%d" % i * 200, "text/plain"))
+      self.assertLessEqual(cache.total_bytes, 1000)
+
+    self.assertEqual(len(cache), 5)
+    self.assertEqual(cache.total_bytes, 1000)
+    self.assertNotIn(0, cache)
+    self.assertIn(9, cache)
+
+    cache.Flush()
+    self.assertEqual(cache.total_bytes, 0)
+
+  def testEntriesExpire(self):
+    cache = frontend.ResponseCache(max_age=10)
+    with test_lib.FakeTime(1000):
+      cache.Put("a", frontend.CachedResponse("data", "text/plain"))
+    with test_lib.FakeTime(1005):
+      self.assertEqual(cache.Get("a").data, "data")
+    with test_lib.FakeTime(1011):
+      self.assertRaises(KeyError, cache.Get, "a")
+      self.assertEqual(cache.total_bytes, 0)
+
+  def testGetOrRenderDoesNotCacheNone(self):
+    cache = frontend.ResponseCache()
+    self.assertIsNone(cache.GetOrRender("a", lambda: None))
+    self.assertNotIn("a", cache)
+
+  def testGzip(self):
+    data = "x" * 10000
+    response = frontend.CachedResponse(data, "text/plain")
+    self.assertEqual(zlib.decompress(response.gzip_data, 16 + zlib.MAX_WBITS),
+                     data)
+
+    self.assertNotEqual(response.gzip_etag, response.etag)
+
+    # Small bodies are sent uncompressed.
+    self.assertIsNone(frontend.CachedResponse("x", "text/plain").gzip_data)
+
 
 def main(args):
   test_lib.main(args)
@@ -10,7 +10,6 @@ import sys
 
 # pylint: disable=unused-import,g-bad-import-order
 from grr.server.flows.general import filesystem
-from grr.lib import server_plugins
 # pylint: enable=unused-import,g-bad-import-order
 
 import logging
@@ -27,6 +26,7 @@ from grr.server import access_control
 from grr.server import aff4
 from grr.server import data_store
 from grr.server import flow_utils
+from grr.server import plugin_manifest
 from grr.server import server_startup
 from grr.server.aff4_objects import standard
 
@@ -41,6 +41,9 @@ except (EnvironmentError, ImportError):
   # EnvironmentError when fuse isn't installed.
   fuse = None
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS
+
 flags.DEFINE_string("aff4path", "/",
                     "Path in AFF4 to use as the root of the filesystem.")
 
@@ -551,7 +554,7 @@ def main(argv):
   del argv  # Unused.
   config.CONFIG.AddContext(contexts.COMMAND_LINE_CONTEXT,
                            "Context applied for all command line tools")
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   if fuse is None:
     logging.fatal("""Could not start!
@@ -5,18 +5,18 @@
 import csv
 import os
 
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=unused-import,g-bad-import-order
-
 from grr.lib import flags
 from grr.lib import utils
 from grr.server import aff4
 from grr.server import data_store
+from grr.server import plugin_manifest
 from grr.server import server_startup
 
 from grr.server.aff4_objects import filestore
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS
+
 flags.DEFINE_string("filename", "", "File with hashes.")
 flags.DEFINE_integer("start", None, "Start row in the file.")
 
@@ -81,7 +81,7 @@ def ImportFile(store, filename, start):
 def main(argv):
   """Main."""
   del argv  # Unused.
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
   filename = flags.FLAGS.filename
   if not os.path.exists(filename):
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+"""End-to-end load test of the GRR server.
+
+Runs a datastore, a frontend, workers and a pool of clients in a single
+process, drives a scripted mix of flows and hunts against the clients and
+writes a JSON report of the server side throughput, so that the results of
+different commits can be compared.
+
+The workload only depends on --load_test_seed and the client ids. To run the
+same workload against the same clients again, pass --cert_file: the client
+keys are generated once and then read back from that file.
+"""
+
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+
+import ipaddr
+
+from grr import config
+from grr.client import poolclient
+from grr.config import contexts
+from grr.lib import flags
+from grr.lib import registry
+from grr.lib import stats
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import access_control
+from grr.server import aff4
+from grr.server import flow
+from grr.server import plugin_manifest
+from grr.server import server_startup
+from grr.server import worker
+from grr.server.data_stores import sqlite_data_store
+from grr.server.flows.general import discovery
+from grr.server.flows.general import file_finder
+from grr.server.flows.general import filesystem
+from grr.server.flows.general import transfer
+from grr.server.hunts import implementation
+from grr.server.hunts import standard
+from grr.tools import frontend
+
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS + [
+    "client_actions", "cron", "flows", "hunts", "output_plugins"
+]
+
+# The --nrclients and --cert_file flags of the pool client select the clients.
+flags.DEFINE_integer("load_test_workers", 2,
+                     "Number of workers to run in the load test.")
+
+flags.DEFINE_integer("load_test_flows_per_client", 4,
+                     "Number of flows the load test starts on every client.")
+
+flags.DEFINE_integer("load_test_hunts", 1,
+                     "Number of hunts the load test runs on all the clients.")
+
+flags.DEFINE_integer("load_test_seed", 0,
+                     "Seed of the random generator which picks the flows.")
+
+flags.DEFINE_integer("load_test_timeout", 3600,
+                     "Seconds to wait for each phase of the load test.")
+
+flags.DEFINE_string("load_test_datastore_dir", "",
+                    "Directory of the load test datastore. A temporary "
+                    "directory is used if not set.")
+
+flags.DEFINE_string("load_test_report", "",
+                    "File to write the JSON report to. If not set, the report "
+                    "is printed.")
+
+
+class LoadTestDataStore(sqlite_data_store.SqliteDataStore):
+  """A SqliteDataStore which counts the operations run against it."""
+
+  def _Count(self, operation):
+    stats.STATS.IncrementCounter(
+        "load_test_datastore_operations", fields=[operation])
+
+  def MultiSet(self, *args, **kwargs):
+    self._Count("MultiSet")
+    return super(LoadTestDataStore, self).MultiSet(*args, **kwargs)
+
+  def DeleteAttributes(self, *args, **kwargs):
+    self._Count("DeleteAttributes")
+    return super(LoadTestDataStore, self).DeleteAttributes(*args, **kwargs)
+
+  def DeleteSubject(self, *args, **kwargs):
+    self._Count("DeleteSubject")
+    return super(LoadTestDataStore, self).DeleteSubject(*args, **kwargs)
+
+  def MultiResolvePrefix(self, *args, **kwargs):
+    self._Count("MultiResolvePrefix")
+    return super(LoadTestDataStore, self).MultiResolvePrefix(*args, **kwargs)
+
+  def ResolvePrefix(self, *args, **kwargs):
+    self._Count("ResolvePrefix")
+    return super(LoadTestDataStore, self).ResolvePrefix(*args, **kwargs)
+
+  def ResolveMulti(self, *args, **kwargs):
+    self._Count("ResolveMulti")
+    return super(LoadTestDataStore, self).ResolveMulti(*args, **kwargs)
+
+  def ScanAttributes(self, *args, **kwargs):
+    self._Count("ScanAttributes")
+    return super(LoadTestDataStore, self).ScanAttributes(*args, **kwargs)
+
+  def DBSubjectLock(self, *args, **kwargs):
+    self._Count("DBSubjectLock")
+    return super(LoadTestDataStore, self).DBSubjectLock(*args, **kwargs)
+
+
+class LoadTestInit(registry.InitHook):
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric(
+        "load_test_datastore_operations", fields=[("operation", str)])
+
+
+def Percentiles(values):
+  """Returns the nearest-rank percentiles of the given values."""
+  if not values:
+    return {}
+
+  values = sorted(values)
+  result = {}
+  for percentile in (50, 90, 99):
+    rank = max(int(math.ceil(len(values) * percentile / 100.0)), 1)
+    result["p%d" % percentile] = values[rank - 1]
+  result["max"] = values[-1]
+  return result
+
+
+def PeakRSS():
+  """Returns the peak resident set size of the process in bytes."""
+  # Linux reports kilobytes.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoadTest(object):
+  """Runs the GRR components and the workload of a load test."""
+
+  # The flows started on the clients and their relative frequencies.
+  FLOW_MIX = [
+      (discovery.Interrogate.__name__, 1),
+      (filesystem.ListDirectory.__name__, 3),
+      (file_finder.FileFinder.__name__, 3),
+      (transfer.MultiGetFile.__name__, 2),
+  ]
+
+  # Sizes of the files the flows list, hash and download.
+  FIXTURE_FILE_SIZES = [2**i * 1024 for i in range(8)]
+
+  # Counters which measure the throughput of the server.
+  THROUGHPUT_COUNTERS = [
+      "grr_frontendserver_handle_num", "grr_messages_sent",
+      "grr_worker_states_run"
+  ]
+
+  POLL_INTERVAL = 1
+
+  def __init__(self,
+               nrclients,
+               workers,
+               flows_per_client,
+               hunts,
+               seed,
+               timeout,
+               datastore_dir,
+               cert_file=None):
+    self.nrclients = nrclients
+    self.workers = workers
+    self.flows_per_client = flows_per_client
+    self.hunts = hunts
+    self.seed = seed
+    self.timeout = timeout
+    self.datastore_dir = datastore_dir
+    self.cert_file = cert_file
+
+    self.token = access_control.ACLToken(
+        username="GRRLoadTest", reason="Running the load test.").SetUID()
+    self.clients = []
+    self.report = {
+        "config": {
+            "nrclients": nrclients,
+            "workers": workers,
+            "flows_per_client": flows_per_client,
+            "hunts": hunts,
+            "seed": seed,
+        },
+        "peak_rss_bytes": {},
+    }
+
+  def _CreateFixture(self):
+    """Creates the files the flows work on, identical for every seed."""
+    self.fixture_dir = os.path.join(self.datastore_dir, "fixture")
+    if not os.path.isdir(self.fixture_dir):
+      os.makedirs(self.fixture_dir)
+
+    rng = random.Random(0)
+    self.fixture_files = []
+    for i, size in enumerate(self.FIXTURE_FILE_SIZES):
+      path = os.path.join(self.fixture_dir, "file%02d" % i)
+      with open(path, "wb") as fd:
+        fd.write("".join(chr(rng.randrange(256)) for _ in xrange(size)))
+      self.fixture_files.append(path)
+
+  def StartServer(self):
+    """Starts the frontend and the workers."""
+    self._CreateFixture()
+
+    ip = utils.ResolveHostnameToIP("localhost", 0)
+    httpd = frontend.GRRHTTPServer((ip, 0), frontend.GRRHTTPServerHandler)
+    port = httpd.socket.getsockname()[1]
+    if ipaddr.IPAddress(ip).version == 6:
+      url = "http://[%s]:%d/" % (ip, port)
+    else:
+      url = "http://%s:%d/" % (ip, port)
+    config.CONFIG.Set("Client.server_urls", [url])
+
+    threads = [threading.Thread(target=httpd.serve_forever)]
+    for _ in xrange(self.workers):
+      worker_obj = worker.GRRWorker(
+          token=access_control.ACLToken(username="GRRWorker").SetUID())
+      threads.append(threading.Thread(target=worker_obj.Run))
+
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    self.report["peak_rss_bytes"]["server"] = PeakRSS()
+
+  def EnrollClients(self):
+    """Starts the pool clients and waits until they are all enrolled."""
+    clients = None
+    if self.cert_file:
+      clients = poolclient.LoadClients(
+          self.nrclients, self.cert_file, fast_poll=True)
+
+    if clients is None:
+      clients = poolclient.GenerateClients(self.nrclients, fast_poll=True)
+      if self.cert_file:
+        poolclient.SaveClients(clients, self.cert_file)
+
+    # Sorted, so a seed always assigns the same flows to the same clients.
+    self.clients = sorted(
+        clients,
+        key=lambda c: rdf_client.ClientURN.FromPrivateKey(c.private_key))
+
+    start = time.time()
+    for client in self.clients:
+      client.start()
+
+    while True:
+      enrolled = len([c for c in self.clients if c.enrolled])
+      if enrolled == self.nrclients:
+        break
+
+      if time.time() - start > self.timeout:
+        raise RuntimeError("Enrolled %d of %d clients in %ds." %
+                           (enrolled, self.nrclients, self.timeout))
+      time.sleep(self.POLL_INTERVAL)
+
+    self.report["enrollment"] = {"seconds": time.time() - start}
+    self.report["peak_rss_bytes"]["clients"] = PeakRSS()
+
+  def _FlowArgs(self, flow_name, rng):
+    """Returns the args of a flow of the workload."""
+    if flow_name == discovery.Interrogate.__name__:
+      return discovery.InterrogateArgs()
+
+    if flow_name == filesystem.ListDirectory.__name__:
+      return filesystem.ListDirectoryArgs(pathspec=rdf_paths.PathSpec(
+          path=self.fixture_dir, pathtype=rdf_paths.PathSpec.PathType.OS))
+
+    if flow_name == file_finder.FileFinder.__name__:
+      return rdf_file_finder.FileFinderArgs(
+          paths=[os.path.join(self.fixture_dir, "*")],
+          action=rdf_file_finder.FileFinderAction(
+              action_type=rdf_file_finder.FileFinderAction.Action.HASH))
+
+    if flow_name == transfer.MultiGetFile.__name__:
+      return transfer.MultiGetFileArgs(pathspecs=[
+          rdf_paths.PathSpec(
+              path=path, pathtype=rdf_paths.PathSpec.PathType.OS)
+          for path in rng.sample(self.fixture_files, 2)
+      ])
+
+    raise ValueError("Unknown flow %s." % flow_name)
+
+  def PlanWorkload(self):
+    """Returns a list of (client_id, flow_name, args) for the seed."""
+    rng = random.Random(self.seed)
+    choices = []
+    for flow_name, weight in self.FLOW_MIX:
+      choices.extend([flow_name] * weight)
+
+    plan = []
+    for client in self.clients:
+      client_id = rdf_client.ClientURN.FromPrivateKey(client.private_key)
+      for _ in xrange(self.flows_per_client):
+        flow_name = rng.choice(choices)
+        plan.append((client_id, flow_name, self._FlowArgs(flow_name, rng)))
+
+    rng.shuffle(plan)
+    return plan
+
+  def _StartHunt(self):
+    with implementation.GRRHunt.StartHunt(
+        hunt_name=standard.GenericHunt.__name__,
+        flow_runner_args=rdf_flows.FlowRunnerArgs(
+            flow_name=file_finder.FileFinder.__name__),
+        flow_args=rdf_file_finder.FileFinderArgs(
+            paths=[os.path.join(self.fixture_dir, "*")],
+            action=rdf_file_finder.FileFinderAction(
+                action_type=rdf_file_finder.FileFinderAction.Action.HASH)),
+        client_rate=0,
+        token=self.token) as hunt:
+      hunt.Run()
+
+    return hunt.urn
+
+  def _CounterValues(self):
+    values = {}
+    for name in self.THROUGHPUT_COUNTERS:
+      values[name] = stats.STATS.GetMetricValue(name)
+    for fields in stats.STATS.GetMetricFields(
+        "load_test_datastore_operations"):
+      values[fields[0]] = stats.STATS.GetMetricValue(
+          "load_test_datastore_operations", fields=fields)
+    return values
+
+  def RunWorkload(self):
+    """Runs the flows and hunts and waits until they finish."""
+    plan = self.PlanWorkload()
+    counters_before = self._CounterValues()
+    start = time.time()
+
+    # Urn of each running flow to its name and start time.
+    pending_flows = {}
+    for client_id, flow_name, args in plan:
+      urn = flow.GRRFlow.StartFlow(
+          client_id=client_id, flow_name=flow_name, args=args, token=self.token)
+      pending_flows[urn] = (flow_name, time.time())
+
+    # Urn of each running hunt to its start time.
+    pending_hunts = {}
+    for _ in xrange(self.hunts):
+      pending_hunts[self._StartHunt()] = time.time()
+
+    latencies = {}
+    failed_flows = 0
+    hunt_latencies = []
+    while pending_flows or pending_hunts:
+      if time.time() - start > self.timeout:
+        raise RuntimeError("%d flows and %d hunts did not finish in %ds." %
+                           (len(pending_flows), len(pending_hunts),
+                            self.timeout))
+      time.sleep(self.POLL_INTERVAL)
+
+      now = time.time()
+      for flow_obj in aff4.FACTORY.MultiOpen(
+          list(pending_flows), aff4_type=flow.GRRFlow, token=self.token):
+        runner = flow_obj.GetRunner()
+        if runner.IsRunning():
+          continue
+
+        flow_name, flow_start = pending_flows.pop(flow_obj.urn)
+        latencies.setdefault(flow_name, []).append(now - flow_start)
+        if runner.GetState() == rdf_flows.FlowContext.State.ERROR:
+          failed_flows += 1
+
+      for hunt_obj in aff4.FACTORY.MultiOpen(
+          list(pending_hunts),
+          aff4_type=implementation.GRRHunt,
+          token=self.token):
+        _, completed, _ = hunt_obj.GetClientsCounts()
+        if completed >= self.nrclients:
+          hunt_latencies.append(now - pending_hunts.pop(hunt_obj.urn))
+
+    duration = time.time() - start
+    counters = self._CounterValues()
+    for name, value in counters.items():
+      counters[name] = value - counters_before.get(name, 0)
+
+    all_latencies = []
+    for values in latencies.values():
+      all_latencies.extend(values)
+
+    self.report["workload"] = {
+        "seconds": duration,
+        "flows": len(plan),
+        "failed_flows": failed_flows,
+        "messages_sent_per_second":
+            counters.pop("grr_messages_sent") / duration,
+        "frontend_requests_per_second":
+            counters.pop("grr_frontendserver_handle_num") / duration,
+        "worker_states_per_second":
+            counters.pop("grr_worker_states_run") / duration,
+        "flow_latency_seconds": Percentiles(all_latencies),
+        "flow_latency_seconds_by_flow": dict(
+            (name, Percentiles(values))
+            for name, values in latencies.iteritems()),
+        "hunt_latency_seconds": Percentiles(hunt_latencies),
+        # Only the datastore operation counters are left.
+        "datastore_operations": counters,
+    }
+    self.report["peak_rss_bytes"]["workload"] = PeakRSS()
+
+  def Stop(self):
+    for client in self.clients:
+      client.Stop()
+
+  def Run(self):
+    """Runs the whole load test and returns the report."""
+    self.StartServer()
+    try:
+      self.EnrollClients()
+      self.RunWorkload()
+    finally:
+      self.Stop()
+
+    return self.report
+
+
+def main(argv):
+  del argv  # Unused.
+  config.CONFIG.AddContext(contexts.BENCHMARK_CONTEXT,
+                           "Context applied when running benchmarks.")
+
+  datastore_dir = flags.FLAGS.load_test_datastore_dir
+  if not datastore_dir:
+    datastore_dir = tempfile.mkdtemp(prefix="grr_load_test")
+
+  # The datastore is picked when it is initialized, explicit -p options still
+  # override these.
+  flags.FLAGS.parameter = [
+      "Datastore.implementation=%s" % LoadTestDataStore.__name__,
+      "Datastore.location=%s" % os.path.join(datastore_dir, "db"),
+  ] + flags.FLAGS.parameter
+
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
+  config.CONFIG.SetWriteBack("/dev/null")
+  # Hunts are assigned to clients when they check in with the foreman.
+  config.CONFIG.Set("Client.foreman_check_frequency", 10)
+
+  load_test = LoadTest(
+      nrclients=flags.FLAGS.nrclients,
+      workers=flags.FLAGS.load_test_workers,
+      flows_per_client=flags.FLAGS.load_test_flows_per_client,
+      hunts=flags.FLAGS.load_test_hunts,
+      seed=flags.FLAGS.load_test_seed,
+      timeout=flags.FLAGS.load_test_timeout,
+      datastore_dir=datastore_dir,
+      cert_file=flags.FLAGS.cert_file)
+  try:
+    report = json.dumps(load_test.Run(), indent=2, sort_keys=True)
+  finally:
+    if not flags.FLAGS.load_test_datastore_dir:
+      shutil.rmtree(datastore_dir, ignore_errors=True)
+
+  if flags.FLAGS.load_test_report:
+    with open(flags.FLAGS.load_test_report, "wb") as fd:
+      fd.write(report)
+  else:
+    print report
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
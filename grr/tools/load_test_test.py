@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Tests for the load test harness."""
+
+
+from grr.lib import flags
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.test_lib import test_lib
+from grr.tools import load_test
+
+
+class FakePoolClient(object):
+
+  def __init__(self, private_key):
+    self.private_key = private_key
+
+
+class LoadTestTest(test_lib.GRRBaseTest):
+  """Tests the parts of the load test which don't need running clients."""
+
+  def setUp(self):
+    super(LoadTestTest, self).setUp()
+    self.private_keys = [
+        rdf_crypto.RSAPrivateKey.GenerateKey(bits=1024) for _ in range(3)
+    ]
+
+  def _LoadTest(self, seed):
+    test = load_test.LoadTest(
+        nrclients=len(self.private_keys),
+        workers=1,
+        flows_per_client=5,
+        hunts=0,
+        seed=seed,
+        timeout=10,
+        datastore_dir=self.temp_dir)
+    test._CreateFixture()
+    test.clients = [FakePoolClient(key) for key in self.private_keys]
+    return test
+
+  def _Plan(self, seed):
+    return [(client_id, flow_name, args.SerializeToString())
+            for client_id, flow_name, args in self._LoadTest(seed)
+            .PlanWorkload()]
+
+  def testWorkloadOnlyDependsOnTheSeed(self):
+    plan = self._Plan(1)
+    self.assertEqual(len(plan), 15)
+    self.assertEqual(plan, self._Plan(1))
+    self.assertNotEqual(plan, self._Plan(2))
+
+    flow_names = set(x[0] for x in load_test.LoadTest.FLOW_MIX)
+    self.assertTrue(set(x[1] for x in plan).issubset(flow_names))
+
+  def testFixtureIsIdenticalForEverySeed(self):
+    test = self._LoadTest(1)
+    contents = [open(path, "rb").read() for path in test.fixture_files]
+    self.assertEqual([len(x) for x in contents],
+                     load_test.LoadTest.FIXTURE_FILE_SIZES)
+
+    test = self._LoadTest(2)
+    self.assertEqual(contents,
+                     [open(path, "rb").read() for path in test.fixture_files])
+
+  def testPercentiles(self):
+    self.assertEqual(load_test.Percentiles([]), {})
+    self.assertEqual(
+        load_test.Percentiles(range(100, 0, -1)),
+        {"p50": 50,
+         "p90": 90,
+         "p99": 99,
+         "max": 100})
+    self.assertEqual(
+        load_test.Percentiles([3]), {"p50": 3,
+                                     "p90": 3,
+                                     "p99": 3,
+                                     "max": 3})
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
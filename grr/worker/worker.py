@@ -5,18 +5,19 @@ We basically pull a new task from the task master, and run the plugin
 it specifies.
 """
 
-
-# pylint: disable=unused-import,g-bad-import-order
-from grr.lib import server_plugins
-# pylint: enable=unused-import,g-bad-import-order
-
 from grr import config
 from grr.config import contexts
 from grr.lib import flags
 from grr.server import access_control
+from grr.server import plugin_manifest
 from grr.server import server_startup
 from grr.server import worker
 
+# Plugin subsystems imported at startup, see plugin_manifest.
+PLUGIN_SUBSYSTEMS = plugin_manifest.STORAGE_SUBSYSTEMS + [
+    "cron", "flows", "hunts", "output_plugins"
+]
+
 
 def main(argv):
   """Main."""
@@ -25,7 +26,7 @@ def main(argv):
                            "Context applied when running a worker.")
 
   # Initialise flows and config_lib
-  server_startup.Init()
+  server_startup.Init(subsystems=PLUGIN_SUBSYSTEMS)
 
 
   token = access_control.ACLToken(username="GRRWorker").SetUID()
@@ -22,6 +22,7 @@ from grr.server import flow_runner
 from grr.server import front_end
 from grr.server import queue_manager
 from grr.server import worker
+from grr.server.aff4_objects import users as aff4_users
 from grr.server.flows.general import administrative
 from grr.server.hunts import implementation
 from grr.server.hunts import standard
@@ -660,10 +661,13 @@ class GrrWorkerTest(flow_test_lib.FlowTestsBaseclass):
     self.assertEqual(stats.RSS_size, 1234)
 
     # Make sure no notifications have been sent.
-    user = aff4.FACTORY.Open(
-        "aff4:/users/%s" % self.token.username, token=self.token)
-    notifications = user.Get(user.Schema.PENDING_NOTIFICATIONS)
-    self.assertIsNone(notifications)
+    user = aff4.FACTORY.Create(
+        "aff4:/users/%s" % self.token.username,
+        aff4_type=aff4_users.GRRUser,
+        mode="r",
+        token=self.token)
+    notifications = user.GetPendingNotifications()
+    self.assertFalse(notifications)
 
   def testWellKnownFlowResponsesAreProcessedOnlyOnce(self):
     worker_obj = worker.GRRWorker(token=self.token)